@@ -9,6 +9,10 @@ import datetime
 import logging
 from functools import wraps
 
+from config.settings import Config
+from etl.utils.schema import SchemaManager
+from etl.utils.report_store import report_store
+
 # --- 1. 配置 (保持不变) ---
 NEO4J_URI = os.environ.get("NEO4J_URI", "bolt://neo4j.haxm.local:7687")
 NEO4J_USER = os.environ.get("NEO4J_USER", "neo4j")
@@ -28,6 +32,13 @@ try:
 except Exception as e:
     logging.error(f"启动时连接Neo4j失败: {e}")
 
+# 启动时确保读查询和ETL依赖的约束与索引已就绪
+if driver and Config.SCHEMA_BOOTSTRAP:
+    try:
+        SchemaManager(driver, NEO4J_DATABASE).ensure_schema()
+    except Exception as e:
+        logging.error(f"图谱约束与索引初始化失败: {e}")
+
 # --- 3. 装饰器和辅助函数 (保持不变) ---
 def neo4j_session(f):
     @wraps(f)
@@ -280,6 +291,34 @@ def get_marital_info(session, patient_id):
     result = session.execute_read(lambda tx: tx.run(query, patientId=patient_id).single())
     return jsonify(serialize_record(result)) if result else jsonify({})
 
+@app.route('/api/examinations/<string:report_id>/report', methods=['GET'])
+@neo4j_session
+def get_examination_report(session, report_id):
+    """获取检查报告完整正文 (按需读取)"""
+    # 图谱中只保留摘要的报告从报告库读取正文，仍保存在节点上的旧报告直接返回
+    query = """
+    MATCH (ex:Examination {reportId: $reportId})
+    RETURN ex.fullReport AS fullReport, ex.reportHash AS reportHash, ex.reportLength AS reportLength
+    """
+    result = session.execute_read(lambda tx: tx.run(query, reportId=report_id).single())
+    if not result:
+        return jsonify({"error": "未找到检查报告"}), 404
+
+    full_report = result["fullReport"]
+    if full_report is None and result["reportHash"]:
+        stored = report_store.get(report_id)
+        if stored is None:
+            return jsonify({"error": "报告库中未找到检查报告正文"}), 404
+        if stored["hash"] != result["reportHash"]:
+            logging.warning(f"检查报告正文与图谱摘要不一致 - reportId: {report_id}")
+        full_report = stored["fullReport"]
+
+    return jsonify({
+        "reportId": report_id,
+        "reportLength": len(full_report) if full_report is not None else 0,
+        "fullReport": full_report,
+    })
+
 # 【注意】以下API因依赖于我们当前模型中不存在的节点(如BodyPart)而暂时禁用。
 # 如果未来业务需要，可以扩展ETL和图模型来支持它们。
 #
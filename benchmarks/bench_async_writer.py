@@ -0,0 +1,196 @@
+# benchmarks/bench_async_writer.py
+"""
+写入并发基准：在模拟的每语句往返延迟下，对比线程池写入 (MAX_WORKERS 个线程，每线程一个写事务)
+与 AsyncPortraitWriter (一个线程内最多 ASYNC_MAX_IN_FLIGHT 个写事务) 的整批写入耗时。
+
+不连接 Neo4j：同步和异步两种假事务对每条语句都等待 --latency-ms 毫秒，再按 fake_responder 返回结果，
+因此两种写入方式执行完全相同的语句，差别只在并发方式上。画像取自 files/ 下的样例 JSON，
+每个样例复制 --repeat 份并替换 patientId (与 bench_write_path.py 相同)。
+
+用法 (在项目根目录执行):
+    python benchmarks/bench_async_writer.py [--files-dir files] [--repeat 50] [--latency-ms 2] [--concurrency 4 16 64]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from config.settings import Config  # noqa: E402
+from etl.core.condition_resolver import condition_resolver  # noqa: E402
+from etl.core.conflict_scheduler import schedule_lanes  # noqa: E402
+from etl.core.dimension_cache import dimension_cache  # noqa: E402
+from etl.processors.async_writer import AsyncPortraitWriter  # noqa: E402
+from etl.processors.dry_run import RecordedResult, fake_responder  # noqa: E402
+from etl.processors.health_portrait import HealthPortraitProcessor  # noqa: E402
+from etl.utils.statement_stats import statement_name  # noqa: E402
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_write_path import build_patients  # noqa: E402
+
+
+def _answer(query, params):
+    return fake_responder(statement_name(query), params)
+
+
+class SleepingTransaction:
+    """同步假事务：每条语句阻塞等待 latency 秒"""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def run(self, query, parameters=None, **kwparameters):
+        params = dict(parameters or {}, **kwparameters)
+        time.sleep(self.latency)
+        return RecordedResult(_answer(query, params))
+
+
+class SleepingSession:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def execute_write(self, work, *args):
+        return work(SleepingTransaction(self.latency), *args)
+
+
+class SleepingDb:
+    def __init__(self, latency):
+        self.latency = latency
+
+    @contextmanager
+    def get_session(self):
+        yield SleepingSession(self.latency)
+
+
+class AsyncRecordedResult:
+    def __init__(self, records):
+        self._records = list(records or [])
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for record in self._records:
+            yield record
+
+    async def consume(self):
+        return None
+
+
+class AsyncSleepingTransaction:
+    """异步假事务：每条语句 await asyncio.sleep(latency)"""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    async def run(self, query, parameters=None, **kwparameters):
+        params = dict(parameters or {}, **kwparameters)
+        await asyncio.sleep(self.latency)
+        return AsyncRecordedResult(_answer(query, params))
+
+
+class AsyncSleepingSession:
+    def __init__(self, latency):
+        self.latency = latency
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def execute_write(self, work, *args):
+        return await work(AsyncSleepingTransaction(self.latency), *args)
+
+
+class AsyncSleepingConnection:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def get_session(self):
+        return AsyncSleepingSession(self.latency)
+
+    async def close(self):
+        pass
+
+
+class BenchProcessor(HealthPortraitProcessor):
+    """使用假连接的处理器，写入逻辑与 HealthPortraitProcessor 完全一致"""
+
+    def __init__(self, db):
+        self.db = db
+        self._deltas = {}
+
+
+def _reset_caches():
+    condition_resolver.clear()
+    dimension_cache.clear()
+
+
+def run_threads(processor, pending, workers):
+    _reset_caches()
+    started = time.perf_counter()
+    lanes = schedule_lanes(pending, workers)
+
+    def write_lane(lane):
+        failed = []
+        for group in processor.split_groups(lane):
+            failed.extend(processor.write_group(group))
+        return failed
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(1, len(lanes))) as executor:
+        for future in as_completed([executor.submit(write_lane, lane) for lane in lanes]):
+            failed.extend(future.result())
+    return time.perf_counter() - started, failed
+
+
+def run_async(processor, pending, in_flight, latency):
+    _reset_caches()
+    writer = AsyncPortraitWriter(processor, lambda: AsyncSleepingConnection(latency), max_in_flight=in_flight)
+    started = time.perf_counter()
+    try:
+        failed = writer.write(pending)
+    finally:
+        writer.close()
+    return time.perf_counter() - started, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="写入并发基准 (线程池 vs asyncio)")
+    parser.add_argument('--files-dir', default=os.path.join(PROJECT_ROOT, 'files'))
+    parser.add_argument('--repeat', type=int, default=50, help="每个样例画像复制的份数")
+    parser.add_argument('--latency-ms', type=float, default=2.0, help="模拟的每条语句往返延迟")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[4, 16, 64],
+                        help="线程数 / 同时进行中的事务数")
+    args = parser.parse_args()
+
+    patients = build_patients(args.files_dir, args.repeat)
+    if not patients:
+        print(f"{args.files_dir} 下没有可用的样例画像")
+        return 1
+    pending = [(patient['patientId'], patient, None) for patient in patients]
+    latency = args.latency_ms / 1000.0
+    processor = BenchProcessor(SleepingDb(latency))
+
+    print(f"样本: {len(patients)} 个患者, TX_GROUP_SIZE={Config.TX_GROUP_SIZE}, 每语句延迟 {args.latency_ms} ms")
+    print(f"{'并发':>6}{'线程池 s':>12}{'asyncio s':>12}{'患者/秒 (线程)':>18}{'患者/秒 (async)':>18}")
+    for concurrency in args.concurrency:
+        thread_seconds, thread_failed = run_threads(processor, pending, concurrency)
+        async_seconds, async_failed = run_async(processor, pending, concurrency, latency)
+        if thread_failed or async_failed:
+            print(f"写入失败: 线程池 {len(thread_failed)} 个, asyncio {len(async_failed)} 个")
+            return 1
+        print(f"{concurrency:>6}{thread_seconds:>12.2f}{async_seconds:>12.2f}"
+              f"{len(patients) / thread_seconds:>18.1f}{len(patients) / async_seconds:>18.1f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,139 @@
+# benchmarks/bench_decode.py
+"""
+画像解码基准：对比三种方式把 getHealthPortrait 响应体解码并构建批量写入参数行的耗时和内存 (不连接 Neo4j)：
+
+  - requests + dict：现有路径，requests 的 response.json() 解析为 dict，build_patient_sections 逐字段 .get() 映射
+  - msgspec + dict：msgspec.json.decode 解析为 dict (api.py/prefetch.py 现在的解析方式)，映射不变
+  - 类型化记录：decode_portrait 直接解码为 msgspec 记录 (去空白、占位值在解码时处理)，build_record_sections 按属性映射
+
+样本分两组：files/ 下的样例画像 (小画像，逐个解码) 和用样例就诊记录生成的约 --size-mb MB 的大画像。
+耗时取 --repeat 次中的最好成绩；内存为 tracemalloc 统计的解码结果占用 (留存) 和解码+映射过程的峰值。
+
+用法 (在项目根目录执行):
+    python benchmarks/bench_decode.py [--size-mb 20] [--repeat 5]
+"""
+
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import msgspec
+import requests
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_stream_decode import generate_payload  # noqa: E402
+
+
+def requests_response(body):
+    """构造一个已读完响应体的 requests.Response，response.json() 与真实请求走同一段代码"""
+    response = requests.Response()
+    response.status_code = 200
+    response.headers['Content-Type'] = 'application/json;charset=UTF-8'
+    response._content = body
+    return response
+
+
+def build_modes():
+    from etl.core.etl_patient import build_patient_sections, build_record_sections
+    from etl.core.portrait_records import decode_portrait
+
+    def requests_dict(body):
+        data = requests_response(body).json()['data']
+        return build_patient_sections(data.get('patientId'), data)
+
+    def msgspec_dict(body):
+        data = msgspec.json.decode(body)['data']
+        return build_patient_sections(data.get('patientId'), data)
+
+    def typed_records(body):
+        record = decode_portrait(body).data
+        return build_record_sections(record.patient_id, record)
+
+    return (
+        ('requests + dict', lambda body: requests_response(body).json(), requests_dict),
+        ('msgspec + dict', msgspec.json.decode, msgspec_dict),
+        ('类型化记录', decode_portrait, typed_records),
+    )
+
+
+def measure(bodies, decode, pipeline, repeat):
+    """返回 (解码耗时, 解码+映射耗时, 参数行数, 留存 MB, 峰值 MB)"""
+    def best(func):
+        result = None
+        elapsed = float('inf')
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = [func(body) for body in bodies]
+            elapsed = min(elapsed, time.perf_counter() - started)
+            del result
+            gc.collect()
+        return elapsed
+
+    decode_s = best(decode)
+    total_s = best(pipeline)
+    rows = sum(len(section_rows) for body in bodies for section_rows in pipeline(body).values())
+
+    gc.collect()
+    tracemalloc.start()
+    decoded = [decode(body) for body in bodies]
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del decoded
+    gc.collect()
+    tracemalloc.start()
+    sections = [pipeline(body) for body in bodies]
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del sections
+    return decode_s, total_s, rows, retained / 1024 / 1024, peak / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="画像解码基准 (requests + dict / msgspec + dict / 类型化记录)")
+    parser.add_argument('--files-dir', default=os.path.join(PROJECT_ROOT, 'files'))
+    parser.add_argument('--size-mb', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    from config.settings import Config
+    from etl.processors.dry_run import load_payload_files
+
+    # 只测量解码和参数行构建，不连接报告库
+    Config.REPORT_STORE_ENABLED = False
+
+    samples = [
+        msgspec.json.encode({'code': 0, 'msg': 'ok', 'data': data})
+        for _, data in load_payload_files(args.files_dir) if data
+    ]
+    fd, path = tempfile.mkstemp(prefix='bench-portrait-', suffix='.json')
+    os.close(fd)
+    try:
+        encounters = generate_payload(path, args.size_mb, args.files_dir)
+        with open(path, 'rb') as f:
+            large = f.read()
+    finally:
+        os.remove(path)
+
+    modes = build_modes()
+    for title, bodies in (
+        (f"样例画像: {len(samples)} 个, 共 {sum(map(len, samples)) / 1024:.0f} KB", samples),
+        (f"大画像: {len(large) / 1024 / 1024:.1f} MB, {encounters} 次就诊", [large]),
+    ):
+        print(title)
+        print(f"  {'方式':<16}{'解码 ms':>10}{'解码+映射 ms':>14}{'参数行':>10}{'留存 MB':>10}{'峰值 MB':>10}")
+        for label, decode, pipeline in modes:
+            decode_s, total_s, rows, retained_mb, peak_mb = measure(bodies, decode, pipeline, args.repeat)
+            print(f"  {label:<16}{decode_s * 1000:>10.1f}{total_s * 1000:>14.1f}{rows:>10}"
+                  f"{retained_mb:>10.1f}{peak_mb:>10.1f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,163 @@
+# benchmarks/bench_fetch.py
+"""
+画像拉取基准：在本地启动一个模拟 getHealthPortrait 的 HTTP 服务 (每个请求延迟 --latency-ms 毫秒，
+返回 files/ 下的样例画像)，对比两种方式处理同一批 EMPI 的总耗时：
+
+  - 串行：HealthPortraitAPI (requests) 逐个拉取，每个画像拉取后模拟写入 --write-ms 毫秒
+  - 预取：PortraitPrefetcher (httpx，FETCH_CONCURRENCY 个并发请求) 在后台拉取，写入线程依次取用
+
+不连接 Neo4j。加 --serve 时只启动模拟服务，可把 BIGDATA_API_BASE_URL 指向它做联调。
+
+用法 (在项目根目录执行):
+    python benchmarks/bench_fetch.py [--patients 200] [--latency-ms 20] [--write-ms 10] [--concurrency 8]
+    python benchmarks/bench_fetch.py --serve --port 18080
+"""
+
+import argparse
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from config.settings import Config  # noqa: E402
+from etl.processors.dry_run import load_payload_files  # noqa: E402
+from etl.utils.api import PORTRAIT_PATH, HealthPortraitAPI  # noqa: E402
+from etl.utils.prefetch import PortraitPrefetcher  # noqa: E402
+
+
+class StandInPortraitServer:
+    """模拟大数据平台的 getHealthPortrait 接口：按请求的 patientId 轮流返回样例画像"""
+
+    def __init__(self, samples, latency, port=0):
+        self.samples = samples
+        self.latency = latency
+        handler = self._handler()
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), handler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler(self):
+        server = self
+        counter = itertools.count()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # 支持 keep-alive
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path != PORTRAIT_PATH:
+                    self.send_error(404)
+                    return
+                patient_id = parse_qs(url.query).get('patientId', [''])[0]
+                time.sleep(server.latency)
+                data = dict(server.samples[next(counter) % len(server.samples)], patientId=patient_id)
+                body = json.dumps({'code': 0, 'msg': 'ok', 'data': data}, ensure_ascii=False).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def run_serial(empi_list, write_seconds):
+    api = HealthPortraitAPI()
+    started = time.perf_counter()
+    fetched = 0
+    for empi in empi_list:
+        if api.get_health_portrait(empi):
+            fetched += 1
+        time.sleep(write_seconds)
+    return time.perf_counter() - started, fetched
+
+
+def run_prefetch(empi_list, write_seconds, concurrency, depth):
+    prefetcher = PortraitPrefetcher(concurrency=concurrency, depth=depth)
+    started = time.perf_counter()
+    fetched = 0
+    try:
+        prefetcher.prefetch(empi_list)
+        for empi in empi_list:
+            _, patient_data = prefetcher.take(empi)
+            if patient_data:
+                fetched += 1
+            time.sleep(write_seconds)
+    finally:
+        prefetcher.close()
+    return time.perf_counter() - started, fetched
+
+
+def main():
+    parser = argparse.ArgumentParser(description="画像拉取基准 (串行 vs 异步预取)")
+    parser.add_argument('--files-dir', default=os.path.join(PROJECT_ROOT, 'files'))
+    parser.add_argument('--patients', type=int, default=200)
+    parser.add_argument('--latency-ms', type=float, default=20.0, help="模拟接口的每请求延迟")
+    parser.add_argument('--write-ms', type=float, default=10.0, help="模拟的每患者写入耗时")
+    parser.add_argument('--concurrency', type=int, default=Config.FETCH_CONCURRENCY)
+    parser.add_argument('--depth', type=int, default=Config.FETCH_PREFETCH_DEPTH)
+    parser.add_argument('--serve', action='store_true', help="只启动模拟服务")
+    parser.add_argument('--port', type=int, default=0)
+    args = parser.parse_args()
+
+    samples = [data for _, data in load_payload_files(args.files_dir) if data and data.get('patientId')]
+    if not samples:
+        print(f"{args.files_dir} 下没有可用的样例画像")
+        return 1
+
+    server = StandInPortraitServer(samples, args.latency_ms / 1000.0, args.port)
+    if args.serve:
+        print(f"模拟接口: {server.base_url}{PORTRAIT_PATH}?patientId=...")
+        try:
+            server.httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        server.httpd.server_close()
+        return 0
+
+    server.start()
+    original_url = Config.BIGDATA_API_BASE_URL
+    Config.BIGDATA_API_BASE_URL = server.base_url
+    try:
+        empi_list = [f"bench-{index}" for index in range(args.patients)]
+        write_seconds = args.write_ms / 1000.0
+        serial_seconds, serial_fetched = run_serial(empi_list, write_seconds)
+        prefetch_seconds, prefetch_fetched = run_prefetch(empi_list, write_seconds, args.concurrency, args.depth)
+    finally:
+        Config.BIGDATA_API_BASE_URL = original_url
+        server.stop()
+
+    print(f"样本: {args.patients} 个患者, 接口延迟 {args.latency_ms} ms, 写入 {args.write_ms} ms, "
+          f"并发 {args.concurrency}, 预取深度 {args.depth}")
+    print(f"{'方式':<10}{'总耗时 s':>12}{'患者/秒':>12}{'成功':>8}")
+    print(f"{'串行':<10}{serial_seconds:>12.2f}{args.patients / serial_seconds:>12.1f}{serial_fetched:>8}")
+    print(f"{'预取':<10}{prefetch_seconds:>12.2f}{args.patients / prefetch_seconds:>12.1f}{prefetch_fetched:>8}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+# benchmarks/bench_parse_datetime.py
+"""
+parse_datetime 微基准：对比原来逐个尝试 strptime 格式的实现与正则快速路径 + LRU 缓存。
+
+取值来自 files/test_patient.json 映射时实际传给 parse_datetime 的字符串 (按调用次数复制放大)，
+分别测量缓存冷启动 (每轮清空缓存) 和缓存命中两种情况。
+
+用法 (在项目根目录执行):
+    python benchmarks/bench_parse_datetime.py [--repeat 200] [--rounds 5]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from etl.core import etl_patient  # noqa: E402
+
+
+def legacy_parse_datetime(dt_str):
+    """优化前的实现 (去掉了逐条日志)"""
+    if not dt_str or not isinstance(dt_str, str):
+        return None
+    for fmt in etl_patient.DATETIME_FORMATS:
+        try:
+            return datetime.strptime(dt_str, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def collect_values(path):
+    """记录映射一个画像时 parse_datetime 收到的全部参数"""
+    with open(path, 'r', encoding='utf-8') as f:
+        payload = json.load(f)
+    payload = payload.get('data', payload)
+
+    values = []
+    original = etl_patient.parse_datetime
+
+    def recorder(dt_str):
+        values.append(dt_str)
+        return original(dt_str)
+
+    etl_patient.parse_datetime = recorder
+    try:
+        etl_patient.build_patient_sections(payload['patientId'], payload)
+        values.append(payload.get('createdAt'))
+        values.append(payload.get('updateTime'))
+    finally:
+        etl_patient.parse_datetime = original
+    return values
+
+
+def measure(func, values, rounds, before_round=None):
+    best = None
+    for _ in range(rounds):
+        if before_round:
+            before_round()
+        started = time.perf_counter()
+        for value in values:
+            func(value)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="parse_datetime 微基准")
+    parser.add_argument('--payload', default=os.path.join(PROJECT_ROOT, 'files', 'test_patient.json'))
+    parser.add_argument('--repeat', type=int, default=200, help="把一个画像的取值复制的次数")
+    parser.add_argument('--rounds', type=int, default=5, help="每种实现测量的轮数，取最快一轮")
+    args = parser.parse_args()
+
+    sample = collect_values(args.payload)
+    values = sample * args.repeat
+
+    mismatches = [v for v in set(sample) if legacy_parse_datetime(v) != etl_patient.parse_datetime(v)]
+    if mismatches:
+        print(f"结果不一致: {mismatches}")
+        return 1
+
+    cache_clear = etl_patient._parse_datetime_cached.cache_clear
+    legacy = measure(legacy_parse_datetime, values, args.rounds)
+    cold = measure(etl_patient.parse_datetime, values, args.rounds, before_round=cache_clear)
+    uncached = etl_patient._parse_datetime_cached.__wrapped__
+    fast_only = measure(lambda v: uncached(v) if v and isinstance(v, str) else None, values, args.rounds)
+
+    print(f"样本: {len(sample)} 次调用/画像, 去重 {len(set(sample))} 个值, 共 {len(values)} 次调用")
+    print(f"{'实现':<24}{'耗时(ms)':>12}{'us/次':>10}{'加速比':>10}")
+    for name, elapsed in (
+        ('strptime 逐个尝试', legacy),
+        ('正则快速路径(无缓存)', fast_only),
+        ('正则快速路径 + LRU', cold),
+    ):
+        print(f"{name:<24}{elapsed * 1000:>12.2f}{elapsed / len(values) * 1e6:>10.3f}{legacy / elapsed:>10.1f}x")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
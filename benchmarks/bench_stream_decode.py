@@ -0,0 +1,154 @@
+# benchmarks/bench_stream_decode.py
+"""
+超大画像解码基准：用 files/ 下样例画像的就诊记录 (换成新的 encounterId) 生成约 --size-mb MB 的
+getHealthPortrait 响应，分别在独立子进程中按两种方式完成变更检测哈希和批量写入 (写事务只计数、不连接 Neo4j)，
+对比峰值内存 (ru_maxrss 相对导入完成后的增量) 和耗时：
+
+  - 整体解码：response.json() 一次解析整份画像，build_patient_sections 一次构建所有参数行
+  - 流式解码：PayloadBuffer 按块接收后转存临时文件，ijson 逐条解析就诊，按 STREAM_FLUSH_ROWS 分块写入
+
+用法 (在项目根目录执行):
+    python benchmarks/bench_stream_decode.py [--size-mb 100] [--flush-rows 5000]
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+CHUNK_BYTES = 256 * 1024
+
+
+class CountingTransaction:
+    """只统计语句数和参数行数的写事务替身，不保留参数"""
+
+    def __init__(self):
+        self.statements = 0
+        self.rows = 0
+
+    def run(self, query, parameters=None, **kwargs):
+        params = dict(parameters or {}, **kwargs)
+        self.statements += 1
+        rows = params.get('rows')
+        self.rows += len(rows) if isinstance(rows, list) else 1
+        return []
+
+
+def generate_payload(path, size_mb, files_dir):
+    """把样例画像的就诊记录循环复制 (encounterId/reportId 递增) 写成约 size_mb MB 的响应体，逐条写出不占内存"""
+    from etl.processors.dry_run import load_payload_files
+
+    samples = [data for _, data in load_payload_files(files_dir) if data and data.get('encounters')]
+    if not samples:
+        raise SystemExit(f"{files_dir} 下没有带就诊记录的样例画像")
+    head = {key: value for key, value in samples[0].items() if key != 'encounters'}
+    templates = [encounter for sample in samples for encounter in sample['encounters'] if encounter]
+    target = size_mb * 1024 * 1024
+
+    with open(path, 'w', encoding='utf-8') as f:
+        prefix = json.dumps({'code': 0, 'msg': 'ok', 'data': head}, ensure_ascii=False)
+        # 在 data 的最后插入 encounters 数组
+        f.write(prefix[:-2] + ', "encounters": [')
+        written, index = len(prefix), 0
+        while written < target:
+            encounter = dict(templates[index % len(templates)], encounterId=f"bench-{index}")
+            for key in ('examinations', 'labTests'):
+                encounter[key] = [
+                    dict(record, reportId=f"bench-{index}-{key}-{position}")
+                    for position, record in enumerate(encounter.get(key) or []) if record
+                ]
+            text = json.dumps(encounter, ensure_ascii=False)
+            f.write((', ' if index else '') + text)
+            written += len(text.encode('utf-8')) + 2
+            index += 1
+        f.write(']}}')
+    return index
+
+
+def run_child(mode, path):
+    from etl.core.change_detection import portrait_hash
+    from etl.core.etl_patient import import_patient_data_from_json
+    from etl.utils.stream_decode import PayloadBuffer
+
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    if mode == 'dict':
+        with open(path, 'rb') as f:
+            data = json.loads(f.read())
+    else:
+        buffer = PayloadBuffer()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_BYTES), b''):
+                buffer.write(chunk)
+        data = buffer.finish()
+    patient_data = data['data']
+    decoded = time.perf_counter()
+
+    tx = CountingTransaction()
+    portrait_hash(patient_data)
+    import_patient_data_from_json(tx, patient_data)
+    finished = time.perf_counter()
+
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({
+        'peak_mb': (peak_kb - baseline_kb) / 1024,
+        'decode_s': decoded - started,
+        'total_s': finished - started,
+        'statements': tx.statements,
+        'rows': tx.rows,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="超大画像解码基准 (整体解码 vs 流式解码)")
+    parser.add_argument('--files-dir', default=os.path.join(PROJECT_ROOT, 'files'))
+    parser.add_argument('--size-mb', type=int, default=100)
+    parser.add_argument('--flush-rows', type=int, default=None, help="覆盖 STREAM_FLUSH_ROWS")
+    parser.add_argument('--child', choices=('dict', 'stream'), help=argparse.SUPPRESS)
+    parser.add_argument('--payload', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    from config.settings import Config
+
+    # 只测量解码和参数行构建，不连接报告库
+    Config.REPORT_STORE_ENABLED = False
+    Config.STREAM_DECODE_MIN_BYTES = 1024 * 1024
+    if args.flush_rows:
+        Config.STREAM_FLUSH_ROWS = args.flush_rows
+    if args.child:
+        run_child(args.child, args.payload)
+        return 0
+
+    fd, path = tempfile.mkstemp(prefix='bench-portrait-', suffix='.json')
+    os.close(fd)
+    try:
+        encounters = generate_payload(path, args.size_mb, args.files_dir)
+        results = {}
+        for mode in ('dict', 'stream'):
+            command = [sys.executable, os.path.abspath(__file__), '--child', mode, '--payload', path]
+            if args.flush_rows:
+                command += ['--flush-rows', str(args.flush_rows)]
+            output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+            results[mode] = json.loads(output.strip().splitlines()[-1])
+        size_mb = os.path.getsize(path) / 1024 / 1024
+    finally:
+        os.remove(path)
+
+    print(f"样本: {size_mb:.1f} MB 响应体, {encounters} 次就诊, STREAM_FLUSH_ROWS={args.flush_rows or Config.STREAM_FLUSH_ROWS}")
+    print(f"{'方式':<10}{'峰值内存 MB':>14}{'解码 s':>10}{'总耗时 s':>12}{'语句数':>10}{'参数行':>12}")
+    for mode, label in (('dict', '整体解码'), ('stream', '流式解码')):
+        r = results[mode]
+        print(f"{label:<10}{r['peak_mb']:>14.1f}{r['decode_s']:>10.2f}{r['total_s']:>12.2f}"
+              f"{r['statements']:>10}{r['rows']:>12}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,82 @@
+# benchmarks/bench_write_path.py
+"""
+写入路径回归基准：用 RecordingTransaction 在不连接 Neo4j 的情况下，对比三种写入模式
+(逐行写入 / 按数据段批量写入 / 图谱增量写入) 的每患者语句数、参数行数和映射 CPU 耗时。
+
+画像取自 files/ 下的样例 JSON，每个样例复制 --repeat 份并替换 patientId，
+模拟一批不同患者共用同一批维度节点的情况。语句数的变化说明写入路径的回归或改进。
+
+用法 (在项目根目录执行):
+    python benchmarks/bench_write_path.py [--files-dir files] [--repeat 200]
+"""
+
+import argparse
+import copy
+import os
+import sys
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from config.settings import Config  # noqa: E402
+from etl.core.condition_resolver import condition_resolver  # noqa: E402
+from etl.core.dimension_cache import dimension_cache  # noqa: E402
+from etl.processors.dry_run import DryRunProcessor, load_payload_files  # noqa: E402
+
+MODES = (
+    ('逐行写入', {'ETL_BATCHED_WRITES': False, 'GRAPH_DELTA_WRITES': False}),
+    ('按数据段批量写入', {'ETL_BATCHED_WRITES': True, 'GRAPH_DELTA_WRITES': False}),
+    ('图谱增量写入', {'ETL_BATCHED_WRITES': True, 'GRAPH_DELTA_WRITES': True}),
+)
+
+
+def build_patients(files_dir, repeat):
+    samples = [data for _, data in load_payload_files(files_dir) if data and data.get('patientId')]
+    patients = []
+    for index in range(repeat):
+        for sample in samples:
+            patient = copy.deepcopy(sample)
+            patient['patientId'] = f"{sample['patientId']}-{index}"
+            patients.append(patient)
+    return patients
+
+
+def run_mode(patients, settings):
+    original = {name: getattr(Config, name) for name in settings}
+    for name, value in settings.items():
+        setattr(Config, name, value)
+    condition_resolver.clear()
+    dimension_cache.clear()
+    processor = DryRunProcessor()
+    try:
+        for patient in patients:
+            processor.process(patient)
+    finally:
+        for name, value in original.items():
+            setattr(Config, name, value)
+    return processor.report()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="写入路径回归基准")
+    parser.add_argument('--files-dir', default=os.path.join(PROJECT_ROOT, 'files'))
+    parser.add_argument('--repeat', type=int, default=200, help="每个样例画像复制的份数")
+    args = parser.parse_args()
+
+    patients = build_patients(args.files_dir, args.repeat)
+    if not patients:
+        print(f"{args.files_dir} 下没有可用的样例画像")
+        return 1
+
+    print(f"样本: {len(patients)} 个患者")
+    print(f"{'模式':<20}{'语句/患者':>10}{'p95':>8}{'参数行/患者':>12}{'CPU ms/患者':>14}{'CPU p95':>10}")
+    for name, settings in MODES:
+        report = run_mode(patients, settings)
+        per_patient = report['statements_per_patient']
+        print(f"{name:<20}{per_patient['mean']:>10}{per_patient['p95']:>8}"
+              f"{report['rows'] / report['patients']:>12.1f}{report['cpu_ms']['mean']:>14.3f}{report['cpu_ms']['p95']:>10.3f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -28,13 +28,90 @@ class Config:
     # 大数平台API配置
     # BIGDATA_API_BASE_URL = "http://10.51.28.117:7080" # 测试地址
     BIGDATA_API_BASE_URL = "http://inside.whitelist.com:1115" # 正式地址
-    BIGDATA_API_TIMEOUT = 10000
+    BIGDATA_API_CONNECT_TIMEOUT = 5   # 建立连接超时（秒）
+    BIGDATA_API_READ_TIMEOUT = 60     # 读取响应超时（秒）
+    PATIENT_FETCH_DEADLINE = 120      # 单个患者拉取的总时限（秒），包括排队、限流等待和请求
+    # 限流与熔断：所有拉取共用一个令牌桶；连续失败达到阈值后熔断，期间快速失败并暂停拉取
+    API_RATE_LIMIT = 0               # 每秒请求数（0 不限流）
+    API_RATE_BURST = 20               # 令牌桶容量
+    API_BREAKER_FAILURES = 5          # 触发熔断的连续失败次数（0 关闭熔断）
+    API_BREAKER_RESET_SECONDS = 30    # 熔断持续时间（秒），之后放行一个探测请求
     
     # 调度配置
     BATCH_SIZE = 50              # 批处理大小
-    MAX_WORKERS = 1              # 最大并发数（暂时串行，避免死锁）
+    MAX_WORKERS = 1              # 最大并发数（TWO_PHASE_LOAD 或 TX_GROUP_SIZE > 1 时按共享节点冲突调度写入线程，可适当调大）
     RETRY_TIMES = 3              # 重试次数
     RETRY_DELAY = 5              # 重试延迟（秒）
+    # 异步预取画像：后台事件循环用 httpx 并发拉取后续患者的画像，写入线程从中取用
+    ASYNC_FETCH = False
+    FETCH_CONCURRENCY = 8        # 同时进行中的画像请求数上限 (也是 keep-alive 连接池大小)
+    FETCH_PREFETCH_DEPTH = 100   # 已拉取但尚未写入的画像上限
+    # 自适应并发 (AIMD)：p95 耗时和错误率在目标内时逐步上调并发数，平台变慢或返回非 0 code 时成倍下调
+    ADAPTIVE_CONCURRENCY = False
+    FETCH_INITIAL_CONCURRENCY = 4
+    FETCH_MIN_CONCURRENCY = 1
+    FETCH_TARGET_P95_MS = 3000   # p95 耗时目标（毫秒）
+    FETCH_MAX_ERROR_RATE = 0.05  # 错误率目标
+    FETCH_LATENCY_WINDOW = 20    # 每次评估的请求数
+    FETCH_DECREASE_FACTOR = 0.5  # 下调时的乘数
+    # 对冲请求：超过运行中 p95 耗时仍未返回的请求再发一次，取先成功返回的结果
+    HEDGED_REQUESTS = False
+    HEDGE_BUDGET = 0.05          # 对冲请求数占总请求数的上限
+    HEDGE_LATENCY_WINDOW = 200   # 计算 p95 的最近成功请求数
+    HEDGE_MIN_SAMPLES = 20       # 样本少于此数时不对冲
+    HEDGE_MIN_DELAY_MS = 100     # 对冲前至少等待的毫秒数
+    # 流式解码：响应体超过阈值时转存临时文件，用 ijson 逐条解析就诊记录并分块写入，单个患者的内存占用不随画像大小增长
+    STREAM_DECODE = False
+    STREAM_DECODE_MIN_BYTES = 16 * 1024 * 1024  # 超过此大小的响应体走流式解码
+    STREAM_DECODE_DIR = None     # 临时文件目录（None 为系统临时目录）
+    STREAM_FLUSH_ROWS = 5000     # 流式写入时每块累计的数据段行数
+    
+    # 写入配置
+    ETL_BATCHED_WRITES = True    # 按数据段批量写入（每个患者每段一条 UNWIND 语句），False 为逐行写入
+    TX_GROUP_SIZE = 1            # 每个写事务包含的患者数，大于 1 时启用多患者事务分组
+    TX_GROUP_MAX_BYTES = 8 * 1024 * 1024  # 单个分组的负载字节预算（0 表示不限制）
+    CONDITION_CACHE_SIZE = 100000  # 诊断 Condition 解析缓存容量（code/name 各自的 LRU 上限，0 表示关闭）
+    DIMENSION_CACHE_SIZE = 50000   # 运行级维度节点去重缓存容量（Hospital/Department/Provider/LabTestItem/Allergen，0 表示关闭）
+    DATETIME_CACHE_SIZE = 65536    # 日期时间字符串解析结果的 LRU 缓存容量（0 表示关闭）
+    
+    # 类型化记录：映射前把画像转换为 msgspec 记录 (etl/core/portrait_records.py)，去空白、空值和“无”/“不详”占位值在转换时统一处理
+    TYPED_RECORDS = False
+    
+    # 变更检测：画像负载哈希未变化的患者跳过写入（哈希保存在 Patient.portraitHash）
+    CHANGE_DETECTION = True
+    CHANGE_DETECTION_IGNORED_FIELDS = ('createdAt', 'updatedAt', 'updateTime')  # 计算哈希时忽略的易变字段
+    CHANGE_DETECTION_VERSION = 1  # 图谱映射逻辑变更时递增，强制所有患者重新写入
+    # 就诊增量同步：按就诊子树指纹 (Encounter.subtreeHash) 只写入变化/新增的就诊
+    ENCOUNTER_DELTA_SYNC = False
+    # 就诊增量同步时删除数据源中已消失的就诊 (DETACH DELETE)，需要显式开启；本次画像中没有任何就诊时始终不删除
+    ENCOUNTER_DELTA_DELETE = False
+    # 两阶段批量加载：先由单写入者写入整批共享节点（医院/科室/医生/Condition/检验项目/过敏原/既往史事件/生活方式），
+    # 再并发写入患者自有数据，对共享节点只做 MATCH；需要 ETL_BATCHED_WRITES
+    TWO_PHASE_LOAD = False
+    # 图谱增量写入：先把画像编译为节点/关系 upsert 增量 (不访问数据库)，再把整组患者的增量合并后按标签/关系类型批量写入
+    GRAPH_DELTA_WRITES = False
+    DELTA_COMPILE_PROCESSES = 0  # 编译增量使用的子进程数（0 表示在写入线程内编译）
+    # 异步写入：用 AsyncGraphDatabase 在一个线程内并发执行写事务，替代按 MAX_WORKERS 开线程写入（需要 neo4j 驱动 5.x）
+    ASYNC_WRITES = False
+    ASYNC_MAX_IN_FLIGHT = 16     # 同时进行中的写事务上限
+    # 亲子关系推断：每批写入后只对本批带有家庭成员的患者补全“配偶的子女”缺失的 PARENT_OF 关系
+    FAMILY_INFERENCE = False
+    FAMILY_INFERENCE_BATCH_SIZE = 1000  # 每个推断事务的患者数；--infer-parents 全图回填时为每个子事务的行数
+    
+    # 画像负载本地缓存：拉取成功的画像压缩后按 (patientId, 负载哈希) 保存，失败重试和 --replay 直接读取缓存
+    SPOOL_ENABLED = False
+    SPOOL_PATH = os.path.join(PROJECT_ROOT, "spool", "payloads.sqlite")
+    SPOOL_MAX_BYTES = 2 * 1024 * 1024 * 1024  # 压缩后总大小上限（0 表示不限制）
+    SPOOL_MAX_AGE_HOURS = 72     # 记录保留时长（小时，0 表示不过期）
+    
+    # 检查报告正文存储：Examination.fullReport 压缩后按 reportId 存入本地 SQLite，图谱节点只保留哈希/长度/预览
+    REPORT_STORE_ENABLED = False
+    REPORT_STORE_PATH = os.path.join(PROJECT_ROOT, "reports", "reports.sqlite")
+    REPORT_PREVIEW_CHARS = 200   # 节点上保留的正文预览字符数
+    
+    # 图谱约束与索引
+    SCHEMA_BOOTSTRAP = True      # ETL 和 API 启动时自动创建缺失的约束与索引
+    SCHEMA_AWAIT_TIMEOUT = 300   # 等待索引上线的超时时间（秒）
     
     # 超时配置
     CONNECTION_TIMEOUT = 30      # 数据库连接超时
@@ -46,6 +123,9 @@ class Config:
     LOG_FILE_ENCODING = "utf-8"  # 日志文件编码
     LOG_MAX_BYTES = 10 * 1024 * 1024  # 10MB
     LOG_BACKUP_COUNT = 5  # 保留最近5个旧日志文件
+    # 写入语句统计：按语句名汇总调用次数、行数、耗时分位数与 ResultSummary 计数，运行结束时输出表格并保存 JSON
+    STATEMENT_STATS = False
+    STATEMENT_STATS_DIR = os.path.join(LOG_DIR, "statements")
     
     
     # 测试PostgreSQL 连接配置（已弃用）
@@ -96,10 +176,68 @@ class Config:
             errors.append("BATCH_SIZE 必须大于 0")
         if cls.MAX_WORKERS <= 0:
             errors.append("MAX_WORKERS 必须大于 0")
+        if cls.BIGDATA_API_CONNECT_TIMEOUT <= 0 or cls.BIGDATA_API_READ_TIMEOUT <= 0:
+            errors.append("BIGDATA_API_CONNECT_TIMEOUT 和 BIGDATA_API_READ_TIMEOUT 必须大于 0")
+        if cls.PATIENT_FETCH_DEADLINE <= 0:
+            errors.append("PATIENT_FETCH_DEADLINE 必须大于 0")
+        if cls.API_RATE_LIMIT < 0:
+            errors.append("API_RATE_LIMIT 不能为负数")
+        if cls.API_RATE_BURST <= 0:
+            errors.append("API_RATE_BURST 必须大于 0")
+        if cls.API_BREAKER_FAILURES < 0:
+            errors.append("API_BREAKER_FAILURES 不能为负数")
+        if cls.API_BREAKER_RESET_SECONDS <= 0:
+            errors.append("API_BREAKER_RESET_SECONDS 必须大于 0")
+        if cls.FETCH_CONCURRENCY <= 0:
+            errors.append("FETCH_CONCURRENCY 必须大于 0")
+        if cls.FETCH_PREFETCH_DEPTH <= 0:
+            errors.append("FETCH_PREFETCH_DEPTH 必须大于 0")
+        if not 1 <= cls.FETCH_MIN_CONCURRENCY <= cls.FETCH_INITIAL_CONCURRENCY <= cls.FETCH_CONCURRENCY:
+            errors.append("必须满足 1 <= FETCH_MIN_CONCURRENCY <= FETCH_INITIAL_CONCURRENCY <= FETCH_CONCURRENCY")
+        if cls.FETCH_TARGET_P95_MS <= 0:
+            errors.append("FETCH_TARGET_P95_MS 必须大于 0")
+        if not 0 <= cls.FETCH_MAX_ERROR_RATE < 1:
+            errors.append("FETCH_MAX_ERROR_RATE 必须在 [0, 1) 之间")
+        if cls.FETCH_LATENCY_WINDOW <= 0:
+            errors.append("FETCH_LATENCY_WINDOW 必须大于 0")
+        if not 0 < cls.FETCH_DECREASE_FACTOR < 1:
+            errors.append("FETCH_DECREASE_FACTOR 必须在 (0, 1) 之间")
+        if not 0 <= cls.HEDGE_BUDGET <= 1:
+            errors.append("HEDGE_BUDGET 必须在 [0, 1] 之间")
+        if cls.HEDGE_LATENCY_WINDOW <= 0:
+            errors.append("HEDGE_LATENCY_WINDOW 必须大于 0")
+        if cls.HEDGE_MIN_SAMPLES < 0 or cls.HEDGE_MIN_DELAY_MS < 0:
+            errors.append("HEDGE_MIN_SAMPLES 和 HEDGE_MIN_DELAY_MS 不能为负数")
+        if cls.STREAM_DECODE_MIN_BYTES < 0:
+            errors.append("STREAM_DECODE_MIN_BYTES 不能为负数")
+        if cls.STREAM_FLUSH_ROWS <= 0:
+            errors.append("STREAM_FLUSH_ROWS 必须大于 0")
         if cls.RETRY_TIMES < 0:
             errors.append("RETRY_TIMES 不能为负数")
         if cls.RETRY_DELAY < 0:
             errors.append("RETRY_DELAY 不能为负数")
+        if cls.TX_GROUP_SIZE <= 0:
+            errors.append("TX_GROUP_SIZE 必须大于 0")
+        if cls.DIMENSION_CACHE_SIZE < 0:
+            errors.append("DIMENSION_CACHE_SIZE 不能为负数")
+        if cls.DATETIME_CACHE_SIZE < 0:
+            errors.append("DATETIME_CACHE_SIZE 不能为负数")
+        if cls.CONDITION_CACHE_SIZE < 0:
+            errors.append("CONDITION_CACHE_SIZE 不能为负数")
+        if cls.TX_GROUP_MAX_BYTES < 0:
+            errors.append("TX_GROUP_MAX_BYTES 不能为负数")
+        if cls.SPOOL_MAX_BYTES < 0:
+            errors.append("SPOOL_MAX_BYTES 不能为负数")
+        if cls.SPOOL_MAX_AGE_HOURS < 0:
+            errors.append("SPOOL_MAX_AGE_HOURS 不能为负数")
+        if cls.DELTA_COMPILE_PROCESSES < 0:
+            errors.append("DELTA_COMPILE_PROCESSES 不能为负数")
+        if cls.ASYNC_MAX_IN_FLIGHT <= 0:
+            errors.append("ASYNC_MAX_IN_FLIGHT 必须大于 0")
+        if cls.REPORT_PREVIEW_CHARS < 0:
+            errors.append("REPORT_PREVIEW_CHARS 不能为负数")
+        if cls.FAMILY_INFERENCE_BATCH_SIZE <= 0:
+            errors.append("FAMILY_INFERENCE_BATCH_SIZE 必须大于 0")
         
         # 验证目录权限
         try:
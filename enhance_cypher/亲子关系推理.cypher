@@ -1,3 +1,7 @@
+// 全图亲子关系推断。ETL 在每批写入后已自动对本批涉及家庭成员的患者执行同样的推断
+// (etl/core/family_inference.py)；全图回填请使用 python main.py --infer-parents，
+// 它通过 CALL {} IN TRANSACTIONS 分批提交，不会形成一个巨大的事务。
+
 // 1. 找到一个“夫妻”对 (parent1 和 parent2)
 MATCH (parent1:Patient)-[:SPOUSE_OF]-(parent2:Patient)
 
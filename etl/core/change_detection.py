@@ -0,0 +1,68 @@
+# etl/core/change_detection.py
+
+import hashlib
+import json
+
+from config.settings import Config
+from etl.utils.statement_stats import name_statement
+from etl.utils.stream_decode import EncounterStream
+
+# 批量读取已写入患者的画像哈希
+LOAD_HASHES_QUERY = name_statement('patient.load_hashes', """
+UNWIND $patientIds AS patientId
+MATCH (p:Patient {patientId: patientId})
+RETURN p.patientId AS patientId, p.portraitHash AS portraitHash
+""")
+
+# 与患者数据在同一事务中写入，保证哈希只在写入成功后才生效
+STORE_HASH_QUERY = name_statement('patient.store_hash', """
+MATCH (p:Patient {patientId: $patientId})
+SET p.portraitHash = $portraitHash
+""")
+
+
+def _strip_volatile(value, ignored):
+    if isinstance(value, dict):
+        return {k: _strip_volatile(v, ignored) for k, v in value.items() if k not in ignored}
+    if isinstance(value, list):
+        return [_strip_volatile(v, ignored) for v in value]
+    return value
+
+
+def canonical_hash(value):
+    """
+    计算任意负载的规范化哈希。
+    忽略 createdAt 等易变字段，键排序后序列化；CHANGE_DETECTION_VERSION 参与计算，
+    图谱映射逻辑变更时递增即可让所有数据重新写入。
+    """
+    canonical = _strip_volatile(value, set(Config.CHANGE_DETECTION_IGNORED_FIELDS))
+    payload = json.dumps(
+        [Config.CHANGE_DETECTION_VERSION, canonical],
+        ensure_ascii=False, sort_keys=True, separators=(',', ':'), default=str
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def portrait_hash(patient_data):
+    """
+    计算整份健康画像负载的哈希。
+    流式解码的画像逐条计算就诊记录的哈希后再合并，不需要整份画像驻留内存
+    (结果与同一画像整体解码时的哈希不同，画像跨过 STREAM_DECODE_MIN_BYTES 时会重新写入一次)。
+    """
+    encounters = patient_data.get('encounters') if isinstance(patient_data, dict) else None
+    if isinstance(encounters, EncounterStream):
+        digest = hashlib.sha256()
+        for encounter in encounters:
+            digest.update(canonical_hash(encounter).encode('ascii'))
+        return canonical_hash([dict(patient_data, encounters=None), digest.hexdigest()])
+    return canonical_hash(patient_data)
+
+
+def load_stored_hashes(session, patient_ids):
+    """返回 {patientId: portraitHash}，没有写入过的患者不在结果中"""
+    result = session.run(LOAD_HASHES_QUERY, patientIds=list(patient_ids))
+    return {record['patientId']: record['portraitHash'] for record in result}
+
+
+def store_hash(tx, patient_id, digest):
+    tx.run(STORE_HASH_QUERY, patientId=patient_id, portraitHash=digest)
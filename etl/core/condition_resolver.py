@@ -0,0 +1,444 @@
+# etl/core/condition_resolver.py
+
+import threading
+from collections import OrderedDict
+
+from config.settings import Config
+from etl.utils.logger import setup_logger
+from etl.utils.metrics import run_metrics
+from etl.utils.statement_stats import name_statement
+
+logger = setup_logger('condition_resolver')
+
+
+# 缓存未命中的诊断逐行按原有规则解析：有 code 时按 code 查找，code 和 name 都查不到才新建；
+# 没有 code 时按 name 查找或新建。在 CALL 子查询中逐行执行，后面的行能看到前面行新建的节点。
+RESOLVE_CONDITIONS_QUERY = name_statement('diagnosis.resolve', """
+UNWIND $rows AS row
+CALL {
+    WITH row
+    OPTIONAL MATCH (byCode:Condition {code: row.diseaseCode})
+    WITH row, count(byCode) AS codeHits
+    OPTIONAL MATCH (byName:Condition {name: row.diseaseName})
+    WITH row, codeHits, count(byName) AS nameHits
+    FOREACH (ignored IN CASE WHEN codeHits = 0 AND nameHits = 0 THEN [1] ELSE [] END |
+        CREATE (c:Condition)
+            SET c.code = row.diseaseCode, c.name = row.diseaseName
+    )
+    WITH row
+    OPTIONAL MATCH (byCode:Condition {code: row.diseaseCode})
+    WITH row, collect(byCode) AS byCode
+    OPTIONAL MATCH (byName:Condition {name: row.diseaseName}) WHERE row.diseaseCode IS NULL
+    WITH byCode + collect(byName) AS matched
+    RETURN [c IN matched | elementId(c)] AS conditionIds
+}
+RETURN row.idx AS idx, conditionIds
+""")
+
+# 已解析出节点 id 的诊断直接按 id 建立关系
+LINK_DIAGNOSES_QUERY = name_statement('diagnosis.link_resolved', """
+UNWIND $rows AS row
+UNWIND row.conditionIds AS conditionId
+MATCH (c:Condition) WHERE elementId(c) = conditionId
+SET c.name = row.diseaseName
+WITH c, row
+MATCH (e:Encounter {encounterId: row.encounterId})
+MERGE (e)-[:RECORDED_DIAGNOSIS]->(c)
+""")
+
+# 两阶段加载的第二阶段：Condition 节点和名称已在第一阶段写好，这里只 MATCH 节点、建立关系
+LINK_PRELOADED_DIAGNOSES_QUERY = name_statement('diagnosis.link_preloaded', """
+UNWIND $rows AS row
+UNWIND row.conditionIds AS conditionId
+MATCH (c:Condition) WHERE elementId(c) = conditionId
+MATCH (e:Encounter {encounterId: row.encounterId})
+MERGE (e)-[:RECORDED_DIAGNOSIS]->(c)
+""")
+
+# 两阶段加载的第一阶段：按整批诊断写入 Condition 名称
+SET_CONDITION_NAMES_QUERY = name_statement('diagnosis.set_names', """
+UNWIND $rows AS row
+UNWIND row.conditionIds AS conditionId
+MATCH (c:Condition) WHERE elementId(c) = conditionId
+SET c.name = row.diseaseName
+""")
+
+# 诊断与检查发现交错出现时按原顺序逐行写入 Condition：诊断沿用 RESOLVE_CONDITIONS_QUERY 的规则并写入名称、
+# 建立 RECORDED_DIAGNOSIS，检查发现按 name MERGE 并建立 HAS_FINDING (与 BATCHED_SECTION_QUERIES 中的语句一致)。
+# 检查发现行带 findingResult，诊断行没有；返回每条诊断解析到的节点 id
+CONDITION_LINK_QUERY = name_statement('condition.link', """
+UNWIND $rows AS row
+CALL {
+    WITH row
+    WITH row WHERE row.findingResult IS NULL
+    OPTIONAL MATCH (byCode:Condition {code: row.diseaseCode})
+    WITH row, count(byCode) AS codeHits
+    OPTIONAL MATCH (byName:Condition {name: row.diseaseName})
+    WITH row, codeHits, count(byName) AS nameHits
+    FOREACH (ignored IN CASE WHEN codeHits = 0 AND nameHits = 0 THEN [1] ELSE [] END |
+        CREATE (c:Condition)
+            SET c.code = row.diseaseCode, c.name = row.diseaseName
+    )
+    WITH row
+    OPTIONAL MATCH (byCode:Condition {code: row.diseaseCode})
+    WITH row, collect(byCode) AS byCode
+    OPTIONAL MATCH (byName:Condition {name: row.diseaseName}) WHERE row.diseaseCode IS NULL
+    WITH row, byCode + collect(byName) AS matched
+    OPTIONAL MATCH (e:Encounter {encounterId: row.encounterId})
+    FOREACH (c IN matched |
+        SET c.name = row.diseaseName
+        FOREACH (ignored IN CASE WHEN e IS NULL THEN [] ELSE [1] END |
+            MERGE (e)-[:RECORDED_DIAGNOSIS]->(c)
+        )
+    )
+    RETURN [c IN matched | elementId(c)] AS conditionIds
+    UNION
+    WITH row
+    WITH row WHERE row.findingResult IS NOT NULL
+    MATCH (ex:Examination {reportId: row.reportId})
+    MERGE (c:Condition {name: row.findingResult})
+    ON CREATE SET c.code = row.findingCode
+    MERGE (ex)-[r:HAS_FINDING]->(c)
+    ON CREATE SET
+        r.bodyPart = row.bodyPart,
+        r.diagnosisId = row.diagnosisId
+    RETURN [] AS conditionIds
+}
+RETURN row.idx AS idx, conditionIds
+""")
+
+# 两阶段加载的第一阶段：同上，只写 Condition 节点和名称，不建立关系
+PRELOAD_CONDITIONS_QUERY = name_statement('condition.preload', """
+UNWIND $rows AS row
+CALL {
+    WITH row
+    WITH row WHERE row.findingResult IS NULL
+    OPTIONAL MATCH (byCode:Condition {code: row.diseaseCode})
+    WITH row, count(byCode) AS codeHits
+    OPTIONAL MATCH (byName:Condition {name: row.diseaseName})
+    WITH row, codeHits, count(byName) AS nameHits
+    FOREACH (ignored IN CASE WHEN codeHits = 0 AND nameHits = 0 THEN [1] ELSE [] END |
+        CREATE (c:Condition)
+            SET c.code = row.diseaseCode, c.name = row.diseaseName
+    )
+    WITH row
+    OPTIONAL MATCH (byCode:Condition {code: row.diseaseCode})
+    WITH row, collect(byCode) AS byCode
+    OPTIONAL MATCH (byName:Condition {name: row.diseaseName}) WHERE row.diseaseCode IS NULL
+    WITH row, byCode + collect(byName) AS matched
+    FOREACH (c IN matched | SET c.name = row.diseaseName)
+    RETURN [c IN matched | elementId(c)] AS conditionIds
+    UNION
+    WITH row
+    WITH row WHERE row.findingResult IS NOT NULL
+    MERGE (c:Condition {name: row.findingResult})
+    ON CREATE SET c.code = row.findingCode
+    RETURN [] AS conditionIds
+}
+RETURN row.idx AS idx, conditionIds
+""")
+
+# 预热按 code / name 聚合：同一个 code (或 name) 可能对应多个节点，缓存条目必须包含全部节点，
+# 条数上限只在键之间截断，不会把某个键的节点集合截成一半
+WARM_CODES_QUERY = name_statement('condition.warm_codes', """
+MATCH (c:Condition) WHERE c.code IS NOT NULL
+WITH c.code AS code, collect(elementId(c)) AS ids
+RETURN code, ids
+LIMIT $limit
+""")
+
+WARM_NAMES_QUERY = name_statement('condition.warm_names', """
+MATCH (c:Condition) WHERE c.name IS NOT NULL
+WITH c.name AS name, collect(elementId(c)) AS ids
+RETURN name, ids
+LIMIT $limit
+""")
+
+
+class ConditionResolver:
+    """
+    诊断 Condition 节点解析缓存。
+
+    维护 code -> 节点id 与 name -> 节点id 两个 LRU 映射，运行开始时从 Neo4j 批量预热。
+    诊断命中缓存时直接按节点 id 建立关系，只有未命中的诊断才走数据库查找/新建。
+    事务内新解析的条目先暂存在线程本地，事务提交后才写入共享缓存，避免缓存指向被回滚的节点。
+    """
+
+    def __init__(self, max_size=None):
+        self.max_size = Config.CONDITION_CACHE_SIZE if max_size is None else max_size
+        self._by_code = OrderedDict()
+        self._by_name = OrderedDict()
+        self._name_of = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pinned = {}
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def warm(self, driver, database=None):
+        """从 Neo4j 批量加载已有 Condition 节点的 code 和 name 条目，返回加载的条目数"""
+        if not self.enabled:
+            return 0
+        codes = names = 0
+        with driver.session(database=database or Config.NEO4J_DATABASE) as session:
+            for record in session.run(WARM_CODES_QUERY, limit=self.max_size):
+                with self._lock:
+                    self._by_code[record['code']] = tuple(record['ids'])
+                    self._evict(self._by_code)
+                codes += 1
+            for record in session.run(WARM_NAMES_QUERY, limit=self.max_size):
+                with self._lock:
+                    for node_id in record['ids']:
+                        self._add_name(record['name'], node_id)
+                names += 1
+        logger.info(f"Condition 缓存预热完成，加载 {codes} 个 code、{names} 个 name")
+        return codes + names
+
+    def clear(self):
+        with self._lock:
+            self._by_code.clear()
+            self._by_name.clear()
+            self._name_of.clear()
+            self.hits = 0
+            self.misses = 0
+
+    # --- 事务暂存 ---
+
+    def begin(self):
+        """事务函数开始时调用；execute_write 重试时会重新开始暂存"""
+        self._local.pending = []
+
+    def commit(self):
+        """事务提交成功后，把暂存的解析结果写入共享缓存"""
+        pending = getattr(self._local, 'pending', None) or []
+        self._local.pending = []
+        with self._lock:
+            for code, name, ids in pending:
+                self._remember(code, name, ids)
+
+    def rollback(self):
+        self._local.pending = []
+
+    def detach(self):
+        """取出当前线程暂存的条目；asyncio 写入在同一线程内交替执行多个事务，提交前再用 attach 放回"""
+        pending = getattr(self._local, 'pending', None) or []
+        self._local.pending = []
+        return pending
+
+    def attach(self, pending):
+        self._local.pending = pending
+
+    # --- 两阶段加载 ---
+
+    @property
+    def pinned(self):
+        return bool(self._pinned)
+
+    def pin(self, mapping):
+        """第一阶段提交后固定整批诊断的解析结果，第二阶段按它只 MATCH 节点"""
+        self._pinned = dict(mapping)
+
+    def unpin(self):
+        self._pinned = {}
+
+    def preload(self, tx, rows):
+        """
+        两阶段加载的第一阶段：解析(必要时新建)整批诊断的 Condition 节点，并写入节点名称。
+
+        按诊断在批次中首次出现的顺序解析，保持逐行写入时“先出现的先建”的规则；
+        逐行写入时每条诊断都会 SET c.name，这里同一节点以最后一次出现的名称为准；
+        缓存中记录的名称已经相同的节点不再写入。
+
+        Returns:
+            dict: {(diseaseCode, diseaseName): [节点id, ...]}
+        """
+        keys = list(OrderedDict.fromkeys((row['diseaseCode'], row['diseaseName']) for row in rows))
+        key_rows = [{'diseaseCode': code, 'diseaseName': name} for code, name in keys]
+        mapping = dict(zip(keys, self._resolve(tx, key_rows)))
+
+        last_seen = OrderedDict()
+        for row in rows:
+            key = (row['diseaseCode'], row['diseaseName'])
+            last_seen.pop(key, None)
+            last_seen[key] = mapping[key]
+
+        name_rows = []
+        with self._lock:
+            current = {node_id: self._name_of.get(node_id) for ids in last_seen.values() for node_id in ids}
+        for (code, name), ids in last_seen.items():
+            if not ids:
+                continue
+            if any(current[node_id] != name for node_id in ids):
+                name_rows.append({'diseaseName': name, 'conditionIds': ids})
+                current.update((node_id, name) for node_id in ids)
+            self._stage(code, name, ids)
+        if name_rows:
+            tx.run(SET_CONDITION_NAMES_QUERY, rows=name_rows)
+        return mapping
+
+    def preload_in_order(self, tx, rows):
+        """
+        两阶段加载的第一阶段：诊断与检查发现交错出现的患者按原顺序逐行写入 Condition
+        (rows 为 etl_patient.ordered_condition_rows 合并后的行)。
+
+        Returns:
+            dict: {(diseaseCode, diseaseName): [节点id, ...]}，同一诊断以最后一次出现的解析结果为准
+        """
+        return self._run_in_order(tx, PRELOAD_CONDITIONS_QUERY, rows)
+
+    # --- 解析与写入 ---
+
+    def link_in_order(self, tx, rows):
+        """
+        诊断与检查发现按原顺序在一条语句中写入 (rows 为 etl_patient.ordered_condition_rows 合并后的行)。
+        检查发现可能先建出与后面的诊断同名的节点，诊断不能提前解析，这里由数据库逐行解析，结果同样暂存到事务提交。
+        """
+        self._run_in_order(tx, CONDITION_LINK_QUERY, rows)
+
+    def link_diagnoses(self, tx, rows):
+        """
+        为 build_diagnosis_rows 产出的诊断行解析 Condition 节点并建立 RECORDED_DIAGNOSIS 关系。
+        """
+        if self._pinned:
+            preloaded_rows, rest = [], []
+            for row in rows:
+                ids = self._pinned.get((row['diseaseCode'], row['diseaseName']))
+                if ids is None:
+                    rest.append(row)
+                elif ids:
+                    preloaded_rows.append(dict(row, conditionIds=list(ids)))
+            if preloaded_rows:
+                tx.run(LINK_PRELOADED_DIAGNOSES_QUERY, rows=preloaded_rows)
+            rows = rest
+            if not rows:
+                return
+
+        resolved = self._resolve(tx, rows)
+
+        link_rows = []
+        for row, ids in zip(rows, resolved):
+            if not ids:
+                # code 未命中但同名节点已存在时，原有规则不建立关系
+                continue
+            link_rows.append(dict(row, conditionIds=ids))
+            self._stage(row['diseaseCode'], row['diseaseName'], ids)
+
+        if link_rows:
+            tx.run(LINK_DIAGNOSES_QUERY, rows=link_rows)
+
+    # --- 内部方法 ---
+
+    def _run_in_order(self, tx, query, rows):
+        params = [dict(row, idx=idx) for idx, row in enumerate(rows)]
+        mapping = {}
+        for record in sorted(tx.run(query, rows=params), key=lambda record: record['idx']):
+            row = rows[record['idx']]
+            if 'findingResult' in row:
+                continue
+            ids = list(record['conditionIds'])
+            key = (row['diseaseCode'], row['diseaseName'])
+            mapping.pop(key, None)
+            mapping[key] = ids
+            if ids and self.enabled:
+                self._stage(row['diseaseCode'], row['diseaseName'], ids)
+        return mapping
+
+    def _resolve(self, tx, rows):
+        """返回与 rows 一一对应的节点 id 列表；缓存未命中的 (code, name) 走数据库查找/新建"""
+        resolved = [self._lookup(row['diseaseCode'], row['diseaseName']) for row in rows]
+
+        # 同一个 (code, name) 只需解析一次，按首次出现的顺序解析即可保持逐行语义
+        keys = []
+        for row, ids in zip(rows, resolved):
+            key = (row['diseaseCode'], row['diseaseName'])
+            if ids is None and key not in keys:
+                keys.append(key)
+        hits = len(rows) - sum(1 for ids in resolved if ids is None)
+        with self._lock:
+            self.hits += hits
+            self.misses += len(keys)
+        if hits:
+            run_metrics.incr('condition.hits', hits)
+        if keys:
+            run_metrics.incr('condition.misses', len(keys))
+
+        if keys:
+            miss_rows = [
+                {'idx': idx, 'diseaseCode': code, 'diseaseName': name}
+                for idx, (code, name) in enumerate(keys)
+            ]
+            by_key = {}
+            for record in tx.run(RESOLVE_CONDITIONS_QUERY, rows=miss_rows):
+                by_key[keys[record['idx']]] = list(record['conditionIds'])
+            resolved = [
+                by_key.get((row['diseaseCode'], row['diseaseName']), []) if ids is None else ids
+                for row, ids in zip(rows, resolved)
+            ]
+        return resolved
+
+    def _lookup(self, code, name):
+        pending = getattr(self._local, 'pending', None) or []
+        for p_code, p_name, ids in reversed(pending):
+            if (code is not None and p_code == code) or (code is None and p_name == name):
+                return ids
+        with self._lock:
+            mapping, key = (self._by_code, code) if code is not None else (self._by_name, name)
+            ids = mapping.get(key)
+            if ids is not None:
+                mapping.move_to_end(key)
+            return ids
+
+    def _stage(self, code, name, ids):
+        if not hasattr(self._local, 'pending'):
+            self._local.pending = []
+        self._local.pending.append((code, name, ids))
+
+    def _remember(self, code, name, ids):
+        if code is not None:
+            self._by_code[code] = tuple(ids)
+            self._by_code.move_to_end(code)
+            self._evict(self._by_code)
+        # 关系写入时会 SET c.name，节点可能被改名，先移除这些节点的旧名称条目
+        for node_id in ids:
+            old_name = self._name_of.get(node_id)
+            if old_name is not None and old_name != name:
+                self._drop_name(old_name)
+        if name is not None:
+            for node_id in ids:
+                self._add_name(name, node_id)
+
+    def _add_code(self, code, node_id):
+        ids = self._by_code.get(code, ())
+        if node_id not in ids:
+            self._by_code[code] = ids + (node_id,)
+        self._by_code.move_to_end(code)
+        self._evict(self._by_code)
+
+    def _add_name(self, name, node_id):
+        ids = self._by_name.get(name, ())
+        if node_id not in ids:
+            self._by_name[name] = ids + (node_id,)
+        self._name_of[node_id] = name
+        self._by_name.move_to_end(name)
+        self._evict(self._by_name)
+
+    def _drop_name(self, name):
+        for node_id in self._by_name.pop(name, ()):
+            if self._name_of.get(node_id) == name:
+                del self._name_of[node_id]
+
+    def _evict(self, mapping):
+        while len(mapping) > self.max_size:
+            key, ids = mapping.popitem(last=False)
+            if mapping is self._by_name:
+                for node_id in ids:
+                    if self._name_of.get(node_id) == key:
+                        del self._name_of[node_id]
+
+
+# 进程内共享的解析器实例
+condition_resolver = ConditionResolver()
@@ -0,0 +1,93 @@
+# etl/core/conflict_scheduler.py
+
+import heapq
+
+from etl.core.etl_patient import (
+    build_family_member_rows,
+    build_lifestyle_fact_row,
+    iter_lifestyle_facts,
+)
+from etl.utils.logger import setup_logger
+
+logger = setup_logger('conflict_scheduler')
+
+# 两阶段加载预写入成功后，这些标签的节点在第二阶段只被 MATCH，不再计为写冲突
+PRELOADED_CONFLICT_LABELS = ('LifestyleFact',)
+
+
+def conflict_keys(patient_data):
+    """
+    患者写入时会加写锁的跨患者共享节点键：
+      - ('Patient', patientId)：本人，以及家族成员节点上被 SET 的 patientId
+      - ('Identity', (idType, idValue))：本人的认领查询，以及家族成员按证件 MERGE 的 Patient 节点
+      - ('LifestyleFact', (type, value))
+
+    医院、科室取值很少，几乎每个患者都会涉及，计为冲突会把整批患者并成一个 lane；
+    这两类节点在写入时按 id 排序 (见 etl_patient.LOCK_ORDERED_SECTIONS)，各事务按相同顺序加锁，不计入冲突键。
+    """
+    patient_id = patient_data.get('patientId')
+    keys = {('Patient', patient_id)}
+
+    id_type, id_value = patient_data.get('idType'), patient_data.get('idValue')
+    if id_type and id_value:
+        keys.add(('Identity', (id_type, id_value)))
+
+    for row in build_family_member_rows(patient_id, patient_data.get('familyMembers') or []):
+        keys.add(('Identity', (row['idType'], row['idValue'])))
+        if row['properties'].get('patientId') is not None:
+            keys.add(('Patient', row['properties']['patientId']))
+
+    for fact_type, fact_value, source, record_data in iter_lifestyle_facts(patient_data):
+        row = build_lifestyle_fact_row(patient_id, fact_type, fact_value, source, record_data)
+        if row is not None:
+            keys.add(('LifestyleFact', (row['type'], row['value'])))
+    return keys
+
+
+def schedule_lanes(items, lanes, ignored_labels=()):
+    """
+    按共享节点键把待写入的患者分配到写入线程 (lane)。
+
+    共享任意一个键的患者通过并查集归入同一个连通分量，同一分量的患者放在同一个 lane 内
+    按原有顺序串行写入；互不相关的分量按大小从大到小分配到当前负载最小的 lane，lane 之间并发。
+
+    Args:
+        items: [(key, patient_data, digest), ...]
+        lanes: lane 数量，一般为 MAX_WORKERS
+        ignored_labels: 不计为冲突的节点标签
+
+    Returns:
+        list: 每个 lane 的 items 列表 (不含空 lane)
+    """
+    parent = list(range(len(items)))
+
+    def find(index):
+        while parent[index] != index:
+            parent[index] = parent[parent[index]]
+            index = parent[index]
+        return index
+
+    owner = {}
+    for index, (_, patient_data, _) in enumerate(items):
+        for key in conflict_keys(patient_data):
+            if key[0] in ignored_labels:
+                continue
+            other = owner.setdefault(key, index)
+            if other != index:
+                parent[find(index)] = find(other)
+
+    components = {}
+    for index in range(len(items)):
+        components.setdefault(find(index), []).append(index)
+
+    heap = [(0, lane) for lane in range(max(1, lanes))]
+    assigned = [[] for _ in heap]
+    for members in sorted(components.values(), key=len, reverse=True):
+        load, lane = heapq.heappop(heap)
+        assigned[lane].extend(members)
+        heapq.heappush(heap, (load + len(members), lane))
+
+    result = [[items[index] for index in sorted(members)] for members in assigned if members]
+    largest = max((len(members) for members in components.values()), default=0)
+    logger.debug(f"冲突调度 - {len(items)} 个患者, {len(components)} 个分量, 最大分量 {largest}, {len(result)} 个 lane")
+    return result
@@ -0,0 +1,186 @@
+# etl/core/delta_writer.py
+
+from collections import OrderedDict
+from functools import lru_cache
+
+from etl.core.condition_resolver import condition_resolver
+from etl.core.dimension_cache import dimension_cache
+from etl.core.etl_patient import import_section_rows
+from etl.core.graph_delta import UNDIRECTED_REL_TYPES, node_labels
+from etl.utils.logger import setup_logger
+from etl.utils.metrics import run_metrics
+from etl.utils.report_store import report_store
+from etl.utils.statement_stats import name_statement
+
+logger = setup_logger('delta_writer')
+
+# 与 import_patient_core 一致：认领按证件预建、还没有 patientId 的节点与本人节点的 upsert 在同一条语句中完成，
+# 两次查找分别由 patientId 唯一约束和 (idType, idValue) 复合索引支撑
+PATIENT_NODE_QUERY = name_statement('delta.node.Patient.patientId', """
+UNWIND $rows AS row
+OPTIONAL MATCH (existing:Patient {patientId: row.key[0]})
+WITH row, head(collect(existing)) AS existing
+OPTIONAL MATCH (prebuilt:Patient {idType: row.set.idType, idValue: row.set.idValue})
+WHERE row.claim AND existing IS NULL AND prebuilt.patientId IS NULL
+WITH row, head(collect(prebuilt)) AS prebuilt
+FOREACH (node IN CASE WHEN prebuilt IS NULL THEN [] ELSE [prebuilt] END |
+    SET node.patientId = row.key[0]
+)
+MERGE (n:Patient {patientId: row.key[0]})
+ON CREATE SET n += row.create
+ON MATCH SET n += row.match
+SET n += row.set
+""")
+
+
+# 医院、科室不计入冲突调度 (见 etl_patient.LOCK_ORDERED_SECTIONS)，按键排序后写入，并发事务按相同顺序加锁
+LOCK_ORDERED_LABELS = ('Hospital', 'Department')
+
+# 诊断和检查发现的关系由 conditions 中的参数行按 Condition 解析规则写入，不按增量中的 upsert 写入
+CONDITION_REL_TYPES = ('RECORDED_DIAGNOSIS', 'HAS_FINDING')
+
+
+def _key_map(key_props, param):
+    return ', '.join(f"{prop}: {param}[{index}]" for index, prop in enumerate(key_props))
+
+
+@lru_cache(maxsize=None)
+def node_query(label, key_props):
+    return name_statement(f"delta.node.{label}.{'+'.join(key_props)}", f"""
+    UNWIND $rows AS row
+    MERGE (n:{':'.join(node_labels(label))} {{{_key_map(key_props, 'row.key')}}})
+    ON CREATE SET n += row.create
+    ON MATCH SET n += row.match
+    SET n += row.set
+    """)
+
+
+@lru_cache(maxsize=None)
+def rel_query(rel_type, start_label, start_key_props, end_label, end_key_props, key_props):
+    rel_keys = f" {{{_key_map(key_props, 'row.key')}}}" if key_props else ''
+    arrow = '-' if rel_type in UNDIRECTED_REL_TYPES else '->'
+    name = f"delta.rel.{rel_type}.{start_label}.{'+'.join(start_key_props)}-{end_label}.{'+'.join(end_key_props)}"
+    return name_statement(name, f"""
+    UNWIND $rows AS row
+    MATCH (a:{':'.join(node_labels(start_label))} {{{_key_map(start_key_props, 'row.start')}}})
+    MATCH (b:{':'.join(node_labels(end_label))} {{{_key_map(end_key_props, 'row.end')}}})
+    MERGE (a)-[r:{rel_type}{rel_keys}]{arrow}(b)
+    ON CREATE SET r += row.create
+    SET r += row.set
+    """)
+
+
+def _pinned(ref):
+    """两阶段加载第一阶段已写入的共享节点 (键与 dimension_cache.pin 的格式一致)"""
+    if not dimension_cache.pinned:
+        return False
+    key = ref.key[0] if len(ref.key) == 1 else ref.key
+    return dimension_cache.is_pinned(ref.label, key)
+
+
+def _findings_first(rows):
+    """是否有检查发现出现在诊断之前 (与 etl_patient.condition_rows_interleaved 相同，这里按合并后的行顺序判断)"""
+    diagnoses = [index for index, row in enumerate(rows) if 'findingResult' not in row]
+    return bool(diagnoses) and any('findingResult' in row for row in rows[:diagnoses[-1]])
+
+
+def _apply_conditions(tx, rows):
+    """
+    按逐行写入的规则写入诊断和检查发现：诊断走 Condition 解析 (两阶段加载时使用第一阶段固定的结果)，
+    有检查发现出现在诊断之前时合并为一条语句按原顺序执行。返回发送的语句数。
+    """
+    if not condition_resolver.pinned and _findings_first(rows):
+        condition_resolver.link_in_order(tx, rows)
+        return 1
+    statements = 0
+    for name, section_rows in (
+        ('diagnosis.link', [row for row in rows if 'findingResult' not in row]),
+        ('exam.finding', [row for row in rows if 'findingResult' in row]),
+    ):
+        if section_rows:
+            import_section_rows(tx, None, name, section_rows)
+            statements += 1
+    return statements
+
+
+def apply_delta(tx, delta):
+    """
+    在事务中写入一个 (可以是多个患者合并后的) 图谱增量：
+    先写入本人节点 (同时认领按证件预建的节点)，再按标签和键分组 upsert 其他节点，最后按关系类型和端点分组 upsert 关系，
+    每组一条 UNWIND 语句。两阶段加载时已固定的共享节点不再 upsert，两端都已固定的关系也不再写入。
+
+    诊断和检查发现按 delta.conditions 中的参数行写入 (见 _apply_conditions)，在 Condition 节点 upsert 之前执行，
+    增量中对应的 Condition 节点和关系不再写入；家族病史等其他关系引用的 Condition 仍按名称 upsert。
+    """
+    # 启用报告库时检查报告正文存入报告库，不再写入图谱
+    delta = report_store.offload_delta(delta)
+
+    # 除诊断和检查发现外仍引用 Condition 的节点 (家族病史)
+    condition_refs = {upsert.end for upsert in delta.rels
+                      if upsert.type not in CONDITION_REL_TYPES and upsert.end.label == 'Condition'}
+
+    patients = []
+    node_groups = OrderedDict()
+    for upsert in delta.nodes:
+        ref = upsert.ref
+        if ref.label == 'Condition' and ref not in condition_refs:
+            continue
+        row = {
+            'key': list(ref.key),
+            'set': upsert.set_props,
+            'create': upsert.create_props,
+            'match': upsert.match_props,
+        }
+        if ref.label == 'Patient' and ref.key_props == ('patientId',):
+            # 证件信息完整时才认领预建节点
+            row['claim'] = bool(upsert.set_props.get('idType') and upsert.set_props.get('idValue'))
+            patients.append(row)
+            continue
+        if _pinned(ref):
+            continue
+        node_groups.setdefault((ref.label, ref.key_props), []).append(row)
+
+    rel_groups = OrderedDict()
+    for upsert in delta.rels:
+        start, end = upsert.start, upsert.end
+        if upsert.type in CONDITION_REL_TYPES:
+            continue
+        if _pinned(start) and _pinned(end):
+            continue
+        group = (upsert.type, start.label, start.key_props, end.label, end.key_props, upsert.key_props)
+        rel_groups.setdefault(group, []).append({
+            'start': list(start.key),
+            'end': list(end.key),
+            'key': list(upsert.key),
+            'set': upsert.set_props,
+            'create': upsert.create_props,
+        })
+
+    for (label, _), rows in node_groups.items():
+        if label in LOCK_ORDERED_LABELS:
+            rows.sort(key=lambda row: [str(value) for value in row['key']])
+
+    statements = 0
+    if patients:
+        # 先写本人节点：后面按证件 MERGE 的家族成员节点如果正是本批的患者，会匹配到已认领的节点
+        tx.run(PATIENT_NODE_QUERY, rows=patients)
+        statements += 1
+    # Condition 之外的节点 (Encounter、Examination 等) 先写入，诊断和检查发现按原有规则解析后，再写其他 Condition
+    for (label, key_props), rows in node_groups.items():
+        if label != 'Condition':
+            tx.run(node_query(label, key_props), rows=rows)
+            statements += 1
+    if delta.conditions:
+        statements += _apply_conditions(tx, [row for _, row in delta.conditions])
+    for (label, key_props), rows in node_groups.items():
+        if label == 'Condition':
+            tx.run(node_query(label, key_props), rows=rows)
+            statements += 1
+    for group, rows in rel_groups.items():
+        tx.run(rel_query(*group), rows=rows)
+        statements += 1
+
+    run_metrics.incr('delta.nodes', len(patients) + sum(len(rows) for rows in node_groups.values()))
+    run_metrics.incr('delta.rels', sum(len(rows) for rows in rel_groups.values()))
+    run_metrics.incr('delta.statements', statements)
+    logger.debug(f"写入图谱增量 - {len(delta.patient_ids)} 个患者, {statements} 条语句")
@@ -0,0 +1,134 @@
+# etl/core/dimension_cache.py
+
+import threading
+from collections import OrderedDict
+
+from config.settings import Config
+from etl.utils.logger import setup_logger
+
+logger = setup_logger('dimension_cache')
+
+
+class DimensionCache:
+    """
+    运行级维度节点去重缓存 (Hospital / Department / Provider / LabTestItem / Allergen)。
+
+    记录本次运行中已经 upsert 过的维度节点及其属性值。后续患者的同一维度节点、
+    同样的属性值不再重复 MERGE+SET，只建立关系，减少对这些共享热点节点的加锁。
+    与 ConditionResolver 一样，事务内的记录先暂存，提交成功后才生效。
+    """
+
+    def __init__(self, max_size=None):
+        self.max_size = Config.DIMENSION_CACHE_SIZE if max_size is None else max_size
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pinned = frozenset()
+        self.skipped = 0
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def clear(self):
+        """每次运行开始时清空，保证缓存只反映本次运行写入过的值"""
+        with self._lock:
+            self._seen.clear()
+            self.skipped = 0
+
+    def begin(self):
+        self._local.pending = OrderedDict()
+
+    def commit(self):
+        pending = getattr(self._local, 'pending', None) or {}
+        self._local.pending = OrderedDict()
+        with self._lock:
+            for key, signature in pending.items():
+                self._seen[key] = signature
+                self._seen.move_to_end(key)
+            while len(self._seen) > self.max_size:
+                self._seen.popitem(last=False)
+
+    def rollback(self):
+        self._local.pending = OrderedDict()
+
+    def detach(self):
+        """取出当前线程暂存的条目；asyncio 写入在同一线程内交替执行多个事务，提交前再用 attach 放回"""
+        pending = getattr(self._local, 'pending', None) or OrderedDict()
+        self._local.pending = OrderedDict()
+        return pending
+
+    def attach(self, pending):
+        self._local.pending = pending
+
+    def mark(self, label, key, signature=()):
+        """记录一个已在当前事务中 upsert 的维度节点"""
+        if not hasattr(self._local, 'pending'):
+            self._local.pending = OrderedDict()
+        self._local.pending[(label, key)] = tuple(signature)
+
+    def split(self, label, rows, key_field, signature_fields):
+        """
+        把一个数据段的参数行拆分为 (需要 MERGE+SET 的行, 只需建立关系的行)。
+
+        按行顺序判断：节点当前的属性值(包括本批中前面行写入的值)与本行一致时才跳过 upsert，
+        因此“后写覆盖先写”的结果与全部 upsert 时相同。
+        """
+        upsert_rows, link_rows = [], []
+        for row in rows:
+            key = (label, row[key_field])
+            signature = tuple(row[field] for field in signature_fields)
+            if self._current(key) == signature:
+                link_rows.append(row)
+            else:
+                upsert_rows.append(row)
+                self.mark(label, row[key_field], signature)
+        self.skipped += len(link_rows)
+        return upsert_rows, link_rows
+
+    # --- 两阶段加载 ---
+
+    @property
+    def pinned(self):
+        return bool(self._pinned)
+
+    def pin(self, keys):
+        """第一阶段提交后固定整批已写入的共享节点 {(标签, 键), ...}，第二阶段只 MATCH 这些节点"""
+        self._pinned = frozenset(keys)
+
+    def unpin(self):
+        self._pinned = frozenset()
+
+    def is_pinned(self, label, key):
+        return (label, key) in self._pinned
+
+    def split_pinned(self, label, rows, key_fields):
+        """把一个数据段的参数行拆分为 (仍需 MERGE 的行, 节点已由第一阶段写入、只需建立关系的行)"""
+        upsert_rows, link_rows = [], []
+        for row in rows:
+            if (label, row_key(row, key_fields)) in self._pinned:
+                link_rows.append(row)
+            else:
+                upsert_rows.append(row)
+        return upsert_rows, link_rows
+
+    def _current(self, key):
+        pending = getattr(self._local, 'pending', None)
+        if pending and key in pending:
+            return pending[key]
+        with self._lock:
+            signature = self._seen.get(key)
+            if signature is not None:
+                self._seen.move_to_end(key)
+            return signature
+
+
+def row_key(row, key_fields):
+    """取参数行的节点键；key_fields 为元组时返回组合键"""
+    if isinstance(key_fields, tuple):
+        return tuple(row[field] for field in key_fields)
+    return row[key_fields]
+
+
+# 进程内共享的维度缓存实例
+dimension_cache = DimensionCache()
@@ -0,0 +1,208 @@
+# etl/core/dimension_preload.py
+
+from collections import OrderedDict
+
+from etl.core.condition_resolver import condition_resolver
+from etl.core.dimension_cache import dimension_cache, row_key
+from etl.core.etl_patient import (
+    DIMENSION_SECTIONS, PRELOADED_SECTIONS, condition_rows_interleaved, iter_patient_sections, ordered_condition_rows,
+)
+from etl.utils.logger import setup_logger
+from etl.utils.stream_decode import is_streamed
+from etl.utils.statement_stats import register_statements
+
+logger = setup_logger('dimension_preload')
+
+# 两阶段加载第一阶段的写入语句：不涉及任何患者节点，只 upsert 共享节点，
+# 属性写法与 BATCHED_SECTION_QUERIES 中对应的语句一致 (SET 为后写覆盖，ON CREATE SET 为先写为准)
+PRELOAD_QUERIES = OrderedDict([
+    ('encounter.hospital', """
+    UNWIND $rows AS row
+    MERGE (h:Hospital {hospitalId: row.hospitalId})
+    SET h.name = row.hospitalName
+    """),
+    ('encounter.department', """
+    UNWIND $rows AS row
+    MERGE (d:Department {departmentId: row.departmentId})
+    SET d.name = row.departmentName
+    WITH d, row
+    OPTIONAL MATCH (h:Hospital {hospitalId: row.hospitalId})
+    FOREACH (ignored IN CASE WHEN h IS NULL THEN [] ELSE [1] END |
+        MERGE (h)-[:HAS_DEPARTMENT]->(d)
+    )
+    """),
+    ('encounter.provider', """
+    UNWIND $rows AS row
+    MERGE (doc:Provider {providerId: row.providerId})
+    SET doc.name = row.providerName
+    """),
+    ('exam.finding', """
+    UNWIND $rows AS row
+    MERGE (c:Condition {name: row.findingResult})
+    ON CREATE SET c.code = row.findingCode
+    """),
+    ('lab.item', """
+    UNWIND $rows AS row
+    MERGE (li:LabTestItem {name: row.itemName})
+    ON CREATE SET li.code = row.itemCode
+    """),
+    ('allergy.link', """
+    UNWIND $rows AS row
+    MERGE (a:Allergen {name: row.allergen})
+    """),
+    ('family_history.link', """
+    UNWIND $rows AS row
+    MERGE (c:Condition {name: row.relativeDisease})
+    """),
+    ('event.blood_transfusion', """
+    UNWIND $rows AS row
+    MERGE (e:PastMedicalEvent:BloodTransfusion {name: row.name, date: row.date})
+    ON CREATE SET
+        e.volumeMl = row.volume,
+        e.address = row.address,
+        e.transfusionId = row.transfusionId
+    """),
+    ('event.surgery', """
+    UNWIND $rows AS row
+    MERGE (e:PastMedicalEvent:Surgery {name: row.name})
+    ON CREATE SET
+        e.date = row.date,
+        e.bodySite = row.bodySite,
+        e.code = row.code
+    """),
+    ('event.trauma', """
+    UNWIND $rows AS row
+    MERGE (e:PastMedicalEvent:Trauma {name: row.name})
+    ON CREATE SET
+        e.date = row.date,
+        e.severity = row.severity,
+        e.healed = row.healed,
+        e.traumaId = row.traumaId
+    """),
+    ('lifestyle.fact', """
+    UNWIND $rows AS row
+    MERGE (f:LifestyleFact {type: row.type, value: row.value})
+    """),
+])
+
+register_statements('preload.', PRELOAD_QUERIES)
+
+# 语句中只有 ON CREATE SET (或没有属性) 的数据段：同一节点以批次中第一次出现的行为准；
+# 其余数据段使用 SET，逐行写入时后写覆盖先写
+FIRST_WINS_SECTIONS = {
+    'exam.finding', 'lab.item', 'allergy.link', 'family_history.link',
+    'event.blood_transfusion', 'event.surgery', 'event.trauma', 'lifestyle.fact',
+}
+
+
+class BatchDimensions:
+    """
+    一批患者涉及的全部共享节点。
+
+    Attributes:
+        sections: {数据段: [参数行, ...]}，每个数据段已去重并按节点键排序，保证固定的加锁顺序
+        diagnoses: 整批诊断行 (保持批次顺序，Condition 的“先查后建”依赖出现顺序)
+        ordered_conditions: 有检查发现出现在诊断之前的患者的诊断和检查发现行，按逐行写入的顺序合并
+    """
+
+    def __init__(self, sections, diagnoses, ordered_conditions=()):
+        self.sections = sections
+        self.diagnoses = diagnoses
+        self.ordered_conditions = list(ordered_conditions)
+
+    def keys(self):
+        """第一阶段写入后可以在第二阶段只 MATCH 的 {(标签, 键), ...}"""
+        keys = set()
+        for name, rows in self.sections.items():
+            label, key_fields = PRELOADED_SECTIONS[name]
+            keys.update((label, row_key(row, key_fields)) for row in rows)
+        label, key_field = PRELOADED_SECTIONS['exam.finding']
+        keys.update((label, row[key_field]) for row in self.ordered_conditions if key_field in row)
+        return keys
+
+    def __len__(self):
+        return (sum(len(rows) for rows in self.sections.values()) + len(self.diagnoses)
+                + len(self.ordered_conditions))
+
+
+def _distinct(name, rows):
+    """按数据段的覆盖规则去重，再按节点键稳定排序"""
+    _, key_fields = PRELOADED_SECTIONS[name]
+    distinct = OrderedDict()
+    for row in rows:
+        key = row_key(row, key_fields)
+        if isinstance(key, tuple) and any(part is None for part in key):
+            # 组合键含空值时 MERGE 会报错，留给第二阶段按原有语句逐患者处理
+            continue
+        if name in FIRST_WINS_SECTIONS:
+            distinct.setdefault(key, row)
+        else:
+            # SET 语义：保留所有不同的取值，顺序按最后一次出现排列，重放后结果与逐行写入一致
+            signature = tuple(sorted((k, repr(v)) for k, v in row.items() if k != 'encounterId'))
+            distinct.pop((key, signature), None)
+            distinct[(key, signature)] = row
+    return sorted(distinct.values(), key=lambda row: repr(row_key(row, key_fields)))
+
+
+def collect_batch_dimensions(patients):
+    """
+    汇总一批患者健康画像中的共享节点。
+
+    Args:
+        patients: [(patient_id, patient_data), ...]
+    """
+    collected = OrderedDict((name, []) for name in PRELOAD_QUERIES)
+    diagnoses = []
+    ordered_conditions = []
+    for patient_id, patient_data in patients:
+        streamed = is_streamed(patient_data)
+        for sections in iter_patient_sections(patient_id, patient_data):
+            diagnosis_rows, finding_rows = sections.get('diagnosis.link', []), sections.get('exam.finding', [])
+            if condition_rows_interleaved(diagnosis_rows, finding_rows):
+                # 检查发现可能先建出与后面的诊断同名的 Condition，这类患者的诊断和检查发现按原顺序预写入。
+                # 第二阶段检查发现仍按名称 MATCH：后面的诊断按 code 把检查发现建出的节点改名时 (罕见)，
+                # 该检查发现关联到改名后仍同名的节点，与逐行写入不同
+                ordered_conditions.extend(ordered_condition_rows(diagnosis_rows, finding_rows))
+                sections = dict(sections, **{'exam.finding': []})
+            else:
+                diagnoses.extend(diagnosis_rows)
+            for name in collected:
+                collected[name].extend(sections.get(name, []))
+            if streamed:
+                # 流式解码的超大画像逐块去重，汇总的共享节点行数不随就诊数增长
+                for name in collected:
+                    collected[name] = _distinct(name, collected[name])
+
+    sections = OrderedDict()
+    for name, rows in collected.items():
+        rows = _distinct(name, rows)
+        if rows:
+            sections[name] = rows
+    return BatchDimensions(sections, diagnoses, ordered_conditions)
+
+
+def preload_dimensions(tx, dimensions):
+    """
+    两阶段加载的第一阶段 (单写入者)：在一个事务中 upsert 整批的共享节点。
+
+    Returns:
+        dict: 诊断解析结果 {(diseaseCode, diseaseName): [节点id, ...]}
+    """
+    # 诊断先于检查发现/家族史解析：诊断与检查发现不交错的患者，逐患者写入时诊断段在前，同名 Condition 由诊断规则先建；
+    # 交错的患者按原顺序逐行解析
+    diagnosis_ids = {}
+    if dimensions.diagnoses:
+        diagnosis_ids = condition_resolver.preload(tx, dimensions.diagnoses)
+    if dimensions.ordered_conditions:
+        diagnosis_ids.update(condition_resolver.preload_in_order(tx, dimensions.ordered_conditions))
+
+    for name, rows in dimensions.sections.items():
+        if name in DIMENSION_SECTIONS and dimension_cache.enabled:
+            # 本次运行已写过且属性未变的维度节点无需再次 upsert
+            label, key_field, signature_fields = DIMENSION_SECTIONS[name]
+            rows, _ = dimension_cache.split(label, rows, key_field, signature_fields)
+        if rows:
+            tx.run(PRELOAD_QUERIES[name], rows=rows)
+
+    logger.debug(f"共享节点预写入完成 - {len(dimensions)} 行")
+    return diagnosis_ids
@@ -0,0 +1,211 @@
+# etl/core/encounter_delta.py
+
+from collections import OrderedDict
+
+from config.settings import Config
+from etl.core.change_detection import canonical_hash
+from etl.utils.logger import setup_logger
+from etl.utils.metrics import run_metrics
+from etl.utils.statement_stats import name_statement
+from etl.utils.stream_decode import EncounterStream
+
+logger = setup_logger('encounter_delta')
+
+# 读取患者已写入的就诊及其子树指纹
+LOAD_SUBTREE_HASHES_QUERY = name_statement('encounter.load_hashes', """
+MATCH (p:Patient {patientId: $patientId})-[:HAD_ENCOUNTER]->(e:Encounter)
+RETURN e.encounterId AS encounterId, e.subtreeHash AS subtreeHash
+""")
+
+# 一次读取一批患者已写入的就诊子树指纹 (两阶段加载的第一阶段用来跳过未变化的就诊)
+LOAD_BATCH_SUBTREE_HASHES_QUERY = name_statement('encounter.load_batch_hashes', """
+UNWIND $patientIds AS patientId
+MATCH (p:Patient {patientId: patientId})-[:HAD_ENCOUNTER]->(e:Encounter)
+RETURN patientId, e.encounterId AS encounterId, e.subtreeHash AS subtreeHash
+""")
+
+# 清空就诊的子树：删除就诊发出的关系，检查/检验报告不再被任何就诊引用时一并删除
+PRUNE_SUBTREES_QUERY = name_statement('encounter.prune', """
+UNWIND $encounterIds AS encounterId
+MATCH (e:Encounter {encounterId: encounterId})
+CALL {
+    WITH e
+    MATCH (e)-[r:AT_HOSPITAL|IN_DEPARTMENT|TREATED_BY|RECORDED_DIAGNOSIS]->()
+    DELETE r
+}
+CALL {
+    WITH e
+    MATCH (e)-[r:HAD_EXAMINATION|HAD_LAB_TEST]->(child)
+    DELETE r
+    WITH DISTINCT child
+    WHERE NOT ()-[:HAD_EXAMINATION|HAD_LAB_TEST]->(child)
+    DETACH DELETE child
+}
+""")
+
+# 数据源中已不存在的就诊，在子树清空后删除就诊节点本身
+DELETE_ENCOUNTERS_QUERY = name_statement('encounter.delete', """
+UNWIND $encounterIds AS encounterId
+MATCH (p:Patient {patientId: $patientId})-[:HAD_ENCOUNTER]->(e:Encounter {encounterId: encounterId})
+DETACH DELETE e
+""")
+
+# 子树写入完成后记录指纹
+STORE_SUBTREE_HASHES_QUERY = name_statement('encounter.store_hashes', """
+UNWIND $rows AS row
+MATCH (e:Encounter {encounterId: row.encounterId})
+SET e.subtreeHash = row.subtreeHash
+""")
+
+
+class EncounterDelta:
+    """
+    一个患者本次需要写入的就诊增量。
+
+    Attributes:
+        encounters: 指纹变化或新增的就诊记录 (保持数据源中的原始顺序)，交给常规导入流程写入
+        hashes: {encounterId: subtreeHash}，写入完成后通过 store_hashes 记录
+        unchanged / removed: 跳过的就诊数、删除的就诊数
+    """
+
+    def __init__(self, encounters, hashes, unchanged, removed):
+        self.encounters = encounters
+        self.hashes = hashes
+        self.unchanged = unchanged
+        self.removed = removed
+
+    def store_hashes(self, tx):
+        if not self.hashes:
+            return
+        rows = [{'encounterId': eid, 'subtreeHash': digest} for eid, digest in self.hashes.items()]
+        tx.run(STORE_SUBTREE_HASHES_QUERY, rows=rows)
+
+
+def group_encounters(encounters_list):
+    """按 encounterId 分组 (数据源中同一次就诊可能拆成多条记录)，缺少 encounterId 的记录丢弃"""
+    groups = OrderedDict()
+    for encounter in encounters_list:
+        encounter_id = encounter.get('encounterId') if encounter else None
+        if not encounter_id:
+            continue
+        groups.setdefault(encounter_id, []).append(encounter)
+    return groups
+
+
+def subtree_fingerprints(groups):
+    """每次就诊子树 (就诊本身、诊断、检查、检验) 的规范化哈希"""
+    return {encounter_id: canonical_hash(records) for encounter_id, records in groups.items()}
+
+
+def streamed_subtree_fingerprints(stream):
+    """
+    EncounterStream 版本的 subtree_fingerprints：逐条读取就诊，只暂存同一 encounterId 尚未读完的记录，
+    结果与整体解码后分组计算的指纹一致。
+    """
+    counts = stream.encounter_counts
+    fingerprints = OrderedDict()
+    pending = {}
+    for encounter in stream:
+        encounter_id = encounter.get('encounterId') if encounter else None
+        if not encounter_id:
+            continue
+        records = pending.setdefault(encounter_id, [])
+        records.append(encounter)
+        if len(records) >= counts.get(encounter_id, 0):
+            fingerprints[encounter_id] = canonical_hash(pending.pop(encounter_id))
+    return fingerprints
+
+
+def encounter_fingerprints(encounters_list):
+    """就诊列表或 EncounterStream 的子树指纹 {encounterId: subtreeHash}"""
+    if isinstance(encounters_list, EncounterStream):
+        return streamed_subtree_fingerprints(encounters_list)
+    return subtree_fingerprints(group_encounters(encounters_list))
+
+
+def _fingerprint(encounters_list):
+    """返回 (按 encounterId 分组的记录, 子树指纹)；EncounterStream 不整体分组，分组为 None"""
+    if isinstance(encounters_list, EncounterStream):
+        return None, streamed_subtree_fingerprints(encounters_list)
+    groups = group_encounters(encounters_list)
+    return groups, subtree_fingerprints(groups)
+
+
+def _select(encounters_list, groups, encounter_ids):
+    """只保留指定 encounterId 的就诊记录 (保持原始顺序)，EncounterStream 返回视图"""
+    if groups is None:
+        return encounters_list.only(encounter_ids)
+    return [record for eid, records in groups.items() if eid in encounter_ids for record in records]
+
+
+def load_batch_subtree_hashes(session, patient_ids):
+    """返回 {patientId: {encounterId: subtreeHash}}，没有写入过就诊的患者不在结果中"""
+    stored = {}
+    for record in session.run(LOAD_BATCH_SUBTREE_HASHES_QUERY, patientIds=list(patient_ids)):
+        stored.setdefault(record['patientId'], {})[record['encounterId']] = record['subtreeHash']
+    return stored
+
+
+def changed_encounters(encounters_list, stored):
+    """
+    只保留子树指纹与 stored ({encounterId: subtreeHash}) 不同或新增的就诊记录，
+    与 plan_encounter_delta 交给常规导入流程写入的就诊相同，但不修改图谱。
+    """
+    groups, fingerprints = _fingerprint(encounters_list)
+    changed = {eid for eid, digest in fingerprints.items() if stored.get(eid) != digest}
+    return _select(encounters_list, groups, changed)
+
+
+def plan_encounter_delta(tx, patient_id, encounters_list):
+    """
+    对比数据源与图谱中的就诊子树指纹，在当前事务中完成增量准备：
+      - 指纹未变化的就诊：跳过
+      - 指纹变化的就诊：先清空旧子树，再由常规导入流程重新写入
+      - 新增的就诊：直接写入
+      - 数据源中已消失的就诊：ENCOUNTER_DELTA_DELETE 开启时删除子树和就诊节点，否则保留；
+        本次画像中一次就诊都没有 (接口返回空列表或截断) 时不删除任何就诊
+
+    流式解码的就诊记录 (EncounterStream) 不整体分组，返回只包含变化就诊的 EncounterStream 视图。
+
+    Returns:
+        EncounterDelta
+    """
+    groups, fingerprints = _fingerprint(encounters_list)
+
+    stored = {
+        record['encounterId']: record['subtreeHash']
+        for record in tx.run(LOAD_SUBTREE_HASHES_QUERY, patientId=patient_id)
+    }
+
+    changed = [eid for eid, digest in fingerprints.items() if stored.get(eid) != digest]
+    stale = [eid for eid in changed if eid in stored]
+    vanished = [eid for eid in stored if eid not in fingerprints]
+    if vanished and not (Config.ENCOUNTER_DELTA_DELETE and fingerprints):
+        run_metrics.incr('encounters.delete_skipped', len(vanished))
+        logger.warning(
+            f"保留数据源中已不存在的就诊 - PatientId: {patient_id}, 数量: {len(vanished)}, "
+            f"{'未开启 ENCOUNTER_DELTA_DELETE' if fingerprints else '本次画像中没有就诊记录'}"
+        )
+        vanished = []
+
+    if stale or vanished:
+        tx.run(PRUNE_SUBTREES_QUERY, encounterIds=stale + vanished)
+    if vanished:
+        tx.run(DELETE_ENCOUNTERS_QUERY, patientId=patient_id, encounterIds=vanished)
+        logger.warning(f"删除数据源中已不存在的就诊 - PatientId: {patient_id}, 数量: {len(vanished)}")
+
+    encounters = _select(encounters_list, groups, set(changed))
+    unchanged = len(fingerprints) - len(changed)
+
+    run_metrics.incr('encounters.unchanged', unchanged)
+    run_metrics.incr('encounters.written', len(changed))
+    run_metrics.incr('encounters.removed', len(vanished))
+    logger.debug(
+        f"就诊增量 - PatientId: {patient_id}, 写入: {len(changed)}, 跳过: {unchanged}, 删除: {len(vanished)}"
+    )
+    return EncounterDelta(
+        encounters,
+        {eid: fingerprints[eid] for eid in changed},
+        unchanged,
+        len(vanished),
+    )
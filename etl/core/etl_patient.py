@@ -1,30 +1,76 @@
 # etl/core/etl_patient.py
 
 import json
+import re
 from datetime import datetime
+from functools import lru_cache
+from config.settings import Config
 from etl.utils.logger import setup_logger
+from etl.utils.metrics import run_metrics
+from etl.utils.statement_stats import name_statement, register_statements
+from etl.utils.report_store import report_fields, report_store
+from etl.core.condition_resolver import condition_resolver
+from etl.core.dimension_cache import dimension_cache
+from etl.core.encounter_delta import plan_encounter_delta
+from etl.core.portrait_records import to_encounter_record, to_record
+from etl.utils.stream_decode import EncounterStream
 
 logger = setup_logger('etl_patient_core') 
 
 
+# parse_datetime 支持的格式，按顺序尝试
+DATETIME_FORMATS = (
+    "%Y-%m-%d %H:%M:%S.%f",
+    "%Y-%m-%dT%H:%M:%S.%f",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%d",
+    "%Y-%m-%dT%H:%M:%SZ"
+)
+
+# 一次匹配覆盖 DATETIME_FORMATS 的全部格式，各字段的写法与 strptime 对 %Y/%m/%d/%H/%M/%S/%f 的匹配规则一致
+_DATETIME_PATTERN = re.compile(
+    r'(\d\d\d\d)-(1[0-2]|0[1-9]|[1-9])-(3[01]|[12]\d|0[1-9]|[1-9]| [1-9])'
+    r'(?:(\s+|T)(2[0-3]|[0-1]\d|\d):([0-5]\d|\d):(6[0-1]|[0-5]\d|\d)(?:\.([0-9]{1,6}))?(Z)?)?',
+    re.IGNORECASE
+)
+
+
 def parse_datetime(dt_str):
     """Safely parse datetime strings, trying multiple formats."""
     if not dt_str or not isinstance(dt_str, str):
         return None
-    formats_to_try = [
-        "%Y-%m-%d %H:%M:%S.%f",
-        "%Y-%m-%dT%H:%M:%S.%f",
-        "%Y-%m-%d %H:%M:%S",
-        "%Y-%m-%dT%H:%M:%S",
-        "%Y-%m-%d",
-        "%Y-%m-%dT%H:%M:%SZ"
-    ]
-    for fmt in formats_to_try:
+    result = _parse_datetime_cached(dt_str)
+    if result is None:
+        # 无法解析的值只计数，不逐条记录日志
+        run_metrics.incr('datetime.unparseable')
+    return result
+
+
+@lru_cache(maxsize=Config.DATETIME_CACHE_SIZE)
+def _parse_datetime_cached(dt_str):
+    match = _DATETIME_PATTERN.fullmatch(dt_str)
+    if match:
+        year, month, day, sep, hour, minute, second, fraction, zulu = match.groups()
+        # 'Z' 只出现在不带小数秒的 T 格式中，其余组合交给 strptime 判定
+        if not zulu or (sep.upper() == 'T' and fraction is None):
+            try:
+                if hour is None:
+                    return datetime(int(year), int(month), int(day))
+                return datetime(int(year), int(month), int(day), int(hour), int(minute), int(second),
+                                int(fraction.ljust(6, '0')) if fraction else 0)
+            except ValueError:
+                pass
+    return _parse_datetime_slow(dt_str)
+
+
+def _parse_datetime_slow(dt_str):
+    for fmt in DATETIME_FORMATS:
         try:
             return datetime.strptime(dt_str, fmt)
         except ValueError:
             continue
-    logger.warning(f"Could not parse date string: {dt_str} with any known format.")
+    logger.debug(f"Could not parse date string: {dt_str} with any known format.")
     return None
 
 def import_patient_data_from_json(tx, patient_json_data):
@@ -43,6 +89,22 @@ def import_patient_data_from_json(tx, patient_json_data):
         return
 
     import_patient_core(tx, patient_id, data)
+
+    encounter_delta = None
+    if Config.ENCOUNTER_DELTA_SYNC and data.get('encounters') is not None:
+        # 就诊增量：只写入子树指纹变化或新增的就诊，已消失的就诊在这里删除
+        encounter_delta = plan_encounter_delta(tx, patient_id, data['encounters'])
+        data = dict(data, encounters=encounter_delta.encounters)
+
+    if Config.ETL_BATCHED_WRITES:
+        # 批量模式：每个数据段只发送一条 UNWIND 语句，图谱结果与逐行写入一致；
+        # 流式解码的超大画像按 STREAM_FLUSH_ROWS 分块发送
+        for sections in iter_patient_sections(patient_id, data):
+            import_patient_sections_batched(tx, patient_id, sections)
+        if encounter_delta:
+            encounter_delta.store_hashes(tx)
+        return
+
     # import_encounters(tx, patient_id, data.get('encounters', []))
     # import_allergies(tx, patient_id, data.get('allergyProfilesList', []))
     # import_family_history(tx, patient_id, data.get('familyHistoryList', []))
@@ -84,10 +146,48 @@ def import_patient_data_from_json(tx, patient_json_data):
         import_family_members(tx, patient_id, family_members)    
         
     import_personal_history(tx, patient_id, data)
+
+    if encounter_delta:
+        encounter_delta.store_hashes(tx)
     
     
 
 
+# 本人节点的认领与合并在同一条语句中完成，两次查找分别由 patientId 唯一约束和 (idType, idValue) 复合索引支撑：
+#   - 已有该 patientId 的节点：直接更新
+#   - 没有时，如果存在按证件预建 (家族成员导入时创建)、还没有 patientId 的节点，先由本人认领再更新
+#   - 都没有时新建
+PATIENT_UPSERT_QUERY = name_statement('patient.upsert', """
+OPTIONAL MATCH (existing:Patient {patientId: $patientId})
+WITH head(collect(existing)) AS existing
+OPTIONAL MATCH (prebuilt:Patient {idType: $idType, idValue: $idValue})
+WHERE $claim AND existing IS NULL AND prebuilt.patientId IS NULL
+WITH head(collect(prebuilt)) AS prebuilt
+FOREACH (node IN CASE WHEN prebuilt IS NULL THEN [] ELSE [prebuilt] END |
+    SET node.patientId = $patientId
+)
+MERGE (p:Patient {patientId: $patientId})
+ON CREATE SET
+    p.name = $name,
+    p.empi = $empi,
+    p.birthDate = $birthDate,
+    p.gender = $gender,
+    p.idValue = $idValue,
+    p.idType = $idType,
+    p.maritalStatus = $maritalStatus,
+    p.createdAt = $createdAt
+ON MATCH SET
+    p.name = $name,
+    p.empi = $empi,
+    p.birthDate = $birthDate,
+    p.gender = $gender,
+    p.idValue = $idValue,
+    p.idType = $idType,
+    p.maritalStatus = $maritalStatus,
+    p.updateTime = $updateTime
+""")
+
+
 def import_patient_core(tx, patient_id, data):
     """
     Imports the main patient node, ensuring it can merge with pre-built nodes from family members.
@@ -95,47 +195,10 @@ def import_patient_core(tx, patient_id, data):
     id_type = data.get('idType')
     id_value = data.get('idValue')
 
-    # 步骤 1: "认领"查询
-    # 如果存在一个通过证件信息创建的、但还没有patientId的预建节点，
-    # 就把当前 ETL 的 patient_id 赋予它。
-    # 这一步是连接预建节点和正式节点的关键。
-    if id_type and id_value:
-        claim_query = """
-        MATCH (p:Patient {idType: $idType, idValue: $idValue})
-        WHERE p.patientId IS NULL
-        SET p.patientId = $patientId
-        """
-        tx.run(claim_query, 
-               idType=id_type, 
-               idValue=id_value, 
-               patientId=patient_id)
-
-    # 步骤 2: 主查询 (合并与更新)
-    # 经过步骤1，现在可以安全地通过 patientId 来合并节点，不会产生重复。
-    # 如果节点是预建的，它现在已经被“认领”了；如果是全新的，则会在这里被创建。
-    query = """
-    MERGE (p:Patient {patientId: $patientId})
-    ON CREATE SET
-        p.name = $name,
-        p.empi = $empi,
-        p.birthDate = $birthDate,
-        p.gender = $gender,
-        p.idValue = $idValue,
-        p.idType = $idType,
-        p.maritalStatus = $maritalStatus,
-        p.createdAt = $createdAt
-    ON MATCH SET
-        p.name = $name,
-        p.empi = $empi,
-        p.birthDate = $birthDate,
-        p.gender = $gender,
-        p.idValue = $idValue,
-        p.idType = $idType,
-        p.maritalStatus = $maritalStatus,
-        p.updateTime = $updateTime
-    """
-    tx.run(query,
+    tx.run(PATIENT_UPSERT_QUERY,
            patientId=patient_id,
+           # 证件信息完整时才认领预建节点
+           claim=bool(id_type and id_value),
            name=data.get('name'),
            # 注意：根据您之前的JSON, 'empiNo' 已更正为 'empi'
            empi=data.get('empi'),
@@ -149,24 +212,396 @@ def import_patient_core(tx, patient_id, data):
            updateTime=parse_datetime(data.get('updateTime'))
           )
 
-def import_encounters(tx, patient_id, encounters_list):
-    """Imports all encounters and their nested details, creating distinct nodes for hospitals, departments, and providers."""
-    # 【新增】定义就诊类型的映射
-    encounter_type_map = {
-        '1': '门诊',
-        '2': '住院',
-        '3': '体检'
+# ---------------------------------------------------------------------------
+# 行构建函数 (row builders)
+# 负责把 JSON 映射成参数行，逐行写入和批量写入共用同一套映射与跳过规则。
+# ---------------------------------------------------------------------------
+
+# 就诊类型的映射
+ENCOUNTER_TYPE_MAP = {
+    '1': '门诊',
+    '2': '住院',
+    '3': '体检'
+}
+
+# 家族成员关系代码到标准化类型的映射字典 (白名单)
+FAMILY_RELATIONSHIP_MAP = {
+    '1': 'SPOUSE',
+    '2': 'CHILD',
+    '4': 'PARENT',
+}
+
+# 性别代码映射
+FAMILY_GENDER_MAP = { '1': 'Male', '2': 'Female' }
+
+
+def build_encounter_rows(patient_id, encounter):
+    """
+    为单次就诊构建 encounter / hospital / department / provider 四类参数行。
+    缺少 encounterId 时返回 None。
+    """
+    encounter_id = encounter.get('encounterId')
+    if not encounter_id:
+        logger.debug(f"Skipping encounter for patient {patient_id} due to missing encounterId. Record: {encounter}")
+        return None
+
+    encounter_type_code = encounter.get('encounterType')
+    rows = {
+        'encounter': {
+            'encounterId': encounter_id,
+            'encounterType': encounter_type_code,
+            # 获取可读的类型名称，如果找不到则使用"未知类型"
+            'typeName': ENCOUNTER_TYPE_MAP.get(str(encounter_type_code), '未知类型'),
+            'visitStartTime': parse_datetime(encounter.get('visitStartTime')),
+            'visitEndTime': parse_datetime(encounter.get('visitEndTime')),
+        },
+        'hospital': None,
+        'department': None,
+        'provider': None,
     }
 
-    for encounter in encounters_list:
-        encounter_id = encounter.get('encounterId')
-        if not encounter_id:
-            logger.debug(f"Skipping encounter for patient {patient_id} due to missing encounterId. Record: {encounter}")
+    hospital_id = encounter.get('hospitalId')
+    if hospital_id:
+        rows['hospital'] = {
+            'encounterId': encounter_id,
+            'hospitalId': hospital_id,
+            'hospitalName': encounter.get('hospitalName'),
+        }
+
+    department_id = encounter.get('departmentId')
+    if department_id:
+        rows['department'] = {
+            'encounterId': encounter_id,
+            'departmentId': department_id,
+            'departmentName': encounter.get('departmentName'),
+            'hospitalId': hospital_id,
+        }
+
+    provider_id = encounter.get('attendingProviderId')
+    if provider_id:
+        rows['provider'] = {
+            'encounterId': encounter_id,
+            'providerId': provider_id,
+            'providerName': encounter.get('attendingProviderName'),
+        }
+    return rows
+
+
+def build_diagnosis_rows(encounter_id, diagnoses_list):
+    rows = []
+    for diagnosis in diagnoses_list:
+        disease_name = diagnosis.get('diagnosisName')
+        disease_code = diagnosis.get('diagnosisNo')
+
+        if not disease_name and not disease_code:
+            logger.debug(f"Skipping diagnosis for encounter {encounter_id} due to missing name and code.")
+            continue
+
+        rows.append({
+            'encounterId': encounter_id,
+            'diseaseName': disease_name,
+            'diseaseCode': disease_code,
+        })
+    return rows
+
+
+def build_examination_rows(encounter_id, examinations_list):
+    """返回 (检查报告行, 检查发现行)。"""
+    exam_rows = []
+    finding_rows = []
+    for exam in examinations_list:
+        report_id = exam.get('reportId')
+        if not report_id:
+            logger.debug(f"Skipping examination for encounter {encounter_id} due to missing reportId. Record: {exam}")
+            continue
+
+        exam_rows.append({
+            'encounterId': encounter_id,
+            'reportId': report_id,
+            'timestamp': parse_datetime(exam.get('timestamp')),
+            'fullReport': exam.get('fullReport'),
+            # 启用报告库时节点只保留正文摘要，正文在写入时存入报告库
+            **report_fields(exam.get('fullReport') if Config.REPORT_STORE_ENABLED else None),
+        })
+
+        for finding in exam.get('findings', []):
+            finding_result = finding.get('diagnosisResult')
+            if not finding_result:
+                logger.debug(f"Skipping examination finding for report {report_id} due to missing diagnosisResult. Record: {finding}")
+                continue
+
+            finding_rows.append({
+                'reportId': report_id,
+                'findingResult': finding_result,
+                'findingCode': finding.get('diagnosisCode'),
+                'bodyPart': finding.get('bodyPart'),
+                'diagnosisId': finding.get('diagnosisId'),
+            })
+    return exam_rows, finding_rows
+
+
+def build_lab_test_rows(encounter_id, lab_tests_list):
+    """返回 (检验报告行, 检验项目行)。"""
+    report_rows = []
+    item_rows = []
+    for lab_test in lab_tests_list:
+        report_id = lab_test.get('reportId')
+        if not report_id:
+            logger.debug(f"Skipping lab test for encounter {encounter_id} due to missing reportId. Record: {lab_test}")
+            continue
+
+        report_rows.append({'encounterId': encounter_id, 'reportId': report_id})
+
+        for item in lab_test.get('items', []):
+            item_name = item.get('labtestIndexName', '').strip()
+            test_id = item.get('testId')
+            if not item_name or not test_id:
+                logger.debug(f"Skipping lab test item for report {report_id} due to missing labtestIndexName or testId. Record: {item}")
+                continue
+
+            item_rows.append({
+                'reportId': report_id,
+                'itemName': item_name,
+                'itemCode': item.get('labtestIndexCode', '').strip(),
+                'testId': test_id,
+                'value': item.get('value'),
+                'textValue': item.get('textValue'),
+                'unit': item.get('unit'),
+                'referenceRange': item.get('referenceRange'),
+                'interpretation': item.get('interpretation'),
+                'timestamp': parse_datetime(item.get('timestamp')),
+            })
+    return report_rows, item_rows
+
+
+def build_allergy_rows(patient_id, allergy_list):
+    rows = []
+    for item in allergy_list:
+        allergen_name = item.get('allergen')
+        if not allergen_name or allergen_name == '无':
+            logger.debug(f"Skipping allergy for patient {patient_id} due to missing or '无' allergen. Record: {item}")
+            continue
+
+        rows.append({
+            'allergyId': item.get('allergyId'),
+            'allergen': allergen_name,
+            'allergenType': item.get('allergenType'),
+            'reaction': item.get('reaction'),
+            'reactionType': item.get('reactionType'),
+            'recordedAt': parse_datetime(item.get('recordedAt')),
+        })
+    return rows
+
+
+def build_family_history_rows(patient_id, family_history_list):
+    rows = []
+    for item in family_history_list:
+        relative_disease = item.get('relativeDisease')
+        if not relative_disease or relative_disease == '不详':
+            logger.debug(f"Skipping family history for patient {patient_id}: relativeDisease is missing or '不详'. Record: {item}")
+            continue
+
+        rows.append({
+            'relativeDisease': relative_disease,
+            'relationship': item.get('relativeRelationship'),
+            'onsetAge': item.get('onsetAge'),
+            'recordedAt': parse_datetime(item.get('recordedAt')),
+        })
+    return rows
+
+
+def build_surgery_rows(patient_id, past_surgeries_list):
+    rows = []
+    for item in past_surgeries_list:
+        surgery_name = item.get('surgeryName')
+        if not surgery_name:
+            logger.debug(f"Skipping surgery record for patient {patient_id} due to missing surgeryName. Record: {item}")
+            continue
+
+        rows.append({
+            'name': surgery_name,
+            'date': parse_datetime(item.get('surgeryDate')),
+            'bodySite': item.get('bodySite'),
+            'code': item.get('surgeryCode'),
+        })
+    return rows
+
+
+def build_trauma_rows(patient_id, past_traumas_list):
+    rows = []
+    for item in past_traumas_list:
+        body_site = item.get('bodySite')
+        trauma_type = item.get('traumaType')
+        if not body_site or not trauma_type:
+            logger.debug(f"Skipping trauma record for patient {patient_id} due to missing bodySite or traumaType. Record: {item}")
+            continue
+
+        rows.append({
+            'name': f"{body_site} {trauma_type}",
+            'date': parse_datetime(item.get('traumasDate')),
+            'severity': item.get('severity'),
+            'healed': item.get('healed'),
+            'traumaId': item.get('pastTraumasId'),
+        })
+    return rows
+
+
+def build_blood_transfusion_rows(patient_id, past_blood_transfusions_list):
+    rows = []
+    for item in past_blood_transfusions_list:
+        transfusion_date = item.get('bloodTransfusionsDate')
+        volume = item.get('volumeMl')
+        if not transfusion_date and not volume:
+            logger.debug(f"Skipping empty blood transfusion record for patient {patient_id}. Record: {item}")
+            continue
+
+        rows.append({
+            'name': f"输血 {volume or ''}ml",
+            'date': parse_datetime(transfusion_date),
+            'volume': volume,
+            'address': item.get('bloodTransfusionsAddress'),
+            'transfusionId': item.get('pastBloodTransfusionsId'),
+        })
+    return rows
+
+
+def build_vaccination_rows(patient_id, past_vaccinations_list):
+    rows = []
+    for item in past_vaccinations_list:
+        vaccine_name = item.get('vaccineName')
+        if not vaccine_name:
+            logger.debug(f"Skipping vaccination record for patient {patient_id} due to missing vaccineName. Record: {item}")
+            continue
+
+        vaccine_date = item.get('vaccineDate')
+        parsed_date = parse_datetime(vaccine_date)
+
+        # 创建一个组合唯一标识符，包含所有重要信息
+        # 使用疫苗名称 + 日期字符串 + 剂次 + 患者ID 确保唯一性
+        dose_number = item.get('doseNumber') or ''
+        unique_id = f"{patient_id}_{vaccine_name}_{vaccine_date or 'no_date'}_{dose_number}"
+
+        rows.append({
+            'uniqueId': unique_id,
+            'name': vaccine_name,
+            'date': parsed_date,
+            'doseNumber': dose_number,
+            'manufacturer': item.get('manufacturer'),
+            'lotNumber': item.get('lotNumber'),
+            'vaccineCode': item.get('vaccineCode'),
+        })
+    return rows
+
+
+def iter_lifestyle_facts(data):
+    """按原有顺序产出 (fact_type, fact_value, source, record_data)。"""
+    # Smoking History
+    smoking_history = data.get('personalSmokingHistoryList', [])
+    if smoking_history:
+        status = smoking_history[0].get('status')
+        if status:
+            yield 'SmokingStatus', status, 'personalSmokingHistory', smoking_history[0]
+
+    # Alcohol History
+    alcohol_history = data.get('personalAlcoholHistoryList', [])
+    if alcohol_history:
+        frequency = alcohol_history[0].get('frequency')
+        if frequency:
+            yield 'AlcoholFrequency', frequency, 'personalAlcoholHistory', alcohol_history[0]
+
+    # Physical Traits
+    physical_traits = data.get('physicalTraitsList', [])
+    if physical_traits:
+        bmi = physical_traits[0].get('bmi')
+        if bmi:
+            yield 'BMI', bmi, 'physicalTraits', physical_traits[0]
+
+    # Diet Habits
+    diet_habits = data.get('dietHabitsList', [])
+    if diet_habits:
+        diet_type = diet_habits[0].get('dietType')
+        flavor_type = diet_habits[0].get('flavorType')
+        if diet_type:
+            yield 'DietType', diet_type, 'dietHabits', diet_habits[0]
+        if flavor_type:
+            yield 'FlavorPreference', flavor_type, 'dietHabits', diet_habits[0]
+
+    # Sleep Assessment
+    sleep_assessment = data.get('sleepAssessmentList', [])
+    if sleep_assessment:
+        duration = sleep_assessment[0].get('sleepDuration')
+        quality = sleep_assessment[0].get('sleepQuality')
+        if duration:
+            yield 'SleepDuration', duration, 'sleepAssessment', sleep_assessment[0]
+        if quality:
+            yield 'SleepQuality', quality, 'sleepAssessment', sleep_assessment[0]
+
+
+def build_lifestyle_fact_row(patient_id, fact_type, fact_value, source, record_data):
+    if not fact_value:
+        logger.debug(f"Skipping lifestyle fact '{fact_type}' for patient {patient_id} due to empty value.")
+        return None
+
+    return {
+        'type': fact_type,
+        'value': str(fact_value),
+        'recordedAt': parse_datetime(record_data.get('createdAt')),
+        'source': source,
+    }
+
+
+def build_family_member_rows(main_patient_id, family_members_list):
+    """
+    构建家族成员参数行 (使用idType和idValue作为唯一标识)。
+    【警告】: 仍会将“亲生父母”和“岳父母”不加区分地统一处理为 PARENT_OF 关系。
+    """
+    rows = []
+    for member in family_members_list:
+        rel_code = str(member.get('relationship'))
+        id_type = member.get('idType')
+        id_value = member.get('idValue')
+
+        # 如果唯一标识(证件类型+证件号)缺失，则跳过此记录
+        if not id_type or not id_value:
             continue
 
-        encounter_type_code = encounter.get('encounterType')
-        # 【新增】获取可读的类型名称，如果找不到则使用"未知类型"
-        encounter_type_name = encounter_type_map.get(str(encounter_type_code), '未知类型')
+        if rel_code not in FAMILY_RELATIONSHIP_MAP:
+            continue
+
+        rel_type = FAMILY_RELATIONSHIP_MAP[rel_code]
+
+        # 准备要设置到节点上的所有属性
+        properties_to_set = {
+            "name": member.get("name"),
+            "gender": FAMILY_GENDER_MAP.get(str(member.get("gender"))),
+            "birthDate": member.get("birthDate"),
+            "patientId": member.get("patientId") # 包含patientId，即使它可能为null
+        }
+        # 过滤掉值为None的属性，避免覆盖已有数据为null
+        properties_to_set = {k: v for k, v in properties_to_set.items() if v is not None}
+
+        rows.append({
+            "mainPatientId": str(main_patient_id),
+            "idType": id_type,
+            "idValue": id_value,
+            "properties": properties_to_set,
+            "relType": rel_type,
+            "relName": member.get("relationshipName", rel_type)
+        })
+    return rows
+
+
+# ---------------------------------------------------------------------------
+# 逐行写入 (每条记录一次 tx.run)
+# ---------------------------------------------------------------------------
+
+def import_encounters(tx, patient_id, encounters_list):
+    """Imports all encounters and their nested details, creating distinct nodes for hospitals, departments, and providers."""
+    for encounter in encounters_list:
+        rows = build_encounter_rows(patient_id, encounter)
+        if rows is None:
+            continue
+        encounter_id = rows['encounter']['encounterId']
 
         # 1. 创建或合并 Encounter 节点本身，并加入类型名称
         encounter_query = """
@@ -184,18 +619,10 @@ def import_encounters(tx, patient_id, encounters_list):
             e.visitEndTime = $visitEndTime
         MERGE (p)-[:HAD_ENCOUNTER]->(e)
         """
-        tx.run(encounter_query,
-               patientId=patient_id,
-               encounterId=encounter_id,
-               encounterType=encounter_type_code,
-               typeName=encounter_type_name, # 【新增】传入类型名称参数
-               visitStartTime=parse_datetime(encounter.get('visitStartTime')),
-               visitEndTime=parse_datetime(encounter.get('visitEndTime'))
-              )
-        
-        # 2. 创建或合并 Hospital 节点，并建立关系 (已有逻辑，无需改动)
-        hospital_id = encounter.get('hospitalId')
-        if hospital_id:
+        tx.run(name_statement('legacy.encounter.upsert', encounter_query), patientId=patient_id, **rows['encounter'])
+
+        # 2. 创建或合并 Hospital 节点，并建立关系
+        if rows['hospital']:
             hospital_query = """
             MATCH (e:Encounter {encounterId: $encounterId})
             MERGE (h:Hospital {hospitalId: $hospitalId})
@@ -203,15 +630,10 @@ def import_encounters(tx, patient_id, encounters_list):
             ON MATCH SET h.name = $hospitalName
             MERGE (e)-[:AT_HOSPITAL]->(h)
             """
-            tx.run(hospital_query,
-                   encounterId=encounter_id,
-                   hospitalId=hospital_id,
-                   hospitalName=encounter.get('hospitalName')
-                  )
-
-        # 3. 创建或合并 Department 节点，并建立关系 (已有逻辑，无需改动)
-        department_id = encounter.get('departmentId')
-        if department_id:
+            tx.run(name_statement('legacy.encounter.hospital', hospital_query), **rows['hospital'])
+
+        # 3. 创建或合并 Department 节点，并建立关系
+        if rows['department']:
             department_query = """
             MATCH (e:Encounter {encounterId: $encounterId})
             MERGE (d:Department {departmentId: $departmentId})
@@ -219,19 +641,13 @@ def import_encounters(tx, patient_id, encounters_list):
             ON MATCH SET d.name = $departmentName
             MERGE (e)-[:IN_DEPARTMENT]->(d)
             """
-            if hospital_id:
+            if rows['department']['hospitalId']:
                 department_query += " WITH d MATCH (h:Hospital {hospitalId: $hospitalId}) MERGE (h)-[:HAS_DEPARTMENT]->(d)"
-            
-            tx.run(department_query,
-                   encounterId=encounter_id,
-                   departmentId=department_id,
-                   departmentName=encounter.get('departmentName'),
-                   hospitalId=hospital_id
-                  )
-        
-        # 4. 创建或合并 Provider (医生) 节点，并建立关系 (已有逻辑，无需改动)
-        provider_id = encounter.get('attendingProviderId')
-        if provider_id:
+
+            tx.run(name_statement('legacy.encounter.department', department_query), **rows['department'])
+
+        # 4. 创建或合并 Provider (医生) 节点，并建立关系
+        if rows['provider']:
             provider_query = """
             MATCH (e:Encounter {encounterId: $encounterId})
             MERGE (doc:Provider {providerId: $providerId})
@@ -239,17 +655,13 @@ def import_encounters(tx, patient_id, encounters_list):
             ON MATCH SET doc.name = $providerName
             MERGE (e)-[:TREATED_BY]->(doc)
             """
-            tx.run(provider_query,
-                   encounterId=encounter_id,
-                   providerId=provider_id,
-                   providerName=encounter.get('attendingProviderName')
-                  )
-        
+            tx.run(name_statement('legacy.encounter.provider', provider_query), **rows['provider'])
+
         # 5. 导入该次就诊下的其他嵌套数据
         diagnoses = encounter.get('diagnoses', [])
         if diagnoses is not None:
             import_diagnoses_from_encounter(tx, encounter_id, diagnoses)
-        
+
         examinations = encounter.get('examinations', [])
         if examinations is not None:
             import_examinations_from_encounter(tx, encounter_id, examinations)
@@ -262,14 +674,7 @@ def import_diagnoses_from_encounter(tx, encounter_id, diagnoses_list):
     """
     导入诊断信息 (已修正 Cypher 语法错误)。
     """
-    for diagnosis in diagnoses_list:
-        disease_name = diagnosis.get('diagnosisName')
-        disease_code = diagnosis.get('diagnosisNo')
-
-        if not disease_name and not disease_code:
-            logger.debug(f"Skipping diagnosis for encounter {encounter_id} due to missing name and code.")
-            continue
-
+    for row in build_diagnosis_rows(encounter_id, diagnoses_list):
         # Cypher 查询已修正
         query = """
         WITH $encounterId AS encounterId, $diseaseName AS dName, $diseaseCode AS dCode
@@ -297,39 +702,30 @@ def import_diagnoses_from_encounter(tx, encounter_id, diagnoses_list):
         MERGE (e)-[:RECORDED_DIAGNOSIS]->(c)
         """
         
-        tx.run(query,
-               encounterId=encounter_id,
-               diseaseName=disease_name,
-               diseaseCode=disease_code)
+        tx.run(name_statement('legacy.diagnosis.link', query), **row)
 
 def import_examinations_from_encounter(tx, encounter_id, examinations_list):
     """Imports examination reports and findings for an encounter."""
     for exam in examinations_list:
-        report_id = exam.get('reportId')
-        if not report_id:
-            logger.debug(f"Skipping examination for encounter {encounter_id} due to missing reportId. Record: {exam}")
+        exam_rows, finding_rows = build_examination_rows(encounter_id, [exam])
+        if not exam_rows:
             continue
-            
+
         exam_query = """
         MATCH (e:Encounter {encounterId: $encounterId})
         MERGE (ex:Examination {reportId: $reportId})
         ON CREATE SET 
             ex.timestamp = $timestamp,
             ex.fullReport = $fullReport
+        FOREACH (ignored IN CASE WHEN $reportHash IS NULL THEN [] ELSE [1] END |
+            SET ex.reportHash = $reportHash, ex.reportLength = $reportLength, ex.reportPreview = $reportPreview
+            REMOVE ex.fullReport
+        )
         MERGE (e)-[:HAD_EXAMINATION]->(ex)
         """
-        tx.run(exam_query,
-               encounterId=encounter_id,
-               reportId=report_id,
-               timestamp=parse_datetime(exam.get('timestamp')),
-               fullReport=exam.get('fullReport'))
-        
-        for finding in exam.get('findings', []):
-            finding_result = finding.get('diagnosisResult')
-            if not finding_result:
-                logger.debug(f"Skipping examination finding for report {report_id} due to missing diagnosisResult. Record: {finding}")
-                continue
-                
+        tx.run(name_statement('legacy.exam.upsert', exam_query), **report_store.offload_rows(exam_rows)[0])
+
+        for finding_row in finding_rows:
             finding_query = """
             MATCH (ex:Examination {reportId: $reportId})
             MERGE (c:Condition {name: $findingResult})
@@ -339,19 +735,13 @@ def import_examinations_from_encounter(tx, encounter_id, examinations_list):
                 r.bodyPart = $bodyPart,
                 r.diagnosisId = $diagnosisId
             """
-            tx.run(finding_query,
-                   reportId=report_id,
-                   findingResult=finding_result,
-                   findingCode=finding.get('diagnosisCode'),
-                   bodyPart=finding.get('bodyPart'),
-                   diagnosisId=finding.get('diagnosisId'))
+            tx.run(name_statement('legacy.exam.finding', finding_query), **finding_row)
 
 def import_lab_tests_from_encounter(tx, encounter_id, lab_tests_list):
     """Imports lab test reports and items for an encounter."""
     for lab_test in lab_tests_list:
-        report_id = lab_test.get('reportId')
-        if not report_id:
-            logger.debug(f"Skipping lab test for encounter {encounter_id} due to missing reportId. Record: {lab_test}")
+        report_rows, item_rows = build_lab_test_rows(encounter_id, [lab_test])
+        if not report_rows:
             continue
 
         report_query = """
@@ -359,15 +749,9 @@ def import_lab_tests_from_encounter(tx, encounter_id, lab_tests_list):
         MERGE (ltr:LabTestReport {reportId: $reportId})
         MERGE (e)-[:HAD_LAB_TEST]->(ltr)
         """
-        tx.run(report_query, encounterId=encounter_id, reportId=report_id)
+        tx.run(name_statement('legacy.lab.report', report_query), **report_rows[0])
 
-        for item in lab_test.get('items', []):
-            item_name = item.get('labtestIndexName', '').strip()
-            test_id = item.get('testId')
-            if not item_name or not test_id:
-                logger.debug(f"Skipping lab test item for report {report_id} due to missing labtestIndexName or testId. Record: {item}")
-                continue
-            
+        for item_row in item_rows:
             item_query = """
             MATCH (ltr:LabTestReport {reportId: $reportId})
             MERGE (li:LabTestItem {name: $itemName})
@@ -381,27 +765,11 @@ def import_lab_tests_from_encounter(tx, encounter_id, lab_tests_list):
                 r.interpretation = $interpretation,
                 r.timestamp = $timestamp
             """
-            tx.run(item_query,
-                   reportId=report_id,
-                   itemName=item_name,
-                   itemCode=item.get('labtestIndexCode', '').strip(),
-                   testId=test_id,
-                   value=item.get('value'),
-                   textValue=item.get('textValue'),
-                   unit=item.get('unit'),
-                   referenceRange=item.get('referenceRange'),
-                   interpretation=item.get('interpretation'),
-                   timestamp=parse_datetime(item.get('timestamp'))
-                  )
+            tx.run(name_statement('legacy.lab.item', item_query), **item_row)
 
 def import_allergies(tx, patient_id, allergy_list):
     """Imports allergy information for a patient."""
-    for item in allergy_list:
-        allergen_name = item.get('allergen')
-        if not allergen_name or allergen_name == '无':
-            logger.debug(f"Skipping allergy for patient {patient_id} due to missing or '无' allergen. Record: {item}")
-            continue
-
+    for row in build_allergy_rows(patient_id, allergy_list):
         query = """
         MATCH (p:Patient {patientId: $patientId})
         MERGE (a:Allergen {name: $allergen})
@@ -413,23 +781,11 @@ def import_allergies(tx, patient_id, allergy_list):
             r.reactionType = $reactionType,
             r.recordedAt = $recordedAt
         """
-        tx.run(query,
-               patientId=patient_id,
-               allergyId=item.get('allergyId'),
-               allergen=allergen_name,
-               allergenType=item.get('allergenType'),
-               reaction=item.get('reaction'),
-               reactionType=item.get('reactionType'),
-               recordedAt=parse_datetime(item.get('recordedAt')))
+        tx.run(name_statement('legacy.allergy.link', query), patientId=patient_id, **row)
 
 def import_family_history(tx, patient_id, family_history_list):
     """Imports family medical history for a patient."""
-    for item in family_history_list:
-        relative_disease = item.get('relativeDisease')
-        if not relative_disease or relative_disease == '不详':
-            logger.debug(f"Skipping family history for patient {patient_id}: relativeDisease is missing or '不详'. Record: {item}")
-            continue
-
+    for row in build_family_history_rows(patient_id, family_history_list):
         query = """
         MATCH (p:Patient {patientId: $patientId})
         MERGE (c:Condition {name: $relativeDisease})
@@ -439,20 +795,10 @@ def import_family_history(tx, patient_id, family_history_list):
             r.onsetAge = $onsetAge,
             r.recordedAt = $recordedAt
         """
-        tx.run(query,
-               patientId=patient_id,
-               relativeDisease=relative_disease,
-               relationship=item.get('relativeRelationship'),
-               onsetAge=item.get('onsetAge'),
-               recordedAt=parse_datetime(item.get('recordedAt')))
+        tx.run(name_statement('legacy.family_history.link', query), patientId=patient_id, **row)
 
 def import_past_surgeries(tx, patient_id, past_surgeries_list):
-    for item in past_surgeries_list:
-        surgery_name = item.get('surgeryName')
-        if not surgery_name:
-            logger.debug(f"Skipping surgery record for patient {patient_id} due to missing surgeryName. Record: {item}")
-            continue
-        
+    for row in build_surgery_rows(patient_id, past_surgeries_list):
         query = """
         MATCH (p:Patient {patientId: $patientId})
         MERGE (e:PastMedicalEvent:Surgery {name: $name})
@@ -462,22 +808,10 @@ def import_past_surgeries(tx, patient_id, past_surgeries_list):
             e.code = $code
         MERGE (p)-[:HAD_SURGERY]->(e)
         """
-        tx.run(query, 
-               patientId=patient_id,
-               name=surgery_name,
-               date=parse_datetime(item.get('surgeryDate')),
-               bodySite=item.get('bodySite'),
-               code=item.get('surgeryCode'))
+        tx.run(name_statement('legacy.event.surgery', query), patientId=patient_id, **row)
 
 def import_past_traumas(tx, patient_id, past_traumas_list):
-    for item in past_traumas_list:
-        body_site = item.get('bodySite')
-        trauma_type = item.get('traumaType')
-        if not body_site or not trauma_type:
-            logger.debug(f"Skipping trauma record for patient {patient_id} due to missing bodySite or traumaType. Record: {item}")
-            continue
-        
-        name = f"{body_site} {trauma_type}"
+    for row in build_trauma_rows(patient_id, past_traumas_list):
         query = """
         MATCH (p:Patient {patientId: $patientId})
         MERGE (e:PastMedicalEvent:Trauma {name: $name})
@@ -488,23 +822,10 @@ def import_past_traumas(tx, patient_id, past_traumas_list):
             e.traumaId = $traumaId
         MERGE (p)-[:HAD_TRAUMA]->(e)
         """
-        tx.run(query,
-               patientId=patient_id,
-               name=name,
-               date=parse_datetime(item.get('traumasDate')),
-               severity=item.get('severity'),
-               healed=item.get('healed'),
-               traumaId=item.get('pastTraumasId'))
+        tx.run(name_statement('legacy.event.trauma', query), patientId=patient_id, **row)
 
 def import_past_blood_transfusions(tx, patient_id, past_blood_transfusions_list):
-    for item in past_blood_transfusions_list:
-        transfusion_date = item.get('bloodTransfusionsDate')
-        volume = item.get('volumeMl')
-        if not transfusion_date and not volume:
-            logger.debug(f"Skipping empty blood transfusion record for patient {patient_id}. Record: {item}")
-            continue
-        
-        name = f"输血 {volume or ''}ml"
+    for row in build_blood_transfusion_rows(patient_id, past_blood_transfusions_list):
         query = """
         MATCH (p:Patient {patientId: $patientId})
         MERGE (e:PastMedicalEvent:BloodTransfusion {name: $name, date: $date})
@@ -514,29 +835,10 @@ def import_past_blood_transfusions(tx, patient_id, past_blood_transfusions_list)
             e.transfusionId = $transfusionId
         MERGE (p)-[:HAD_BLOOD_TRANSFUSION]->(e)
         """
-        tx.run(query,
-               patientId=patient_id,
-               name=name,
-               date=parse_datetime(transfusion_date),
-               volume=volume,
-               address=item.get('bloodTransfusionsAddress'),
-               transfusionId=item.get('pastBloodTransfusionsId'))
+        tx.run(name_statement('legacy.event.blood_transfusion', query), patientId=patient_id, **row)
 
 def import_past_vaccinations(tx, patient_id, past_vaccinations_list):
-    for item in past_vaccinations_list:
-        vaccine_name = item.get('vaccineName')
-        if not vaccine_name:
-            logger.debug(f"Skipping vaccination record for patient {patient_id} due to missing vaccineName. Record: {item}")
-            continue
-
-        vaccine_date = item.get('vaccineDate')
-        parsed_date = parse_datetime(vaccine_date)
-        
-        # 创建一个组合唯一标识符，包含所有重要信息
-        # 使用疫苗名称 + 日期字符串 + 剂次 + 患者ID 确保唯一性
-        dose_number = item.get('doseNumber') or ''
-        unique_id = f"{patient_id}_{vaccine_name}_{vaccine_date or 'no_date'}_{dose_number}"
-        
+    for row in build_vaccination_rows(patient_id, past_vaccinations_list):
         query = """
         MATCH (p:Patient {patientId: $patientId})
         MERGE (e:PastMedicalEvent:Vaccination {uniqueId: $uniqueId})
@@ -556,63 +858,17 @@ def import_past_vaccinations(tx, patient_id, past_vaccinations_list):
             e.vaccineCode = $vaccineCode
         MERGE (p)-[:HAD_VACCINATION]->(e)
         """
-        tx.run(query,
-               patientId=patient_id,
-               uniqueId=unique_id,
-               name=vaccine_name,
-               date=parsed_date,
-               doseNumber=dose_number,
-               manufacturer=item.get('manufacturer'),
-               lotNumber=item.get('lotNumber'),
-               vaccineCode=item.get('vaccineCode'))
+        tx.run(name_statement('legacy.event.vaccination', query), patientId=patient_id, **row)
 
 def import_personal_history(tx, patient_id, data):
-    # Smoking History
-    smoking_history = data.get('personalSmokingHistoryList', [])
-    if smoking_history:
-        status = smoking_history[0].get('status')
-        if status:
-            import_lifestyle_fact(tx, patient_id, 'SmokingStatus', status, 'personalSmokingHistory', smoking_history[0])
-
-    # Alcohol History
-    alcohol_history = data.get('personalAlcoholHistoryList', [])
-    if alcohol_history:
-        frequency = alcohol_history[0].get('frequency')
-        if frequency:
-            import_lifestyle_fact(tx, patient_id, 'AlcoholFrequency', frequency, 'personalAlcoholHistory', alcohol_history[0])
-
-    # Physical Traits
-    physical_traits = data.get('physicalTraitsList', [])
-    if physical_traits:
-        bmi = physical_traits[0].get('bmi')
-        if bmi:
-            import_lifestyle_fact(tx, patient_id, 'BMI', bmi, 'physicalTraits', physical_traits[0])
-
-    # Diet Habits
-    diet_habits = data.get('dietHabitsList', [])
-    if diet_habits:
-        diet_type = diet_habits[0].get('dietType')
-        flavor_type = diet_habits[0].get('flavorType')
-        if diet_type:
-            import_lifestyle_fact(tx, patient_id, 'DietType', diet_type, 'dietHabits', diet_habits[0])
-        if flavor_type:
-            import_lifestyle_fact(tx, patient_id, 'FlavorPreference', flavor_type, 'dietHabits', diet_habits[0])
-            
-    # Sleep Assessment
-    sleep_assessment = data.get('sleepAssessmentList', [])
-    if sleep_assessment:
-        duration = sleep_assessment[0].get('sleepDuration')
-        quality = sleep_assessment[0].get('sleepQuality')
-        if duration:
-             import_lifestyle_fact(tx, patient_id, 'SleepDuration', duration, 'sleepAssessment', sleep_assessment[0])
-        if quality:
-             import_lifestyle_fact(tx, patient_id, 'SleepQuality', quality, 'sleepAssessment', sleep_assessment[0])
+    for fact_type, fact_value, source, record_data in iter_lifestyle_facts(data):
+        import_lifestyle_fact(tx, patient_id, fact_type, fact_value, source, record_data)
 
 
 def import_lifestyle_fact(tx, patient_id, fact_type, fact_value, source, record_data):
     """Generic function to import a single lifestyle fact."""
-    if not fact_value:
-        logger.debug(f"Skipping lifestyle fact '{fact_type}' for patient {patient_id} due to empty value.")
+    row = build_lifestyle_fact_row(patient_id, fact_type, fact_value, source, record_data)
+    if row is None:
         return
 
     query = """
@@ -624,57 +880,15 @@ def import_lifestyle_fact(tx, patient_id, fact_type, fact_value, source, record_
         r.source = $source
     """
     
-    tx.run(query,
-           patientId=patient_id,
-           type=fact_type,
-           value=str(fact_value),
-           recordedAt=parse_datetime(record_data.get('createdAt')),
-           source=source,
-          )
+    tx.run(name_statement('legacy.lifestyle.fact', query), patientId=patient_id, **row)
 
 def import_family_members(tx, main_patient_id, family_members_list):
     """
     导入家族成员信息 (V2 - 使用idType和idValue作为唯一标识)。
     【警告】: 此版本仍会将“亲生父母”和“岳父母”不加区分地统一处理为 PARENT_OF 关系。
     """
-    # 关系代码到标准化类型的映射字典 (白名单)
-    RELATIONSHIP_MAP = {
-        '1': 'SPOUSE',
-        '2': 'CHILD',
-        '4': 'PARENT',
-    }
-
-    # 性别代码映射
-    GENDER_MAP = { '1': 'Male', '2': 'Female' }
-
-    for member in family_members_list:
-        rel_code = str(member.get('relationship'))
-        # 核心改动：使用idType和idValue作为主要标识符
-        id_type = member.get('idType')
-        id_value = member.get('idValue')
-
-        # 如果唯一标识(证件类型+证件号)缺失，则跳过此记录
-        if not id_type or not id_value:
-            # 可以在这里添加日志 logger.debug(...)
-            continue
-
-        if rel_code not in RELATIONSHIP_MAP:
-            continue
-            
-        rel_type = RELATIONSHIP_MAP[rel_code]
-        
-        # 准备要设置到节点上的所有属性
-        properties_to_set = {
-            "name": member.get("name"),
-            "gender": GENDER_MAP.get(str(member.get("gender"))),
-            "birthDate": member.get("birthDate"),
-            "patientId": member.get("patientId") # 包含patientId，即使它可能为null
-        }
-        # 过滤掉值为None的属性，避免覆盖已有数据为null
-        properties_to_set = {k: v for k, v in properties_to_set.items() if v is not None}
-        
+    for row in build_family_member_rows(main_patient_id, family_members_list):
         # 统一的Cypher查询，先处理节点，再处理关系
-        # 核心改动：MERGE (relative:Patient {idType: $idType, idValue: $idValue})
         query = """
         // 1. 使用 idType 和 idValue 查找或创建家族成员节点
         MERGE (relative:Patient {idType: $idType, idValue: $idValue})
@@ -690,17 +904,17 @@ def import_family_members(tx, main_patient_id, family_members_list):
         
         # 根据关系类型附加关系创建的Cypher子句
         relationship_cypher = ""
-        if rel_type == 'SPOUSE':
+        if row['relType'] == 'SPOUSE':
             relationship_cypher = """
                 MERGE (main)-[r:SPOUSE_OF]-(relative)
                 SET r.relationshipName = $relName
             """
-        elif rel_type == 'CHILD':
+        elif row['relType'] == 'CHILD':
             relationship_cypher = """
                 MERGE (main)-[r:PARENT_OF]->(relative)
                 SET r.relationshipName = $relName
             """
-        elif rel_type == 'PARENT':
+        elif row['relType'] == 'PARENT':
             relationship_cypher = """
                 MERGE (main)<-[r:PARENT_OF]-(relative)
                 SET r.relationshipName = $relName
@@ -709,11 +923,707 @@ def import_family_members(tx, main_patient_id, family_members_list):
         # 只有在关系类型有效时才执行查询
         if relationship_cypher:
             final_query = query + relationship_cypher
-            params = {
-                "mainPatientId": str(main_patient_id),
-                "idType": id_type,
-                "idValue": id_value,
-                "properties": properties_to_set,
-                "relName": member.get("relationshipName", rel_type)
-            }
-            tx.run(final_query, **params)
\ No newline at end of file
+            params = {k: v for k, v in row.items() if k != 'relType'}
+            tx.run(name_statement('legacy.family.member', final_query), **params)
+
+
+# ---------------------------------------------------------------------------
+# 批量写入 (每个患者每个数据段一条 UNWIND $rows 语句)
+# ---------------------------------------------------------------------------
+
+CONDITION_SECTIONS = ('diagnosis.link', 'exam.finding')
+
+
+def _append_condition_rows(sections, name, rows):
+    """
+    诊断和检查发现都会新建或改名 Condition 节点，结果取决于二者的先后。
+    行上的 seq 记录两个数据段合并后的出现顺序，写入时据此还原逐行写入的顺序 (见 ordered_condition_rows)。
+    """
+    seq = len(sections['diagnosis.link']) + len(sections['exam.finding'])
+    for offset, row in enumerate(rows):
+        row['seq'] = seq + offset
+    sections[name].extend(rows)
+
+
+def condition_rows_interleaved(diagnosis_rows, finding_rows):
+    """是否有检查发现出现在诊断之前：此时先写全部诊断、再写全部检查发现，与逐行写入的结果可能不同"""
+    if not diagnosis_rows or not finding_rows:
+        return False
+    return min(row['seq'] for row in finding_rows) < max(row['seq'] for row in diagnosis_rows)
+
+
+def ordered_condition_rows(diagnosis_rows, finding_rows):
+    """按逐行写入时的顺序合并诊断行和检查发现行"""
+    return sorted(list(diagnosis_rows) + list(finding_rows), key=lambda row: row['seq'])
+
+
+def _append_encounter_sections(sections, patient_id, encounter):
+    """把一次就诊 (及其诊断、检查、检验) 的参数行追加到 sections，返回追加的行数"""
+    rows = build_encounter_rows(patient_id, encounter)
+    if rows is None:
+        return 0
+    encounter_id = rows['encounter']['encounterId']
+    sections['encounter.upsert'].append(rows['encounter'])
+    added = 1
+    for name, key in (('encounter.hospital', 'hospital'), ('encounter.department', 'department'),
+                      ('encounter.provider', 'provider')):
+        if rows[key]:
+            sections[name].append(rows[key])
+            added += 1
+
+    diagnoses = encounter.get('diagnoses', [])
+    if diagnoses is not None:
+        diagnosis_rows = build_diagnosis_rows(encounter_id, diagnoses)
+        _append_condition_rows(sections, 'diagnosis.link', diagnosis_rows)
+        added += len(diagnosis_rows)
+
+    examinations = encounter.get('examinations', [])
+    if examinations is not None:
+        exam_rows, finding_rows = build_examination_rows(encounter_id, examinations)
+        sections['exam.upsert'].extend(exam_rows)
+        _append_condition_rows(sections, 'exam.finding', finding_rows)
+        added += len(exam_rows) + len(finding_rows)
+
+    lab_tests = encounter.get('labTests', [])
+    if lab_tests is not None:
+        report_rows, item_rows = build_lab_test_rows(encounter_id, lab_tests)
+        sections['lab.report'].extend(report_rows)
+        sections['lab.item'].extend(item_rows)
+        added += len(report_rows) + len(item_rows)
+    return added
+
+
+def build_patient_sections(patient_id, data):
+    """
+    把一个患者的健康画像映射为按数据段分组的参数行。
+    返回的字典按写入顺序排列 (就诊及其维度 -> 诊断 -> 检查 -> 检验 -> 既往史 -> 家族成员 -> 生活方式)，
+    同一数据段内保持与逐行写入相同的记录顺序。
+
+    TYPED_RECORDS 开启时先转换为 PatientRecord 再映射 (build_record_sections)，结构不符时按字典映射。
+    """
+    if Config.TYPED_RECORDS:
+        record = to_record(data)
+        if record is not None:
+            return build_record_sections(patient_id, record)
+
+    sections = {name: [] for name in BATCHED_SECTION_QUERIES}
+
+    encounters = data.get('encounters', [])
+    if encounters is not None:
+        for encounter in encounters:
+            _append_encounter_sections(sections, patient_id, encounter)
+
+    allergies = data.get('allergyProfilesList', [])
+    if allergies is not None:
+        sections['allergy.link'].extend(build_allergy_rows(patient_id, allergies))
+
+    family_history = data.get('familyHistoryList', [])
+    if family_history is not None:
+        sections['family_history.link'].extend(build_family_history_rows(patient_id, family_history))
+
+    blood_transfusions = data.get('pastBloodTransfusionsList', [])
+    if blood_transfusions is not None:
+        sections['event.blood_transfusion'].extend(build_blood_transfusion_rows(patient_id, blood_transfusions))
+
+    surgeries = data.get('pastSurgeriesList', [])
+    if surgeries is not None:
+        sections['event.surgery'].extend(build_surgery_rows(patient_id, surgeries))
+
+    traumas = data.get('pastTraumasList', [])
+    if traumas is not None:
+        sections['event.trauma'].extend(build_trauma_rows(patient_id, traumas))
+
+    vaccinations = data.get('pastVaccinationsList', [])
+    if vaccinations is not None:
+        sections['event.vaccination'].extend(build_vaccination_rows(patient_id, vaccinations))
+
+    family_members = data.get('familyMembers', [])
+    if family_members:
+        sections['family.member'].extend(build_family_member_rows(patient_id, family_members))
+
+    for fact_type, fact_value, source, record_data in iter_lifestyle_facts(data):
+        row = build_lifestyle_fact_row(patient_id, fact_type, fact_value, source, record_data)
+        if row is not None:
+            sections['lifestyle.fact'].append(row)
+
+    return sections
+
+
+def iter_patient_sections(patient_id, data):
+    """
+    build_patient_sections 的分块版本。就诊记录为 EncounterStream (超大画像流式解码) 时，
+    就诊相关数据段每累计 STREAM_FLUSH_ROWS 行产出一块，最后一块附带其余数据段，
+    内存中最多保留一块参数行；同一次就诊的行总在同一块内，块内仍按写入顺序排列。
+    其他画像一次产出全部数据段。
+    """
+    encounters = data.get('encounters')
+    if not isinstance(encounters, EncounterStream):
+        yield build_patient_sections(patient_id, data)
+        return
+
+    sections = {name: [] for name in BATCHED_SECTION_QUERIES}
+    pending_rows = 0
+    for encounter in encounters:
+        record = to_encounter_record(encounter) if Config.TYPED_RECORDS and encounter else None
+        if record is not None:
+            if record.encounter_id:
+                pending_rows += _append_encounter_record_sections(sections, patient_id, record)
+        else:
+            pending_rows += _append_encounter_sections(sections, patient_id, encounter)
+        if pending_rows >= Config.STREAM_FLUSH_ROWS:
+            run_metrics.incr('stream.chunks')
+            yield sections
+            sections = {name: [] for name in BATCHED_SECTION_QUERIES}
+            pending_rows = 0
+
+    rest = build_patient_sections(patient_id, dict(data, encounters=None))
+    for name, rows in rest.items():
+        sections[name].extend(rows)
+    run_metrics.incr('stream.chunks')
+    yield sections
+
+
+def _append_encounter_record_sections(sections, patient_id, encounter):
+    """_append_encounter_sections 的类型化记录版本 (EncounterRecord 已在解析时完成校验与规范化)，返回追加的行数"""
+    encounter_id = encounter.encounter_id
+    added = len(encounter.diagnoses) + 1
+    sections['encounter.upsert'].append({
+        'encounterId': encounter_id,
+        'encounterType': encounter.encounter_type,
+        'typeName': ENCOUNTER_TYPE_MAP.get(str(encounter.encounter_type), '未知类型'),
+        'visitStartTime': parse_datetime(encounter.visit_start_time),
+        'visitEndTime': parse_datetime(encounter.visit_end_time),
+    })
+    if encounter.hospital_id:
+        sections['encounter.hospital'].append({
+            'encounterId': encounter_id,
+            'hospitalId': encounter.hospital_id,
+            'hospitalName': encounter.hospital_name,
+        })
+        added += 1
+    if encounter.department_id:
+        sections['encounter.department'].append({
+            'encounterId': encounter_id,
+            'departmentId': encounter.department_id,
+            'departmentName': encounter.department_name,
+            'hospitalId': encounter.hospital_id,
+        })
+        added += 1
+    if encounter.provider_id:
+        sections['encounter.provider'].append({
+            'encounterId': encounter_id,
+            'providerId': encounter.provider_id,
+            'providerName': encounter.provider_name,
+        })
+        added += 1
+
+    _append_condition_rows(sections, 'diagnosis.link', [
+        {'encounterId': encounter_id, 'diseaseName': diagnosis.name, 'diseaseCode': diagnosis.code}
+        for diagnosis in encounter.diagnoses
+    ])
+
+    exam_rows = sections['exam.upsert']
+    for exam in encounter.examinations:
+        exam_rows.append({
+            'encounterId': encounter_id,
+            'reportId': exam.report_id,
+            'timestamp': parse_datetime(exam.timestamp),
+            'fullReport': exam.full_report,
+            **report_fields(exam.full_report if Config.REPORT_STORE_ENABLED else None),
+        })
+        _append_condition_rows(sections, 'exam.finding', [{
+            'reportId': exam.report_id,
+            'findingResult': finding.result,
+            'findingCode': finding.code,
+            'bodyPart': finding.body_part,
+            'diagnosisId': finding.diagnosis_id,
+        } for finding in exam.findings])
+        added += len(exam.findings) + 1
+
+    report_rows, item_rows = sections['lab.report'], sections['lab.item']
+    for lab_test in encounter.lab_tests:
+        report_rows.append({'encounterId': encounter_id, 'reportId': lab_test.report_id})
+        for item in lab_test.items:
+            item_rows.append({
+                'reportId': lab_test.report_id,
+                'itemName': item.name,
+                'itemCode': item.code or '',
+                'testId': item.test_id,
+                'value': item.value,
+                'textValue': item.text_value,
+                'unit': item.unit,
+                'referenceRange': item.reference_range,
+                'interpretation': item.interpretation,
+                'timestamp': parse_datetime(item.timestamp),
+            })
+        added += len(lab_test.items) + 1
+    return added
+
+
+def build_record_sections(patient_id, record):
+    """
+    build_patient_sections 的类型化记录版本：PatientRecord 在解码时已完成校验、去空白和占位值处理
+    (见 etl/core/portrait_records.py)，这里直接按属性映射，数据段和行结构与 build_patient_sections 相同。
+    """
+    sections = {name: [] for name in BATCHED_SECTION_QUERIES}
+    for encounter in record.encounters:
+        _append_encounter_record_sections(sections, patient_id, encounter)
+
+    sections['allergy.link'].extend({
+        'allergyId': allergy.allergy_id,
+        'allergen': allergy.allergen,
+        'allergenType': allergy.allergen_type,
+        'reaction': allergy.reaction,
+        'reactionType': allergy.reaction_type,
+        'recordedAt': parse_datetime(allergy.recorded_at),
+    } for allergy in record.allergies)
+
+    sections['family_history.link'].extend({
+        'relativeDisease': history.disease,
+        'relationship': history.relationship,
+        'onsetAge': history.onset_age,
+        'recordedAt': parse_datetime(history.recorded_at),
+    } for history in record.family_history)
+
+    sections['event.blood_transfusion'].extend({
+        'name': f"输血 {transfusion.volume or ''}ml",
+        'date': parse_datetime(transfusion.date),
+        'volume': transfusion.volume,
+        'address': transfusion.address,
+        'transfusionId': transfusion.transfusion_id,
+    } for transfusion in record.blood_transfusions)
+
+    sections['event.surgery'].extend({
+        'name': surgery.name,
+        'date': parse_datetime(surgery.date),
+        'bodySite': surgery.body_site,
+        'code': surgery.code,
+    } for surgery in record.surgeries)
+
+    sections['event.trauma'].extend({
+        'name': f"{trauma.body_site} {trauma.trauma_type}",
+        'date': parse_datetime(trauma.date),
+        'severity': trauma.severity,
+        'healed': trauma.healed,
+        'traumaId': trauma.trauma_id,
+    } for trauma in record.traumas)
+
+    sections['event.vaccination'].extend({
+        'uniqueId': f"{patient_id}_{vaccination.name}_{vaccination.date or 'no_date'}_{vaccination.dose_number or ''}",
+        'name': vaccination.name,
+        'date': parse_datetime(vaccination.date),
+        'doseNumber': vaccination.dose_number or '',
+        'manufacturer': vaccination.manufacturer,
+        'lotNumber': vaccination.lot_number,
+        'vaccineCode': vaccination.vaccine_code,
+    } for vaccination in record.vaccinations)
+
+    for member in record.family_members:
+        rel_type = FAMILY_RELATIONSHIP_MAP.get(member.relationship)
+        if rel_type is None:
+            continue
+        properties = {
+            'name': member.name,
+            'gender': FAMILY_GENDER_MAP.get(str(member.gender)),
+            'birthDate': member.birth_date,
+            'patientId': member.patient_id,
+        }
+        sections['family.member'].append({
+            'mainPatientId': str(patient_id),
+            'idType': member.id_type,
+            'idValue': member.id_value,
+            'properties': {k: v for k, v in properties.items() if v is not None},
+            'relType': rel_type,
+            'relName': member.relationship_name or rel_type,
+        })
+
+    sections['lifestyle.fact'].extend({
+        'type': fact_type,
+        'value': str(fact_value),
+        'recordedAt': parse_datetime(recorded_at),
+        'source': source,
+    } for fact_type, fact_value, source, recorded_at in record.lifestyle_facts())
+    return sections
+
+
+def import_patient_sections_batched(tx, patient_id, sections):
+    """
+    按数据段顺序执行 UNWIND 语句，空数据段不发送。
+
+    有检查发现出现在诊断之前时 (多次就诊的常见情况)，两个数据段合并为一条语句按逐行写入的顺序执行，
+    保证 Condition 的新建与改名与逐行写入一致；两阶段加载的第二阶段 Condition 已按顺序预写入，不需要合并。
+    """
+    in_order = not condition_resolver.pinned and condition_rows_interleaved(
+        sections.get('diagnosis.link'), sections.get('exam.finding'))
+    for name in BATCHED_SECTION_QUERIES:
+        rows = sections.get(name)
+        if not rows:
+            continue
+        if in_order and name in CONDITION_SECTIONS:
+            if name == 'diagnosis.link':
+                condition_resolver.link_in_order(tx, ordered_condition_rows(rows, sections['exam.finding']))
+            continue
+        import_section_rows(tx, patient_id, name, rows)
+
+
+def import_section_rows(tx, patient_id, name, rows):
+    """写入一个数据段的参数行 (诊断走 Condition 解析，维度节点走缓存/第一阶段固定的结果)"""
+    query = BATCHED_SECTION_QUERIES[name]
+    if name == 'exam.upsert':
+        # 启用报告库时正文存入报告库，不再写入图谱
+        rows = report_store.offload_rows(rows)
+    if name in LOCK_ORDERED_SECTIONS:
+        # 稳定排序：同一节点的多行保持原有先后，SET 的结果不变
+        key_field = LOCK_ORDERED_SECTIONS[name]
+        rows = sorted(rows, key=lambda row: str(row[key_field]))
+    if name == 'diagnosis.link' and (condition_resolver.enabled or condition_resolver.pinned):
+        # 诊断走 Condition 解析缓存 (或第一阶段固定的解析结果)，命中的直接按节点 id 建关系
+        condition_resolver.link_diagnoses(tx, rows)
+        return
+    link_rows = []
+    if name in PRELOADED_SECTIONS and dimension_cache.pinned:
+        # 两阶段加载：共享节点已由第一阶段统一写入，这里只建立关系
+        label, key_fields = PRELOADED_SECTIONS[name]
+        rows, link_rows = dimension_cache.split_pinned(label, rows, key_fields)
+    if rows and name in DIMENSION_SECTIONS and dimension_cache.enabled:
+        # 本次运行已 upsert 过且属性未变的维度节点，只建立关系
+        label, key_field, signature_fields = DIMENSION_SECTIONS[name]
+        rows, cached_rows = dimension_cache.split(label, rows, key_field, signature_fields)
+        link_rows.extend(cached_rows)
+    if rows:
+        tx.run(query, rows=rows, patientId=patient_id)
+    if link_rows:
+        tx.run(BATCHED_LINK_QUERIES[name], rows=link_rows, patientId=patient_id)
+
+
+# 数据段名称 -> UNWIND 语句。字典顺序即写入顺序，与逐行写入时的依赖顺序一致
+# (先有 Encounter/Hospital，再建科室、诊断等依赖它们的关系)。检查报告不涉及 Condition，
+# 提前到诊断之前，诊断与检查发现需要按原顺序合并写入时 Examination 已经存在。
+BATCHED_SECTION_QUERIES = {
+    'encounter.upsert': """
+    MATCH (p:Patient {patientId: $patientId})
+    UNWIND $rows AS row
+    MERGE (e:Encounter {encounterId: row.encounterId})
+    SET e.encounterType = row.encounterType,
+        e.typeName = row.typeName,
+        e.visitStartTime = row.visitStartTime,
+        e.visitEndTime = row.visitEndTime
+    MERGE (p)-[:HAD_ENCOUNTER]->(e)
+    """,
+    'encounter.hospital': """
+    UNWIND $rows AS row
+    MATCH (e:Encounter {encounterId: row.encounterId})
+    MERGE (h:Hospital {hospitalId: row.hospitalId})
+    SET h.name = row.hospitalName
+    MERGE (e)-[:AT_HOSPITAL]->(h)
+    """,
+    'encounter.department': """
+    UNWIND $rows AS row
+    MATCH (e:Encounter {encounterId: row.encounterId})
+    MERGE (d:Department {departmentId: row.departmentId})
+    SET d.name = row.departmentName
+    MERGE (e)-[:IN_DEPARTMENT]->(d)
+    WITH d, row
+    OPTIONAL MATCH (h:Hospital {hospitalId: row.hospitalId})
+    FOREACH (ignored IN CASE WHEN h IS NULL THEN [] ELSE [1] END |
+        MERGE (h)-[:HAS_DEPARTMENT]->(d)
+    )
+    """,
+    'encounter.provider': """
+    UNWIND $rows AS row
+    MATCH (e:Encounter {encounterId: row.encounterId})
+    MERGE (doc:Provider {providerId: row.providerId})
+    SET doc.name = row.providerName
+    MERGE (e)-[:TREATED_BY]->(doc)
+    """,
+    'exam.upsert': """
+    UNWIND $rows AS row
+    MATCH (e:Encounter {encounterId: row.encounterId})
+    MERGE (ex:Examination {reportId: row.reportId})
+    ON CREATE SET
+        ex.timestamp = row.timestamp,
+        ex.fullReport = row.fullReport
+    FOREACH (ignored IN CASE WHEN row.reportHash IS NULL THEN [] ELSE [1] END |
+        SET ex.reportHash = row.reportHash, ex.reportLength = row.reportLength, ex.reportPreview = row.reportPreview
+        REMOVE ex.fullReport
+    )
+    MERGE (e)-[:HAD_EXAMINATION]->(ex)
+    """,
+    # 诊断的“先查后建”依赖前一行的写入结果，放在 CALL 子查询中逐行执行，
+    # 保证同一批内重复出现的新诊断不会被重复创建。
+    'diagnosis.link': """
+    UNWIND $rows AS row
+    CALL {
+        WITH row
+        WITH row.encounterId AS encounterId, row.diseaseName AS dName, row.diseaseCode AS dCode
+
+        OPTIONAL MATCH (c1:Condition {code: dCode}) WHERE dCode IS NOT NULL
+        OPTIONAL MATCH (c2:Condition {name: dName})
+        WITH encounterId, dName, dCode, COALESCE(c1, c2) as existingCondition
+
+        FOREACH(ignored IN CASE WHEN existingCondition IS NOT NULL THEN [] ELSE [1] END |
+            CREATE (c:Condition)
+                SET c.code = dCode, c.name = dName
+        )
+
+        WITH encounterId, dName, dCode
+        MATCH (c:Condition) WHERE (dCode IS NOT NULL AND c.code = dCode) OR (dCode IS NULL AND c.name = dName)
+        SET c.name = dName
+        WITH c, encounterId
+        MATCH (e:Encounter {encounterId: encounterId})
+        MERGE (e)-[:RECORDED_DIAGNOSIS]->(c)
+    }
+    """,
+    'exam.finding': """
+    UNWIND $rows AS row
+    MATCH (ex:Examination {reportId: row.reportId})
+    MERGE (c:Condition {name: row.findingResult})
+    ON CREATE SET c.code = row.findingCode
+    MERGE (ex)-[r:HAS_FINDING]->(c)
+    ON CREATE SET
+        r.bodyPart = row.bodyPart,
+        r.diagnosisId = row.diagnosisId
+    """,
+    'lab.report': """
+    UNWIND $rows AS row
+    MATCH (e:Encounter {encounterId: row.encounterId})
+    MERGE (ltr:LabTestReport {reportId: row.reportId})
+    MERGE (e)-[:HAD_LAB_TEST]->(ltr)
+    """,
+    'lab.item': """
+    UNWIND $rows AS row
+    MATCH (ltr:LabTestReport {reportId: row.reportId})
+    MERGE (li:LabTestItem {name: row.itemName})
+    ON CREATE SET li.code = row.itemCode
+    MERGE (ltr)-[r:HAS_ITEM {testId: row.testId}]->(li)
+    SET
+        r.value = row.value,
+        r.textValue = row.textValue,
+        r.unit = row.unit,
+        r.referenceRange = row.referenceRange,
+        r.interpretation = row.interpretation,
+        r.timestamp = row.timestamp
+    """,
+    'allergy.link': """
+    MATCH (p:Patient {patientId: $patientId})
+    UNWIND $rows AS row
+    MERGE (a:Allergen {name: row.allergen})
+    MERGE (p)-[r:HAS_ALLERGY_TO]->(a)
+    ON CREATE SET
+        r.allergyId = row.allergyId,
+        r.allergenType = row.allergenType,
+        r.reaction = row.reaction,
+        r.reactionType = row.reactionType,
+        r.recordedAt = row.recordedAt
+    """,
+    'family_history.link': """
+    MATCH (p:Patient {patientId: $patientId})
+    UNWIND $rows AS row
+    MERGE (c:Condition {name: row.relativeDisease})
+    MERGE (p)-[r:HAS_FAMILY_HISTORY]->(c)
+    ON CREATE SET
+        r.relationship = row.relationship,
+        r.onsetAge = row.onsetAge,
+        r.recordedAt = row.recordedAt
+    """,
+    'event.blood_transfusion': """
+    MATCH (p:Patient {patientId: $patientId})
+    UNWIND $rows AS row
+    MERGE (e:PastMedicalEvent:BloodTransfusion {name: row.name, date: row.date})
+    ON CREATE SET
+        e.volumeMl = row.volume,
+        e.address = row.address,
+        e.transfusionId = row.transfusionId
+    MERGE (p)-[:HAD_BLOOD_TRANSFUSION]->(e)
+    """,
+    'event.surgery': """
+    MATCH (p:Patient {patientId: $patientId})
+    UNWIND $rows AS row
+    MERGE (e:PastMedicalEvent:Surgery {name: row.name})
+    ON CREATE SET
+        e.date = row.date,
+        e.bodySite = row.bodySite,
+        e.code = row.code
+    MERGE (p)-[:HAD_SURGERY]->(e)
+    """,
+    'event.trauma': """
+    MATCH (p:Patient {patientId: $patientId})
+    UNWIND $rows AS row
+    MERGE (e:PastMedicalEvent:Trauma {name: row.name})
+    ON CREATE SET
+        e.date = row.date,
+        e.severity = row.severity,
+        e.healed = row.healed,
+        e.traumaId = row.traumaId
+    MERGE (p)-[:HAD_TRAUMA]->(e)
+    """,
+    'event.vaccination': """
+    MATCH (p:Patient {patientId: $patientId})
+    UNWIND $rows AS row
+    MERGE (e:PastMedicalEvent:Vaccination {uniqueId: row.uniqueId})
+    SET e.name = row.name,
+        e.date = row.date,
+        e.doseNumber = row.doseNumber,
+        e.manufacturer = row.manufacturer,
+        e.lotNumber = row.lotNumber,
+        e.vaccineCode = row.vaccineCode
+    MERGE (p)-[:HAD_VACCINATION]->(e)
+    """,
+    'family.member': """
+    UNWIND $rows AS row
+    MERGE (relative:Patient {idType: row.idType, idValue: row.idValue})
+    SET relative += row.properties
+    WITH relative, row
+    MATCH (main:Patient {patientId: row.mainPatientId})
+    FOREACH (ignored IN CASE WHEN row.relType = 'SPOUSE' THEN [1] ELSE [] END |
+        MERGE (main)-[r:SPOUSE_OF]-(relative)
+        SET r.relationshipName = row.relName
+    )
+    FOREACH (ignored IN CASE WHEN row.relType = 'CHILD' THEN [1] ELSE [] END |
+        MERGE (main)-[r:PARENT_OF]->(relative)
+        SET r.relationshipName = row.relName
+    )
+    FOREACH (ignored IN CASE WHEN row.relType = 'PARENT' THEN [1] ELSE [] END |
+        MERGE (main)<-[r:PARENT_OF]-(relative)
+        SET r.relationshipName = row.relName
+    )
+    """,
+    'lifestyle.fact': """
+    MATCH (p:Patient {patientId: $patientId})
+    UNWIND $rows AS row
+    MERGE (f:LifestyleFact {type: row.type, value: row.value})
+    MERGE (p)-[r:HAS_LIFESTYLE_FACT]->(f)
+    ON CREATE SET
+        r.recordedAt = row.recordedAt,
+        r.source = row.source
+    """,
+}
+
+
+# 维度数据段 -> (标签, 行中的键字段, 会被 SET 到节点上的字段)
+DIMENSION_SECTIONS = {
+    'encounter.hospital': ('Hospital', 'hospitalId', ('hospitalName',)),
+    'encounter.department': ('Department', 'departmentId', ('departmentName', 'hospitalId')),
+    'encounter.provider': ('Provider', 'providerId', ('providerName',)),
+    'lab.item': ('LabTestItem', 'itemName', ()),
+    'allergy.link': ('Allergen', 'allergen', ()),
+}
+
+# 几乎每个患者都会涉及的低基数共享节点：数据段 -> 行中的键字段。
+# 冲突调度不把它们计为冲突 (见 conflict_scheduler.conflict_keys)，写入时按键排序，并发事务按相同顺序加锁
+LOCK_ORDERED_SECTIONS = {
+    'encounter.hospital': 'hospitalId',
+    'encounter.department': 'departmentId',
+}
+
+# 两阶段加载时由第一阶段统一写入的共享节点：数据段 -> (标签, 行中的键字段)
+PRELOADED_SECTIONS = {
+    'encounter.hospital': ('Hospital', 'hospitalId'),
+    'encounter.department': ('Department', 'departmentId'),
+    'encounter.provider': ('Provider', 'providerId'),
+    'exam.finding': ('Condition', 'findingResult'),
+    'lab.item': ('LabTestItem', 'itemName'),
+    'allergy.link': ('Allergen', 'allergen'),
+    'family_history.link': ('Condition', 'relativeDisease'),
+    'event.blood_transfusion': ('BloodTransfusion', ('name', 'date')),
+    'event.surgery': ('Surgery', 'name'),
+    'event.trauma': ('Trauma', 'name'),
+    'lifestyle.fact': ('LifestyleFact', ('type', 'value')),
+}
+
+# 维度节点已存在且属性未变时使用的语句：只 MATCH 维度节点并建立关系
+BATCHED_LINK_QUERIES = {
+    'encounter.hospital': """
+    UNWIND $rows AS row
+    MATCH (e:Encounter {encounterId: row.encounterId})
+    MATCH (h:Hospital {hospitalId: row.hospitalId})
+    MERGE (e)-[:AT_HOSPITAL]->(h)
+    """,
+    'encounter.department': """
+    UNWIND $rows AS row
+    MATCH (e:Encounter {encounterId: row.encounterId})
+    MATCH (d:Department {departmentId: row.departmentId})
+    MERGE (e)-[:IN_DEPARTMENT]->(d)
+    """,
+    'encounter.provider': """
+    UNWIND $rows AS row
+    MATCH (e:Encounter {encounterId: row.encounterId})
+    MATCH (doc:Provider {providerId: row.providerId})
+    MERGE (e)-[:TREATED_BY]->(doc)
+    """,
+    'exam.finding': """
+    UNWIND $rows AS row
+    MATCH (ex:Examination {reportId: row.reportId})
+    MATCH (c:Condition {name: row.findingResult})
+    MERGE (ex)-[r:HAS_FINDING]->(c)
+    ON CREATE SET
+        r.bodyPart = row.bodyPart,
+        r.diagnosisId = row.diagnosisId
+    """,
+    'lab.item': """
+    UNWIND $rows AS row
+    MATCH (ltr:LabTestReport {reportId: row.reportId})
+    MATCH (li:LabTestItem {name: row.itemName})
+    MERGE (ltr)-[r:HAS_ITEM {testId: row.testId}]->(li)
+    SET
+        r.value = row.value,
+        r.textValue = row.textValue,
+        r.unit = row.unit,
+        r.referenceRange = row.referenceRange,
+        r.interpretation = row.interpretation,
+        r.timestamp = row.timestamp
+    """,
+    'allergy.link': """
+    MATCH (p:Patient {patientId: $patientId})
+    UNWIND $rows AS row
+    MATCH (a:Allergen {name: row.allergen})
+    MERGE (p)-[r:HAS_ALLERGY_TO]->(a)
+    ON CREATE SET
+        r.allergyId = row.allergyId,
+        r.allergenType = row.allergenType,
+        r.reaction = row.reaction,
+        r.reactionType = row.reactionType,
+        r.recordedAt = row.recordedAt
+    """,
+    'family_history.link': """
+    MATCH (p:Patient {patientId: $patientId})
+    UNWIND $rows AS row
+    MATCH (c:Condition {name: row.relativeDisease})
+    MERGE (p)-[r:HAS_FAMILY_HISTORY]->(c)
+    ON CREATE SET
+        r.relationship = row.relationship,
+        r.onsetAge = row.onsetAge,
+        r.recordedAt = row.recordedAt
+    """,
+    'event.blood_transfusion': """
+    MATCH (p:Patient {patientId: $patientId})
+    UNWIND $rows AS row
+    MATCH (e:BloodTransfusion {name: row.name, date: row.date})
+    MERGE (p)-[:HAD_BLOOD_TRANSFUSION]->(e)
+    """,
+    'event.surgery': """
+    MATCH (p:Patient {patientId: $patientId})
+    UNWIND $rows AS row
+    MATCH (e:Surgery {name: row.name})
+    MERGE (p)-[:HAD_SURGERY]->(e)
+    """,
+    'event.trauma': """
+    MATCH (p:Patient {patientId: $patientId})
+    UNWIND $rows AS row
+    MATCH (e:Trauma {name: row.name})
+    MERGE (p)-[:HAD_TRAUMA]->(e)
+    """,
+    'lifestyle.fact': """
+    MATCH (p:Patient {patientId: $patientId})
+    UNWIND $rows AS row
+    MATCH (f:LifestyleFact {type: row.type, value: row.value})
+    MERGE (p)-[r:HAS_LIFESTYLE_FACT]->(f)
+    ON CREATE SET
+        r.recordedAt = row.recordedAt,
+        r.source = row.source
+    """,
+}
+
+
+register_statements('', BATCHED_SECTION_QUERIES)
+register_statements('link.', BATCHED_LINK_QUERIES)
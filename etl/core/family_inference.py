@@ -0,0 +1,102 @@
+# etl/core/family_inference.py
+
+import time
+from functools import lru_cache
+
+from etl.utils.logger import setup_logger
+from etl.utils.statement_stats import name_statement, register_statements, statement_stats
+
+logger = setup_logger('family_inference')
+
+# 推断出的亲子关系带有 inferred 标记，与原始数据区分 (与 enhance_cypher/亲子关系推理.cypher 一致)
+INFERRED_SET = "ON CREATE SET r.inferred = true, r.relationshipName = '父母(推断)'"
+
+# 夫妻 (parent1, parent2) 中 parent1 是 child 的父母、parent2 还没有亲子关系时，补上 parent2 -> child。
+# 本批新写入的 SPOUSE_OF / PARENT_OF 关系一端总是本批的主患者，所以只需分别以主患者作为
+# parent1、parent2、child 各推断一次，就能覆盖本批可能新形成的全部三角关系。
+SCOPED_INFERENCE_QUERIES = {
+    # 主患者是已知的父母一方，补其配偶
+    'as_parent': f"""
+    UNWIND $patientIds AS patientId
+    MATCH (p:Patient {{patientId: patientId}})-[:SPOUSE_OF]-(spouse:Patient)
+    MATCH (p)-[:PARENT_OF]->(child:Patient)
+    WHERE spouse <> child AND NOT (spouse)-[:PARENT_OF]->(child)
+    WITH DISTINCT spouse, child
+    MERGE (spouse)-[r:PARENT_OF]->(child)
+    {INFERRED_SET}
+    """,
+    # 主患者是缺少亲子关系的配偶一方
+    'as_spouse': f"""
+    UNWIND $patientIds AS patientId
+    MATCH (p:Patient {{patientId: patientId}})-[:SPOUSE_OF]-(:Patient)-[:PARENT_OF]->(child:Patient)
+    WHERE p <> child AND NOT (p)-[:PARENT_OF]->(child)
+    WITH DISTINCT p, child
+    MERGE (p)-[r:PARENT_OF]->(child)
+    {INFERRED_SET}
+    """,
+    # 主患者是子女
+    'as_child': f"""
+    UNWIND $patientIds AS patientId
+    MATCH (parent:Patient)-[:PARENT_OF]->(p:Patient {{patientId: patientId}})
+    MATCH (parent)-[:SPOUSE_OF]-(spouse:Patient)
+    WHERE spouse <> p AND NOT (spouse)-[:PARENT_OF]->(p)
+    WITH DISTINCT spouse, p
+    MERGE (spouse)-[r:PARENT_OF]->(p)
+    {INFERRED_SET}
+    """,
+}
+
+
+@lru_cache(maxsize=None)
+def global_inference_query(batch_size):
+    """全图推断 (用于回填)：CALL {} IN TRANSACTIONS 按 batch_size 行分批提交，不会形成一个巨大的事务"""
+    return name_statement('family.infer.global', f"""
+    MATCH (parent1:Patient)-[:SPOUSE_OF]-(parent2:Patient)
+    MATCH (parent1)-[:PARENT_OF]->(child:Patient)
+    WHERE parent2 <> child AND NOT (parent2)-[:PARENT_OF]->(child)
+    WITH DISTINCT parent2, child
+    CALL {{
+        WITH parent2, child
+        MERGE (parent2)-[r:PARENT_OF]->(child)
+        {INFERRED_SET}
+    }} IN TRANSACTIONS OF {int(batch_size)} ROWS
+    """)
+
+
+def has_family(patient_data):
+    """画像中带有家庭成员时，写入后才可能形成新的夫妻/亲子三角关系"""
+    return bool(patient_data and patient_data.get('patientId') and patient_data.get('familyMembers'))
+
+
+def infer_parents_tx(tx, patient_ids):
+    """
+    在一个写事务中为一组患者推断缺失的亲子关系。
+
+    Returns:
+        int: 新建的 PARENT_OF 关系数 (与 infer_parents_global 一样取 ResultSummary 的计数，MATCH 到的已有关系不计入)
+    """
+    inferred = 0
+    for query in SCOPED_INFERENCE_QUERIES.values():
+        inferred += tx.run(query, patientIds=list(patient_ids)).consume().counters.relationships_created
+    return inferred
+
+
+def infer_parents_global(session, batch_size):
+    """
+    对全图执行亲子关系推断。CALL {} IN TRANSACTIONS 只能在自动提交事务中执行，这里直接使用 session.run。
+
+    Returns:
+        int: 新建的 PARENT_OF 关系数
+    """
+    query = global_inference_query(batch_size)
+    started = time.perf_counter()
+    summary = session.run(query).consume()
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if statement_stats.enabled:
+        statement_stats.record('family.infer.global', 1, elapsed_ms, summary)
+    inferred = summary.counters.relationships_created
+    logger.info(f"全图亲子关系推断完成 - 新建 {inferred} 条关系, 耗时 {elapsed_ms / 1000:.1f} 秒")
+    return inferred
+
+
+register_statements('family.infer.', SCOPED_INFERENCE_QUERIES)
@@ -0,0 +1,343 @@
+# etl/core/graph_delta.py
+
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from config.settings import Config
+from etl.core.etl_patient import build_patient_sections, ordered_condition_rows, parse_datetime
+from etl.core.change_detection import portrait_hash
+from etl.core.encounter_delta import encounter_fingerprints
+from etl.utils.logger import setup_logger
+
+logger = setup_logger('graph_delta')
+
+# 节点引用：标签 + MERGE 使用的键属性名 + 键值。同一个标签可以有多种键，
+# 例如 Patient 按 patientId 或按 (idType, idValue)，Condition 按 code 或按 name
+NodeRef = namedtuple('NodeRef', ['label', 'key_props', 'key'])
+
+# 节点 upsert：SET 属性后写覆盖先写；ON CREATE 属性只在创建时写入；ON MATCH 属性只在节点已存在时写入
+NodeUpsert = namedtuple('NodeUpsert', ['ref', 'set_props', 'create_props', 'match_props'])
+
+# 关系 upsert：key_props/key 为 MERGE 关系时使用的关系键 (例如 HAS_ITEM 的 testId)
+RelUpsert = namedtuple('RelUpsert', ['type', 'start', 'end', 'key_props', 'key', 'set_props', 'create_props'])
+
+# 标签 -> 写入时使用的完整标签
+NODE_LABELS = {
+    'BloodTransfusion': ('PastMedicalEvent', 'BloodTransfusion'),
+    'Surgery': ('PastMedicalEvent', 'Surgery'),
+    'Trauma': ('PastMedicalEvent', 'Trauma'),
+    'Vaccination': ('PastMedicalEvent', 'Vaccination'),
+}
+
+# 无方向 MERGE 的关系：两个方向视为同一条关系
+UNDIRECTED_REL_TYPES = {'SPOUSE_OF'}
+
+
+def node_labels(label):
+    return NODE_LABELS.get(label, (label,))
+
+
+def _merge_props(base, update):
+    if not update:
+        return base
+    merged = dict(base or {})
+    merged.update(update)
+    return merged
+
+
+class GraphDelta:
+    """
+    一个或多个患者映射出的图谱增量：按写入顺序排列的节点 upsert 和关系 upsert。
+
+    不依赖数据库，可以在子进程中生成后传回主进程；多个患者的增量可以直接合并，
+    合并后交给 delta_writer 按标签/关系类型批量写入，或交给全量导出器输出 CSV。
+
+    诊断和检查发现的 Condition 另外按逐行写入的顺序保存参数行 (conditions)：写入图谱时 Condition
+    需要按诊断的解析规则 (code 未命中但同名节点已存在时不建立关系) 写入，不能按键直接 MERGE；
+    nodes/rels 中仍保留对应的 upsert，供全量导出器使用。
+    就诊子树内的每个 upsert 和参数行都记录所属的 encounterId，就诊增量同步时据此跳过未变化的就诊。
+    """
+
+    def __init__(self, nodes=None, rels=None, patient_ids=None, conditions=None,
+                 node_encounters=None, rel_encounters=None):
+        self.nodes = nodes if nodes is not None else []
+        self.rels = rels if rels is not None else []
+        self.patient_ids = patient_ids if patient_ids is not None else []
+        # [(encounterId, 诊断行或检查发现行), ...]
+        self.conditions = conditions if conditions is not None else []
+        # 与 nodes/rels 一一对应的 encounterId，不属于就诊子树的为 None
+        self.node_encounters = node_encounters if node_encounters is not None else [None] * len(self.nodes)
+        self.rel_encounters = rel_encounters if rel_encounters is not None else [None] * len(self.rels)
+
+    def __len__(self):
+        return len(self.nodes) + len(self.rels)
+
+    def node(self, label, key_props, key, set_props=None, create_props=None, match_props=None, encounter_id=None):
+        """追加一个节点 upsert，返回节点引用"""
+        ref = NodeRef(label, tuple(key_props), tuple(key))
+        self.nodes.append(NodeUpsert(ref, set_props or {}, create_props or {}, match_props or {}))
+        self.node_encounters.append(encounter_id)
+        return ref
+
+    def rel(self, rel_type, start, end, set_props=None, create_props=None, key_props=(), key=(), encounter_id=None):
+        self.rels.append(RelUpsert(rel_type, start, end, tuple(key_props), tuple(key),
+                                   set_props or {}, create_props or {}))
+        self.rel_encounters.append(encounter_id)
+
+    @classmethod
+    def merged(cls, deltas):
+        """按顺序拼接多个增量"""
+        result = cls()
+        for delta in deltas:
+            result.nodes.extend(delta.nodes)
+            result.rels.extend(delta.rels)
+            result.patient_ids.extend(delta.patient_ids)
+            result.conditions.extend(delta.conditions)
+            result.node_encounters.extend(delta.node_encounters)
+            result.rel_encounters.extend(delta.rel_encounters)
+        return result
+
+    def only_encounters(self, encounter_ids):
+        """
+        就诊增量同步：只保留 encounter_ids 中的就诊子树 (子树指纹变化或新增的就诊) 和不属于就诊子树的部分，
+        与逐行写入时只写入变化就诊的参数行一致。
+        """
+        encounter_ids = set(encounter_ids)
+
+        def kept(items, owners):
+            return [(item, eid) for item, eid in zip(items, owners) if eid is None or eid in encounter_ids]
+
+        nodes = kept(self.nodes, self.node_encounters)
+        rels = kept(self.rels, self.rel_encounters)
+        return GraphDelta(
+            [upsert for upsert, _ in nodes], [upsert for upsert, _ in rels], list(self.patient_ids),
+            [(eid, row) for eid, row in self.conditions if eid in encounter_ids],
+            [eid for _, eid in nodes], [eid for _, eid in rels],
+        )
+
+    def compact(self):
+        """
+        合并同一节点/关系的重复 upsert，保持首次出现的顺序：ON CREATE 属性取第一次，
+        SET 与 ON MATCH 属性后写覆盖先写。无方向关系沿用第一次写入时的方向。
+        """
+        nodes = OrderedDict()
+        for upsert in self.nodes:
+            current = nodes.get(upsert.ref)
+            if current is None:
+                nodes[upsert.ref] = upsert
+            else:
+                nodes[upsert.ref] = current._replace(
+                    set_props=_merge_props(current.set_props, upsert.set_props),
+                    match_props=_merge_props(current.match_props, upsert.match_props),
+                )
+
+        rels = OrderedDict()
+        for upsert in self.rels:
+            start, end = upsert.start, upsert.end
+            if upsert.type in UNDIRECTED_REL_TYPES and repr(start) > repr(end):
+                start, end = end, start
+            identity = (upsert.type, start, end, upsert.key)
+            current = rels.get(identity)
+            if current is None:
+                rels[identity] = upsert
+            else:
+                rels[identity] = current._replace(set_props=_merge_props(current.set_props, upsert.set_props))
+
+        return GraphDelta(list(nodes.values()), list(rels.values()), list(self.patient_ids), list(self.conditions))
+
+
+def compile_patient(patient_data):
+    """
+    把一个患者的健康画像编译为图谱增量，不访问数据库。
+    映射规则与 etl_patient.py 中的写入语句一致，可以在 ProcessPoolExecutor 中执行。
+    诊断和检查发现另外按逐行写入的顺序记入 conditions，写入图谱时由 delta_writer 按 Condition 解析规则写入。
+    """
+    delta = GraphDelta()
+    patient_id = patient_data.get('patientId') if patient_data else None
+    if not patient_id:
+        return delta
+    delta.patient_ids.append(patient_id)
+
+    patient = _compile_patient_core(delta, patient_id, patient_data)
+    sections = build_patient_sections(patient_id, patient_data)
+
+    subtree_hashes = {}
+    if Config.ENCOUNTER_DELTA_SYNC and patient_data.get('encounters') is not None:
+        subtree_hashes = encounter_fingerprints(patient_data['encounters'])
+
+    encounters = {}
+    for row in sections['encounter.upsert']:
+        encounter_id = row['encounterId']
+        set_props = {
+            'encounterType': row['encounterType'],
+            'typeName': row['typeName'],
+            'visitStartTime': row['visitStartTime'],
+            'visitEndTime': row['visitEndTime'],
+        }
+        if encounter_id in subtree_hashes:
+            # 未开启就诊增量同步时不写 subtreeHash，不能把节点上已有的指纹置空
+            set_props['subtreeHash'] = subtree_hashes[encounter_id]
+        encounters[encounter_id] = delta.node('Encounter', ('encounterId',), (encounter_id,), set_props,
+                                              encounter_id=encounter_id)
+        delta.rel('HAD_ENCOUNTER', patient, encounters[encounter_id], encounter_id=encounter_id)
+
+    def encounter(encounter_id):
+        return NodeRef('Encounter', ('encounterId',), (encounter_id,))
+
+    for row in sections['encounter.hospital']:
+        eid = row['encounterId']
+        hospital = delta.node('Hospital', ('hospitalId',), (row['hospitalId'],), {'name': row['hospitalName']},
+                              encounter_id=eid)
+        delta.rel('AT_HOSPITAL', encounter(eid), hospital, encounter_id=eid)
+
+    for row in sections['encounter.department']:
+        eid = row['encounterId']
+        department = delta.node('Department', ('departmentId',), (row['departmentId'],),
+                                {'name': row['departmentName']}, encounter_id=eid)
+        delta.rel('IN_DEPARTMENT', encounter(eid), department, encounter_id=eid)
+        if row['hospitalId']:
+            delta.rel('HAS_DEPARTMENT', NodeRef('Hospital', ('hospitalId',), (row['hospitalId'],)), department,
+                      encounter_id=eid)
+
+    for row in sections['encounter.provider']:
+        eid = row['encounterId']
+        provider = delta.node('Provider', ('providerId',), (row['providerId'],), {'name': row['providerName']},
+                              encounter_id=eid)
+        delta.rel('TREATED_BY', encounter(eid), provider, encounter_id=eid)
+
+    for row in sections['diagnosis.link']:
+        eid = row['encounterId']
+        if row['diseaseCode'] is not None:
+            condition = delta.node('Condition', ('code',), (row['diseaseCode'],), {'name': row['diseaseName']},
+                                   encounter_id=eid)
+        else:
+            condition = delta.node('Condition', ('name',), (row['diseaseName'],), encounter_id=eid)
+        delta.rel('RECORDED_DIAGNOSIS', encounter(eid), condition, encounter_id=eid)
+
+    # 检查报告 reportId -> 所属就诊
+    exam_encounters = {}
+    for row in sections['exam.upsert']:
+        eid = exam_encounters[row['reportId']] = row['encounterId']
+        summary = {field: row[field] for field in ('reportHash', 'reportLength', 'reportPreview')
+                   if row[field] is not None}
+        examination = delta.node('Examination', ('reportId',), (row['reportId'],), summary, create_props={
+            'timestamp': row['timestamp'], 'fullReport': row['fullReport'],
+        }, encounter_id=eid)
+        delta.rel('HAD_EXAMINATION', encounter(eid), examination, encounter_id=eid)
+
+    for row in sections['exam.finding']:
+        eid = exam_encounters.get(row['reportId'])
+        condition = delta.node('Condition', ('name',), (row['findingResult'],),
+                               create_props={'code': row['findingCode']}, encounter_id=eid)
+        delta.rel('HAS_FINDING', NodeRef('Examination', ('reportId',), (row['reportId'],)), condition,
+                  create_props={'bodyPart': row['bodyPart'], 'diagnosisId': row['diagnosisId']}, encounter_id=eid)
+
+    delta.conditions.extend(
+        (row['encounterId'] if 'findingResult' not in row else exam_encounters.get(row['reportId']), row)
+        for row in ordered_condition_rows(sections['diagnosis.link'], sections['exam.finding'])
+    )
+
+    lab_encounters = {}
+    for row in sections['lab.report']:
+        eid = lab_encounters[row['reportId']] = row['encounterId']
+        report = delta.node('LabTestReport', ('reportId',), (row['reportId'],), encounter_id=eid)
+        delta.rel('HAD_LAB_TEST', encounter(eid), report, encounter_id=eid)
+
+    for row in sections['lab.item']:
+        eid = lab_encounters.get(row['reportId'])
+        item = delta.node('LabTestItem', ('name',), (row['itemName'],), create_props={'code': row['itemCode']},
+                          encounter_id=eid)
+        delta.rel('HAS_ITEM', NodeRef('LabTestReport', ('reportId',), (row['reportId'],)), item,
+                  set_props={field: row[field] for field in
+                             ('value', 'textValue', 'unit', 'referenceRange', 'interpretation', 'timestamp')},
+                  key_props=('testId',), key=(row['testId'],), encounter_id=eid)
+
+    for row in sections['allergy.link']:
+        allergen = delta.node('Allergen', ('name',), (row['allergen'],))
+        delta.rel('HAS_ALLERGY_TO', patient, allergen, create_props={
+            field: row[field] for field in ('allergyId', 'allergenType', 'reaction', 'reactionType', 'recordedAt')
+        })
+
+    for row in sections['family_history.link']:
+        condition = delta.node('Condition', ('name',), (row['relativeDisease'],))
+        delta.rel('HAS_FAMILY_HISTORY', patient, condition, create_props={
+            field: row[field] for field in ('relationship', 'onsetAge', 'recordedAt')
+        })
+
+    for row in sections['event.blood_transfusion']:
+        if row['date'] is None:
+            # MERGE 的键属性不能为空
+            logger.warning(f"输血记录缺少日期，跳过 - PatientId: {patient_id}")
+            continue
+        event = delta.node('BloodTransfusion', ('name', 'date'), (row['name'], row['date']), create_props={
+            'volumeMl': row['volume'], 'address': row['address'], 'transfusionId': row['transfusionId'],
+        })
+        delta.rel('HAD_BLOOD_TRANSFUSION', patient, event)
+
+    for row in sections['event.surgery']:
+        event = delta.node('Surgery', ('name',), (row['name'],), create_props={
+            'date': row['date'], 'bodySite': row['bodySite'], 'code': row['code'],
+        })
+        delta.rel('HAD_SURGERY', patient, event)
+
+    for row in sections['event.trauma']:
+        event = delta.node('Trauma', ('name',), (row['name'],), create_props={
+            'date': row['date'], 'severity': row['severity'], 'healed': row['healed'], 'traumaId': row['traumaId'],
+        })
+        delta.rel('HAD_TRAUMA', patient, event)
+
+    for row in sections['event.vaccination']:
+        event = delta.node('Vaccination', ('uniqueId',), (row['uniqueId'],),
+                           {field: value for field, value in row.items() if field != 'uniqueId'})
+        delta.rel('HAD_VACCINATION', patient, event)
+
+    for row in sections['family.member']:
+        relative = delta.node('Patient', ('idType', 'idValue'), (row['idType'], row['idValue']),
+                              dict(row['properties']))
+        main = NodeRef('Patient', ('patientId',), (row['mainPatientId'],))
+        set_props = {'relationshipName': row['relName']}
+        if row['relType'] == 'SPOUSE':
+            delta.rel('SPOUSE_OF', main, relative, set_props)
+        elif row['relType'] == 'CHILD':
+            delta.rel('PARENT_OF', main, relative, set_props)
+        elif row['relType'] == 'PARENT':
+            delta.rel('PARENT_OF', relative, main, set_props)
+
+    for row in sections['lifestyle.fact']:
+        fact = delta.node('LifestyleFact', ('type', 'value'), (row['type'], row['value']))
+        delta.rel('HAS_LIFESTYLE_FACT', patient, fact,
+                  create_props={'recordedAt': row['recordedAt'], 'source': row['source']})
+
+    return delta
+
+
+def _compile_patient_core(delta, patient_id, data):
+    set_props = {
+        'name': data.get('name'),
+        'empi': data.get('empi'),
+        'birthDate': data.get('birthDate'),
+        'gender': data.get('gender'),
+        'idValue': data.get('idValue'),
+        'idType': data.get('idType'),
+        'maritalStatus': data.get('maritalStatus'),
+    }
+    if Config.CHANGE_DETECTION:
+        set_props['portraitHash'] = portrait_hash(data)
+    return delta.node('Patient', ('patientId',), (patient_id,), set_props,
+                      create_props={'createdAt': parse_datetime(data.get('createdAt'))},
+                      match_props={'updateTime': parse_datetime(data.get('updateTime'))})
+
+
+def compile_patients(patients, processes=0):
+    """
+    编译多个患者的增量，返回与输入顺序一致的列表。
+    processes 大于 0 时在子进程中编译；进程池不可用时回落到当前进程。
+    """
+    if processes > 0 and len(patients) > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                chunksize = max(1, len(patients) // (processes * 4))
+                return list(executor.map(compile_patient, patients, chunksize=chunksize))
+        except Exception as e:
+            logger.error(f"多进程编译图谱增量失败，改为当前进程编译: {str(e)}")
+    return [compile_patient(patient_data) for patient_data in patients]
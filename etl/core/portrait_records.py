@@ -0,0 +1,391 @@
+# etl/core/portrait_records.py
+
+from typing import List, Optional, Union
+
+import msgspec
+
+from etl.utils.logger import setup_logger
+from etl.utils.metrics import run_metrics
+
+logger = setup_logger('portrait_records')
+
+# 表示“没有”的占位取值：诊断、检查发现、过敏原、家族史疾病、手术/外伤/疫苗名称为这些值时视为没有记录
+ABSENT_SENTINELS = frozenset(('无', '不详'))
+
+# 标量字段：数据源中同一字段可能是字符串或数字，不在类型上强制，只拒绝对象/数组
+Scalar = Union[str, bool, int, float, None]
+
+
+def _text(value):
+    """字符串去掉首尾空白，空串视为 None；其他类型原样返回"""
+    if isinstance(value, str):
+        value = value.strip()
+        return value or None
+    return value
+
+
+def _known(value):
+    """同 _text，且 ABSENT_SENTINELS 中的占位取值视为 None"""
+    value = _text(value)
+    if value in ABSENT_SENTINELS:
+        return None
+    return value
+
+
+def _kept(records, is_valid):
+    """去掉列表中的 null 元素和未通过校验的记录，丢弃数记入 records.dropped"""
+    if not records:
+        return []
+    kept = [record for record in records if record is not None and is_valid(record)]
+    if len(kept) != len(records):
+        run_metrics.incr('records.dropped', len(records) - len(kept))
+    return kept
+
+
+def _field(name):
+    return msgspec.field(default=None, name=name)
+
+
+# 画像记录都是 msgspec.Struct (自带 __slots__，不参与循环垃圾回收)：
+# 响应体直接解码为记录，字段名与接口一致 (field name)，__post_init__ 中完成去空白、占位值和必填校验，
+# 行构建函数按属性读取，不再逐字段 .get() 和判空。未知字段忽略，字段类型不符 (如标量位置出现对象) 时抛出 ValidationError。
+
+class DiagnosisRecord(msgspec.Struct, gc=False):
+    name: Scalar = _field('diagnosisName')
+    code: Scalar = _field('diagnosisNo')
+
+    def __post_init__(self):
+        self.name = _known(self.name)
+        self.code = _text(self.code)
+
+
+class FindingRecord(msgspec.Struct, gc=False):
+    result: Scalar = _field('diagnosisResult')
+    code: Scalar = _field('diagnosisCode')
+    body_part: Scalar = _field('bodyPart')
+    diagnosis_id: Scalar = _field('diagnosisId')
+
+    def __post_init__(self):
+        self.result = _known(self.result)
+        self.code = _text(self.code)
+        self.body_part = _text(self.body_part)
+
+
+class ExaminationRecord(msgspec.Struct, gc=False):
+    """检查报告。fullReport 为正文，只把空串视为 None，不去除空白"""
+
+    report_id: Scalar = _field('reportId')
+    timestamp: Scalar = _field('timestamp')
+    full_report: Scalar = _field('fullReport')
+    findings: Optional[List[Optional[FindingRecord]]] = _field('findings')
+
+    def __post_init__(self):
+        self.report_id = _text(self.report_id)
+        self.timestamp = _text(self.timestamp)
+        self.full_report = self.full_report or None
+        self.findings = _kept(self.findings, lambda finding: finding.result)
+
+
+class LabItemRecord(msgspec.Struct, gc=False):
+    name: Scalar = _field('labtestIndexName')
+    code: Scalar = _field('labtestIndexCode')
+    test_id: Scalar = _field('testId')
+    value: Scalar = _field('value')
+    text_value: Scalar = _field('textValue')
+    unit: Scalar = _field('unit')
+    reference_range: Scalar = _field('referenceRange')
+    interpretation: Scalar = _field('interpretation')
+    timestamp: Scalar = _field('timestamp')
+
+    def __post_init__(self):
+        self.name = _text(self.name)
+        self.code = _text(self.code)
+        self.text_value = _text(self.text_value)
+        self.unit = _text(self.unit)
+        self.reference_range = _text(self.reference_range)
+        self.interpretation = _text(self.interpretation)
+        self.timestamp = _text(self.timestamp)
+
+
+class LabTestRecord(msgspec.Struct, gc=False):
+    report_id: Scalar = _field('reportId')
+    items: Optional[List[Optional[LabItemRecord]]] = _field('items')
+
+    def __post_init__(self):
+        self.report_id = _text(self.report_id)
+        self.items = _kept(self.items, lambda item: item.name and item.test_id)
+
+
+class EncounterRecord(msgspec.Struct, gc=False):
+    encounter_id: Scalar = _field('encounterId')
+    encounter_type: Scalar = _field('encounterType')
+    visit_start_time: Scalar = _field('visitStartTime')
+    visit_end_time: Scalar = _field('visitEndTime')
+    hospital_id: Scalar = _field('hospitalId')
+    hospital_name: Scalar = _field('hospitalName')
+    department_id: Scalar = _field('departmentId')
+    department_name: Scalar = _field('departmentName')
+    provider_id: Scalar = _field('attendingProviderId')
+    provider_name: Scalar = _field('attendingProviderName')
+    diagnoses: Optional[List[Optional[DiagnosisRecord]]] = _field('diagnoses')
+    examinations: Optional[List[Optional[ExaminationRecord]]] = _field('examinations')
+    lab_tests: Optional[List[Optional[LabTestRecord]]] = _field('labTests')
+
+    def __post_init__(self):
+        self.encounter_id = _text(self.encounter_id)
+        self.encounter_type = _text(self.encounter_type)
+        self.visit_start_time = _text(self.visit_start_time)
+        self.visit_end_time = _text(self.visit_end_time)
+        self.hospital_id = _text(self.hospital_id)
+        self.hospital_name = _text(self.hospital_name)
+        self.department_id = _text(self.department_id)
+        self.department_name = _text(self.department_name)
+        self.provider_id = _text(self.provider_id)
+        self.provider_name = _text(self.provider_name)
+        self.diagnoses = _kept(self.diagnoses, lambda diagnosis: diagnosis.name or diagnosis.code)
+        self.examinations = _kept(self.examinations, lambda exam: exam.report_id)
+        self.lab_tests = _kept(self.lab_tests, lambda lab_test: lab_test.report_id)
+
+
+class AllergyRecord(msgspec.Struct, gc=False):
+    allergy_id: Scalar = _field('allergyId')
+    allergen: Scalar = _field('allergen')
+    allergen_type: Scalar = _field('allergenType')
+    reaction: Scalar = _field('reaction')
+    reaction_type: Scalar = _field('reactionType')
+    recorded_at: Scalar = _field('recordedAt')
+
+    def __post_init__(self):
+        self.allergen = _known(self.allergen)
+        self.allergen_type = _text(self.allergen_type)
+        self.reaction = _text(self.reaction)
+        self.reaction_type = _text(self.reaction_type)
+        self.recorded_at = _text(self.recorded_at)
+
+
+class FamilyHistoryRecord(msgspec.Struct, gc=False):
+    disease: Scalar = _field('relativeDisease')
+    relationship: Scalar = _field('relativeRelationship')
+    onset_age: Scalar = _field('onsetAge')
+    recorded_at: Scalar = _field('recordedAt')
+
+    def __post_init__(self):
+        self.disease = _known(self.disease)
+        self.relationship = _text(self.relationship)
+        self.recorded_at = _text(self.recorded_at)
+
+
+class BloodTransfusionRecord(msgspec.Struct, gc=False):
+    date: Scalar = _field('bloodTransfusionsDate')
+    volume: Scalar = _field('volumeMl')
+    address: Scalar = _field('bloodTransfusionsAddress')
+    transfusion_id: Scalar = _field('pastBloodTransfusionsId')
+
+    def __post_init__(self):
+        self.date = _text(self.date)
+        self.volume = _text(self.volume)
+        self.address = _text(self.address)
+
+
+class SurgeryRecord(msgspec.Struct, gc=False):
+    name: Scalar = _field('surgeryName')
+    date: Scalar = _field('surgeryDate')
+    body_site: Scalar = _field('bodySite')
+    code: Scalar = _field('surgeryCode')
+
+    def __post_init__(self):
+        self.name = _known(self.name)
+        self.date = _text(self.date)
+        self.body_site = _text(self.body_site)
+        self.code = _text(self.code)
+
+
+class TraumaRecord(msgspec.Struct, gc=False):
+    body_site: Scalar = _field('bodySite')
+    trauma_type: Scalar = _field('traumaType')
+    date: Scalar = _field('traumasDate')
+    severity: Scalar = _field('severity')
+    healed: Scalar = _field('healed')
+    trauma_id: Scalar = _field('pastTraumasId')
+
+    def __post_init__(self):
+        self.body_site = _known(self.body_site)
+        self.trauma_type = _known(self.trauma_type)
+        self.date = _text(self.date)
+        self.severity = _text(self.severity)
+
+
+class VaccinationRecord(msgspec.Struct, gc=False):
+    name: Scalar = _field('vaccineName')
+    date: Scalar = _field('vaccineDate')
+    dose_number: Scalar = _field('doseNumber')
+    manufacturer: Scalar = _field('manufacturer')
+    lot_number: Scalar = _field('lotNumber')
+    vaccine_code: Scalar = _field('vaccineCode')
+
+    def __post_init__(self):
+        self.name = _known(self.name)
+        self.date = _text(self.date)
+        self.dose_number = _text(self.dose_number)
+        self.manufacturer = _text(self.manufacturer)
+        self.lot_number = _text(self.lot_number)
+        self.vaccine_code = _text(self.vaccine_code)
+
+
+class FamilyMemberRecord(msgspec.Struct, gc=False):
+    """家族成员。relationship 统一为字符串代码"""
+
+    relationship: Scalar = _field('relationship')
+    relationship_name: Scalar = _field('relationshipName')
+    id_type: Scalar = _field('idType')
+    id_value: Scalar = _field('idValue')
+    name: Scalar = _field('name')
+    gender: Scalar = _field('gender')
+    birth_date: Scalar = _field('birthDate')
+    patient_id: Scalar = _field('patientId')
+
+    def __post_init__(self):
+        self.relationship = str(_text(self.relationship))
+        self.relationship_name = _text(self.relationship_name)
+        self.id_type = _text(self.id_type)
+        self.id_value = _text(self.id_value)
+        self.name = _text(self.name)
+        self.birth_date = _text(self.birth_date)
+        self.patient_id = _text(self.patient_id)
+
+
+class LifestyleRecord(msgspec.Struct, gc=False):
+    """生活方式类列表 (吸烟史、饮酒史、体征、饮食、睡眠) 的记录，只保留映射用到的字段"""
+
+    status: Scalar = _field('status')
+    frequency: Scalar = _field('frequency')
+    bmi: Scalar = _field('bmi')
+    diet_type: Scalar = _field('dietType')
+    flavor_type: Scalar = _field('flavorType')
+    sleep_duration: Scalar = _field('sleepDuration')
+    sleep_quality: Scalar = _field('sleepQuality')
+    created_at: Scalar = _field('createdAt')
+
+    def __post_init__(self):
+        self.status = _text(self.status)
+        self.frequency = _text(self.frequency)
+        self.diet_type = _text(self.diet_type)
+        self.flavor_type = _text(self.flavor_type)
+        self.sleep_duration = _text(self.sleep_duration)
+        self.sleep_quality = _text(self.sleep_quality)
+        self.created_at = _text(self.created_at)
+
+
+LifestyleList = Optional[List[Optional[LifestyleRecord]]]
+
+
+class PatientRecord(msgspec.Struct, gc=False):
+    """一个患者的健康画像。日期时间保持规范化后的字符串，由行构建函数用 parse_datetime (带缓存) 解析"""
+
+    patient_id: Scalar = _field('patientId')
+    name: Scalar = _field('name')
+    empi: Scalar = _field('empi')
+    birth_date: Scalar = _field('birthDate')
+    gender: Scalar = _field('gender')
+    id_type: Scalar = _field('idType')
+    id_value: Scalar = _field('idValue')
+    marital_status: Scalar = _field('maritalStatus')
+    created_at: Scalar = _field('createdAt')
+    update_time: Scalar = _field('updateTime')
+    encounters: Optional[List[Optional[EncounterRecord]]] = _field('encounters')
+    allergies: Optional[List[Optional[AllergyRecord]]] = _field('allergyProfilesList')
+    family_history: Optional[List[Optional[FamilyHistoryRecord]]] = _field('familyHistoryList')
+    blood_transfusions: Optional[List[Optional[BloodTransfusionRecord]]] = _field('pastBloodTransfusionsList')
+    surgeries: Optional[List[Optional[SurgeryRecord]]] = _field('pastSurgeriesList')
+    traumas: Optional[List[Optional[TraumaRecord]]] = _field('pastTraumasList')
+    vaccinations: Optional[List[Optional[VaccinationRecord]]] = _field('pastVaccinationsList')
+    family_members: Optional[List[Optional[FamilyMemberRecord]]] = _field('familyMembers')
+    smoking_history: LifestyleList = _field('personalSmokingHistoryList')
+    alcohol_history: LifestyleList = _field('personalAlcoholHistoryList')
+    physical_traits: LifestyleList = _field('physicalTraitsList')
+    diet_habits: LifestyleList = _field('dietHabitsList')
+    sleep_assessment: LifestyleList = _field('sleepAssessmentList')
+
+    def __post_init__(self):
+        self.patient_id = _text(self.patient_id)
+        self.name = _text(self.name)
+        self.empi = _text(self.empi)
+        self.birth_date = _text(self.birth_date)
+        self.gender = _text(self.gender)
+        self.id_type = _text(self.id_type)
+        self.id_value = _text(self.id_value)
+        self.marital_status = _text(self.marital_status)
+        self.created_at = _text(self.created_at)
+        self.update_time = _text(self.update_time)
+        self.encounters = _kept(self.encounters, lambda encounter: encounter.encounter_id)
+        self.allergies = _kept(self.allergies, lambda allergy: allergy.allergen)
+        self.family_history = _kept(self.family_history, lambda history: history.disease)
+        self.blood_transfusions = _kept(self.blood_transfusions, lambda item: item.date or item.volume)
+        self.surgeries = _kept(self.surgeries, lambda surgery: surgery.name)
+        self.traumas = _kept(self.traumas, lambda trauma: trauma.body_site and trauma.trauma_type)
+        self.vaccinations = _kept(self.vaccinations, lambda vaccination: vaccination.name)
+        self.family_members = _kept(self.family_members, lambda member: member.id_type and member.id_value)
+
+    def lifestyle_facts(self):
+        """按 iter_lifestyle_facts 的顺序产出 (fact_type, fact_value, source, recorded_at)，只看每个列表的第一条记录"""
+        for records, source, fields in (
+            (self.smoking_history, 'personalSmokingHistory', (('status', 'SmokingStatus'),)),
+            (self.alcohol_history, 'personalAlcoholHistory', (('frequency', 'AlcoholFrequency'),)),
+            (self.physical_traits, 'physicalTraits', (('bmi', 'BMI'),)),
+            (self.diet_habits, 'dietHabits', (('diet_type', 'DietType'), ('flavor_type', 'FlavorPreference'))),
+            (self.sleep_assessment, 'sleepAssessment',
+             (('sleep_duration', 'SleepDuration'), ('sleep_quality', 'SleepQuality'))),
+        ):
+            if not records or records[0] is None:
+                continue
+            for field, fact_type in fields:
+                value = getattr(records[0], field)
+                if value:
+                    yield fact_type, value, source, records[0].created_at
+
+
+class PortraitResponse(msgspec.Struct, gc=False):
+    """getHealthPortrait 的响应 {code, msg, data}"""
+
+    code: Scalar = None
+    msg: Scalar = None
+    data: Optional[PatientRecord] = None
+
+
+_response_decoder = msgspec.json.Decoder(PortraitResponse)
+
+
+def decode_portrait(body):
+    """
+    把 getHealthPortrait 的响应体 (bytes) 直接解码为记录，不经过中间的 dict。
+
+    Returns:
+        PortraitResponse
+
+    Raises:
+        msgspec.DecodeError / msgspec.ValidationError: 响应体不是合法 JSON，或字段结构与记录定义不符
+    """
+    return _response_decoder.decode(body)
+
+
+def to_record(patient_data):
+    """
+    把画像字典 (本地缓存、样例文件、流式解码的画像) 转换为 PatientRecord。
+    结构不符时记录 records.invalid 并返回 None，由调用方回退到字典映射。
+    """
+    return _convert(patient_data, PatientRecord)
+
+
+def to_encounter_record(encounter):
+    """同 to_record，转换单次就诊"""
+    return _convert(encounter, EncounterRecord)
+
+
+def _convert(value, record_type):
+    try:
+        return msgspec.convert(value, record_type)
+    except msgspec.ValidationError as e:
+        run_metrics.incr('records.invalid')
+        logger.warning(f"画像结构与 {record_type.__name__} 不符，按字典映射: {str(e)}")
+        return None
+
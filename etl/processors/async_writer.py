@@ -0,0 +1,155 @@
+# etl/processors/async_writer.py
+
+import asyncio
+import json
+import time
+
+from config.settings import Config
+from ..utils.db import AsyncNeo4jConnection
+from ..utils.logger import setup_logger
+from ..utils.metrics import run_metrics
+from ..utils.statement_stats import statement_stats
+from ..utils.stream_decode import is_streamed
+from ..core.conflict_scheduler import schedule_lanes
+from .dry_run import RecordingTransaction
+from .health_portrait import TX_CACHES
+
+logger = setup_logger('async_writer')
+
+# 写入函数需要读取返回结果的语句：录制时遇到没有结果的，先在事务中执行，再带着结果重新录制
+RESULT_STATEMENTS = ('encounter.load_hashes', 'diagnosis.resolve', 'condition.link')
+# 其中的只读语句：同一轮录制中出现的可以一起执行
+READ_STATEMENTS = ('encounter.load_hashes',)
+
+
+def _answer_key(name, params):
+    return name, json.dumps(params, ensure_ascii=False, sort_keys=True, default=str)
+
+
+class AsyncPortraitWriter:
+    """
+    基于 AsyncGraphDatabase 的写入器，ASYNC_WRITES 开启时替代线程池写入。
+
+    与线程池写入使用同一套语句：HealthPortraitProcessor 的事务函数先对 RecordingTransaction 录制出
+    整个分组的语句，再在异步写事务中依次发送。需要读取结果的语句 (就诊子树指纹、诊断解析)
+    先执行并把结果回填后重新录制，直到所有结果都已就绪。
+
+    分组按共享节点冲突调度成最多 ASYNC_MAX_IN_FLIGHT 个 lane，每个 lane 是一个协程、
+    同一时刻只有一个写事务，因此一个线程内最多同时有 ASYNC_MAX_IN_FLIGHT 个写事务。
+    """
+
+    def __init__(self, processor, connection_factory=AsyncNeo4jConnection, max_in_flight=None):
+        self.processor = processor
+        self.max_in_flight = max(1, max_in_flight or Config.ASYNC_MAX_IN_FLIGHT)
+        self._connection_factory = connection_factory
+        self._loop = None
+        self._db = None
+
+    def write(self, pending, ignored_labels=()):
+        """
+        写入 prepare_group 返回的 [(key, patient_data, digest), ...]。
+
+        Returns:
+            list: 写入失败的 key 列表
+        """
+        # 流式解码的超大画像不录制 (录制会把所有分块的参数行都留在内存中)，用同步事务逐块发送
+        failed = []
+        for item in [item for item in pending if is_streamed(item[1])]:
+            failed.extend(self.processor.write_group([item]))
+        pending = [item for item in pending if not is_streamed(item[1])]
+        if not pending:
+            return failed
+        # 事件循环和异步驱动在多次调用间复用，连接池不需要每批重新建立
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+        return failed + self._loop.run_until_complete(self._write_all(pending, ignored_labels))
+
+    def close(self):
+        if self._loop is None:
+            return
+        if self._db is not None:
+            self._loop.run_until_complete(self._db.close())
+            self._db = None
+        self._loop.close()
+        self._loop = None
+
+    async def _write_all(self, pending, ignored_labels):
+        if self._db is None:
+            self._db = self._connection_factory()
+        lanes = schedule_lanes(pending, self.max_in_flight, ignored_labels)
+        results = await asyncio.gather(*(self._write_lane(lane) for lane in lanes))
+        return [key for failed in results for key in failed]
+
+    async def _write_lane(self, lane):
+        failed = []
+        for group in self.processor.split_groups(lane):
+            failed.extend(await self._write_group(group))
+        return failed
+
+    async def _write_group(self, group):
+        """写入一个分组；失败时二分，直到定位到单个出错的患者 (与 HealthPortraitProcessor.write_group 一致)"""
+        try:
+            async with self._db.get_session() as session:
+                staged = await session.execute_write(
+                    self._work, [(patient_data, digest) for _, patient_data, digest in group]
+                )
+        except Exception as e:
+            for cache in TX_CACHES:
+                cache.rollback()
+            if len(group) == 1:
+                key, patient_data, _ = group[0]
+                run_metrics.incr('patients.failed')
+                logger.error(f"处理失败 - PatientId: {patient_data.get('patientId')}, 错误: {str(e)}")
+                return [key]
+            logger.warning(f"分组写入失败，二分重试 - {len(group)} 个患者, 错误: {str(e)}")
+            middle = len(group) // 2
+            return await self._write_group(group[:middle]) + await self._write_group(group[middle:])
+
+        for cache, entries in zip(TX_CACHES, staged):
+            cache.attach(entries)
+            cache.commit()
+        run_metrics.incr('patients.written', len(group))
+        logger.info(f"分组处理成功 - {len(group)} 个患者")
+        return []
+
+    async def _work(self, tx, items):
+        """
+        异步事务函数。录制是同步的、中间没有 await，多个协程交替执行时互不影响；
+        每次 await 之前都把事务内缓存的暂存条目取出，提交成功后由 _write_group 放回并提交。
+        """
+        answers = {}
+        while True:
+            recorder = RecordingTransaction(lambda name, params: answers.get(_answer_key(name, params)))
+            # 只保留最后一轮录制的运行统计计数
+            with run_metrics.buffered() as counters:
+                self.processor._process_group_tx(recorder, items)
+            unanswered = [
+                statement for statement in recorder.statements
+                if statement[0] in RESULT_STATEMENTS and _answer_key(statement[0], statement[2]) not in answers
+            ]
+            if not unanswered:
+                break
+            for cache in TX_CACHES:
+                cache.rollback()
+            # 只读语句一起执行；写语句的参数依赖前面语句的结果，每轮只执行第一条
+            reads = [statement for statement in unanswered if statement[0] in READ_STATEMENTS]
+            for name, query, params in reads or unanswered[:1]:
+                answers[_answer_key(name, params)] = await self._run(tx, name, query, params)
+
+        run_metrics.merge(counters)
+        staged = [cache.detach() for cache in TX_CACHES]
+        for name, query, params in recorder.statements:
+            if _answer_key(name, params) not in answers:
+                await self._run(tx, name, query, params)
+        return staged
+
+    async def _run(self, tx, name, query, params):
+        started = time.perf_counter()
+        result = await tx.run(query, params)
+        records = [record async for record in result]
+        summary = await result.consume()
+        if statement_stats.enabled:
+            rows = params.get('rows')
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            statement_stats.record(name, len(rows) if isinstance(rows, list) else 1, elapsed_ms, summary)
+        return records
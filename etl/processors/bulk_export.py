@@ -0,0 +1,454 @@
+# etl/processors/bulk_export.py
+
+import csv
+import json
+import os
+import sqlite3
+from collections import OrderedDict
+from datetime import datetime
+
+from config.settings import Config
+from ..utils.logger import setup_logger
+from ..utils.metrics import run_metrics
+from ..utils.report_store import report_store
+from ..core.graph_delta import UNDIRECTED_REL_TYPES, compile_patient
+
+logger = setup_logger('bulk_export')
+
+# ID 空间 -> (节点标签, 属性列)。与 etl_patient.py 中 Cypher 语句写入的属性一一对应
+NODE_SPACES = OrderedDict([
+    ('Patient', (('Patient',), ['patientId', 'name', 'empi', 'birthDate', 'gender', 'idType', 'idValue',
+                                'maritalStatus', 'createdAt', 'portraitHash'])),
+    ('Encounter', (('Encounter',), ['encounterId', 'encounterType', 'typeName', 'visitStartTime',
+                                    'visitEndTime', 'subtreeHash'])),
+    ('Hospital', (('Hospital',), ['hospitalId', 'name'])),
+    ('Department', (('Department',), ['departmentId', 'name'])),
+    ('Provider', (('Provider',), ['providerId', 'name'])),
+    ('Condition', (('Condition',), ['code', 'name'])),
+    ('Examination', (('Examination',), ['reportId', 'timestamp', 'fullReport', 'reportHash', 'reportLength',
+                                        'reportPreview'])),
+    ('LabTestReport', (('LabTestReport',), ['reportId'])),
+    ('LabTestItem', (('LabTestItem',), ['name', 'code'])),
+    ('Allergen', (('Allergen',), ['name'])),
+    ('BloodTransfusion', (('PastMedicalEvent', 'BloodTransfusion'), ['name', 'date', 'volumeMl', 'address',
+                                                                     'transfusionId'])),
+    ('Surgery', (('PastMedicalEvent', 'Surgery'), ['name', 'date', 'bodySite', 'code'])),
+    ('Trauma', (('PastMedicalEvent', 'Trauma'), ['name', 'date', 'severity', 'healed', 'traumaId'])),
+    ('Vaccination', (('PastMedicalEvent', 'Vaccination'), ['uniqueId', 'name', 'date', 'doseNumber',
+                                                           'manufacturer', 'lotNumber', 'vaccineCode'])),
+    ('LifestyleFact', (('LifestyleFact',), ['type', 'value'])),
+])
+
+# 关系类型 -> (起点 ID 空间, 终点 ID 空间, 属性列)
+REL_TYPES = OrderedDict([
+    ('HAD_ENCOUNTER', ('Patient', 'Encounter', [])),
+    ('AT_HOSPITAL', ('Encounter', 'Hospital', [])),
+    ('IN_DEPARTMENT', ('Encounter', 'Department', [])),
+    ('HAS_DEPARTMENT', ('Hospital', 'Department', [])),
+    ('TREATED_BY', ('Encounter', 'Provider', [])),
+    ('RECORDED_DIAGNOSIS', ('Encounter', 'Condition', [])),
+    ('HAD_EXAMINATION', ('Encounter', 'Examination', [])),
+    ('HAS_FINDING', ('Examination', 'Condition', ['bodyPart', 'diagnosisId'])),
+    ('HAD_LAB_TEST', ('Encounter', 'LabTestReport', [])),
+    ('HAS_ITEM', ('LabTestReport', 'LabTestItem', ['testId', 'value', 'textValue', 'unit', 'referenceRange',
+                                                   'interpretation', 'timestamp'])),
+    ('HAS_ALLERGY_TO', ('Patient', 'Allergen', ['allergyId', 'allergenType', 'reaction', 'reactionType',
+                                                'recordedAt'])),
+    ('HAS_FAMILY_HISTORY', ('Patient', 'Condition', ['relationship', 'onsetAge', 'recordedAt'])),
+    ('HAD_BLOOD_TRANSFUSION', ('Patient', 'BloodTransfusion', [])),
+    ('HAD_SURGERY', ('Patient', 'Surgery', [])),
+    ('HAD_TRAUMA', ('Patient', 'Trauma', [])),
+    ('HAD_VACCINATION', ('Patient', 'Vaccination', [])),
+    ('SPOUSE_OF', ('Patient', 'Patient', ['relationshipName'])),
+    ('PARENT_OF', ('Patient', 'Patient', ['relationshipName'])),
+    ('HAS_LIFESTYLE_FACT', ('Patient', 'LifestyleFact', ['recordedAt', 'source'])),
+])
+
+# 待解析的节点引用前缀：家族成员按证件引用 Patient，检查发现/家族史/无编码诊断按名称引用 Condition
+IDENTITY_REF = '@'
+CONDITION_NAME_REF = '#'
+
+STAGING_SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    space TEXT, key TEXT, priority INTEGER, seq INTEGER, set_props TEXT, create_props TEXT
+);
+CREATE TABLE IF NOT EXISTS rels (
+    type TEXT, start_space TEXT, start_key TEXT, end_space TEXT, end_key TEXT, disc TEXT,
+    seq INTEGER, set_props TEXT, create_props TEXT
+);
+CREATE TABLE IF NOT EXISTS main_identity (ref TEXT, patient_id TEXT, seq INTEGER);
+CREATE TABLE IF NOT EXISTS family_identity (ref TEXT, patient_id TEXT, seq INTEGER);
+CREATE TABLE IF NOT EXISTS key_map (space TEXT, ref TEXT, key TEXT);
+CREATE TABLE IF NOT EXISTS cond_names (name TEXT, key TEXT);
+"""
+
+
+def _encode(props):
+    if not props:
+        return None
+    return json.dumps(
+        props, ensure_ascii=False,
+        default=lambda v: {'__datetime__': v.isoformat()} if isinstance(v, datetime) else str(v)
+    )
+
+
+def _decode(text):
+    if not text:
+        return {}
+    return json.loads(
+        text,
+        object_hook=lambda d: datetime.fromisoformat(d['__datetime__']) if '__datetime__' in d else d
+    )
+
+
+def _fold(records):
+    """按 MERGE 语义合并同一节点/关系的多次写入：ON CREATE 属性只取第一次，SET 属性后写覆盖先写"""
+    props = None
+    for set_props, create_props in records:
+        if props is None:
+            props = dict(_decode(create_props))
+        props.update(_decode(set_props))
+    return {k: v for k, v in (props or {}).items() if v is not None}
+
+
+def _value_type(value):
+    if isinstance(value, bool):
+        return 'boolean'
+    if isinstance(value, int):
+        return 'long'
+    if isinstance(value, float):
+        return 'double'
+    if isinstance(value, datetime):
+        return 'localdatetime'
+    return 'string'
+
+
+def _column_type(seen):
+    """根据一列中出现过的值类型确定 neo4j-admin 表头类型"""
+    if not seen or 'string' in seen:
+        return 'string'
+    if seen == {'long', 'double'}:
+        return 'double'
+    if len(seen) == 1:
+        return next(iter(seen))
+    return 'string'
+
+
+def _format_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+class BulkExporter:
+    """
+    全量重建导出器：把健康画像经过与 etl_patient.py 相同的映射规则，输出为 neo4j-admin import 所需的 CSV。
+
+    处理过程不连接 Neo4j：
+      1. add_patient 用 graph_delta 编译器把每个患者映射为节点/关系增量 (add_delta 也可以直接接收编译好的增量)，
+         写入导出目录下的 SQLite 暂存库 (磁盘 B 树，内存占用有界)
+      2. export 解析跨患者的节点引用 (家族成员证件、Condition 名称)，按键排序去重后逐个 ID 空间写出 CSV，
+         每个文件配一个单独的表头文件，列类型按实际出现的值推断
+    """
+
+    def __init__(self, export_dir, flush_rows=50000):
+        self.export_dir = export_dir
+        self.flush_rows = flush_rows
+        os.makedirs(export_dir, exist_ok=True)
+        self.staging_path = os.path.join(export_dir, 'staging.sqlite')
+        if os.path.exists(self.staging_path):
+            os.remove(self.staging_path)
+        self.conn = sqlite3.connect(self.staging_path)
+        self.conn.execute('PRAGMA journal_mode = OFF')
+        self.conn.execute('PRAGMA synchronous = OFF')
+        self.conn.execute('PRAGMA temp_store = FILE')
+        self.conn.execute('PRAGMA cache_size = -65536')
+        self.conn.executescript(STAGING_SCHEMA)
+        self._seq = 0
+        self._buffers = {'nodes': [], 'rels': [], 'main_identity': [], 'family_identity': []}
+        self.patients = 0
+
+    # --- 映射 ---
+
+    def add_patient(self, patient_data):
+        """暂存一个患者的全部节点和关系"""
+        patient_id = patient_data.get('patientId') if patient_data else None
+        if not patient_id:
+            logger.warning("接收到空的患者数据，跳过导出。")
+            return False
+        self.add_delta(compile_patient(patient_data))
+        return True
+
+    def add_delta(self, delta):
+        """暂存一个 (可以是多个患者合并后的) 图谱增量"""
+        # 启用报告库时检查报告正文写入报告库，CSV 中只保留摘要
+        delta = report_store.offload_delta(delta)
+        for upsert in delta.nodes:
+            ref = upsert.ref
+            space, key, priority = ref.label, self._key(ref), 1
+            # 键属性在 MERGE 创建节点时写入，导出时并入属性
+            set_props = dict(upsert.set_props, **dict(zip(ref.key_props, ref.key)))
+            if space == 'Patient' and ref.key_props == ('idType', 'idValue'):
+                # 按证件引用的家族成员在导出时解析，先于同一节点上的其他写入合并
+                priority = 0
+                self._buffers['family_identity'].append(
+                    (key[len(IDENTITY_REF):], upsert.set_props.get('patientId'), self._next_seq())
+                )
+            elif space == 'Patient' and set_props.get('idType') and set_props.get('idValue'):
+                self._buffers['main_identity'].append(
+                    (f"{set_props['idType']}|{set_props['idValue']}", str(ref.key[0]), self._next_seq())
+                )
+            self._node(space, key, set_props, upsert.create_props, priority)
+
+        for upsert in delta.rels:
+            set_props = dict(upsert.set_props, **dict(zip(upsert.key_props, upsert.key)))
+            self._rel(upsert.type, (upsert.start.label, self._key(upsert.start)),
+                      (upsert.end.label, self._key(upsert.end)), set_props, upsert.create_props,
+                      disc=self._key_text(upsert.key) if upsert.key else '')
+
+        self.patients += len(delta.patient_ids)
+        run_metrics.incr('export.patients', len(delta.patient_ids))
+        if sum(len(rows) for rows in self._buffers.values()) >= self.flush_rows:
+            self._flush()
+
+    @staticmethod
+    def _key_text(values):
+        if len(values) == 1:
+            return str(values[0])
+        return json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values], ensure_ascii=False)
+
+    def _key(self, ref):
+        """把增量中的节点引用转换为 ID 空间内的键；家族成员证件和按名称引用的 Condition 为待解析的引用"""
+        if ref.label == 'Patient' and ref.key_props == ('idType', 'idValue'):
+            return f"{IDENTITY_REF}{ref.key[0]}|{ref.key[1]}"
+        if ref.label == 'Condition':
+            if ref.key_props == ('name',):
+                return CONDITION_NAME_REF + ref.key[0]
+            return f"code:{ref.key[0]}"
+        return self._key_text(ref.key)
+
+    def _next_seq(self):
+        self._seq += 1
+        return self._seq
+
+    def _node(self, space, key, set_props=None, create_props=None, priority=1):
+        self._buffers['nodes'].append(
+            (space, str(key), priority, self._next_seq(), _encode(set_props), _encode(create_props))
+        )
+
+    def _rel(self, rel_type, start, end, set_props=None, create_props=None, disc=''):
+        self._buffers['rels'].append((
+            rel_type, start[0], str(start[1]), end[0], str(end[1]), disc,
+            self._next_seq(), _encode(set_props), _encode(create_props),
+        ))
+
+    def _flush(self):
+        statements = {
+            'nodes': 'INSERT INTO nodes VALUES (?, ?, ?, ?, ?, ?)',
+            'rels': 'INSERT INTO rels VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            'main_identity': 'INSERT INTO main_identity VALUES (?, ?, ?)',
+            'family_identity': 'INSERT INTO family_identity VALUES (?, ?, ?)',
+        }
+        with self.conn:
+            for table, rows in self._buffers.items():
+                if rows:
+                    self.conn.executemany(statements[table], rows)
+                    rows.clear()
+
+    # --- 导出 ---
+
+    def export(self, keep_staging=False):
+        """
+        解析引用、去重并写出 CSV。
+
+        Returns:
+            dict: {'nodes': {ID空间: 节点数}, 'relationships': {关系类型: 关系数}}
+        """
+        self._flush()
+        logger.info(f"暂存完成 - {self.patients} 个患者，开始解析引用并排序去重")
+        self._resolve_references()
+
+        summary = {'nodes': OrderedDict(), 'relationships': OrderedDict()}
+        for space in NODE_SPACES:
+            summary['nodes'][space] = self._export_nodes(space)
+        for rel_type in REL_TYPES:
+            summary['relationships'][rel_type] = self._export_rels(rel_type)
+        self._write_import_command(summary)
+
+        self.conn.close()
+        if not keep_staging:
+            os.remove(self.staging_path)
+        logger.info(f"全量导出完成 - 节点: {sum(summary['nodes'].values())}, 关系: {sum(summary['relationships'].values())}")
+        return summary
+
+    def _resolve_references(self):
+        with self.conn:
+            self.conn.executescript("""
+            CREATE INDEX IF NOT EXISTS idx_nodes ON nodes (space, key, priority, seq);
+            CREATE INDEX IF NOT EXISTS idx_main_identity ON main_identity (ref, seq);
+            CREATE INDEX IF NOT EXISTS idx_family_identity ON family_identity (ref, seq);
+            DELETE FROM key_map;
+            DELETE FROM cond_names;
+            """)
+
+            # 家族成员：证件号属于某个已导出患者时就是该患者本人；否则用成员信息上的 patientId；都没有时保留证件节点
+            self.conn.execute("""
+            INSERT INTO key_map (space, ref, key)
+            SELECT 'Patient', ? || f.ref, COALESCE(
+                (SELECT m.patient_id FROM main_identity m WHERE m.ref = f.ref ORDER BY m.seq LIMIT 1),
+                (SELECT g.patient_id FROM family_identity g
+                  WHERE g.ref = f.ref AND g.patient_id IS NOT NULL ORDER BY g.seq DESC LIMIT 1),
+                'identity:' || f.ref)
+            FROM (SELECT DISTINCT ref FROM family_identity) f
+            """, (IDENTITY_REF,))
+
+            # 有编码 Condition 的最终名称 (诊断会 SET c.name，后写覆盖先写)
+            cursor = self.conn.execute("""
+            SELECT key, set_props, create_props FROM nodes
+            WHERE space = 'Condition' AND key LIKE 'code:%'
+            ORDER BY key, priority, seq
+            """)
+            batch = []
+            for key, records in self._grouped(cursor):
+                name = _fold(records).get('name')
+                if name is not None:
+                    batch.append((name, key))
+                if len(batch) >= self.flush_rows:
+                    self.conn.executemany('INSERT INTO cond_names VALUES (?, ?)', batch)
+                    batch = []
+            if batch:
+                self.conn.executemany('INSERT INTO cond_names VALUES (?, ?)', batch)
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_cond_names ON cond_names (name)')
+
+            # 按名称引用的 Condition：存在同名有编码节点时指向这些节点 (与 MERGE/MATCH 命中多个节点一致)，否则按名称建节点
+            self.conn.execute("""
+            INSERT INTO key_map (space, ref, key)
+            SELECT 'Condition', r.ref, c.key
+            FROM (SELECT DISTINCT key AS ref FROM nodes WHERE space = 'Condition' AND key LIKE ? || '%') r
+            JOIN cond_names c ON c.name = substr(r.ref, 2)
+            """, (CONDITION_NAME_REF,))
+            self.conn.execute("""
+            INSERT INTO key_map (space, ref, key)
+            SELECT 'Condition', r.ref, 'name:' || substr(r.ref, 2)
+            FROM (SELECT DISTINCT key AS ref FROM nodes WHERE space = 'Condition' AND key LIKE ? || '%') r
+            WHERE NOT EXISTS (SELECT 1 FROM cond_names c WHERE c.name = substr(r.ref, 2))
+            """, (CONDITION_NAME_REF,))
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_key_map ON key_map (space, ref)')
+
+    @staticmethod
+    def _grouped(cursor):
+        """把按键排序的 (key, set_props, create_props) 游标按键分组"""
+        current, records = None, []
+        for key, set_props, create_props in cursor:
+            if records and key != current:
+                yield current, records
+                records = []
+            current = key
+            records.append((set_props, create_props))
+        if records:
+            yield current, records
+
+    def _export_nodes(self, space):
+        labels, columns = NODE_SPACES[space]
+        # 按名称引用、但已解析到有编码节点的 Condition 不再单独建节点 (MERGE 命中已有节点时 ON CREATE 不生效)
+        cursor = self.conn.execute("""
+        SELECT COALESCE(m.key, n.key) AS resolved, n.set_props, n.create_props
+        FROM nodes n LEFT JOIN key_map m ON m.space = n.space AND m.ref = n.key
+        WHERE n.space = ?
+          AND NOT (n.space = 'Condition' AND substr(n.key, 1, 1) = ? AND m.key NOT LIKE 'name:%')
+        ORDER BY resolved, n.priority, n.seq
+        """, (space, CONDITION_NAME_REF))
+
+        seen_types = {column: set() for column in columns}
+        count = 0
+        data_path = os.path.join(self.export_dir, f'nodes_{space}.csv')
+        with open(data_path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            label_value = ';'.join(labels)
+            for key, records in self._grouped(cursor):
+                props = _fold(records)
+                for column in columns:
+                    if column in props:
+                        seen_types[column].add(_value_type(props[column]))
+                writer.writerow([key] + [_format_value(props.get(column)) for column in columns] + [label_value])
+                count += 1
+
+        header = [f':ID({space})'] + [f'{c}:{_column_type(seen_types[c])}' for c in columns] + [':LABEL']
+        self._write_header(f'nodes_{space}_header.csv', header)
+        return count
+
+    def _export_rels(self, rel_type):
+        start_space, end_space, columns = REL_TYPES[rel_type]
+        undirected = rel_type in UNDIRECTED_REL_TYPES
+        cursor = self.conn.execute("""
+        SELECT s, e, CASE WHEN ? AND s > e THEN e ELSE s END AS ks, CASE WHEN ? AND s > e THEN s ELSE e END AS ke,
+               disc, set_props, create_props
+        FROM (
+            SELECT COALESCE(ms.key, r.start_key) AS s, COALESCE(me.key, r.end_key) AS e,
+                   r.disc, r.seq, r.set_props, r.create_props
+            FROM rels r
+            LEFT JOIN key_map ms ON ms.space = r.start_space AND ms.ref = r.start_key
+            LEFT JOIN key_map me ON me.space = r.end_space AND me.ref = r.end_key
+            WHERE r.type = ?
+        )
+        ORDER BY ks, ke, disc, seq
+        """, (undirected, undirected, rel_type))
+
+        seen_types = {column: set() for column in columns}
+        count = 0
+        data_path = os.path.join(self.export_dir, f'rels_{rel_type}.csv')
+        with open(data_path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            current, first, records = None, None, []
+
+            def write():
+                props = _fold(records)
+                for column in columns:
+                    if column in props:
+                        seen_types[column].add(_value_type(props[column]))
+                # 沿用第一次写入时的方向
+                writer.writerow([first[0], first[1]] + [_format_value(props.get(c)) for c in columns] + [rel_type])
+
+            for s, e, ks, ke, disc, set_props, create_props in cursor:
+                identity = (ks, ke, disc)
+                if records and identity != current:
+                    write()
+                    count += 1
+                    records = []
+                if not records:
+                    current, first = identity, (s, e)
+                records.append((set_props, create_props))
+            if records:
+                write()
+                count += 1
+
+        header = [f':START_ID({start_space})', f':END_ID({end_space})']
+        header += [f'{c}:{_column_type(seen_types[c])}' for c in columns] + [':TYPE']
+        self._write_header(f'rels_{rel_type}_header.csv', header)
+        return count
+
+    def _write_header(self, filename, header):
+        with open(os.path.join(self.export_dir, filename), 'w', encoding='utf-8', newline='') as f:
+            csv.writer(f).writerow(header)
+
+    def _write_import_command(self, summary):
+        """生成 neo4j-admin 导入命令，空文件不参与导入"""
+        args = ['neo4j-admin database import full', '--overwrite-destination']
+        for space, count in summary['nodes'].items():
+            if count:
+                args.append(f'--nodes={self._path(f"nodes_{space}_header.csv")},{self._path(f"nodes_{space}.csv")}')
+        for rel_type, count in summary['relationships'].items():
+            if count:
+                args.append(f'--relationships={self._path(f"rels_{rel_type}_header.csv")},{self._path(f"rels_{rel_type}.csv")}')
+        # HAS_DEPARTMENT 等在在线写入中依赖 OPTIONAL MATCH 的关系，端点缺失时跳过
+        args.append('--skip-bad-relationships=true')
+        args.append(Config.NEO4J_DATABASE)
+        with open(os.path.join(self.export_dir, 'import_command.txt'), 'w', encoding='utf-8') as f:
+            f.write(' \\\n    '.join(args) + '\n')
+
+    def _path(self, filename):
+        return os.path.join(os.path.abspath(self.export_dir), filename)
@@ -0,0 +1,239 @@
+# etl/processors/dry_run.py
+
+import json
+import math
+import os
+import time
+from collections import OrderedDict
+
+from config.settings import Config
+from ..utils.logger import setup_logger
+from ..utils.metrics import run_metrics
+from ..utils.statement_stats import statement_name
+from ..core.etl_patient import import_patient_data_from_json
+from ..core.change_detection import portrait_hash, store_hash
+from ..core.encounter_delta import plan_encounter_delta
+from ..core.graph_delta import compile_patient
+from ..core.delta_writer import apply_delta
+from .health_portrait import TX_CACHES
+
+logger = setup_logger('dry_run')
+
+
+class RecordedResult:
+    """RecordingTransaction.run 的返回值：可迭代的记录列表，支持 consume()/single()/data()"""
+
+    def __init__(self, records=None):
+        self._records = list(records or [])
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def consume(self):
+        return None
+
+    def single(self):
+        return self._records[0] if self._records else None
+
+    def data(self):
+        return list(self._records)
+
+
+class RecordingTransaction:
+    """
+    不连接 Neo4j 的写事务替身：满足 import_patient_data_from_json 等写入函数使用的 tx.run 接口，
+    按调用顺序记录 (语句名, 语句, 参数)。
+
+    responder 为 responder(语句名, 参数) -> 记录列表，用于给需要读取返回值的语句 (如诊断解析)
+    构造结果；未提供或返回 None 时语句返回空结果。
+    """
+
+    def __init__(self, responder=None):
+        self.statements = []
+        self._responder = responder
+
+    def run(self, query, parameters=None, **kwparameters):
+        params = dict(parameters or {}, **kwparameters)
+        name = statement_name(query)
+        self.statements.append((name, query, params))
+        records = self._responder(name, params) if self._responder else None
+        return RecordedResult(records)
+
+    def __len__(self):
+        return len(self.statements)
+
+
+def fake_responder(name, params):
+    """诊断解析 (含按顺序合并写入的诊断) 按 (code, name) 返回一个占位节点 id，使后续的关联语句与真实运行时的行数一致"""
+    if name == 'diagnosis.resolve':
+        return [
+            {'idx': row['idx'], 'conditionIds': [f"dry-run:{row['diseaseCode'] or row['diseaseName']}"]}
+            for row in params['rows']
+        ]
+    if name == 'condition.link':
+        return [
+            {'idx': row['idx'],
+             'conditionIds': [] if 'findingResult' in row else [f"dry-run:{row['diseaseCode'] or row['diseaseName']}"]}
+            for row in params['rows']
+        ]
+    return None
+
+
+def load_payload_files(directory):
+    """
+    读取目录下的样例画像 JSON (如 files/ 中保存的接口响应)，返回 [(来源, patient_data), ...]。
+    文件内容可以是接口响应 ({code, msg, data})、画像本身或它们的列表。
+    """
+    payloads = []
+    for filename in sorted(os.listdir(directory)):
+        if not filename.lower().endswith('.json'):
+            continue
+        path = os.path.join(directory, filename)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                content = json.load(f)
+        except (json.JSONDecodeError, IOError, UnicodeDecodeError) as e:
+            logger.warning(f"无法读取样例画像 {path}: {e}")
+            continue
+        for item in content if isinstance(content, list) else [content]:
+            if isinstance(item, dict) and 'data' in item and 'patientId' not in item:
+                item = item['data']
+            payloads.append((filename, item))
+    return payloads
+
+
+def _rows(params):
+    rows = params.get('rows')
+    return len(rows) if isinstance(rows, list) else 1
+
+
+def _percentile(values, percent):
+    if not values:
+        return 0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(percent / 100.0 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class DryRunProcessor:
+    """
+    演练模式：按当前配置 (ETL_BATCHED_WRITES / GRAPH_DELTA_WRITES / CHANGE_DETECTION / ENCOUNTER_DELTA_SYNC)
+    把画像映射成写入语句并记录下来，不连接 Neo4j。
+
+    每个患者视为一个单独的事务 (不做分组和两阶段加载)，统计每个患者的语句数、参数行数和映射 CPU 耗时，
+    可选把全部语句按 JSON Lines 写入 record_path。
+    """
+
+    def __init__(self, record_path=None):
+        self.record_path = record_path
+        self._record_file = None
+        self._by_statement = OrderedDict()
+        self._patients = []  # [(patientId, 语句数, 参数行数, CPU 毫秒), ...]
+
+    def process(self, patient_data):
+        if not patient_data or not patient_data.get("patientId"):
+            logger.warning("接收到空的患者数据，跳过处理。")
+            return False
+
+        patient_id = patient_data['patientId']
+        tx = RecordingTransaction(fake_responder)
+        for cache in TX_CACHES:
+            cache.begin()
+        started = time.process_time()
+        try:
+            self._write(tx, patient_data)
+        except Exception as e:
+            for cache in TX_CACHES:
+                cache.rollback()
+            run_metrics.incr('patients.failed')
+            logger.error(f"演练失败 - PatientId: {patient_id}, 错误: {str(e)}")
+            return False
+        cpu_ms = (time.process_time() - started) * 1000
+        for cache in TX_CACHES:
+            cache.commit()
+
+        rows = 0
+        for name, query, params in tx.statements:
+            entry = self._by_statement.setdefault(name, [0, 0])
+            entry[0] += 1
+            entry[1] += _rows(params)
+            rows += _rows(params)
+        self._patients.append((patient_id, len(tx), rows, cpu_ms))
+        run_metrics.incr('patients.written')
+        run_metrics.incr('dry_run.statements', len(tx))
+        if self.record_path:
+            self._record(patient_id, tx.statements)
+        logger.debug(f"演练完成 - PatientId: {patient_id}, {len(tx)} 条语句, {rows} 行参数, CPU {cpu_ms:.2f} ms")
+        return True
+
+    def _write(self, tx, patient_data):
+        """与 HealthPortraitProcessor 单患者事务的写入路径一致"""
+        patient_id = patient_data['patientId']
+        if Config.GRAPH_DELTA_WRITES:
+            delta = compile_patient(patient_data)
+            if Config.ENCOUNTER_DELTA_SYNC and patient_data.get('encounters') is not None:
+                delta = delta.only_encounters(plan_encounter_delta(tx, patient_id, patient_data['encounters']).hashes)
+            apply_delta(tx, delta.compact())
+            return
+        import_patient_data_from_json(tx, patient_data)
+        if Config.CHANGE_DETECTION:
+            store_hash(tx, patient_id, portrait_hash(patient_data))
+
+    def _record(self, patient_id, statements):
+        if self._record_file is None:
+            directory = os.path.dirname(self.record_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._record_file = open(self.record_path, 'w', encoding='utf-8')
+        for name, query, params in statements:
+            self._record_file.write(json.dumps(
+                {'patientId': patient_id, 'statement': name, 'query': query, 'parameters': params},
+                ensure_ascii=False, default=str
+            ) + '\n')
+
+    def close(self):
+        if self._record_file is not None:
+            self._record_file.close()
+            self._record_file = None
+
+    def report(self):
+        counts = [count for _, count, _, _ in self._patients]
+        cpu = [cpu_ms for _, _, _, cpu_ms in self._patients]
+        patients = len(self._patients)
+        return OrderedDict([
+            ('patients', patients),
+            ('statements', sum(counts)),
+            ('rows', sum(rows for _, _, rows, _ in self._patients)),
+            ('statements_per_patient', OrderedDict([
+                ('mean', round(sum(counts) / patients, 2) if patients else 0),
+                ('p50', _percentile(counts, 50)),
+                ('p95', _percentile(counts, 95)),
+                ('max', max(counts) if counts else 0),
+            ])),
+            ('cpu_ms', OrderedDict([
+                ('total', round(sum(cpu), 2)),
+                ('mean', round(sum(cpu) / patients, 3) if patients else 0),
+                ('p95', round(_percentile(cpu, 95), 3)),
+            ])),
+            ('by_statement', [
+                OrderedDict([('statement', name), ('calls', calls), ('rows', rows)])
+                for name, (calls, rows) in sorted(self._by_statement.items(), key=lambda item: -item[1][0])
+            ]),
+        ])
+
+    def format_report(self, report=None):
+        report = self.report() if report is None else report
+        per_patient = report['statements_per_patient']
+        cpu = report['cpu_ms']
+        lines = [
+            f"演练统计: {report['patients']} 个患者, {report['statements']} 条语句, {report['rows']} 行参数",
+            f"每患者语句数: mean={per_patient['mean']} p50={per_patient['p50']} "
+            f"p95={per_patient['p95']} max={per_patient['max']}",
+            f"映射 CPU 耗时(ms): total={cpu['total']} mean={cpu['mean']} p95={cpu['p95']}",
+        ]
+        if report['by_statement']:
+            width = max(len('语句'), *(len(row['statement']) for row in report['by_statement']))
+            lines.append(f"{'语句'.ljust(width)}  {'calls':>7}  {'rows':>8}")
+            for row in report['by_statement']:
+                lines.append(f"{row['statement'].ljust(width)}  {row['calls']:>7}  {row['rows']:>8}")
+        return '\n'.join(lines)
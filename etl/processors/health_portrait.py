@@ -1,41 +1,321 @@
 # etl/processors/health_portrait.py
 
+import time
+
+from config.settings import Config
 from ..utils.logger import setup_logger
 from ..utils.db import Neo4jConnection
+from ..utils.metrics import run_metrics
+from ..utils.report_store import report_store
+from ..utils.stream_decode import is_streamed, payload_bytes
+from ..utils.statement_stats import InstrumentedTransaction, statement_stats
 # 这里的星号导入已经包含了我们需要的 import_patient_data_from_json 函数
 from ..core.etl_patient import *
+from ..core.condition_resolver import condition_resolver
+from ..core.dimension_cache import dimension_cache
+from ..core.change_detection import portrait_hash, load_stored_hashes, store_hash
+from ..core.dimension_preload import collect_batch_dimensions, preload_dimensions
+from ..core.encounter_delta import changed_encounters, load_batch_subtree_hashes, plan_encounter_delta
+from ..core.graph_delta import GraphDelta, compile_patient, compile_patients
+from ..core.delta_writer import apply_delta
+from ..core.family_inference import infer_parents_tx
 
 # 注意: 您项目中的日志记录器似乎有多个版本，这里保留您代码中的版本
 # 如果etl.utils.logger中的是health_portrait_logger，则使用 from ..utils.logger import health_portrait_logger as logger
 logger = setup_logger('health_portrait')
 
+# 在事务内暂存、提交后才生效的进程内缓存 (报告库在提交后才写入正文)
+TX_CACHES = [condition_resolver, dimension_cache, report_store]
+
 class HealthPortraitProcessor:
     def __init__(self):
         # 这种方式也可以，但每次process都会创建一个新连接池，如果并发量大建议将db connection设为单例或在外部管理
         self.db = Neo4jConnection()
+        # 本批预先编译好的图谱增量 {patientId: GraphDelta}
+        self._deltas = {}
     
     def process(self, patient_data):
         if not patient_data or not patient_data.get("patientId"):
             logger.warning("接收到空的患者数据，跳过处理。")
             return False  # 明确返回失败状态
             
+        patient_id = patient_data.get('patientId')
         try:
             # Neo4j驱动是线程安全的，可以在这里获取session
             with self.db.get_session() as session:
+                digest = None
+                if Config.CHANGE_DETECTION:
+                    digest = portrait_hash(patient_data)
+                    if load_stored_hashes(session, [patient_id]).get(patient_id) == digest:
+                        run_metrics.incr('patients.skipped_unchanged')
+                        logger.info(f"画像未变化，跳过写入 - PatientId: {patient_id}")
+                        return True
                 # 调用内部事务方法
-                session.execute_write(self._process_tx, patient_data)
-                logger.info(f"处理成功 - PatientId: {patient_data.get('patientId')}")
+                self._execute_write(session, self._process_tx, patient_data, digest)
+                run_metrics.incr('patients.written')
+                logger.info(f"处理成功 - PatientId: {patient_id}")
                 return True # 明确返回成功
         except Exception as e:
             # 记录错误日志
-            logger.error(f"处理失败 - PatientId: {patient_data.get('patientId')}, 错误: {str(e)}")
+            run_metrics.incr('patients.failed')
+            logger.error(f"处理失败 - PatientId: {patient_id}, 错误: {str(e)}")
             # 【关键修改】向上抛出异常，以便JobManager可以捕获并进行重试
             raise e
+
+    def process_group(self, items):
+        """
+        多患者事务分组写入：把多个患者打包进同一个写事务，摊薄提交开销。
+
+        Args:
+            items: [(key, patient_data), ...]，key 一般是 EMPI，用于回报失败记录
+
+        Returns:
+            list: 写入失败的 key 列表。某个分组失败时会二分重试，只有真正出错的患者进入失败列表。
+        """
+        failed, pending = self.prepare_group(items)
+        for group in self.split_groups(pending):
+            failed.extend(self.write_group(group))
+        return failed
+
+    def prepare_group(self, items):
+        """
+        过滤空数据和画像未变化的患者。
+
+        Returns:
+            tuple: (失败的 key 列表, 待写入的 [(key, patient_data, digest), ...])
+        """
+        failed = []
+        valid = []
+        for key, patient_data in items:
+            if not patient_data or not patient_data.get("patientId"):
+                logger.warning(f"接收到空的患者数据，跳过处理 - EMPI: {key}")
+                failed.append(key)
+            else:
+                valid.append((key, patient_data))
+
+        run_metrics.incr('patients.failed', len(failed))
+        if not valid:
+            return failed, []
+
+        # (key, patient_data, digest)
+        pending = [(key, patient_data, None) for key, patient_data in valid]
+        if Config.CHANGE_DETECTION:
+            pending = self._drop_unchanged(valid)
+        return failed, pending
+
+    def preload_dimensions(self, pending):
+        """
+        两阶段加载的第一阶段：单写入者在一个事务中写入整批的共享节点，
+        成功后固定这些节点，后续 write_group 只 MATCH 它们、不再加锁修改。
+
+        就诊增量同步时只汇总子树指纹变化或新增的就诊，未变化的就诊在第二阶段不会写入，其共享节点也不需要预写入。
+
+        Returns:
+            bool: 是否预写入成功。失败时不固定任何节点，第二阶段按原有语句写入。
+        """
+        patients = [(patient_data['patientId'], patient_data) for _, patient_data, _ in pending]
+        try:
+            with self.db.get_session() as session:
+                if Config.ENCOUNTER_DELTA_SYNC:
+                    patients = self._changed_encounters_only(session, patients)
+                dimensions = collect_batch_dimensions(patients)
+                if not len(dimensions):
+                    return True
+                diagnosis_ids = self._execute_write(session, self._preload_tx, dimensions)
+        except Exception as e:
+            logger.error(f"共享节点预写入失败: {str(e)}")
+            return False
+        dimension_cache.pin(dimensions.keys())
+        condition_resolver.pin(diagnosis_ids)
+        logger.info(f"共享节点预写入完成 - {len(pending)} 个患者, {len(dimensions)} 行")
+        return True
+
+    @staticmethod
+    def _changed_encounters_only(session, patients):
+        stored = load_batch_subtree_hashes(
+            session, [patient_id for patient_id, patient_data in patients if patient_data.get('encounters') is not None]
+        )
+        return [
+            (patient_id, patient_data) if patient_data.get('encounters') is None else
+            (patient_id, dict(patient_data, encounters=changed_encounters(patient_data['encounters'],
+                                                                          stored.get(patient_id, {}))))
+            for patient_id, patient_data in patients
+        ]
+
+    def release_preloaded(self):
+        """批次结束后解除固定"""
+        dimension_cache.unpin()
+        condition_resolver.unpin()
+
+    def compile_deltas(self, pending):
+        """
+        GRAPH_DELTA_WRITES 模式下在写入前统一编译整批的图谱增量 (DELTA_COMPILE_PROCESSES 大于 0 时使用子进程)，
+        映射耗时与写入耗时分别记入 delta.compile_ms / delta.apply_ms。
+        """
+        if not Config.GRAPH_DELTA_WRITES or not pending:
+            return
+        # 流式解码的超大画像在写入时按数据段分块写入，不编译增量
+        patients = [patient_data for _, patient_data, _ in pending if not is_streamed(patient_data)]
+        if not patients:
+            return
+        started = time.perf_counter()
+        deltas = compile_patients(patients, Config.DELTA_COMPILE_PROCESSES)
+        run_metrics.incr('delta.compile_ms', int((time.perf_counter() - started) * 1000))
+        for patient_data, delta in zip(patients, deltas):
+            self._deltas[patient_data['patientId']] = delta
+
+    def release_deltas(self):
+        self._deltas.clear()
+
+    def infer_family(self, patient_ids):
+        """
+        批次写入后为本批带有家庭成员的患者推断缺失的亲子关系，每 FAMILY_INFERENCE_BATCH_SIZE 个患者一个事务。
+        推断失败只记录日志，不影响患者的写入结果，遗漏的关系可以通过 --infer-parents 全图回填。
+
+        Returns:
+            int: 新建的 PARENT_OF 关系数
+        """
+        patient_ids = list(patient_ids)
+        size = max(1, Config.FAMILY_INFERENCE_BATCH_SIZE)
+        inferred = 0
+        for start in range(0, len(patient_ids), size):
+            chunk = patient_ids[start:start + size]
+            try:
+                with self.db.get_session() as session:
+                    inferred += self._execute_write(session, infer_parents_tx, chunk)
+            except Exception as e:
+                run_metrics.incr('family.inference_failed', len(chunk))
+                logger.error(f"亲子关系推断失败 - {len(chunk)} 个患者, 错误: {str(e)}")
+        run_metrics.incr('family.inferred', inferred)
+        if inferred:
+            logger.info(f"亲子关系推断 - {len(patient_ids)} 个患者, 新建 {inferred} 条关系")
+        return inferred
+
+    def _drop_unchanged(self, items):
+        """一次查询取回整组的已存哈希，过滤掉画像未变化的患者"""
+        hashed = [(key, patient_data, portrait_hash(patient_data)) for key, patient_data in items]
+        with self.db.get_session() as session:
+            stored = load_stored_hashes(session, [patient_data['patientId'] for _, patient_data, _ in hashed])
+        changed = [item for item in hashed if stored.get(item[1]['patientId']) != item[2]]
+        skipped = len(hashed) - len(changed)
+        if skipped:
+            run_metrics.incr('patients.skipped_unchanged', skipped)
+            logger.info(f"画像未变化，跳过写入 {skipped} 个患者")
+        return changed
+
+    def split_groups(self, items):
+        """按 TX_GROUP_SIZE 条数和 TX_GROUP_MAX_BYTES 字节预算切分分组。"""
+        max_size = max(1, Config.TX_GROUP_SIZE)
+        max_bytes = Config.TX_GROUP_MAX_BYTES
+        group, group_bytes = [], 0
+        for item in items:
+            item_bytes = 0
+            if max_bytes:
+                item_bytes = payload_bytes(item[1])
+                if group and group_bytes + item_bytes > max_bytes:
+                    yield group
+                    group, group_bytes = [], 0
+            group.append(item)
+            group_bytes += item_bytes
+            if len(group) >= max_size:
+                yield group
+                group, group_bytes = [], 0
+        if group:
+            yield group
+
+    def write_group(self, group):
+        """写入一个分组；失败时二分，直到定位到单个出错的患者。"""
+        try:
+            with self.db.get_session() as session:
+                self._execute_write(session, self._process_group_tx, [(patient_data, digest) for _, patient_data, digest in group])
+            run_metrics.incr('patients.written', len(group))
+            logger.info(f"分组处理成功 - {len(group)} 个患者")
+            return []
+        except Exception as e:
+            if len(group) == 1:
+                key, patient_data, _ = group[0]
+                run_metrics.incr('patients.failed')
+                logger.error(f"处理失败 - PatientId: {patient_data.get('patientId')}, 错误: {str(e)}")
+                return [key]
+            logger.warning(f"分组写入失败，二分重试 - {len(group)} 个患者, 错误: {str(e)}")
+            middle = len(group) // 2
+            return self.write_group(group[:middle]) + self.write_group(group[middle:])
     
-    def _process_tx(self, tx, patient_data):
+    def _execute_write(self, session, work, *args):
+        """执行写事务，并在提交成功/失败后同步提交/丢弃事务内缓存的暂存条目"""
+        if statement_stats.enabled:
+            # 按语句名统计每条语句的耗时与 ResultSummary 计数
+            work = self._instrumented(work)
+        try:
+            result = session.execute_write(work, *args)
+        except Exception:
+            for cache in TX_CACHES:
+                cache.rollback()
+            raise
+        for cache in TX_CACHES:
+            cache.commit()
+        return result
+
+    @staticmethod
+    def _instrumented(work):
+        def instrumented_work(tx, *args):
+            return work(InstrumentedTransaction(tx), *args)
+        return instrumented_work
+
+    def _process_tx(self, tx, patient_data, digest=None):
         """
         这个方法在数据库事务中执行
         """
+        for cache in TX_CACHES:
+            cache.begin()
+        if Config.GRAPH_DELTA_WRITES and not is_streamed(patient_data):
+            self._write_deltas(tx, [patient_data])
+            return
         # 这里的调用是正确的
         import_patient_data_from_json(tx, patient_data)
-        # 这里不需要返回任何东西，如果发生错误，Neo4j驱动会自动抛出异常
\ No newline at end of file
+        if digest:
+            store_hash(tx, patient_data['patientId'], digest)
+        # 这里不需要返回任何东西，如果发生错误，Neo4j驱动会自动抛出异常
+
+    def _process_group_tx(self, tx, items):
+        """在同一个事务中依次写入多个患者，items 为 [(patient_data, digest), ...]"""
+        for cache in TX_CACHES:
+            cache.begin()
+        if Config.GRAPH_DELTA_WRITES:
+            patients = [patient_data for patient_data, _ in items if not is_streamed(patient_data)]
+            if patients:
+                self._write_deltas(tx, patients)
+            # 流式解码的超大画像不编译整份增量，按数据段分块写入
+            items = [(patient_data, digest) for patient_data, digest in items if is_streamed(patient_data)]
+        for patient_data, digest in items:
+            import_patient_data_from_json(tx, patient_data)
+            if digest:
+                store_hash(tx, patient_data['patientId'], digest)
+
+    def _write_deltas(self, tx, patients):
+        """
+        把一组患者的图谱增量合并后一次写入。增量中已包含 portraitHash/subtreeHash，
+        就诊增量同步时先删除已消失的就诊、清理变化就诊的旧子树，增量中只保留变化或新增的就诊子树。
+        """
+        deltas = []
+        for patient_data in patients:
+            patient_id = patient_data['patientId']
+            plan = None
+            if Config.ENCOUNTER_DELTA_SYNC and patient_data.get('encounters') is not None:
+                plan = plan_encounter_delta(tx, patient_id, patient_data['encounters'])
+            delta = self._deltas.get(patient_id)
+            if delta is None:
+                started = time.perf_counter()
+                delta = compile_patient(patient_data)
+                run_metrics.incr('delta.compile_ms', int((time.perf_counter() - started) * 1000))
+            if plan is not None:
+                delta = delta.only_encounters(plan.hashes)
+            deltas.append(delta)
+        started = time.perf_counter()
+        apply_delta(tx, GraphDelta.merged(deltas).compact())
+        run_metrics.incr('delta.apply_ms', int((time.perf_counter() - started) * 1000))
+
+    def _preload_tx(self, tx, dimensions):
+        for cache in TX_CACHES:
+            cache.begin()
+        return preload_dimensions(tx, dimensions)
@@ -1,5 +1,6 @@
 from .logger import setup_logger
 from .db import Neo4jConnection
 from .api import HealthPortraitAPI
+from .schema import SchemaManager
 
-__all__ = ['setup_logger', 'Neo4jConnection', 'HealthPortraitAPI']
\ No newline at end of file
+__all__ = ['setup_logger', 'Neo4jConnection', 'HealthPortraitAPI', 'SchemaManager']
\ No newline at end of file
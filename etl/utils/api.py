@@ -1,27 +1,133 @@
+import time
+
+import msgspec
 import requests
 from config.settings import Config
+from .concurrency import api_concurrency
+from .hedging import api_hedger
 from .logger import setup_logger
+from .metrics import run_metrics
+from .resilience import CircuitOpenError, Deadline, DeadlineExceeded, api_breaker, api_rate_limiter
+from .stream_decode import STREAM_CHUNK_BYTES, PayloadBuffer
 
 logger = setup_logger('api')
 
+PORTRAIT_PATH = "/api/data-center-api/datafactory/getHealthPortrait"
+
+
+class MalformedResponse(ValueError):
+    """响应体不是 {code, msg, data} 结构"""
+
+
+def check_portrait_response(data):
+    """
+    检查响应体结构：必须是带 code 的对象，code 为 0 时还要带 data。
+    在记录熔断器成功之前调用，格式错误的响应与请求异常一样计为一次失败。
+    """
+    if not isinstance(data, dict) or 'code' not in data:
+        raise MalformedResponse(f"响应格式错误: 缺少 code ({type(data).__name__})")
+    if data['code'] == 0 and 'data' not in data:
+        raise MalformedResponse("响应格式错误: code 为 0 但缺少 data")
+    return data
+
+
+def parse_portrait_response(patientId, data):
+    """解析 getHealthPortrait 的响应 ({code, msg, data})，code 不为 0 时记录错误并返回 None"""
+    if data["code"] == 0:
+        return data["data"]
+    logger.error(f"API错误 - patientId: {patientId}, 消息: {data.get('msg')}")
+    return None
+
+
+def read_portrait_response(response, deadline=None):
+    """
+    按块读取响应体：超过 STREAM_DECODE_MIN_BYTES 的画像转存临时文件流式解码，
+    就诊记录替换为 EncounterStream，不在内存中保留整份画像。
+
+    读超时只限制两个数据块之间的间隔，持续慢速返回的大画像按 deadline 在块之间检查总时限，超过时抛出 DeadlineExceeded
+    """
+    buffer = PayloadBuffer()
+    try:
+        for chunk in response.iter_content(chunk_size=STREAM_CHUNK_BYTES):
+            if deadline is not None and deadline.remaining() <= 0:
+                raise DeadlineExceeded("读取响应体超过单患者拉取时限")
+            buffer.write(chunk)
+    except Exception:
+        buffer.discard()
+        raise
+    finally:
+        response.close()
+    return buffer.finish()
+
+
 class HealthPortraitAPI:
     def __init__(self):
         self.session = requests.Session()
         self.base_url = Config.BIGDATA_API_BASE_URL
-    
+
     def get_health_portrait(self, patientId):
-        url = f"{self.base_url}/api/data-center-api/datafactory/getHealthPortrait"
+        """
+        拉取一个患者的健康画像，失败时返回 None。
+
+        熔断中时快速失败；限流等待、并发排队和请求本身都受 PATIENT_FETCH_DEADLINE 总时限约束。
+        HEDGED_REQUESTS 开启时，超过运行中 p95 耗时仍未返回的请求在预算内对冲一次。
+        """
+        deadline = Deadline(Config.PATIENT_FETCH_DEADLINE)
+        try:
+            api_breaker.check()
+            if api_hedger.enabled:
+                return api_hedger.call(
+                    lambda: self._attempt(patientId, deadline),
+                    lambda: self._attempt(patientId, deadline, hedge=True)
+                )
+            return self._attempt(patientId, deadline)
+        except CircuitOpenError as e:
+            logger.warning(f"跳过请求 - patientId: {patientId}, {str(e)}")
+        except DeadlineExceeded as e:
+            run_metrics.incr('api.deadline_exceeded')
+            logger.error(f"API请求超时 - patientId: {patientId}, {str(e)}")
+        return None
+
+    def _attempt(self, patientId, deadline, hedge=False):
+        """一次请求：限流令牌、并发名额和请求本身。对冲请求不等待令牌和名额，没有余量时直接放弃"""
+        wait = api_rate_limiter.reserve(0 if hedge else deadline.remaining())
+        if wait is None:
+            if hedge:
+                return None
+            raise DeadlineExceeded("等待限流令牌超过单患者拉取时限")
+        time.sleep(wait)
+        with api_concurrency.slot(0 if hedge else deadline.remaining()):
+            return self._request(patientId, deadline)
+
+    def _request(self, patientId, deadline):
+        timeout = (deadline.cap(Config.BIGDATA_API_CONNECT_TIMEOUT), deadline.cap(Config.BIGDATA_API_READ_TIMEOUT))
+        api_breaker.before_call()
+        started = time.perf_counter()
+        ok = False
         try:
             response = self.session.get(
-                url, 
+                f"{self.base_url}{PORTRAIT_PATH}",
                 params={"patientId": patientId},
-                timeout=Config.BIGDATA_API_TIMEOUT
+                timeout=timeout,
+                stream=Config.STREAM_DECODE
             )
             response.raise_for_status()
-            data = response.json()
-            if data["code"] == 0:
-                return data["data"]
-            logger.error(f"API错误 - patientId: {patientId}, 消息: {data['msg']}")
+            if Config.STREAM_DECODE:
+                data = read_portrait_response(response, deadline)
+            else:
+                data = msgspec.json.decode(response.content)
+            check_portrait_response(data)
+            api_breaker.record_success()
+            ok = data["code"] == 0
+            return parse_portrait_response(patientId, data)
+        except DeadlineExceeded:
+            # 与请求前的时限检查一样记入 api.deadline_exceeded (由 get_health_portrait 统计)，同时计为一次失败
+            api_breaker.record_failure()
+            raise
         except Exception as e:
+            api_breaker.record_failure()
             logger.error(f"API请求失败 - patientId: {patientId}, 错误: {str(e)}")
-        return None
\ No newline at end of file
+        finally:
+            # 耗时和成败 (含非 0 code) 用于自适应调整并发上限
+            api_concurrency.record((time.perf_counter() - started) * 1000, ok)
+        return None
@@ -0,0 +1,123 @@
+import math
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+from config.settings import Config
+from .logger import setup_logger
+from .metrics import run_metrics
+from .resilience import DeadlineExceeded
+
+logger = setup_logger('concurrency')
+
+
+class LatencyWindow:
+    """最近 size 次请求的耗时与成败，用于计算 p95 耗时和错误率"""
+
+    def __init__(self, size):
+        self._samples = deque(maxlen=max(1, size))
+
+    def add(self, latency_ms, ok):
+        self._samples.append((latency_ms, ok))
+
+    def __len__(self):
+        return len(self._samples)
+
+    def p95(self):
+        if not self._samples:
+            return 0
+        ordered = sorted(latency_ms for latency_ms, _ in self._samples)
+        return ordered[max(0, math.ceil(0.95 * len(ordered)) - 1)]
+
+    def error_rate(self):
+        if not self._samples:
+            return 0.0
+        return sum(1 for _, ok in self._samples if not ok) / len(self._samples)
+
+    def clear(self):
+        self._samples.clear()
+
+
+class AIMDController:
+    """
+    大数据平台接口的自适应并发上限 (加性增、乘性减)：
+
+      - 每积累 FETCH_LATENCY_WINDOW 次请求评估一次，p95 耗时和错误率都在目标内时上限加 1
+      - p95 超过 FETCH_TARGET_P95_MS 或错误率 (请求异常、接口返回非 0 code) 超过 FETCH_MAX_ERROR_RATE 时
+        上限乘以 FETCH_DECREASE_FACTOR，窗口内错误数已超标时不等窗口攒满立即下调
+
+    上限在 [FETCH_MIN_CONCURRENCY, FETCH_CONCURRENCY] 之间，当前值记入运行统计 fetch.concurrency_limit。
+    同步调用方用 slot() 占用名额；异步调用方自行按 limit 排队，只需 record 请求结果。
+    """
+
+    def __init__(self, min_limit=None, max_limit=None, initial=None, target_p95_ms=None,
+                 max_error_rate=None, window_size=None, decrease_factor=None):
+        self.min_limit = max(1, min_limit or Config.FETCH_MIN_CONCURRENCY)
+        self.max_limit = max(self.min_limit, max_limit or Config.FETCH_CONCURRENCY)
+        self.target_p95_ms = Config.FETCH_TARGET_P95_MS if target_p95_ms is None else target_p95_ms
+        self.max_error_rate = Config.FETCH_MAX_ERROR_RATE if max_error_rate is None else max_error_rate
+        self.decrease_factor = Config.FETCH_DECREASE_FACTOR if decrease_factor is None else decrease_factor
+        self.window_size = max(1, window_size or Config.FETCH_LATENCY_WINDOW)
+        self._window = LatencyWindow(self.window_size)
+        self._limit = self._clamp(initial or Config.FETCH_INITIAL_CONCURRENCY)
+        self._in_flight = 0
+        self._condition = threading.Condition()
+
+    @property
+    def enabled(self):
+        return Config.ADAPTIVE_CONCURRENCY
+
+    @property
+    def limit(self):
+        return self._limit if self.enabled else self.max_limit
+
+    def _clamp(self, value):
+        return max(self.min_limit, min(self.max_limit, int(value)))
+
+    def record(self, latency_ms, ok):
+        """记录一次请求的耗时和成败，必要时调整并发上限"""
+        if not self.enabled:
+            return
+        with self._condition:
+            self._window.add(latency_ms, ok)
+            errors = self._window.error_rate() * len(self._window)
+            if errors > self.max_error_rate * self.window_size:
+                self._decrease(f"错误率 {self._window.error_rate():.0%}")
+            elif len(self._window) >= self.window_size:
+                p95 = self._window.p95()
+                if p95 > self.target_p95_ms:
+                    self._decrease(f"p95 {p95:.0f} ms")
+                else:
+                    self._set_limit(self._limit + 1)
+                    self._window.clear()
+            run_metrics.set_gauge('fetch.concurrency_limit', self._limit)
+            self._condition.notify_all()
+
+    def _decrease(self, reason):
+        previous = self._limit
+        self._set_limit(math.floor(self._limit * self.decrease_factor))
+        self._window.clear()
+        if self._limit != previous:
+            run_metrics.incr('fetch.concurrency_decreases')
+            logger.warning(f"大数据平台接口并发上限下调 {previous} -> {self._limit} ({reason})")
+
+    def _set_limit(self, value):
+        self._limit = self._clamp(value)
+
+    @contextmanager
+    def slot(self, timeout=None):
+        """同步调用方占用一个并发名额，进行中的请求数达到当前上限时等待，超过 timeout 秒抛出 DeadlineExceeded"""
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._in_flight < self.limit, timeout):
+                raise DeadlineExceeded("等待并发名额超时")
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._in_flight -= 1
+                self._condition.notify_all()
+
+
+# 进程内共享的大数据平台接口并发控制
+api_concurrency = AIMDController()
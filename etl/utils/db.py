@@ -1,4 +1,4 @@
-from neo4j import GraphDatabase
+from neo4j import AsyncGraphDatabase, GraphDatabase
 from config.settings import Config
 import threading
 
@@ -26,4 +26,28 @@ class Neo4jConnection:
     def get_session(self):
         if not hasattr(self, 'driver') or not self.driver:
             raise RuntimeError("Neo4j driver 已被关闭或未初始化")
-        return self.driver.session(database=Config.NEO4J_DATABASE)
\ No newline at end of file
+        return self.driver.session(database=Config.NEO4J_DATABASE)
+
+
+class AsyncNeo4jConnection:
+    """
+    asyncio 写入使用的驱动 (AsyncGraphDatabase)。异步驱动绑定创建它的事件循环，
+    需要在同一个事件循环内使用和关闭，因此不做成进程级单例。
+    """
+
+    def __init__(self):
+        self.driver = AsyncGraphDatabase.driver(
+            Config.NEO4J_URI,
+            auth=(Config.NEO4J_USER, Config.NEO4J_PASSWORD),
+            max_connection_pool_size=max(Config.ASYNC_MAX_IN_FLIGHT, 1) + 2
+        )
+
+    async def close(self):
+        if self.driver:
+            await self.driver.close()
+            self.driver = None
+
+    def get_session(self):
+        if not self.driver:
+            raise RuntimeError("Neo4j async driver 已被关闭或未初始化")
+        return self.driver.session(database=Config.NEO4J_DATABASE)
@@ -0,0 +1,189 @@
+import asyncio
+import threading
+import time
+import weakref
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+
+from config.settings import Config
+from .concurrency import LatencyWindow
+from .logger import setup_logger
+from .metrics import run_metrics
+
+logger = setup_logger('hedging')
+
+
+class Hedger:
+    """
+    对冲请求：请求在运行中的 p95 耗时内还没有返回时，再发一个相同的请求，取先成功返回的结果。
+
+    - p95 取最近 HEDGE_LATENCY_WINDOW 次成功请求的耗时，样本少于 HEDGE_MIN_SAMPLES 时不对冲，
+      等待时间不低于 HEDGE_MIN_DELAY_MS
+    - 对冲请求数不超过总请求数的 HEDGE_BUDGET，平台整体变慢时不会把请求量翻倍
+    - 运行统计：hedge.calls (请求数)、hedge.sent (对冲数)、hedge.won (对冲请求先返回的次数)、hedge.rate (对冲比例)
+
+    同步调用方用 call，请求在线程池中执行，输掉的请求无法取消，在后台执行完后丢弃；
+    异步调用方用 acall，输掉的请求直接取消，请求内可以用 cancelled_by_hedger 区分这种取消和超过时限的取消。
+    """
+
+    def __init__(self, budget=None, window_size=None, min_samples=None, min_delay_ms=None):
+        self.budget = Config.HEDGE_BUDGET if budget is None else budget
+        self.min_samples = Config.HEDGE_MIN_SAMPLES if min_samples is None else min_samples
+        self.min_delay_ms = Config.HEDGE_MIN_DELAY_MS if min_delay_ms is None else min_delay_ms
+        self._window = LatencyWindow(window_size or Config.HEDGE_LATENCY_WINDOW)
+        self._calls = 0
+        self._hedges = 0
+        self._lock = threading.Lock()
+        self._executor = None
+        # acall 在另一个请求先返回后主动取消的任务
+        self._abandoned = weakref.WeakSet()
+
+    @property
+    def enabled(self):
+        return Config.HEDGED_REQUESTS
+
+    def delay(self):
+        """对冲前等待的秒数；样本不足时返回 None (不对冲)"""
+        with self._lock:
+            if len(self._window) < max(1, self.min_samples):
+                return None
+            return max(self._window.p95(), self.min_delay_ms) / 1000.0
+
+    def _start_call(self):
+        with self._lock:
+            self._calls += 1
+        run_metrics.incr('hedge.calls')
+
+    def _take_budget(self):
+        with self._lock:
+            if self._hedges + 1 > self.budget * self._calls:
+                return False
+            self._hedges += 1
+        run_metrics.incr('hedge.sent')
+        run_metrics.set_gauge('hedge.rate', round(run_metrics.get('hedge.sent') / max(1, run_metrics.get('hedge.calls')), 4))
+        return True
+
+    def _record(self, started, result):
+        if result is not None:
+            with self._lock:
+                self._window.add((time.perf_counter() - started) * 1000, True)
+
+    def _timed(self, request):
+        started = time.perf_counter()
+        result = request()
+        self._record(started, result)
+        return result
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # 调用线程只等待结果，请求本身 (含输掉后仍在执行的请求) 都在这里执行
+                self._executor = ThreadPoolExecutor(
+                    max_workers=Config.MAX_WORKERS + Config.FETCH_CONCURRENCY,
+                    thread_name_prefix='hedge'
+                )
+            return self._executor
+
+    def call(self, primary, hedge):
+        """
+        同步执行 primary()，超过 p95 仍未返回时在预算内执行 hedge()。
+
+        Returns:
+            先返回的非 None 结果；都返回 None 时为 None。两个请求都抛出异常时抛出 primary 的异常
+        """
+        self._start_call()
+        delay = self.delay()
+        if delay is None:
+            return self._timed(primary)
+
+        executor = self._get_executor()
+        first = executor.submit(self._timed, primary)
+        try:
+            return first.result(timeout=delay)
+        except FutureTimeout:
+            pass
+        if not self._take_budget():
+            return first.result()
+
+        second = executor.submit(self._timed, hedge)
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    if future is first:
+                        error = e
+                    continue
+                if result is not None:
+                    if future is second:
+                        run_metrics.incr('hedge.won')
+                    return result
+        if error is not None:
+            raise error
+        return None
+
+    async def acall(self, primary, hedge):
+        """call 的 asyncio 版本，primary/hedge 为返回协程的函数；先成功返回后取消另一个请求"""
+        self._start_call()
+        delay = self.delay()
+        first = asyncio.ensure_future(self._atimed(primary))
+        tasks = [first]
+        abandon = True
+        try:
+            if delay is None:
+                return await first
+            done, _ = await asyncio.wait({first}, timeout=delay)
+            if done or not self._take_budget():
+                return await first
+
+            second = asyncio.ensure_future(self._atimed(hedge))
+            tasks.append(second)
+            pending = {first, second}
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        if task is first:
+                            error = task.exception()
+                        continue
+                    if task.result() is not None:
+                        if task is second:
+                            run_metrics.incr('hedge.won')
+                        return task.result()
+            if error is not None:
+                raise error
+            return None
+        except asyncio.CancelledError:
+            # 调用方超过时限取消：仍在进行的请求按超时取消
+            abandon = False
+            raise
+        finally:
+            # 调用方超时被取消或已有结果时，取消仍在进行的请求
+            for task in tasks:
+                if not task.done():
+                    if abandon:
+                        self._abandoned.add(task)
+                    task.cancel()
+
+    def cancelled_by_hedger(self, task=None):
+        """task (默认当前任务) 是否是 acall 因另一个请求先返回而取消的：这种取消不是失败，不应计入熔断和并发控制"""
+        return (task or asyncio.current_task()) in self._abandoned
+
+    async def _atimed(self, request):
+        started = time.perf_counter()
+        result = await request()
+        self._record(started, result)
+        return result
+
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+# 进程内共享的大数据平台接口对冲请求 (同步拉取和异步预取共用耗时统计与预算)
+api_hedger = Hedger()
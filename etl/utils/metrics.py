@@ -0,0 +1,67 @@
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+
+class RunMetrics:
+    """单次ETL运行的计数器与指标，线程安全，运行结束时输出汇总"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = Counter()
+        self._gauges = {}
+        self._local = threading.local()
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+
+    def incr(self, name, value=1):
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is not None:
+            buffer[name] += value
+            return
+        with self._lock:
+            self._counters[name] += value
+
+    @contextmanager
+    def buffered(self):
+        """当前线程内的计数先记入返回的 Counter、不计入运行统计，由调用方决定是否 merge"""
+        buffer = Counter()
+        self._local.buffer = buffer
+        try:
+            yield buffer
+        finally:
+            self._local.buffer = None
+
+    def merge(self, counters):
+        with self._lock:
+            self._counters.update(counters)
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def get(self, name, default=0):
+        with self._lock:
+            if name in self._gauges:
+                return self._gauges[name]
+            return self._counters.get(name, default)
+
+    def snapshot(self):
+        with self._lock:
+            data = dict(self._counters)
+            data.update(self._gauges)
+            return data
+
+    def summary(self):
+        snapshot = self.snapshot()
+        if not snapshot:
+            return "运行统计: 无"
+        items = ', '.join(f"{name}={snapshot[name]}" for name in sorted(snapshot))
+        return f"运行统计: {items}"
+
+
+# 进程内共享的运行指标
+run_metrics = RunMetrics()
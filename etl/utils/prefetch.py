@@ -0,0 +1,318 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import httpx
+import msgspec
+
+from config.settings import Config
+from .api import PORTRAIT_PATH, check_portrait_response, parse_portrait_response
+from .concurrency import api_concurrency
+from .hedging import api_hedger
+from .logger import setup_logger
+from .metrics import run_metrics
+from .resilience import CircuitOpenError, Deadline, DeadlineExceeded, api_breaker, api_rate_limiter
+from .stream_decode import STREAM_CHUNK_BYTES, PayloadBuffer
+
+logger = setup_logger('prefetch')
+
+
+class AsyncHealthPortraitAPI:
+    """
+    HealthPortraitAPI 的 asyncio 版本 (httpx.AsyncClient)：连接池大小与并发上限一致，
+    连接保持 keep-alive 在多次请求间复用。响应解析与同步版本相同。
+
+    同时进行中的请求数不超过 api_concurrency 的当前上限 (也不超过 concurrency)，
+    每个请求的耗时和成败都反馈给 api_concurrency。
+    """
+
+    def __init__(self, base_url=None, concurrency=None, controller=api_concurrency):
+        self.base_url = base_url or Config.BIGDATA_API_BASE_URL
+        self.concurrency = max(1, concurrency or Config.FETCH_CONCURRENCY)
+        self.controller = controller
+        self._client = None
+        self._gate = None
+        self._in_flight = 0
+
+    def _get_client(self):
+        # httpx.AsyncClient 绑定创建它的事件循环，首次请求时在事件循环内创建
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(Config.BIGDATA_API_READ_TIMEOUT, connect=Config.BIGDATA_API_CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=self.concurrency,
+                    max_keepalive_connections=self.concurrency
+                )
+            )
+        return self._client
+
+    async def get_health_portrait(self, patientId):
+        """
+        与 HealthPortraitAPI.get_health_portrait 相同，限流、排队、熔断等待和请求共用单患者总时限。
+        熔断期间协程等待熔断器允许探测而不是快速失败：等待不占用线程，已排队的预取不会全部变成失败。
+        """
+        deadline = Deadline(Config.PATIENT_FETCH_DEADLINE)
+        try:
+            if api_hedger.enabled:
+                attempt = api_hedger.acall(
+                    lambda: self._attempt(patientId, deadline),
+                    lambda: self._attempt(patientId, deadline, hedge=True)
+                )
+            else:
+                attempt = self._attempt(patientId, deadline)
+            return await asyncio.wait_for(attempt, deadline.remaining())
+        except (DeadlineExceeded, asyncio.TimeoutError) as e:
+            run_metrics.incr('api.deadline_exceeded')
+            logger.error(f"API请求超时 - patientId: {patientId}, {str(e) or '已超过单患者拉取时限'}")
+        return None
+
+    async def _attempt(self, patientId, deadline, hedge=False):
+        """一次请求：限流令牌、并发名额和请求本身。对冲请求不等待令牌和名额，没有余量时直接放弃"""
+        wait = api_rate_limiter.reserve(0 if hedge else deadline.remaining())
+        if wait is None:
+            if hedge:
+                return None
+            raise DeadlineExceeded("等待限流令牌超过单患者拉取时限")
+        await asyncio.sleep(wait)
+        if self._gate is None:
+            self._gate = asyncio.Condition()
+        async with self._gate:
+            if hedge and not self._has_capacity():
+                return None
+            await self._gate.wait_for(self._has_capacity)
+            self._in_flight += 1
+        try:
+            return await self._request(patientId, deadline)
+        finally:
+            async with self._gate:
+                self._in_flight -= 1
+                # 上限可能已上调，唤醒所有等待者重新检查
+                self._gate.notify_all()
+
+    @staticmethod
+    async def _wait_for_breaker():
+        while True:
+            wait = api_breaker.retry_after()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            try:
+                api_breaker.before_call()
+                return
+            except CircuitOpenError:
+                # 半开状态下探测名额已被其他请求占用，继续等待探测结果
+                continue
+
+    def _has_capacity(self):
+        return self._in_flight < min(self.controller.limit, self.concurrency)
+
+    async def _request(self, patientId, deadline):
+        timeout = httpx.Timeout(
+            deadline.cap(Config.BIGDATA_API_READ_TIMEOUT),
+            connect=deadline.cap(Config.BIGDATA_API_CONNECT_TIMEOUT)
+        )
+        await self._wait_for_breaker()
+        started = time.perf_counter()
+        ok = False
+        abandoned = False
+        try:
+            if Config.STREAM_DECODE:
+                data = await self._stream_response(patientId, timeout)
+            else:
+                response = await self._get_client().get(PORTRAIT_PATH, params={"patientId": patientId}, timeout=timeout)
+                response.raise_for_status()
+                data = msgspec.json.decode(response.content)
+            check_portrait_response(data)
+            api_breaker.record_success()
+            ok = data["code"] == 0
+            return parse_portrait_response(patientId, data)
+        except asyncio.CancelledError:
+            if api_hedger.cancelled_by_hedger():
+                # 对冲的另一个请求已先返回，输掉的请求被取消：既不是失败，耗时也不反馈给并发控制
+                abandoned = True
+                raise
+            # 超过单患者总时限被取消，同样计为一次失败
+            api_breaker.record_failure()
+            raise
+        except Exception as e:
+            api_breaker.record_failure()
+            logger.error(f"API请求失败 - patientId: {patientId}, 错误: {str(e)}")
+        finally:
+            if not abandoned:
+                self.controller.record((time.perf_counter() - started) * 1000, ok)
+        return None
+
+    async def _stream_response(self, patientId, timeout):
+        """按块读取响应体 (见 read_portrait_response)；转存临时文件的大画像在线程中解码，不阻塞事件循环"""
+        buffer = PayloadBuffer()
+        try:
+            async with self._get_client().stream(
+                'GET', PORTRAIT_PATH, params={"patientId": patientId}, timeout=timeout
+            ) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes(STREAM_CHUNK_BYTES):
+                    buffer.write(chunk)
+        except BaseException:
+            buffer.discard()
+            raise
+        if buffer.spilled:
+            return await asyncio.get_running_loop().run_in_executor(None, buffer.finish)
+        return buffer.finish()
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class PortraitPrefetcher:
+    """
+    画像预取：后台线程中的事件循环按 EMPI 顺序并发拉取画像 (并发数由 api_concurrency 自适应调整，
+    最多 FETCH_CONCURRENCY 个请求)，
+    写入线程用 take 取走结果，拉取与写入不再串行相加。
+
+    已拉取但尚未被取走的画像最多 FETCH_PREFETCH_DEPTH 个，超出时暂停拉取，避免整批画像堆积在内存中。
+    写入按 EMPI 列表的顺序消费，所以占用名额的总是最早的画像，不会互相等待。
+    """
+
+    def __init__(self, api_factory=AsyncHealthPortraitAPI, concurrency=None, depth=None):
+        self.concurrency = max(1, concurrency or Config.FETCH_CONCURRENCY)
+        self.depth = max(1, depth or Config.FETCH_PREFETCH_DEPTH)
+        self._api_factory = api_factory
+        self._api = None
+        self._loop = None
+        self._thread = None
+        self._slots = None
+        self._tasks = set()
+        self._futures = {}  # {empi: Future}，take 时取出
+        self._lock = threading.Lock()
+
+    def _start(self):
+        if self._loop is not None:
+            return
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='portrait-prefetch', daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._setup(), self._loop).result()
+
+    async def _setup(self):
+        self._api = self._api_factory(concurrency=self.concurrency)
+        self._slots = asyncio.Semaphore(self.depth)
+
+    def prefetch(self, empi_list):
+        """按顺序预取一组 EMPI 的画像；已在预取中的 EMPI 不重复提交"""
+        entries = []
+        with self._lock:
+            for empi in empi_list:
+                if empi not in self._futures:
+                    future = Future()
+                    self._futures[empi] = future
+                    entries.append((empi, future))
+        if not entries:
+            return
+        self._start()
+        asyncio.run_coroutine_threadsafe(self._fetch_all(entries), self._loop)
+
+    async def _fetch_all(self, entries):
+        self._track(asyncio.current_task())
+        for empi, future in entries:
+            await self._slots.acquire()
+            if future.cancelled():
+                # 开始拉取前已被 discard
+                self._slots.release()
+                continue
+            await self._pause_while_open()
+            self._track(asyncio.ensure_future(self._fetch_one(empi, future)))
+
+    async def _pause_while_open(self):
+        # 熔断期间暂停预取，不把后续 EMPI 都变成快速失败
+        wait = api_breaker.retry_after()
+        while wait > 0:
+            run_metrics.incr('prefetch.paused_ms', int(wait * 1000))
+            await asyncio.sleep(wait)
+            wait = api_breaker.retry_after()
+
+    def _track(self, task):
+        # 关闭时取消仍在等待名额或请求中的任务
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _fetch_one(self, empi, future):
+        try:
+            patient_data = await self._api.get_health_portrait(empi)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            logger.error(f"预取画像失败 - EMPI: {empi}, 错误: {str(e)}")
+            patient_data = None
+        run_metrics.incr('prefetch.fetched')
+        with self._lock:
+            if future.cancelled():
+                # 拉取过程中已被 discard，结果不再有人取走，由这里归还名额
+                self._slots.release()
+            else:
+                future.set_result(patient_data)
+
+    def take(self, empi):
+        """
+        取走一个已提交预取的画像，必要时等待拉取完成。
+        最多等待单患者拉取时限加一次熔断暂停的时长，超时按拉取失败处理。
+
+        Returns:
+            tuple: (是否在预取中, patient_data)；EMPI 未提交预取或已被取走时返回 (False, None)
+        """
+        with self._lock:
+            future = self._futures.pop(empi, None)
+        if future is None:
+            return False, None
+        started = time.perf_counter()
+        try:
+            patient_data = future.result(timeout=Config.PATIENT_FETCH_DEADLINE + Config.API_BREAKER_RESET_SECONDS)
+        except FutureTimeoutError:
+            logger.error(f"等待预取画像超时 - EMPI: {empi}")
+            run_metrics.incr('prefetch.timeouts')
+            self._cancel(future)
+            return True, None
+        finally:
+            run_metrics.incr('prefetch.wait_ms', int((time.perf_counter() - started) * 1000))
+        self._loop.call_soon_threadsafe(self._slots.release)
+        return True, patient_data
+
+    def discard(self, empi_list):
+        """
+        放弃一组不会再被取走的预取 (已从本地缓存读到画像，或批次中途中止)，归还它们占用的名额。
+        已被取走或未提交预取的 EMPI 忽略。
+        """
+        with self._lock:
+            futures = [self._futures.pop(empi) for empi in empi_list if empi in self._futures]
+        for future in futures:
+            self._cancel(future)
+        if futures:
+            run_metrics.incr('prefetch.discarded', len(futures))
+
+    def _cancel(self, future):
+        # 还没有结果时取消，名额由事件循环在拉取开始前或结束后归还；已有结果时在这里归还
+        with self._lock:
+            if not future.cancel():
+                self._loop.call_soon_threadsafe(self._slots.release)
+
+    def close(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+        self._thread = None
+        with self._lock:
+            self._futures.clear()
+
+    async def _shutdown(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self._api.aclose()
@@ -0,0 +1,195 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from config.settings import Config
+from .logger import setup_logger
+from .metrics import run_metrics
+
+logger = setup_logger('report_store')
+
+REPORT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    report_id TEXT PRIMARY KEY,
+    hash TEXT NOT NULL,
+    length INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    stored_at REAL NOT NULL
+);
+"""
+
+
+def report_fields(text):
+    """Examination 节点上保留的报告摘要：正文哈希、字符数和前 REPORT_PREVIEW_CHARS 个字符"""
+    if not text:
+        return {'reportHash': None, 'reportLength': None, 'reportPreview': None}
+    return {
+        'reportHash': hashlib.sha256(text.encode('utf-8')).hexdigest(),
+        'reportLength': len(text),
+        'reportPreview': text[:Config.REPORT_PREVIEW_CHARS],
+    }
+
+
+class ReportStore:
+    """
+    检查报告正文存储：Examination.fullReport 按 reportId zlib 压缩后存入本地 SQLite，
+    图谱中只保留哈希、长度和预览，完整正文由 app.py 按需读取。
+
+    写事务中 offload 的正文先暂存在线程本地，事务提交后才写入 SQLite (与 TX_CACHES 中的其他缓存一致)，
+    回滚或 execute_write 重试时丢弃，报告库不会留下图谱中不存在的报告；事务之外 (全量导出) 直接写入。
+    """
+
+    def __init__(self, path=None):
+        self.path = path or Config.REPORT_STORE_PATH
+        self._conn = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def enabled(self):
+        return Config.REPORT_STORE_ENABLED
+
+    def _connection(self):
+        # 首次使用时才创建文件，导入模块不产生副作用
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            conn.executescript(REPORT_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    # --- 事务暂存 ---
+
+    def begin(self):
+        """事务函数开始时调用；execute_write 重试时会重新开始暂存"""
+        self._local.pending = []
+
+    def commit(self):
+        """事务提交成功后，写入暂存的报告正文"""
+        pending = getattr(self._local, 'pending', None) or []
+        self._local.pending = None
+        if pending:
+            self.put_many(pending)
+
+    def rollback(self):
+        self._local.pending = None
+
+    def detach(self):
+        """取出当前线程暂存的报告；asyncio 写入在同一线程内交替执行多个事务，提交前再用 attach 放回"""
+        pending = getattr(self._local, 'pending', None) or []
+        self._local.pending = None
+        return pending
+
+    def attach(self, pending):
+        self._local.pending = pending
+
+    def _save(self, reports):
+        """在事务中时暂存到提交后写入，否则直接写入"""
+        pending = getattr(self._local, 'pending', None)
+        if pending is None:
+            self.put_many(reports)
+        else:
+            pending.extend(reports)
+
+    def put_many(self, reports):
+        """
+        保存一组报告正文 [(reportId, text), ...]；正文哈希未变化的报告不重复写入。
+
+        Returns:
+            int: 实际写入的报告数
+        """
+        rows = []
+        for report_id, text in reports:
+            fields = report_fields(text)
+            rows.append((str(report_id), fields['reportHash'], fields['reportLength'], text))
+        if not rows:
+            return 0
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            stored = {}
+            for start in range(0, len(rows), 500):
+                chunk = [row[0] for row in rows[start:start + 500]]
+                placeholders = ', '.join('?' * len(chunk))
+                stored.update(conn.execute(
+                    f'SELECT report_id, hash FROM reports WHERE report_id IN ({placeholders})', chunk
+                ).fetchall())
+            changed = [
+                (report_id, digest, length, zlib.compress(text.encode('utf-8'), 6), now)
+                for report_id, digest, length, text in rows
+                if stored.get(report_id) != digest
+            ]
+            if changed:
+                with conn:
+                    conn.executemany(
+                        'INSERT OR REPLACE INTO reports (report_id, hash, length, data, stored_at) VALUES (?, ?, ?, ?, ?)',
+                        changed
+                    )
+        run_metrics.incr('reports.stored', len(changed))
+        return len(changed)
+
+    def get(self, report_id):
+        """
+        读取一份报告。
+
+        Returns:
+            dict: {'reportId', 'hash', 'length', 'fullReport'}，不存在时返回 None
+        """
+        with self._lock:
+            row = self._connection().execute(
+                'SELECT hash, length, data FROM reports WHERE report_id = ?', (str(report_id),)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            'reportId': str(report_id),
+            'hash': row[0],
+            'length': row[1],
+            'fullReport': zlib.decompress(row[2]).decode('utf-8'),
+        }
+
+    def offload_rows(self, rows):
+        """
+        把检查报告参数行中的正文存入报告库，返回去掉正文的参数行 (fullReport 为 None)。
+        未启用时原样返回。
+        """
+        if not self.enabled:
+            return rows
+        self._save([(row['reportId'], row['fullReport']) for row in rows if row.get('fullReport')])
+        return [dict(row, fullReport=None) for row in rows]
+
+    def offload_delta(self, delta):
+        """
+        图谱增量版本的 offload_rows：Examination 节点的正文存入报告库，
+        创建属性中去掉正文，并在更新属性中把已有节点上的 fullReport 置空。
+        """
+        if not self.enabled:
+            return delta
+        reports = []
+        for index, upsert in enumerate(delta.nodes):
+            if upsert.ref.label != 'Examination' or 'fullReport' not in upsert.create_props:
+                continue
+            create_props = dict(upsert.create_props)
+            text = create_props.pop('fullReport')
+            set_props = upsert.set_props
+            if text:
+                reports.append((upsert.ref.key[0], text))
+                set_props = dict(set_props, fullReport=None)
+            delta.nodes[index] = upsert._replace(create_props=create_props, set_props=set_props)
+        self._save(reports)
+        return delta
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+# 进程内共享的检查报告正文存储
+report_store = ReportStore()
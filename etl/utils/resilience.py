@@ -0,0 +1,172 @@
+import threading
+import time
+
+from config.settings import Config
+from .logger import setup_logger
+from .metrics import run_metrics
+
+logger = setup_logger('resilience')
+
+# 半开状态下已有探测请求在进行时，其他调用方的重新检查间隔（秒）
+HALF_OPEN_POLL_SECONDS = 1.0
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开时快速失败，不再向大数据平台发送请求"""
+
+
+class DeadlineExceeded(Exception):
+    """单个患者的拉取 (排队、限流等待和请求) 超过 PATIENT_FETCH_DEADLINE"""
+
+
+class Deadline:
+    """单个患者拉取的总时限"""
+
+    def __init__(self, seconds):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def cap(self, timeout):
+        """单次等待或超时不超过剩余时间；时限已过时抛出 DeadlineExceeded"""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded("已超过单患者拉取时限")
+        return min(timeout, remaining)
+
+
+class TokenBucket:
+    """
+    线程安全的令牌桶：每秒补充 rate 个令牌，最多积累 burst 个。rate 为 0 时不限流。
+
+    reserve 立即预占一个令牌并返回需要等待的秒数，由调用方 sleep (同步) 或 await asyncio.sleep (异步)，
+    线程和事件循环可以共用同一个令牌桶。
+    """
+
+    def __init__(self, rate=None, burst=None):
+        self.rate = Config.API_RATE_LIMIT if rate is None else rate
+        self.burst = max(1, Config.API_RATE_BURST if burst is None else burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait=None):
+        """
+        预占一个令牌。
+
+        Returns:
+            float: 需要等待的秒数；等待时间会超过 max_wait 时不预占并返回 None
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = max(0.0, (1 - self._tokens) / self.rate)
+            if max_wait is not None and wait > max_wait:
+                return None
+            # 令牌数可以为负，表示已被排队中的调用方预占
+            self._tokens -= 1
+        if wait:
+            run_metrics.incr('api.rate_limited_ms', int(wait * 1000))
+        return wait
+
+
+class CircuitBreaker:
+    """
+    大数据平台接口熔断器：连续 API_BREAKER_FAILURES 次请求失败 (连接失败、超时、HTTP 错误、响应格式错误) 后打开，
+    API_BREAKER_RESET_SECONDS 秒内所有请求快速失败；之后进入半开状态放行一个探测请求，
+    成功则关闭，失败则重新打开。接口正常返回的非 0 code 不计为失败。
+
+    状态记入运行统计 api.circuit_state，打开次数记入 api.circuit_opened。
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=None, reset_seconds=None):
+        self.failure_threshold = Config.API_BREAKER_FAILURES if failure_threshold is None else failure_threshold
+        self.reset_seconds = Config.API_BREAKER_RESET_SECONDS if reset_seconds is None else reset_seconds
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.failure_threshold > 0
+
+    @property
+    def state(self):
+        with self._lock:
+            self._refresh()
+            return self._state
+
+    def _refresh(self):
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_seconds:
+            self._set_state(self.HALF_OPEN)
+            self._probing = False
+
+    def _set_state(self, state):
+        self._state = state
+        run_metrics.set_gauge('api.circuit_state', state)
+
+    def retry_after(self):
+        """距离可以再次发送请求还有多少秒；熔断器关闭或可以探测时为 0"""
+        if not self.enabled:
+            return 0.0
+        with self._lock:
+            self._refresh()
+            if self._state == self.OPEN:
+                return max(0.0, self._opened_at + self.reset_seconds - time.monotonic())
+            if self._state == self.HALF_OPEN and self._probing:
+                return HALF_OPEN_POLL_SECONDS
+            return 0.0
+
+    def check(self):
+        """不占用探测名额的快速检查，熔断中时抛出 CircuitOpenError"""
+        wait = self.retry_after()
+        if wait > 0:
+            run_metrics.incr('api.circuit_rejected')
+            raise CircuitOpenError(f"大数据平台接口熔断中，{wait:.0f} 秒后重试")
+
+    def before_call(self):
+        """发送请求前调用：熔断中时抛出 CircuitOpenError，半开状态下只放行一个探测请求"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._refresh()
+            if self._state == self.OPEN or (self._state == self.HALF_OPEN and self._probing):
+                run_metrics.incr('api.circuit_rejected')
+                raise CircuitOpenError("大数据平台接口熔断中")
+            if self._state == self.HALF_OPEN:
+                self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            if self._state != self.CLOSED:
+                logger.info("大数据平台接口恢复，熔断器关闭")
+                self._set_state(self.CLOSED)
+                self._probing = False
+
+    def record_failure(self):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or (self._state == self.CLOSED and self._failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                self._probing = False
+                self._set_state(self.OPEN)
+                run_metrics.incr('api.circuit_opened')
+                logger.error(f"大数据平台接口连续 {self._failures} 次请求失败，熔断 {self.reset_seconds} 秒")
+
+
+# 进程内共享的大数据平台接口限流与熔断 (同步拉取和异步预取共用)
+api_rate_limiter = TokenBucket()
+api_breaker = CircuitBreaker()
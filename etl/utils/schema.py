@@ -0,0 +1,108 @@
+# etl/utils/schema.py
+
+from neo4j.exceptions import Neo4jError
+from config.settings import Config
+from .logger import setup_logger
+
+logger = setup_logger('schema')
+
+# 图模型中 ETL 用于 MERGE 的全部键，以及 app.py 读查询的入口键。
+# (名称, 类型, 标签, 属性)；类型为 UNIQUE 时创建唯一约束，INDEX 时创建范围索引。
+# Condition 的 code/name 以及 LifestyleFact、既往事件的键允许重复，只建索引。
+SCHEMA_DEFINITIONS = [
+    ('patient_id_unique', 'UNIQUE', 'Patient', ('patientId',)),
+    ('patient_identity', 'INDEX', 'Patient', ('idType', 'idValue')),
+    ('encounter_id_unique', 'UNIQUE', 'Encounter', ('encounterId',)),
+    ('hospital_id_unique', 'UNIQUE', 'Hospital', ('hospitalId',)),
+    ('department_id_unique', 'UNIQUE', 'Department', ('departmentId',)),
+    ('provider_id_unique', 'UNIQUE', 'Provider', ('providerId',)),
+    ('examination_report_id_unique', 'UNIQUE', 'Examination', ('reportId',)),
+    ('lab_test_report_id_unique', 'UNIQUE', 'LabTestReport', ('reportId',)),
+    ('lab_test_item_name_unique', 'UNIQUE', 'LabTestItem', ('name',)),
+    ('condition_code', 'INDEX', 'Condition', ('code',)),
+    ('condition_name', 'INDEX', 'Condition', ('name',)),
+    ('allergen_name_unique', 'UNIQUE', 'Allergen', ('name',)),
+    ('lifestyle_fact_type_value', 'INDEX', 'LifestyleFact', ('type', 'value')),
+    ('vaccination_unique_id_unique', 'UNIQUE', 'Vaccination', ('uniqueId',)),
+    ('surgery_name', 'INDEX', 'Surgery', ('name',)),
+    ('trauma_name', 'INDEX', 'Trauma', ('name',)),
+    ('blood_transfusion_name_date', 'INDEX', 'BloodTransfusion', ('name', 'date')),
+]
+
+# 能为 MERGE/MATCH 等值查找提供支撑的索引类型 (Neo4j 4.x 为 BTREE，5.x 为 RANGE)
+BACKING_INDEX_TYPES = ('RANGE', 'BTREE')
+
+
+class SchemaManager:
+    """幂等地创建图模型所需的约束与索引，并校验每个 MERGE 键都有在线索引支撑"""
+
+    def __init__(self, driver, database=None):
+        self.driver = driver
+        self.database = database or Config.NEO4J_DATABASE
+
+    def ensure_schema(self):
+        """
+        创建缺失的约束和索引，等待其上线，然后报告没有索引支撑的 MERGE 键。
+
+        Returns:
+            list: 缺少在线索引的 (标签, 属性元组) 列表，为空表示全部就绪
+        """
+        with self.driver.session(database=self.database) as session:
+            for definition in SCHEMA_DEFINITIONS:
+                self._create(session, *definition)
+
+            logger.info(f"等待索引上线 (超时 {Config.SCHEMA_AWAIT_TIMEOUT} 秒)...")
+            try:
+                session.run("CALL db.awaitIndexes($timeout)", timeout=Config.SCHEMA_AWAIT_TIMEOUT).consume()
+            except Neo4jError as e:
+                logger.error(f"等待索引上线超时或失败: {e}")
+
+            missing = self.find_unbacked_merge_keys(session)
+
+        if missing:
+            for label, properties in missing:
+                logger.error(f"MERGE 键缺少在线索引，将退化为标签扫描: :{label}({', '.join(properties)})")
+        else:
+            logger.info(f"图谱约束与索引已就绪，共 {len(SCHEMA_DEFINITIONS)} 个 MERGE 键")
+        return missing
+
+    def find_unbacked_merge_keys(self, session):
+        """返回在 SHOW INDEXES 中找不到 ONLINE 状态支撑索引的 MERGE 键"""
+        result = session.run(
+            "SHOW INDEXES YIELD type, entityType, labelsOrTypes, properties, state "
+            "WHERE entityType = 'NODE' "
+            "RETURN type, labelsOrTypes, properties, state"
+        )
+        online = set()
+        for record in result:
+            if record['type'] not in BACKING_INDEX_TYPES or record['state'] != 'ONLINE':
+                continue
+            for label in record['labelsOrTypes'] or []:
+                online.add((label, tuple(record['properties'] or [])))
+
+        return [
+            (label, properties)
+            for _, _, label, properties in SCHEMA_DEFINITIONS
+            if (label, properties) not in online
+        ]
+
+    def _create(self, session, name, kind, label, properties):
+        if kind == 'UNIQUE' and len(properties) == 1:
+            query = (
+                f"CREATE CONSTRAINT {name} IF NOT EXISTS "
+                f"FOR (n:{label}) REQUIRE n.{properties[0]} IS UNIQUE"
+            )
+            try:
+                session.run(query).consume()
+                return
+            except Neo4jError as e:
+                # 已有重复数据或已存在同键的普通索引时无法建唯一约束，退化为普通索引
+                logger.warning(f"无法创建唯一约束 {name}，改为创建索引: {e}")
+                name = name[:-len('_unique')] if name.endswith('_unique') else name
+
+        props = ', '.join(f"n.{p}" for p in properties)
+        query = f"CREATE INDEX {name} IF NOT EXISTS FOR (n:{label}) ON ({props})"
+        try:
+            session.run(query).consume()
+        except Neo4jError as e:
+            logger.error(f"创建索引 {name} 失败: {e}")
@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from config.settings import Config
+from .logger import setup_logger
+
+logger = setup_logger('spool')
+
+SPOOL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS payloads (
+    hash TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    patient_id TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (patient_id, hash)
+);
+CREATE INDEX IF NOT EXISTS idx_entries_fetched_at ON entries (fetched_at);
+"""
+
+
+def payload_digest(raw):
+    return hashlib.sha256(raw).hexdigest()
+
+
+class PayloadSpool:
+    """
+    本地画像负载缓存：每次从大数据平台拉取成功的画像按内容哈希 zlib 压缩后存入 SQLite，
+    以 (patientId, 负载哈希) 为键记录拉取时间。重试和重放直接读取缓存，不再调用平台接口。
+
+    相同内容只保存一份；超过 SPOOL_MAX_AGE_HOURS 的记录在读取时视为不存在，
+    evict 按时间和 SPOOL_MAX_BYTES 淘汰最旧的记录。
+    """
+
+    def __init__(self, path=None, max_bytes=None, max_age_hours=None):
+        self.path = path or Config.SPOOL_PATH
+        self.max_bytes = Config.SPOOL_MAX_BYTES if max_bytes is None else max_bytes
+        self.max_age_hours = Config.SPOOL_MAX_AGE_HOURS if max_age_hours is None else max_age_hours
+        self._conn = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return Config.SPOOL_ENABLED
+
+    def _connection(self):
+        # 首次使用时才创建文件，导入模块不产生副作用
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            conn.executescript(SPOOL_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _min_fetched_at(self):
+        if not self.max_age_hours:
+            return 0
+        return time.time() - self.max_age_hours * 3600
+
+    def put(self, patient_id, payload):
+        """
+        保存一个患者的画像负载。
+
+        Returns:
+            str: 负载哈希
+        """
+        raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        digest = payload_digest(raw)
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                if conn.execute('SELECT 1 FROM payloads WHERE hash = ?', (digest,)).fetchone() is None:
+                    data = zlib.compress(raw, 6)
+                    conn.execute('INSERT INTO payloads (hash, data, size) VALUES (?, ?, ?)', (digest, data, len(data)))
+                conn.execute(
+                    'INSERT OR REPLACE INTO entries (patient_id, hash, fetched_at) VALUES (?, ?, ?)',
+                    (str(patient_id), digest, time.time())
+                )
+        return digest
+
+    def get(self, patient_id):
+        """读取一个患者最近一次拉取的画像负载，没有或已过期时返回 None"""
+        with self._lock:
+            row = self._connection().execute("""
+            SELECT p.data FROM entries e JOIN payloads p ON p.hash = e.hash
+            WHERE e.patient_id = ? AND e.fetched_at >= ?
+            ORDER BY e.fetched_at DESC LIMIT 1
+            """, (str(patient_id), self._min_fetched_at())).fetchone()
+        if row is None:
+            return None
+        return json.loads(zlib.decompress(row[0]).decode('utf-8'))
+
+    def patient_ids(self):
+        """缓存中所有未过期的患者 ID，按最近拉取时间排序"""
+        with self._lock:
+            rows = self._connection().execute("""
+            SELECT patient_id FROM entries WHERE fetched_at >= ?
+            GROUP BY patient_id ORDER BY MAX(fetched_at)
+            """, (self._min_fetched_at(),)).fetchall()
+        return [row[0] for row in rows]
+
+    def evict(self):
+        """
+        淘汰过期记录；压缩后的总大小仍超过 SPOOL_MAX_BYTES 时从最旧的记录开始淘汰，
+        最后删除不再被引用的负载。
+
+        Returns:
+            int: 淘汰的记录数
+        """
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                evicted = conn.execute('DELETE FROM entries WHERE fetched_at < ?', (self._min_fetched_at(),)).rowcount
+                conn.execute('DELETE FROM payloads WHERE hash NOT IN (SELECT hash FROM entries)')
+
+                total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM payloads').fetchone()[0]
+                if self.max_bytes and total > self.max_bytes:
+                    # 同一负载可能被多个记录引用，按负载最后一次被拉取的时间淘汰
+                    cursor = conn.execute("""
+                    SELECT p.hash, p.size FROM payloads p JOIN entries e ON e.hash = p.hash
+                    GROUP BY p.hash ORDER BY MAX(e.fetched_at)
+                    """)
+                    stale = []
+                    for digest, size in cursor.fetchall():
+                        if total <= self.max_bytes:
+                            break
+                        stale.append((digest,))
+                        total -= size
+                    evicted += sum(
+                        conn.execute('DELETE FROM entries WHERE hash = ?', item).rowcount for item in stale
+                    )
+                    conn.executemany('DELETE FROM payloads WHERE hash = ?', stale)
+            conn.execute('PRAGMA incremental_vacuum')
+        if evicted:
+            logger.info(f"画像缓存淘汰 {evicted} 条记录，剩余 {total} 字节")
+        return evicted
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+# 进程内共享的画像负载缓存
+payload_spool = PayloadSpool()
@@ -0,0 +1,208 @@
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from config.settings import Config
+from .logger import setup_logger
+
+logger = setup_logger('statement_stats')
+
+# Cypher 文本 -> 稳定的语句名
+_STATEMENT_NAMES = {}
+
+# 每个语句保留的耗时样本数 (蓄水池抽样)，用于计算分位数
+LATENCY_SAMPLES = 10000
+
+
+def name_statement(name, query):
+    """登记语句名并原样返回语句，定义语句常量或调用 tx.run 时使用"""
+    _STATEMENT_NAMES[query] = name
+    return query
+
+
+def register_statements(prefix, queries):
+    """批量登记 {名称: 语句} 字典中的语句，语句名为 prefix + 字典键"""
+    for name, query in queries.items():
+        _STATEMENT_NAMES[query] = prefix + name
+
+
+def statement_name(query):
+    name = _STATEMENT_NAMES.get(query)
+    if name is None:
+        # 未登记的语句按文本哈希命名，保证同一语句在多次运行间名称不变
+        name = 'unnamed.' + hashlib.sha1(query.encode('utf-8')).hexdigest()[:8]
+    return name
+
+
+def _percentile(samples, percent):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    # 最近秩法
+    index = max(0, min(len(ordered) - 1, math.ceil(percent / 100.0 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class _StatementEntry:
+    __slots__ = ('calls', 'rows', 'total_ms', 'server_ms', 'samples', 'nodes_created', 'nodes_deleted',
+                 'relationships_created', 'relationships_deleted', 'properties_set')
+
+    def __init__(self):
+        self.calls = 0
+        self.rows = 0
+        self.total_ms = 0.0
+        self.server_ms = 0
+        self.samples = []
+        self.nodes_created = 0
+        self.nodes_deleted = 0
+        self.relationships_created = 0
+        self.relationships_deleted = 0
+        self.properties_set = 0
+
+
+class StatementStats:
+    """
+    单次运行中每条写入语句的调用次数、参数行数、耗时分布和 ResultSummary 计数，线程安全。
+
+    耗时为客户端从发送语句到取完结果的时间 (毫秒)；服务端耗时为 result_available_after 与
+    result_consumed_after 之和。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    @property
+    def enabled(self):
+        return Config.STATEMENT_STATS
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+
+    def record(self, name, rows, elapsed_ms, summary=None):
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                entry = self._entries[name] = _StatementEntry()
+            entry.calls += 1
+            entry.rows += rows
+            entry.total_ms += elapsed_ms
+            if len(entry.samples) < LATENCY_SAMPLES:
+                entry.samples.append(elapsed_ms)
+            else:
+                slot = random.randrange(entry.calls)
+                if slot < LATENCY_SAMPLES:
+                    entry.samples[slot] = elapsed_ms
+            if summary is not None:
+                entry.server_ms += (summary.result_available_after or 0) + (summary.result_consumed_after or 0)
+                counters = summary.counters
+                entry.nodes_created += counters.nodes_created
+                entry.nodes_deleted += counters.nodes_deleted
+                entry.relationships_created += counters.relationships_created
+                entry.relationships_deleted += counters.relationships_deleted
+                entry.properties_set += counters.properties_set
+
+    def report(self):
+        """按总耗时从高到低排列的统计结果"""
+        with self._lock:
+            items = [(name, entry, list(entry.samples)) for name, entry in self._entries.items()]
+        report = []
+        for name, entry, samples in sorted(items, key=lambda item: item[1].total_ms, reverse=True):
+            report.append(OrderedDict([
+                ('statement', name),
+                ('calls', entry.calls),
+                ('rows', entry.rows),
+                ('total_ms', round(entry.total_ms, 2)),
+                ('server_ms', entry.server_ms),
+                ('p50_ms', round(_percentile(samples, 50), 2)),
+                ('p95_ms', round(_percentile(samples, 95), 2)),
+                ('p99_ms', round(_percentile(samples, 99), 2)),
+                ('nodes_created', entry.nodes_created),
+                ('nodes_deleted', entry.nodes_deleted),
+                ('relationships_created', entry.relationships_created),
+                ('relationships_deleted', entry.relationships_deleted),
+                ('properties_set', entry.properties_set),
+            ]))
+        return report
+
+    def format_table(self, report=None):
+        report = self.report() if report is None else report
+        if not report:
+            return "语句统计: 无"
+        columns = [
+            ('statement', '语句'), ('calls', 'calls'), ('rows', 'rows'), ('total_ms', 'total_ms'),
+            ('p50_ms', 'p50'), ('p95_ms', 'p95'), ('p99_ms', 'p99'), ('nodes_created', 'nodes+'),
+            ('relationships_created', 'rels+'), ('properties_set', 'props'),
+        ]
+        widths = [max(len(title), *(len(str(row[key])) for row in report)) for key, title in columns]
+        lines = ['  '.join(title.ljust(width) for (_, title), width in zip(columns, widths))]
+        for row in report:
+            lines.append('  '.join(
+                str(row[key]).ljust(width) if key == 'statement' else str(row[key]).rjust(width)
+                for (key, _), width in zip(columns, widths)
+            ))
+        return "语句统计:\n" + '\n'.join(lines)
+
+    def dump(self, label='etl'):
+        """把统计结果写入 STATEMENT_STATS_DIR 下的 JSON 文件并输出表格日志，返回文件路径"""
+        report = self.report()
+        if not report:
+            return None
+        os.makedirs(Config.STATEMENT_STATS_DIR, exist_ok=True)
+        path = os.path.join(Config.STATEMENT_STATS_DIR, f"statements_{label}_{time.strftime('%Y%m%d_%H%M%S')}.json")
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+        except IOError as e:
+            logger.error(f"写入语句统计失败: {e}")
+            path = None
+        logger.info(self.format_table(report))
+        if path:
+            logger.info(f"语句统计已保存: {path}")
+        return path
+
+
+class ConsumedResult(list):
+    """已经取完的结果：记录列表，consume() 返回执行时读取的 ResultSummary"""
+
+    def __init__(self, records, summary):
+        super().__init__(records)
+        self._summary = summary
+
+    def consume(self):
+        return self._summary
+
+
+class InstrumentedTransaction:
+    """
+    包装写事务：每条语句执行后立即取完结果并读取 ResultSummary，按语句名记入 statement_stats。
+    返回的是记录列表 (ConsumedResult)，调用方可以迭代，也可以用 consume() 读取计数。
+    """
+
+    def __init__(self, tx, stats=None):
+        self._tx = tx
+        self._stats = stats or statement_stats
+
+    def run(self, query, parameters=None, **kwparameters):
+        started = time.perf_counter()
+        result = self._tx.run(query, parameters, **kwparameters)
+        records = list(result)
+        summary = result.consume()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        params = dict(parameters or {}, **kwparameters)
+        rows = params.get('rows')
+        self._stats.record(statement_name(query), len(rows) if isinstance(rows, list) else 1, elapsed_ms, summary)
+        return ConsumedResult(records, summary)
+
+    def __getattr__(self, name):
+        return getattr(self._tx, name)
+
+
+# 进程内共享的语句统计
+statement_stats = StatementStats()
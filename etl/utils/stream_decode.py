@@ -0,0 +1,208 @@
+import json
+import os
+import tempfile
+import weakref
+from collections import Counter
+
+import ijson
+import msgspec
+
+from config.settings import Config
+from .logger import setup_logger
+from .metrics import run_metrics
+
+logger = setup_logger('stream_decode')
+
+# 就诊记录在 getHealthPortrait 响应中的路径 (ijson 前缀)
+ENCOUNTERS_PREFIX = 'data.encounters.item'
+# 读取响应体的块大小
+STREAM_CHUNK_BYTES = 256 * 1024
+
+
+class PayloadFile:
+    """
+    转存到临时文件的响应体。没有引用后删除文件；
+    序列化到子进程 (DELTA_COMPILE_PROCESSES) 的副本只读取，不负责删除。
+    """
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self._finalizer = weakref.finalize(self, _remove_file, path)
+
+    def __getstate__(self):
+        return {'path': self.path, 'size': self.size}
+
+    def __setstate__(self, state):
+        self.path = state['path']
+        self.size = state['size']
+        self._finalizer = None
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class EncounterStream:
+    """
+    流式解码的就诊记录：每次迭代从临时文件中逐条解析，不在内存中保留整个就诊列表。
+
+    可以重复迭代 (变更检测、增量计划和写入各读一遍)。encounter_counts 为每个 encounterId 的记录数，
+    在解码时统计，用于流式计算与列表版本一致的就诊子树指纹。
+    """
+
+    def __init__(self, payload_file, encounter_counts, total, only=None):
+        self._file = payload_file
+        self.encounter_counts = encounter_counts
+        self._total = total
+        self._only = only
+
+    @property
+    def size(self):
+        return self._file.size
+
+    def __iter__(self):
+        with open(self._file.path, 'rb') as f:
+            for encounter in ijson.items(f, ENCOUNTERS_PREFIX, use_float=True):
+                if self._only is None or (encounter and encounter.get('encounterId') in self._only):
+                    yield encounter
+
+    def __len__(self):
+        if self._only is None:
+            return self._total
+        return sum(self.encounter_counts.get(encounter_id, 0) for encounter_id in self._only)
+
+    def only(self, encounter_ids):
+        """只包含指定 encounterId 的记录的视图 (增量同步只写入有变化的就诊)"""
+        encounter_ids = set(encounter_ids)
+        counts = {encounter_id: count for encounter_id, count in self.encounter_counts.items()
+                  if encounter_id in encounter_ids}
+        return EncounterStream(self._file, counts, sum(counts.values()), encounter_ids)
+
+    def __repr__(self):
+        return f"<EncounterStream {len(self)} encounters, {self.size} bytes>"
+
+
+def is_streamed(patient_data):
+    """画像的就诊记录是否为流式解码的 EncounterStream"""
+    return isinstance(patient_data, dict) and isinstance(patient_data.get('encounters'), EncounterStream)
+
+
+def payload_bytes(patient_data):
+    """画像的大致字节数：流式解码的画像取响应体大小，其余按 JSON 序列化长度估算"""
+    if is_streamed(patient_data):
+        return patient_data['encounters'].size
+    return len(json.dumps(patient_data, ensure_ascii=False, default=str).encode('utf-8'))
+
+
+def decode_payload_file(payload_file):
+    """
+    解析转存到临时文件的 getHealthPortrait 响应：只构建除 encounters 以外的字段，
+    同时统计每个 encounterId 的记录数；encounters 替换为按需读取的 EncounterStream。
+
+    Returns:
+        dict: 与 response.json() 结构相同的 {code, msg, data}
+    """
+    result = {}
+    data = None
+    key = None
+    builder = None
+    counts = Counter()
+    total = 0
+    value_prefix = None
+    with open(payload_file.path, 'rb') as f:
+        for prefix, event, value in ijson.parse(f, use_float=True):
+            if builder is not None:
+                builder.event(event, value)
+                if prefix == value_prefix and event in ('end_map', 'end_array'):
+                    data[key] = builder.value
+                    builder = None
+                continue
+            if prefix == 'data' and event == 'start_map':
+                data = {}
+            elif prefix == 'data' and event == 'map_key':
+                key = value
+                value_prefix = f'data.{key}'
+            elif prefix == ENCOUNTERS_PREFIX:
+                if event not in ('map_key', 'end_map', 'end_array'):
+                    total += 1
+            elif prefix == f'{ENCOUNTERS_PREFIX}.encounterId':
+                if value is not None and value != '':
+                    counts[value] += 1
+            elif prefix == 'data.encounters' or prefix.startswith('data.encounters.'):
+                continue
+            elif data is not None and prefix == value_prefix:
+                if event in ('start_map', 'start_array'):
+                    builder = ijson.ObjectBuilder()
+                    builder.event(event, value)
+                else:
+                    data[key] = value
+            elif prefix in ('code', 'msg'):
+                result[prefix] = value
+    if data is not None:
+        data['encounters'] = EncounterStream(payload_file, dict(counts), total)
+    result['data'] = data
+    return result
+
+
+class PayloadBuffer:
+    """
+    按块接收 getHealthPortrait 的响应体：不超过 STREAM_DECODE_MIN_BYTES 时留在内存中用 msgspec 整体解析，
+    超过后转存到临时文件，由 decode_payload_file 流式解码，就诊记录不再整体驻留内存。
+    """
+
+    def __init__(self, threshold=None):
+        self.threshold = Config.STREAM_DECODE_MIN_BYTES if threshold is None else threshold
+        self.size = 0
+        self._buffer = bytearray()
+        self._file = None
+        self._path = None
+
+    @property
+    def spilled(self):
+        return self._path is not None
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        if self._file is not None:
+            self._file.write(chunk)
+            return
+        self._buffer += chunk
+        if len(self._buffer) > self.threshold:
+            fd, self._path = tempfile.mkstemp(prefix='portrait-', suffix='.json', dir=Config.STREAM_DECODE_DIR)
+            self._file = os.fdopen(fd, 'wb')
+            self._file.write(self._buffer)
+            self._buffer = bytearray()
+
+    def finish(self):
+        """
+        Returns:
+            dict: 解析后的响应 {code, msg, data}
+        """
+        if self._path is None:
+            return msgspec.json.decode(self._buffer)
+        self._file.close()
+        self._file = None
+        payload_file = PayloadFile(self._path, self.size)
+        self._path = None
+        try:
+            result = decode_payload_file(payload_file)
+        except Exception:
+            payload_file._finalizer()
+            raise
+        run_metrics.incr('fetch.streamed')
+        run_metrics.incr('fetch.streamed_bytes', self.size)
+        logger.info(f"画像响应 {self.size / 1024 / 1024:.1f} MB，已转存临时文件流式解码")
+        return result
+
+    def discard(self):
+        """请求失败时删除已写入的临时文件"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._path is not None:
+            _remove_file(self._path)
+            self._path = None
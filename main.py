@@ -1,13 +1,27 @@
+import argparse # 命令行参数
 import datetime # 导入 datetime 模块
 import json # 用于读写状态文件
 import os # 用于文件路径操作
 import time # 用于重试延迟
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timezone, timedelta # 用于时区处理
 
 from config.settings import Config
 from scheduler.job_manager import JobManager
 from etl.utils.logger import setup_logger
 from etl.utils.sqlserver import SQLServerConnection
+from etl.utils.db import Neo4jConnection
+from etl.utils.metrics import run_metrics
+from etl.utils.api import HealthPortraitAPI
+from etl.utils.prefetch import PortraitPrefetcher
+from etl.utils.hedging import api_hedger
+from etl.utils.spool import payload_spool
+from etl.utils.report_store import report_store
+from etl.utils.statement_stats import statement_stats
+from etl.processors.bulk_export import BulkExporter
+from etl.processors.dry_run import DryRunProcessor, load_payload_files
+from etl.core.graph_delta import compile_patients
+from etl.core.family_inference import infer_parents_global
 
 logger = setup_logger('main')
 
@@ -89,6 +103,8 @@ def main():
     current_run_start_time = datetime.datetime.now(tz=beijing_tz) # 使用北京时间
 
     try:
+        job_manager.start_run()
+
         last_successful_run_time = load_last_load_timestamp()
         
         empi_list = load_empi_list(last_load_timestamp=last_successful_run_time)
@@ -100,6 +116,8 @@ def main():
             return
 
         total_batches = (len(empi_list) + Config.BATCH_SIZE - 1) // Config.BATCH_SIZE
+        # ASYNC_FETCH 开启时后台按顺序预取画像，写入当前批次的同时拉取后续批次
+        job_manager.prefetch(empi_list)
         
         for i in range(0, len(empi_list), Config.BATCH_SIZE):
             batch = empi_list[i:i + Config.BATCH_SIZE]
@@ -166,14 +184,204 @@ def main():
         raise
     finally:
         # 清理资源
+        try:
+            job_manager.close_prefetcher()
+        except Exception as cleanup_error:
+            logger.error(f"Error closing portrait prefetcher: {cleanup_error}")
+        api_hedger.close()
+        try:
+            job_manager.close_async_writer()
+        except Exception as cleanup_error:
+            logger.error(f"Error closing async Neo4j writer: {cleanup_error}")
         try:
             if job_manager and hasattr(job_manager, 'processor') and hasattr(job_manager.processor, 'db') and job_manager.processor.db:
                 job_manager.processor.db.close()
                 logger.info("Neo4j connection closed via JobManager.")
         except Exception as cleanup_error:
             logger.error(f"Error closing Neo4j connection: {cleanup_error}")
+        payload_spool.close()
+        report_store.close()
         
+        logger.info(run_metrics.summary())
+        statement_stats.dump('main')
         logger.info("ETL任务执行结束")
 
+def run_full_rebuild(export_dir):
+    """
+    全量重建：拉取全部患者的健康画像，按与增量 ETL 相同的映射规则输出 neo4j-admin import 所需的 CSV。
+    整个过程不连接 Neo4j，导入命令写在导出目录的 import_command.txt 中。
+    """
+    run_metrics.reset()
+    prefetcher = None
+    try:
+        empi_list = load_empi_list()
+        if not empi_list:
+            logger.warning("EMPI list is empty. Nothing to export.")
+            return
+
+        api = HealthPortraitAPI()
+        exporter = BulkExporter(export_dir)
+        total_batches = (len(empi_list) + Config.BATCH_SIZE - 1) // Config.BATCH_SIZE
+        if Config.ASYNC_FETCH:
+            prefetcher = PortraitPrefetcher()
+            prefetcher.prefetch(empi_list)
+
+        def fetch(empi):
+            if prefetcher is not None:
+                prefetched, patient_data = prefetcher.take(empi)
+                if prefetched:
+                    return patient_data
+            return api.get_health_portrait(empi)
+
+        def export_batch(batch):
+            failed = []
+            fetched = []
+            with ThreadPoolExecutor(max_workers=Config.MAX_WORKERS) as executor:
+                # map 保持输入顺序，暂存库只在主线程写入
+                for empi, patient_data in zip(batch, executor.map(fetch, batch)):
+                    if not patient_data or not patient_data.get('patientId'):
+                        failed.append(empi)
+                    else:
+                        fetched.append(patient_data)
+            # 映射不依赖数据库，DELTA_COMPILE_PROCESSES 大于 0 时在子进程中编译
+            for delta in compile_patients(fetched, Config.DELTA_COMPILE_PROCESSES):
+                exporter.add_delta(delta)
+            return failed
+
+        failed_empis = []
+        for i in range(0, len(empi_list), Config.BATCH_SIZE):
+            batch = empi_list[i:i + Config.BATCH_SIZE]
+            logger.info(f"导出第 {i//Config.BATCH_SIZE + 1}/{total_batches} 批，{len(batch)} 条记录")
+            failed_empis.extend(export_batch(batch))
+
+        retry_count = 0
+        while failed_empis and retry_count < Config.RETRY_TIMES:
+            retry_count += 1
+            logger.info(f"重试第{retry_count}次，剩余{len(failed_empis)}个失败任务...")
+            time.sleep(Config.RETRY_DELAY)
+            failed_empis = export_batch(failed_empis)
+
+        if failed_empis:
+            run_metrics.incr('export.failed', len(failed_empis))
+            logger.error(f"{len(failed_empis)} EMPIs failed to fetch and are missing from the export.")
+
+        summary = exporter.export()
+        logger.info(f"导出文件目录: {os.path.abspath(export_dir)}，导入命令见 import_command.txt")
+        logger.info(f"节点统计: {dict(summary['nodes'])}")
+        logger.info(f"关系统计: {dict(summary['relationships'])}")
+    finally:
+        if prefetcher is not None:
+            prefetcher.close()
+        report_store.close()
+        logger.info(run_metrics.summary())
+        logger.info("全量导出任务执行结束")
+
+def run_replay():
+    """
+    重放：把本地画像缓存中所有未过期患者的最近一次负载重新写入 Neo4j，不调用大数据平台接口，
+    也不更新增量时间戳。用于图谱故障恢复后补写。
+    """
+    job_manager = JobManager()
+    try:
+        job_manager.start_run()
+        empi_list = payload_spool.patient_ids()
+        if not empi_list:
+            logger.warning("画像缓存为空，没有可重放的数据")
+            return
+
+        total_batches = (len(empi_list) + Config.BATCH_SIZE - 1) // Config.BATCH_SIZE
+        for i in range(0, len(empi_list), Config.BATCH_SIZE):
+            batch = empi_list[i:i + Config.BATCH_SIZE]
+            logger.info(f"重放第 {i//Config.BATCH_SIZE + 1}/{total_batches} 批，{len(batch)} 条记录")
+            job_manager.process_batch(batch, from_spool=True)
+
+        retry_count = 0
+        while not job_manager.error_queue.empty() and retry_count < Config.RETRY_TIMES:
+            retry_count += 1
+            logger.info(f"重试第{retry_count}次，剩余{job_manager.error_queue.qsize()}个失败任务...")
+            time.sleep(Config.RETRY_DELAY)
+            job_manager.retry_failed()
+
+        if not job_manager.error_queue.empty():
+            logger.error(f"{job_manager.error_queue.qsize()} EMPIs still failed after {retry_count} retries.")
+    finally:
+        job_manager.close_async_writer()
+        job_manager.processor.db.close()
+        payload_spool.close()
+        report_store.close()
+        logger.info(run_metrics.summary())
+        statement_stats.dump('replay')
+        logger.info("重放任务执行结束")
+
+def run_infer_parents():
+    """全图亲子关系推断 (回填)：不拉取画像，直接在图谱上按 FAMILY_INFERENCE_BATCH_SIZE 行分批提交"""
+    statement_stats.reset()
+    db = Neo4jConnection()
+    try:
+        with db.get_session() as session:
+            infer_parents_global(session, Config.FAMILY_INFERENCE_BATCH_SIZE)
+    finally:
+        db.close()
+        statement_stats.dump('infer_parents')
+        logger.info("亲子关系回填任务执行结束")
+
+def run_dry_run(source, files_dir, record_path=None):
+    """
+    演练：按当前写入配置把画像映射成 Cypher 语句并记录，不连接 Neo4j、不更新增量时间戳。
+    画像来自本地画像缓存 (source='spool') 或 files_dir 下的样例 JSON (source='files')，
+    输出每患者语句数、各语句调用次数和映射 CPU 耗时。
+    """
+    run_metrics.reset()
+    processor = DryRunProcessor(record_path)
+    try:
+        if source == 'spool':
+            items = ((empi, payload_spool.get(empi)) for empi in payload_spool.patient_ids())
+        else:
+            items = load_payload_files(files_dir)
+
+        for key, patient_data in items:
+            if not processor.process(patient_data):
+                logger.warning(f"演练跳过 - {key}")
+
+        logger.info(processor.format_report())
+        if record_path:
+            logger.info(f"演练语句已保存: {os.path.abspath(record_path)}")
+    finally:
+        processor.close()
+        payload_spool.close()
+        report_store.close()
+        logger.info(run_metrics.summary())
+        logger.info("演练任务执行结束")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="健康画像 Neo4j ETL")
+    parser.add_argument('--full-rebuild', action='store_true',
+                        help="全量重建模式：输出 neo4j-admin import 所需的 CSV，不写入 Neo4j")
+    parser.add_argument('--export-dir', default='export',
+                        help="全量重建模式的 CSV 输出目录 (默认: export)")
+    parser.add_argument('--replay', action='store_true',
+                        help="重放模式：把本地画像缓存中的负载重新写入 Neo4j，不调用大数据平台接口")
+    parser.add_argument('--infer-parents', action='store_true',
+                        help="对全图执行亲子关系推断 (分批提交)，用于全量导入后回填")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="演练模式：把画像映射成写入语句并统计，不连接 Neo4j")
+    parser.add_argument('--dry-run-source', choices=['files', 'spool'], default='files',
+                        help="演练模式的画像来源：files 为样例 JSON 目录，spool 为本地画像缓存 (默认: files)")
+    parser.add_argument('--files-dir', default='files',
+                        help="演练模式读取样例 JSON 的目录 (默认: files)")
+    parser.add_argument('--record-output',
+                        help="演练模式下把全部语句和参数按 JSON Lines 写入该文件")
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    args = parse_args()
+    if args.full_rebuild:
+        run_full_rebuild(args.export_dir)
+    elif args.replay:
+        run_replay()
+    elif args.infer_parents:
+        run_infer_parents()
+    elif args.dry_run:
+        run_dry_run(args.dry_run_source, args.files_dir, args.record_output)
+    else:
+        main()
\ No newline at end of file
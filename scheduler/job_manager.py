@@ -1,9 +1,23 @@
+import threading
+import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from queue import Queue
 from config.settings import Config
 from etl.utils.logger import setup_logger
 from etl.utils.api import HealthPortraitAPI
+from etl.utils.schema import SchemaManager
+from etl.utils.metrics import run_metrics
+from etl.utils.prefetch import PortraitPrefetcher
+from etl.utils.resilience import api_breaker
+from etl.utils.spool import payload_spool
+from etl.utils.statement_stats import statement_stats
+from etl.utils.stream_decode import is_streamed
+from etl.core.condition_resolver import condition_resolver
+from etl.core.dimension_cache import dimension_cache
+from etl.core.conflict_scheduler import schedule_lanes, PRELOADED_CONFLICT_LABELS
+from etl.core.family_inference import has_family
 from etl.processors.health_portrait import HealthPortraitProcessor
+from etl.processors.async_writer import AsyncPortraitWriter
 import json
 
 logger = setup_logger('job_manager')
@@ -13,11 +27,100 @@ class JobManager:
         self.api = HealthPortraitAPI()
         self.processor = HealthPortraitProcessor()
         self.error_queue = Queue()
+        self.async_writer = None
+        # ASYNC_FETCH 开启时由后台事件循环预取画像，写入线程从中取用
+        self.prefetcher = PortraitPrefetcher() if Config.ASYNC_FETCH else None
+        # 本批拉取到的、带有家庭成员的患者，批次结束后推断亲子关系
+        self._family_ids = set()
+        self._family_lock = threading.Lock()
     
-    def process_batch(self, empi_list):
+    def start_run(self):
+        """每次ETL运行开始前的准备工作：确保图谱约束与索引就绪，预热进程内缓存"""
+        run_metrics.reset()
+        statement_stats.reset()
+
+        if Config.SCHEMA_BOOTSTRAP:
+            try:
+                SchemaManager(self.processor.db.driver).ensure_schema()
+            except Exception as e:
+                # 索引缺失只影响写入性能，不阻断本次ETL
+                logger.error(f"图谱约束与索引初始化失败: {str(e)}")
+
+        if payload_spool.enabled:
+            try:
+                payload_spool.evict()
+            except Exception as e:
+                logger.error(f"画像缓存淘汰失败: {str(e)}")
+
+        # 维度缓存只对本次运行有效
+        dimension_cache.clear()
+
+        if condition_resolver.enabled:
+            try:
+                condition_resolver.warm(self.processor.db.driver)
+            except Exception as e:
+                # 预热失败时缓存为空，诊断会逐个回落到数据库解析
+                logger.error(f"Condition 缓存预热失败: {str(e)}")
+
+    def process_batch(self, empi_list, from_spool=False):
+        """
+        处理一批 EMPI。from_spool 为 True 时 (失败重试、重放) 优先从本地画像缓存读取，
+        缓存中没有时才调用大数据平台接口。
+        """
+        self._pause_fetch()
+        try:
+            if Config.TWO_PHASE_LOAD and Config.ETL_BATCHED_WRITES:
+                self._process_batch_two_phase(empi_list, from_spool)
+            elif Config.TX_GROUP_SIZE > 1 or Config.ASYNC_WRITES:
+                self._process_batch_grouped(empi_list, from_spool)
+            else:
+                self._process_batch_single(empi_list, from_spool)
+        finally:
+            if self.prefetcher is not None:
+                # 批次中途中止时未取走的预取不会再被取走，归还占用的名额
+                self.prefetcher.discard(empi_list)
+            self._infer_family()
+
+    def _pause_fetch(self):
+        """大数据平台接口熔断期间暂停拉取，等到可以探测时再开始本批，避免整批 EMPI 快速失败"""
+        wait = api_breaker.retry_after()
+        if wait > 0:
+            logger.warning(f"大数据平台接口熔断中，暂停拉取 {wait:.0f} 秒")
+        self._wait_for_breaker()
+
+    @staticmethod
+    def _wait_for_breaker():
+        """熔断期间等到可以发出探测请求 (半开探测进行中时按 HALF_OPEN_POLL_SECONDS 轮询)"""
+        wait = api_breaker.retry_after()
+        while wait > 0:
+            run_metrics.incr('api.paused_ms', int(wait * 1000))
+            time.sleep(wait)
+            wait = api_breaker.retry_after()
+
+    def _track_family(self, patients):
+        """记录写入成功、带有家庭成员的患者，批次结束后推断亲子关系；写入失败的患者等重试成功后再推断"""
+        patient_ids = [patient_data['patientId'] for patient_data in patients if has_family(patient_data)]
+        if patient_ids:
+            with self._family_lock:
+                self._family_ids.update(patient_ids)
+
+    @staticmethod
+    def _written(pending, failed):
+        """pending 中没有写入失败的患者画像"""
+        failed = set(failed)
+        return [patient_data for key, patient_data, _ in pending if key not in failed]
+
+    def _infer_family(self):
+        """批次结束后只对本批涉及家庭成员的患者做亲子关系推断"""
+        with self._family_lock:
+            patient_ids, self._family_ids = sorted(self._family_ids, key=str), set()
+        if patient_ids and Config.FAMILY_INFERENCE:
+            self.processor.infer_family(patient_ids)
+
+    def _process_batch_single(self, empi_list, from_spool=False):
         with ThreadPoolExecutor(max_workers=Config.MAX_WORKERS) as executor:
             future_to_empi = {
-                executor.submit(self._process_single, empi): empi 
+                executor.submit(self._process_single, empi, from_spool): empi 
                 for empi in empi_list
             }
             
@@ -30,19 +133,161 @@ class JobManager:
                     logger.error(f"处理失败 - EMPI: {empi}, 错误: {str(e)}")
                     self.error_queue.put(empi)
     
-    def _process_single(self, empi):
+    def _process_batch_two_phase(self, empi_list, from_spool=False):
+        """
+        两阶段批量加载：
+          1. 单写入者按固定顺序一次性写入整批涉及的共享节点 (医院、科室、医生、Condition、检验项目等)
+          2. 多线程并发写入患者自有的数据，对共享节点只做 MATCH，不再争抢同一批节点的写锁
+        """
+        failed, pending = self.processor.prepare_group(self._fetch_batch(empi_list, from_spool))
+
+        if pending:
+            self.processor.compile_deltas(pending)
+            preloaded = self.processor.preload_dimensions(pending)
+            try:
+                # 预写入成功后医院、科室、生活方式节点在第二阶段只被 MATCH，不再参与冲突调度；
+                # 预写入失败时这些节点仍由各患者 MERGE，按冲突调度串行化
+                lane_failed = self._write_lanes(pending, PRELOADED_CONFLICT_LABELS if preloaded else ())
+                failed.extend(lane_failed)
+                self._track_family(self._written(pending, lane_failed))
+            finally:
+                self.processor.release_preloaded()
+                self.processor.release_deltas()
+
+        for empi in failed:
+            self.error_queue.put(empi)
+
+    def _write_lanes(self, pending, ignored_labels=()):
+        """
+        按共享节点键冲突调度写入：有冲突的患者在同一个线程内串行写入，互不相关的患者并发写入。
+
+        Returns:
+            list: 写入失败的 EMPI 列表
+        """
+        if Config.ASYNC_WRITES:
+            # 异步写入：同样按冲突调度，lane 数上限为 ASYNC_MAX_IN_FLIGHT
+            if self.async_writer is None:
+                self.async_writer = AsyncPortraitWriter(self.processor)
+            return self.async_writer.write(pending, ignored_labels)
+
+        lanes = schedule_lanes(pending, Config.MAX_WORKERS, ignored_labels)
+        failed = []
+        with ThreadPoolExecutor(max_workers=max(1, len(lanes))) as executor:
+            futures = [executor.submit(self._write_lane, lane) for lane in lanes]
+            for future in as_completed(futures):
+                failed.extend(future.result())
+        return failed
+
+    def prefetch(self, empi_list):
+        """提交整个 EMPI 列表的画像预取；未开启 ASYNC_FETCH 时不做任何事"""
+        if self.prefetcher is not None:
+            self.prefetcher.prefetch(empi_list)
+
+    def close_prefetcher(self):
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+
+    def close_async_writer(self):
+        if self.async_writer is not None:
+            self.async_writer.close()
+            self.async_writer = None
+
+    def _write_lane(self, lane):
+        failed = []
+        for group in self.processor.split_groups(lane):
+            failed.extend(self.processor.write_group(group))
+        return failed
+
+    def _fetch(self, empi, from_spool=False, wait_breaker=False):
+        """
+        获取一个患者的健康画像；从平台拉取成功后写入本地缓存。
+        wait_breaker 为 True 时 (整批拉取的工作线程) 批次中途熔断也等到可以探测时再请求，与异步预取一致，不快速失败
+        """
+        if from_spool and payload_spool.enabled:
+            try:
+                patient_data = payload_spool.get(empi)
+            except Exception as e:
+                logger.error(f"读取画像缓存失败 - EMPI: {empi}, 错误: {str(e)}")
+                patient_data = None
+            if patient_data:
+                run_metrics.incr('spool.hits')
+                if self.prefetcher is not None:
+                    self.prefetcher.discard([empi])
+                return patient_data
+            run_metrics.incr('spool.misses')
+
+        prefetched = False
+        if self.prefetcher is not None:
+            prefetched, patient_data = self.prefetcher.take(empi)
+        if not prefetched:
+            if wait_breaker:
+                self._wait_for_breaker()
+            patient_data = self.api.get_health_portrait(empi)
+        if is_streamed(patient_data):
+            # 流式解码的超大画像不写入本地缓存 (缓存需要整份画像在内存中压缩)，重试时重新拉取
+            run_metrics.incr('spool.skipped_streamed')
+        elif patient_data and payload_spool.enabled:
+            try:
+                payload_spool.put(empi, patient_data)
+            except Exception as e:
+                # 缓存写入失败不影响本次处理
+                logger.error(f"写入画像缓存失败 - EMPI: {empi}, 错误: {str(e)}")
+        return patient_data
+
+    def _fetch_batch(self, empi_list, from_spool=False):
+        """并发拉取整批健康画像，拉取失败的 EMPI 直接进入失败队列"""
+        items = []
+        with ThreadPoolExecutor(max_workers=Config.MAX_WORKERS) as executor:
+            future_to_empi = {
+                executor.submit(self._fetch, empi, from_spool, True): empi
+                for empi in empi_list
+            }
+
+            for future in as_completed(future_to_empi):
+                empi = future_to_empi[future]
+                try:
+                    patient_data = future.result()
+                except Exception as e:
+                    logger.error(f"获取数据失败 - EMPI: {empi}, 错误: {str(e)}")
+                    patient_data = None
+                if not patient_data:
+                    run_metrics.incr('patients.fetch_failed')
+                    self.error_queue.put(empi)
+                    continue
+                items.append((empi, patient_data))
+        return items
+
+    def _process_batch_grouped(self, empi_list, from_spool=False):
+        """先并发拉取整批数据，再按分组把多个患者放进同一个写事务"""
+        failed, pending = self.processor.prepare_group(self._fetch_batch(empi_list, from_spool))
+        if pending:
+            self.processor.compile_deltas(pending)
+            try:
+                lane_failed = self._write_lanes(pending)
+                failed.extend(lane_failed)
+                self._track_family(self._written(pending, lane_failed))
+            finally:
+                self.processor.release_deltas()
+        for empi in failed:
+            self.error_queue.put(empi)
+
+    def _process_single(self, empi, from_spool=False):
         # 获取数据
-        patient_data = self.api.get_health_portrait(empi)
+        patient_data = self._fetch(empi, from_spool)
         
 
         # with open("patient.json", 'r', encoding='utf-8') as f:
         #     patient_data = json.load(f)
         
         if not patient_data:
+            run_metrics.incr('patients.fetch_failed')
             return False
             
         # 处理数据
-        return self.processor.process(patient_data)
+        if not self.processor.process(patient_data):
+            return False
+        self._track_family([patient_data])
+        return True
     
     def retry_failed(self):
         failed_empis = []
@@ -51,4 +296,5 @@ class JobManager:
         
         if failed_empis:
             logger.info(f"重试 {len(failed_empis)} 条失败记录")
-            self.process_batch(failed_empis)
\ No newline at end of file
+            # 本次运行已拉取过的画像直接从本地缓存读取
+            self.process_batch(failed_empis, from_spool=True)
\ No newline at end of file
@@ -7,6 +7,8 @@ from config.settings import Config
 from etl.utils.logger import setup_logger
 from etl.utils.sqlserver import SQLServerConnection
 from scheduler.job_manager import JobManager
+from etl.utils.metrics import run_metrics
+from etl.utils.statement_stats import statement_stats
 
 logger = setup_logger('scheduler')
 
@@ -45,6 +47,7 @@ class ETLScheduler:
     def run_etl_job(self):
         """执行ETL任务"""
         logger.info("开始执行ETL任务...")
+        self.job_manager.start_run()
         
         # 加载上次运行时间
         last_run_time = self._load_last_run_time()
@@ -81,6 +84,8 @@ class ETLScheduler:
                 
         # 保存本次运行时间
         self._save_last_run_time()
+        logger.info(run_metrics.summary())
+        statement_stats.dump('scheduler')
         logger.info("ETL任务执行完成")
         
     def start(self, interval_hours=24):
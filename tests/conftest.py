@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 测试按项目根目录导入 config / etl / scheduler
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
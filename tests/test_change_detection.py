@@ -0,0 +1,77 @@
+"""画像变更检测：规范化哈希，以及画像未变化的患者跳过写入"""
+
+from contextlib import contextmanager
+
+from config.settings import Config
+from etl.core.change_detection import canonical_hash, load_stored_hashes, portrait_hash, store_hash
+from etl.processors.dry_run import RecordingTransaction
+from etl.processors.health_portrait import HealthPortraitProcessor
+from etl.utils.metrics import run_metrics
+
+PATIENT = {
+    'patientId': 'P1',
+    'name': '张三',
+    'updateTime': '2024-03-01 08:00:00',
+    'encounters': [{'encounterId': 'E1', 'createdAt': '2024-03-01 08:00:00', 'diagnoses': []}],
+}
+
+
+def test_hash_ignores_key_order_and_volatile_fields():
+    reordered = {
+        'encounters': [{'diagnoses': [], 'createdAt': '2025-01-01 00:00:00', 'encounterId': 'E1'}],
+        'updateTime': '2025-01-01 00:00:00',
+        'name': '张三',
+        'patientId': 'P1',
+    }
+    assert portrait_hash(reordered) == portrait_hash(PATIENT)
+
+
+def test_hash_changes_with_content_and_list_order():
+    assert portrait_hash(dict(PATIENT, name='李四')) != portrait_hash(PATIENT)
+    assert canonical_hash([1, 2]) != canonical_hash([2, 1])
+
+
+def test_mapping_version_changes_every_hash(monkeypatch):
+    before = portrait_hash(PATIENT)
+    monkeypatch.setattr(Config, 'CHANGE_DETECTION_VERSION', Config.CHANGE_DETECTION_VERSION + 1)
+    assert portrait_hash(PATIENT) != before
+
+
+def test_hash_statements():
+    tx = RecordingTransaction(lambda name, params: [
+        {'patientId': 'P1', 'portraitHash': 'abc'},
+    ] if name == 'patient.load_hashes' else None)
+
+    assert load_stored_hashes(tx, ('P1', 'P2')) == {'P1': 'abc'}
+    store_hash(tx, 'P2', 'def')
+    assert [(name, params) for name, _, params in tx.statements] == [
+        ('patient.load_hashes', {'patientIds': ['P1', 'P2']}),
+        ('patient.store_hash', {'patientId': 'P2', 'portraitHash': 'def'}),
+    ]
+
+
+class FakeConnection:
+    def __init__(self, stored):
+        self.tx = RecordingTransaction(lambda name, params: [
+            {'patientId': patient_id, 'portraitHash': stored[patient_id]}
+            for patient_id in params['patientIds'] if patient_id in stored
+        ])
+
+    @contextmanager
+    def get_session(self):
+        yield self.tx
+
+
+def test_unchanged_patients_are_skipped(monkeypatch):
+    monkeypatch.setattr(Config, 'CHANGE_DETECTION', True)
+    run_metrics.reset()
+    changed = dict(PATIENT, patientId='P2')
+    processor = HealthPortraitProcessor.__new__(HealthPortraitProcessor)
+    processor.db = FakeConnection({'P1': portrait_hash(PATIENT), 'P2': 'stale'})
+
+    failed, pending = processor.prepare_group([('e1', PATIENT), ('e2', changed), ('e3', None)])
+
+    assert failed == ['e3']
+    assert pending == [('e2', changed, portrait_hash(changed))]
+    assert len(processor.db.tx.statements) == 1
+    assert run_metrics.get('patients.skipped_unchanged') == 1
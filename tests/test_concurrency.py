@@ -0,0 +1,98 @@
+"""大数据平台接口的 AIMD 自适应并发上限"""
+
+import threading
+
+import pytest
+
+from config.settings import Config
+from etl.utils.concurrency import AIMDController, LatencyWindow
+from etl.utils.resilience import DeadlineExceeded
+
+
+@pytest.fixture(autouse=True)
+def adaptive(monkeypatch):
+    monkeypatch.setattr(Config, 'ADAPTIVE_CONCURRENCY', True)
+
+
+def controller(**overrides):
+    settings = dict(min_limit=2, max_limit=10, initial=4, target_p95_ms=500, max_error_rate=0.2,
+                    window_size=10, decrease_factor=0.5)
+    settings.update(overrides)
+    return AIMDController(**settings)
+
+
+def record(control, count, latency_ms=100, ok=True):
+    for _ in range(count):
+        control.record(latency_ms, ok)
+
+
+def test_window_p95_and_error_rate():
+    window = LatencyWindow(20)
+    for latency_ms in range(1, 21):
+        window.add(latency_ms, latency_ms % 5 != 0)
+    assert window.p95() == 19
+    assert window.error_rate() == pytest.approx(0.2)
+
+
+def test_healthy_window_adds_one():
+    control = controller()
+    record(control, 9)
+    assert control.limit == 4
+    record(control, 1)
+    assert control.limit == 5
+    record(control, 10)
+    assert control.limit == 6
+
+
+def test_slow_window_halves_the_limit():
+    control = controller(initial=8)
+    record(control, 10, latency_ms=800)
+    assert control.limit == 4
+
+
+def test_errors_decrease_before_the_window_fills():
+    control = controller(initial=8)
+    record(control, 2, ok=False)
+    assert control.limit == 8
+    # 第 3 个错误已超过 20% × 10，不等窗口攒满
+    record(control, 1, ok=False)
+    assert control.limit == 4
+
+
+def test_limit_stays_within_bounds():
+    control = controller(initial=3)
+    record(control, 10, latency_ms=800)
+    record(control, 10, latency_ms=800)
+    assert control.limit == 2
+    record(control, 200)
+    assert control.limit == 10
+
+
+def test_disabled_controller_uses_the_maximum(monkeypatch):
+    monkeypatch.setattr(Config, 'ADAPTIVE_CONCURRENCY', False)
+    control = controller()
+    record(control, 10, latency_ms=800)
+    assert control.limit == 10
+
+
+def test_slot_waits_for_capacity():
+    control = controller(initial=2)
+    with control.slot(), control.slot():
+        with pytest.raises(DeadlineExceeded):
+            with control.slot(timeout=0.01):
+                pass
+
+    entered = threading.Event()
+
+    def wait_for_slot():
+        with control.slot(timeout=5):
+            entered.set()
+
+    with control.slot(), control.slot():
+        waiter = threading.Thread(target=wait_for_slot)
+        waiter.start()
+        assert not entered.wait(0.05)
+        # 上调上限后等待者立即获得名额
+        record(control, 10)
+        assert entered.wait(1)
+    waiter.join()
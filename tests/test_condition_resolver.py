@@ -0,0 +1,102 @@
+"""Condition 解析缓存：预热按键加载完整的节点集合，命中的诊断不再访问数据库，缓存按 LRU 淘汰"""
+
+from contextlib import contextmanager
+
+from etl.core.condition_resolver import ConditionResolver
+from etl.processors.dry_run import RecordingTransaction, fake_responder
+
+# 同一个 code 对应两个节点
+CONDITIONS = [
+    ('c1', 'I10', '高血压'),
+    ('c2', 'I10', '原发性高血压'),
+    ('c3', 'E11', '2型糖尿病'),
+    ('c4', None, '头痛'),
+]
+
+
+def aggregated(field):
+    groups = {}
+    for node_id, code, name in CONDITIONS:
+        key = code if field == 'code' else name
+        if key is not None:
+            groups.setdefault(key, []).append(node_id)
+    return [{field: key, 'ids': ids} for key, ids in groups.items()]
+
+
+class FakeDriver:
+    """预热语句按 code / name 聚合返回 CONDITIONS"""
+
+    def __init__(self):
+        self.tx = RecordingTransaction(self._respond)
+
+    @staticmethod
+    def _respond(name, params):
+        field = {'condition.warm_codes': 'code', 'condition.warm_names': 'name'}[name]
+        return aggregated(field)[:params['limit']]
+
+    @contextmanager
+    def session(self, database=None):
+        yield self.tx
+
+
+def diagnosis(code, name, encounter_id='E1'):
+    return {'encounterId': encounter_id, 'diseaseCode': code, 'diseaseName': name}
+
+
+def link(resolver, rows):
+    tx = RecordingTransaction(fake_responder)
+    resolver.begin()
+    resolver.link_diagnoses(tx, rows)
+    resolver.commit()
+    return tx.statements
+
+
+def test_warm_loads_every_node_of_a_code():
+    resolver = ConditionResolver(max_size=10)
+    assert resolver.warm(FakeDriver()) == 2 + 4
+
+    (name, _, params), = link(resolver, [diagnosis('I10', '高血压'), diagnosis(None, '头痛')])
+    assert name == 'diagnosis.link_resolved'
+    assert [row['conditionIds'] for row in params['rows']] == [('c1', 'c2'), ('c4',)]
+
+
+def test_warm_limit_cuts_between_codes():
+    resolver = ConditionResolver(max_size=1)
+    resolver.warm(FakeDriver())
+
+    # I10 的两个节点都在缓存中；E11 超出上限未加载，回落到数据库解析
+    statements = link(resolver, [diagnosis('I10', '高血压'), diagnosis('E11', '2型糖尿病')])
+    assert [name for name, _, _ in statements] == ['diagnosis.resolve', 'diagnosis.link_resolved']
+    assert [row['diseaseCode'] for row in statements[0][2]['rows']] == ['E11']
+    assert statements[1][2]['rows'][0]['conditionIds'] == ('c1', 'c2')
+
+
+def test_resolved_conditions_are_cached_after_commit():
+    resolver = ConditionResolver(max_size=10)
+    first = link(resolver, [diagnosis('J45', '哮喘')])
+    second = link(resolver, [diagnosis('J45', '哮喘', encounter_id='E2')])
+
+    assert [name for name, _, _ in first] == ['diagnosis.resolve', 'diagnosis.link_resolved']
+    assert [name for name, _, _ in second] == ['diagnosis.link_resolved']
+    assert resolver.hits == 1 and resolver.misses == 1
+
+
+def test_rolled_back_resolutions_are_not_cached():
+    resolver = ConditionResolver(max_size=10)
+    tx = RecordingTransaction(fake_responder)
+    resolver.begin()
+    resolver.link_diagnoses(tx, [diagnosis('J45', '哮喘')])
+    resolver.rollback()
+
+    assert [name for name, _, _ in link(resolver, [diagnosis('J45', '哮喘')])][0] == 'diagnosis.resolve'
+
+
+def test_least_recently_used_code_is_evicted():
+    resolver = ConditionResolver(max_size=2)
+    link(resolver, [diagnosis('A1', '甲'), diagnosis('B1', '乙')])
+    link(resolver, [diagnosis('A1', '甲')])
+    link(resolver, [diagnosis('C1', '丙')])
+
+    # B1 最久未使用，被淘汰后重新解析；A1 仍然命中
+    assert [name for name, _, _ in link(resolver, [diagnosis('A1', '甲')])] == ['diagnosis.link_resolved']
+    assert [name for name, _, _ in link(resolver, [diagnosis('B1', '乙')])][0] == 'diagnosis.resolve'
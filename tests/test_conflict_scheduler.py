@@ -0,0 +1,68 @@
+"""冲突调度：互不相关的患者分到不同 lane，共享节点的患者串行写入；医院、科室按 id 顺序加锁"""
+
+from etl.core.conflict_scheduler import conflict_keys, schedule_lanes
+from etl.core.etl_patient import import_section_rows
+from etl.processors.dry_run import RecordingTransaction
+
+
+def patient(patient_id, hospitals=('H1',), family_id=None, **fields):
+    data = dict(fields, patientId=patient_id, encounters=[
+        {'encounterId': f'{patient_id}-E{index}', 'hospitalId': hospital_id, 'departmentId': f'{hospital_id}-D1'}
+        for index, hospital_id in enumerate(hospitals)
+    ])
+    if family_id:
+        data['familyMembers'] = [{'idType': '01', 'idValue': family_id, 'relationship': '1', 'name': '配偶'}]
+    return data
+
+
+def items(*patients):
+    return [(data['patientId'], data, None) for data in patients]
+
+
+def lane_ids(lanes):
+    return sorted(sorted(key for key, _, _ in lane) for lane in lanes)
+
+
+def test_hospital_and_department_are_not_conflict_keys():
+    labels = {label for label, _ in conflict_keys(patient('P1', hospitals=('H1', 'H2')))}
+    assert labels == {'Patient'}
+
+
+def test_independent_patients_land_in_separate_lanes():
+    # 四个患者在同一家医院、同一个科室就诊，但没有其他共享节点
+    lanes = schedule_lanes(items(*(patient(f'P{index}') for index in range(4))), lanes=4)
+    assert lane_ids(lanes) == [['P0'], ['P1'], ['P2'], ['P3']]
+
+
+def test_patients_sharing_a_family_member_share_a_lane():
+    lanes = schedule_lanes(items(
+        patient('P1', family_id='ID-1'),
+        patient('P2', family_id='ID-1'),
+        patient('P3', idType='01', idValue='ID-3'),
+        patient('P4', family_id='ID-3'),
+        patient('P5'),
+    ), lanes=4)
+    assert lane_ids(lanes) == [['P1', 'P2'], ['P3', 'P4'], ['P5']]
+
+
+def test_components_keep_input_order_within_a_lane():
+    lanes = schedule_lanes(items(
+        patient('P2', family_id='ID-1'),
+        patient('P1', family_id='ID-1'),
+    ), lanes=2)
+    assert [[key for key, _, _ in lane] for lane in lanes] == [['P2', 'P1']]
+
+
+def test_hospital_rows_are_written_in_key_order():
+    tx = RecordingTransaction()
+    rows = [
+        {'encounterId': 'E1', 'hospitalId': 'H2', 'hospitalName': '二院'},
+        {'encounterId': 'E2', 'hospitalId': 'H1', 'hospitalName': '一院'},
+        {'encounterId': 'E3', 'hospitalId': 'H2', 'hospitalName': '第二医院'},
+    ]
+    import_section_rows(tx, 'P1', 'encounter.hospital', rows)
+
+    (name, _, params), = tx.statements
+    assert name == 'encounter.hospital'
+    # 同一医院的多行保持原有先后，最后写入的名称不变
+    assert [row['encounterId'] for row in params['rows']] == ['E2', 'E1', 'E3']
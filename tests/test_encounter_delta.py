@@ -0,0 +1,79 @@
+"""就诊增量同步：只写入指纹变化的就诊，已消失的就诊只在显式开启时删除"""
+
+import pytest
+
+from config.settings import Config
+from etl.core.encounter_delta import encounter_fingerprints, plan_encounter_delta
+from etl.processors.dry_run import RecordingTransaction
+from etl.utils.metrics import run_metrics
+
+
+def encounter(encounter_id, diagnosis='高血压'):
+    return {'encounterId': encounter_id, 'encounterType': 1,
+            'diagnoses': [{'diagnosisName': diagnosis, 'diagnosisNo': 'I10'}]}
+
+
+def recording(stored):
+    def responder(name, params):
+        if name == 'encounter.load_hashes':
+            return [{'encounterId': eid, 'subtreeHash': digest} for eid, digest in stored.items()]
+        return None
+    return RecordingTransaction(responder)
+
+
+def names(tx):
+    return [name for name, _, _ in tx.statements]
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    run_metrics.reset()
+
+
+def test_only_changed_and_new_encounters_are_written():
+    encounters = [encounter('E1'), encounter('E2', '糖尿病'), encounter('E3')]
+    stored = encounter_fingerprints([encounter('E1'), encounter('E2')])
+    tx = recording(stored)
+
+    delta = plan_encounter_delta(tx, 'P1', encounters)
+
+    assert [row['encounterId'] for row in delta.encounters] == ['E2', 'E3']
+    assert set(delta.hashes) == {'E2', 'E3'}
+    assert delta.unchanged == 1
+    # 只有指纹变化的 E2 需要清空旧子树
+    assert names(tx) == ['encounter.load_hashes', 'encounter.prune']
+    assert tx.statements[1][2]['encounterIds'] == ['E2']
+
+
+def test_vanished_encounters_are_kept_by_default(monkeypatch):
+    monkeypatch.setattr(Config, 'ENCOUNTER_DELTA_DELETE', False)
+    tx = recording(encounter_fingerprints([encounter('E1'), encounter('E2')]))
+
+    delta = plan_encounter_delta(tx, 'P1', [encounter('E1')])
+
+    assert names(tx) == ['encounter.load_hashes']
+    assert delta.removed == 0
+    assert run_metrics.get('encounters.delete_skipped') == 1
+
+
+def test_vanished_encounters_are_deleted_when_enabled(monkeypatch):
+    monkeypatch.setattr(Config, 'ENCOUNTER_DELTA_DELETE', True)
+    tx = recording(encounter_fingerprints([encounter('E1'), encounter('E2')]))
+
+    delta = plan_encounter_delta(tx, 'P1', [encounter('E1')])
+
+    assert names(tx) == ['encounter.load_hashes', 'encounter.prune', 'encounter.delete']
+    assert tx.statements[2][2] == {'patientId': 'P1', 'encounterIds': ['E2']}
+    assert delta.removed == 1
+    assert run_metrics.get('encounters.removed') == 1
+
+
+def test_empty_encounter_list_never_deletes(monkeypatch):
+    monkeypatch.setattr(Config, 'ENCOUNTER_DELTA_DELETE', True)
+    tx = recording(encounter_fingerprints([encounter('E1'), encounter('E2')]))
+
+    delta = plan_encounter_delta(tx, 'P1', [])
+
+    assert names(tx) == ['encounter.load_hashes']
+    assert delta.removed == 0
+    assert run_metrics.get('encounters.delete_skipped') == 2
@@ -0,0 +1,99 @@
+"""图谱增量：编译结果与写入的 UNWIND 语句"""
+
+import pytest
+
+from config.settings import Config
+from etl.core.condition_resolver import condition_resolver
+from etl.core.delta_writer import apply_delta
+from etl.core.graph_delta import GraphDelta, compile_patient
+from etl.processors.dry_run import RecordingTransaction, fake_responder
+
+
+def encounter(encounter_id, hospital_id, diagnoses=()):
+    return {
+        'encounterId': encounter_id,
+        'encounterType': '1',
+        'visitStartTime': '2024-03-01 08:00:00',
+        'hospitalId': hospital_id,
+        'hospitalName': f'医院{hospital_id}',
+        'diagnoses': [{'diagnosisNo': code, 'diagnosisName': name} for code, name in diagnoses],
+    }
+
+
+PATIENT = {
+    'patientId': 'P1',
+    'name': '张三',
+    'idType': '01',
+    'idValue': '110101199001011234',
+    'encounters': [
+        encounter('E1', 'H2', [('I10', '高血压')]),
+        encounter('E2', 'H1'),
+        encounter('E3', 'H2'),
+    ],
+}
+
+
+@pytest.fixture(autouse=True)
+def resolver_transaction():
+    # 诊断解析结果只在事务提交后进入缓存，测试之间互不影响
+    condition_resolver.begin()
+    yield
+    condition_resolver.rollback()
+
+
+def apply(delta):
+    tx = RecordingTransaction(fake_responder)
+    apply_delta(tx, delta.compact())
+    return {name: params for name, _, params in tx.statements}, [name for name, _, _ in tx.statements]
+
+
+def encounter_props(delta):
+    return {upsert.ref.key[0]: upsert.set_props for upsert in delta.nodes if upsert.ref.label == 'Encounter'}
+
+
+def test_subtree_hash_is_omitted_without_encounter_delta_sync(monkeypatch):
+    monkeypatch.setattr(Config, 'ENCOUNTER_DELTA_SYNC', False)
+    assert all('subtreeHash' not in props for props in encounter_props(compile_patient(PATIENT)).values())
+
+    monkeypatch.setattr(Config, 'ENCOUNTER_DELTA_SYNC', True)
+    props = encounter_props(compile_patient(PATIENT))
+    assert all(props[eid]['subtreeHash'] for eid in ('E1', 'E2', 'E3'))
+
+
+def test_one_statement_per_label_and_rel_type():
+    statements, order = apply(compile_patient(PATIENT))
+
+    assert order[0] == 'delta.node.Patient.patientId'
+    assert len(statements['delta.node.Encounter.encounterId']['rows']) == 3
+    # 两次就诊在 H2：合并为一个节点，按 id 排序写入
+    assert [row['key'] for row in statements['delta.node.Hospital.hospitalId']['rows']] == [['H1'], ['H2']]
+    assert len(statements['delta.rel.AT_HOSPITAL.Encounter.encounterId-Hospital.hospitalId']['rows']) == 3
+    assert len(order) == len(set(order))
+
+
+def test_diagnoses_are_written_by_condition_resolution():
+    statements, order = apply(compile_patient(PATIENT))
+
+    assert order.index('delta.node.Encounter.encounterId') < order.index('diagnosis.resolve')
+    assert statements['diagnosis.link_resolved']['rows'][0]['encounterId'] == 'E1'
+    # Condition 节点和 RECORDED_DIAGNOSIS 不再按增量 upsert
+    assert not [name for name in order if 'Condition' in name or 'RECORDED_DIAGNOSIS' in name]
+
+
+def test_only_encounters_keeps_changed_subtrees(monkeypatch):
+    monkeypatch.setattr(Config, 'ENCOUNTER_DELTA_SYNC', True)
+    statements, order = apply(compile_patient(PATIENT).only_encounters(['E2']))
+
+    assert [row['key'] for row in statements['delta.node.Encounter.encounterId']['rows']] == [['E2']]
+    assert [row['key'] for row in statements['delta.node.Hospital.hospitalId']['rows']] == [['H1']]
+    assert 'diagnosis.resolve' not in order
+    assert statements['delta.node.Patient.patientId']['rows'][0]['key'] == ['P1']
+
+
+def test_merged_deltas_share_statements():
+    other = dict(PATIENT, patientId='P2', idValue='110101199202022345',
+                 encounters=[encounter('E9', 'H1')])
+    statements, _ = apply(GraphDelta.merged([compile_patient(PATIENT), compile_patient(other)]))
+
+    assert [row['key'] for row in statements['delta.node.Patient.patientId']['rows']] == [['P1'], ['P2']]
+    assert [row['key'] for row in statements['delta.node.Hospital.hospitalId']['rows']] == [['H1'], ['H2']]
@@ -0,0 +1,96 @@
+"""对冲请求：输掉的请求被取消时不计为熔断失败，也不计入并发控制的错误"""
+
+import asyncio
+
+import msgspec
+import pytest
+
+from config.settings import Config
+from etl.utils import prefetch
+from etl.utils.hedging import Hedger
+from etl.utils.resilience import CircuitBreaker, TokenBucket
+
+BODY = msgspec.json.encode({'code': 0, 'msg': 'ok', 'data': {'patientId': 'P1'}})
+
+
+class RecordingController:
+    """只记录耗时和成败的并发控制器"""
+
+    limit = 10
+
+    def __init__(self):
+        self.records = []
+
+    def record(self, latency_ms, ok):
+        self.records.append(ok)
+
+    @property
+    def errors(self):
+        return self.records.count(False)
+
+
+class Response:
+    content = BODY
+
+    def raise_for_status(self):
+        pass
+
+
+class SlowFirstClient:
+    """第一个请求 delays[0] 秒后返回，第二个请求 delays[1] 秒后返回"""
+
+    def __init__(self, *delays):
+        self.delays = list(delays)
+
+    async def get(self, path, params=None, timeout=None):
+        await asyncio.sleep(self.delays.pop(0))
+        return Response()
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    monkeypatch.setattr(Config, 'STREAM_DECODE', False)
+    monkeypatch.setattr(prefetch, 'api_rate_limiter', TokenBucket(rate=0))
+    breaker = CircuitBreaker(failure_threshold=5, reset_seconds=30)
+    monkeypatch.setattr(prefetch, 'api_breaker', breaker)
+    return breaker
+
+
+def hedged_api(monkeypatch, client):
+    monkeypatch.setattr(Config, 'HEDGED_REQUESTS', True)
+    hedger = Hedger(budget=1.0, window_size=10, min_samples=1, min_delay_ms=10)
+    hedger._window.add(10, True)
+    monkeypatch.setattr(prefetch, 'api_hedger', hedger)
+    api = prefetch.AsyncHealthPortraitAPI(base_url='http://portrait.test', concurrency=4,
+                                          controller=RecordingController())
+    api._client = client
+    return api
+
+
+def fetch(api, settle=0.05):
+    async def run():
+        result = await api.get_health_portrait('P1')
+        # 让被取消的请求走完 CancelledError 处理
+        await asyncio.sleep(settle)
+        return result
+    return asyncio.run(run())
+
+
+def test_hedge_win_does_not_count_loser_as_failure(monkeypatch, breaker):
+    monkeypatch.setattr(Config, 'PATIENT_FETCH_DEADLINE', 5)
+    api = hedged_api(monkeypatch, SlowFirstClient(1.0, 0.0))
+
+    assert fetch(api) == {'patientId': 'P1'}
+    assert breaker._failures == 0
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert api.controller.errors == 0
+    assert api.controller.records == [True]
+
+
+def test_deadline_cancellation_counts_as_failure(monkeypatch, breaker):
+    monkeypatch.setattr(Config, 'PATIENT_FETCH_DEADLINE', 0.05)
+    api = hedged_api(monkeypatch, SlowFirstClient(1.0, 1.0))
+
+    assert fetch(api) is None
+    assert breaker._failures == 2
+    assert api.controller.errors == 2
@@ -0,0 +1,53 @@
+"""parse_datetime 的正则快速路径与逐个格式 strptime 的结果一致"""
+
+from datetime import datetime
+
+import pytest
+
+from etl.core.etl_patient import _parse_datetime_slow, parse_datetime
+from etl.utils.metrics import run_metrics
+
+SAMPLES = [
+    '2024-03-01',
+    '2024-03-01 08:05:09',
+    '2024-03-01T08:05:09',
+    '2024-03-01 08:05:09.123',
+    '2024-03-01T08:05:09.123456',
+    '2024-03-01T08:05:09Z',
+    '2024-03-01t08:05:09z',
+    '2024-3-1 8:5:9',
+    '2024-03- 1',
+    '2024-03-01  08:05:09',
+    '2024-03-01 23:59:60',
+    # 以下快速路径不匹配或结果不合法，交给 strptime 判定
+    '2024-03-01 08:05:09.123Z',
+    '2024-03-01 08:05:09Z',
+    '2024-02-30',
+    '2024-13-01',
+    '2024-03-01 24:00:00',
+    '2024-03-01 08:05',
+    '2024-03-01 08:05:09.1234567',
+    '24-03-01',
+    '2024/03/01',
+    '不详',
+    '',
+]
+
+
+@pytest.mark.parametrize('value', SAMPLES)
+def test_fast_path_matches_strptime(value):
+    assert parse_datetime(value) == _parse_datetime_slow(value)
+
+
+def test_fraction_is_padded_to_microseconds():
+    assert parse_datetime('2024-03-01 08:05:09.12') == datetime(2024, 3, 1, 8, 5, 9, 120000)
+
+
+def test_unparseable_values_are_counted():
+    run_metrics.reset()
+    assert parse_datetime('2024-02-30') is None
+    assert parse_datetime('2024-02-30') is None
+    assert parse_datetime(None) is None
+    assert parse_datetime(20240301) is None
+    # 缓存命中的无法解析值同样计数；非字符串不计
+    assert run_metrics.get('datetime.unparseable') == 2
@@ -0,0 +1,84 @@
+"""类型化画像记录：解码时的校验与清洗，映射结果与字典映射一致"""
+
+import json
+import os
+
+import msgspec
+import pytest
+
+from config.settings import Config
+from etl.core.etl_patient import build_patient_sections
+from etl.core.portrait_records import PatientRecord, decode_portrait, to_record
+from etl.utils.metrics import run_metrics
+
+SAMPLE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'files', 'test_patient.json')
+
+
+@pytest.fixture
+def sample():
+    with open(SAMPLE_PATH, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def sections(patient_data, monkeypatch, typed):
+    monkeypatch.setattr(Config, 'TYPED_RECORDS', typed)
+    return build_patient_sections(patient_data['patientId'], patient_data)
+
+
+def test_decode_portrait_returns_records(sample):
+    response = decode_portrait(msgspec.json.encode(sample))
+    assert response.code == sample['code']
+    assert isinstance(response.data, PatientRecord)
+    assert response.data.patient_id == sample['data']['patientId']
+
+
+def blank_to_none(sections_by_name):
+    """记录在解码时把空串视为 None，字典映射保留原值"""
+    def normalize(value):
+        if isinstance(value, str) and not value.strip():
+            return None
+        return value
+    return {name: [{key: normalize(value) for key, value in row.items()} for row in rows]
+            for name, rows in sections_by_name.items()}
+
+
+def test_typed_sections_match_dict_mapping(sample, monkeypatch):
+    patient_data = sample['data']
+    typed = sections(patient_data, monkeypatch, True)
+    assert typed == blank_to_none(typed)
+    assert typed == blank_to_none(sections(patient_data, monkeypatch, False))
+
+
+def test_records_strip_blanks_and_sentinels():
+    record = to_record({
+        'patientId': ' P1 ',
+        'name': '',
+        'encounters': [
+            {'encounterId': 'E1', 'diagnoses': [{'diagnosisName': ' 无 ', 'diagnosisNo': ' I10 '}]},
+        ],
+    })
+    assert record.patient_id == 'P1'
+    assert record.name is None
+    diagnosis = record.encounters[0].diagnoses[0]
+    assert (diagnosis.name, diagnosis.code) == (None, 'I10')
+
+
+def test_invalid_entries_are_dropped_and_counted():
+    run_metrics.reset()
+    record = to_record({
+        'patientId': 'P1',
+        'encounters': [None, {'encounterId': ''}, {'encounterId': 'E1'}],
+        'allergyProfilesList': [{'allergen': '不详'}, {'allergen': '青霉素'}],
+    })
+    assert [encounter.encounter_id for encounter in record.encounters] == ['E1']
+    assert [allergy.allergen for allergy in record.allergies] == ['青霉素']
+    assert run_metrics.get('records.dropped') == 3
+
+
+def test_mismatched_structure_falls_back_to_dict_mapping(monkeypatch):
+    run_metrics.reset()
+    # name 位置出现对象：转换失败，按字典映射
+    patient_data = {'patientId': 'P1', 'name': {'first': '三'}, 'encounters': [{'encounterId': 'E1'}]}
+    assert to_record(patient_data) is None
+    assert run_metrics.get('records.invalid') == 1
+    assert sections(patient_data, monkeypatch, True) == sections(patient_data, monkeypatch, False)
@@ -0,0 +1,72 @@
+"""画像预取：放弃的预取归还名额，等待拉取结果有时限"""
+
+import asyncio
+
+import pytest
+
+from config.settings import Config
+from etl.utils.prefetch import PortraitPrefetcher
+
+
+class FakeAPI:
+    """按 EMPI 返回画像；delays 中的 EMPI 先等待对应秒数"""
+
+    def __init__(self, delays=None):
+        self.delays = delays or {}
+        self.requested = []
+
+    async def get_health_portrait(self, empi):
+        self.requested.append(empi)
+        await asyncio.sleep(self.delays.get(empi, 0))
+        return {'patientId': empi}
+
+    async def aclose(self):
+        pass
+
+
+@pytest.fixture
+def make_prefetcher():
+    prefetchers = []
+
+    def make(depth, delays=None):
+        api = FakeAPI(delays)
+        prefetcher = PortraitPrefetcher(api_factory=lambda concurrency: api, concurrency=4, depth=depth)
+        prefetchers.append(prefetcher)
+        return prefetcher, api
+
+    yield make
+    for prefetcher in prefetchers:
+        prefetcher.close()
+
+
+def test_discarded_prefetch_releases_its_slot(make_prefetcher):
+    prefetcher, api = make_prefetcher(depth=1)
+    prefetcher.prefetch(['A', 'B', 'C'])
+
+    # A 从本地缓存读到，不会被取走；名额不归还时 B 永远拉取不到
+    prefetcher.discard(['A'])
+    assert prefetcher.take('B') == (True, {'patientId': 'B'})
+    assert prefetcher.take('C') == (True, {'patientId': 'C'})
+    assert prefetcher.take('A') == (False, None)
+
+
+def test_discard_before_fetch_starts_skips_the_request(make_prefetcher):
+    prefetcher, api = make_prefetcher(depth=1, delays={'A': 0.2})
+    prefetcher.prefetch(['A', 'B', 'C'])
+
+    prefetcher.discard(['B'])
+    assert prefetcher.take('A') == (True, {'patientId': 'A'})
+    assert prefetcher.take('C') == (True, {'patientId': 'C'})
+    assert api.requested == ['A', 'C']
+
+
+def test_take_gives_up_after_deadline(monkeypatch, make_prefetcher):
+    monkeypatch.setattr(Config, 'PATIENT_FETCH_DEADLINE', 0.05)
+    monkeypatch.setattr(Config, 'API_BREAKER_RESET_SECONDS', 0.05)
+    prefetcher, api = make_prefetcher(depth=1, delays={'A': 0.5})
+    prefetcher.prefetch(['A', 'B'])
+
+    assert prefetcher.take('A') == (True, None)
+    # 超时放弃的 A 拉取结束后归还名额
+    monkeypatch.setattr(Config, 'PATIENT_FETCH_DEADLINE', 5)
+    assert prefetcher.take('B') == (True, {'patientId': 'B'})
@@ -0,0 +1,70 @@
+"""检查报告库：事务中的正文提交后才写入，回滚时丢弃"""
+
+import pytest
+
+from config.settings import Config
+from etl.core import etl_patient
+from etl.core.etl_patient import import_section_rows
+from etl.processors.dry_run import RecordingTransaction
+from etl.utils.report_store import ReportStore
+
+EXAM = {'encounterId': 'E1', 'reportId': 'R1', 'fullReport': '双肺纹理清晰，未见实质性病变。'}
+
+
+@pytest.fixture
+def store(monkeypatch, tmp_path):
+    monkeypatch.setattr(Config, 'REPORT_STORE_ENABLED', True)
+    store = ReportStore(str(tmp_path / 'reports.sqlite'))
+    monkeypatch.setattr(etl_patient, 'report_store', store)
+    yield store
+    store.close()
+
+
+def write_exam():
+    tx = RecordingTransaction()
+    import_section_rows(tx, 'P1', 'exam.upsert', [dict(EXAM)])
+    (name, _, params), = tx.statements
+    assert name == 'exam.upsert'
+    return params['rows'][0]
+
+
+def test_report_is_stored_after_commit(store):
+    store.begin()
+    row = write_exam()
+    assert row['fullReport'] is None
+    assert store.get('R1') is None
+
+    store.commit()
+    assert store.get('R1')['fullReport'] == EXAM['fullReport']
+
+
+def test_rolled_back_report_is_not_stored(store):
+    store.begin()
+    write_exam()
+    store.rollback()
+    assert store.get('R1') is None
+
+    # 重试时重新开始暂存，只写入最后一次
+    store.begin()
+    write_exam()
+    store.begin()
+    write_exam()
+    store.commit()
+    assert store.get('R1')['length'] == len(EXAM['fullReport'])
+
+
+def test_report_outside_transaction_is_stored_immediately(store):
+    write_exam()
+    assert store.get('R1')['fullReport'] == EXAM['fullReport']
+
+
+def test_detached_reports_are_stored_when_attached_and_committed(store):
+    store.begin()
+    write_exam()
+    staged = store.detach()
+    store.commit()
+    assert store.get('R1') is None
+
+    store.attach(staged)
+    store.commit()
+    assert store.get('R1') is not None
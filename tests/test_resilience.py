@@ -0,0 +1,211 @@
+"""大数据平台接口的令牌桶限流、熔断器状态机，以及格式错误的响应计为失败"""
+
+import asyncio
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import msgspec
+import pytest
+
+from config.settings import Config
+from etl.utils import api, prefetch, resilience
+from etl.utils.resilience import CircuitBreaker, CircuitOpenError, TokenBucket
+
+
+class Clock:
+    """替换 resilience 模块中的 time，手动推进 monotonic"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(resilience, 'time', SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+# --- 令牌桶 ---
+
+def test_token_bucket_spends_burst_then_waits(clock):
+    bucket = TokenBucket(rate=10, burst=2)
+    assert [bucket.reserve() for _ in range(2)] == [0.0, 0.0]
+    # 令牌已用完，后续调用方按预占顺序排队
+    assert bucket.reserve() == pytest.approx(0.1)
+    assert bucket.reserve() == pytest.approx(0.2)
+
+    clock.advance(1)
+    assert bucket.reserve() == 0.0
+
+
+def test_token_bucket_does_not_reserve_beyond_max_wait(clock):
+    bucket = TokenBucket(rate=1, burst=1)
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve(max_wait=0.5) is None
+    # 未预占，等待时间没有累加
+    assert bucket.reserve(max_wait=1) == pytest.approx(1.0)
+
+
+def test_token_bucket_without_rate_never_waits():
+    bucket = TokenBucket(rate=0)
+    assert {bucket.reserve(max_wait=0) for _ in range(100)} == {0.0}
+
+
+# --- 熔断器 ---
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_seconds=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.retry_after() == pytest.approx(30)
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_half_open_lets_one_probe_through(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=30)
+    breaker.record_failure()
+    clock.advance(30)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    assert breaker.retry_after() == resilience.HALF_OPEN_POLL_SECONDS
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.before_call()
+
+
+def test_failed_probe_reopens(clock):
+    breaker = CircuitBreaker(failure_threshold=5, reset_seconds=30)
+    for _ in range(5):
+        breaker.record_failure()
+    clock.advance(30)
+    breaker.before_call()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.retry_after() == pytest.approx(30)
+
+
+def test_disabled_breaker_never_opens(clock):
+    breaker = CircuitBreaker(failure_threshold=0, reset_seconds=30)
+    for _ in range(10):
+        breaker.record_failure()
+    breaker.before_call()
+    assert breaker.retry_after() == 0.0
+
+
+# --- 响应格式 ---
+
+MALFORMED_BODIES = [b'[]', b'{"msg": "ok"}', b'{"code": 0, "msg": "ok"}']
+
+
+class RecordingController:
+    """只记录成败的并发控制器"""
+
+    limit = 10
+
+    def __init__(self):
+        self.records = []
+
+    @contextmanager
+    def slot(self, timeout=None):
+        yield
+
+    def record(self, latency_ms, ok):
+        self.records.append(ok)
+
+
+class Response:
+    def __init__(self, content):
+        self.content = content
+
+    def raise_for_status(self):
+        pass
+
+
+class Session:
+    def __init__(self, content):
+        self.content = content
+
+    def get(self, url, params=None, timeout=None, stream=False):
+        return Response(self.content)
+
+
+class AsyncClient:
+    def __init__(self, content):
+        self.content = content
+
+    async def get(self, path, params=None, timeout=None):
+        return Response(self.content)
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    monkeypatch.setattr(Config, 'STREAM_DECODE', False)
+    monkeypatch.setattr(Config, 'HEDGED_REQUESTS', False)
+    breaker = CircuitBreaker(failure_threshold=5, reset_seconds=30)
+    for module in (api, prefetch):
+        monkeypatch.setattr(module, 'api_breaker', breaker)
+        monkeypatch.setattr(module, 'api_rate_limiter', TokenBucket(rate=0))
+    return breaker
+
+
+def sync_api(monkeypatch, content):
+    controller = RecordingController()
+    monkeypatch.setattr(api, 'api_concurrency', controller)
+    client = api.HealthPortraitAPI()
+    client.session = Session(content)
+    return client, controller
+
+
+def async_api(content):
+    client = prefetch.AsyncHealthPortraitAPI(base_url='http://portrait.test', concurrency=4,
+                                             controller=RecordingController())
+    client._client = AsyncClient(content)
+    return client, client.controller
+
+
+@pytest.mark.parametrize('body', MALFORMED_BODIES)
+def test_malformed_payload_counts_as_failure(monkeypatch, breaker, body):
+    client, controller = sync_api(monkeypatch, body)
+    breaker.record_failure()
+    assert client.get_health_portrait('P1') is None
+    # 不能先按成功重置连续失败计数
+    assert breaker._failures == 2
+    assert controller.records == [False]
+
+
+@pytest.mark.parametrize('body', MALFORMED_BODIES)
+def test_malformed_payload_counts_as_failure_async(breaker, body):
+    client, controller = async_api(body)
+    breaker.record_failure()
+    assert asyncio.run(client.get_health_portrait('P1')) is None
+    assert breaker._failures == 2
+    assert controller.records == [False]
+
+
+def test_error_code_is_not_a_breaker_failure(monkeypatch, breaker):
+    client, controller = sync_api(monkeypatch, msgspec.json.encode({'code': 500, 'msg': '患者不存在'}))
+    breaker.record_failure()
+    assert client.get_health_portrait('P1') is None
+    # 接口正常返回的非 0 code 重置连续失败计数，但仍作为错误反馈给并发控制
+    assert breaker._failures == 0
+    assert controller.records == [False]
@@ -0,0 +1,96 @@
+"""画像负载本地缓存：读写、按内容去重、过期和按大小淘汰"""
+
+from types import SimpleNamespace
+
+import pytest
+
+from etl.utils import spool as spool_module
+from etl.utils.spool import PayloadSpool
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(spool_module, 'time', SimpleNamespace(time=clock.time))
+    return clock
+
+
+@pytest.fixture
+def make_spool(tmp_path):
+    spools = []
+
+    def make(max_bytes=0, max_age_hours=0):
+        spool = PayloadSpool(str(tmp_path / f'spool{len(spools)}' / 'payloads.sqlite'), max_bytes, max_age_hours)
+        spools.append(spool)
+        return spool
+
+    yield make
+    for spool in spools:
+        spool.close()
+
+
+def portrait(patient_id, name='张三', size=0):
+    return {'patientId': patient_id, 'name': name, 'note': 'x' * size, 'encounters': [{'encounterId': 'E1'}]}
+
+
+def count(spool, table):
+    return spool._connection().execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+
+def test_round_trip_returns_latest_payload(clock, make_spool):
+    spool = make_spool()
+    spool.put('P1', portrait('P1'))
+    clock.advance(1)
+    spool.put('P1', portrait('P1', name='李四'))
+
+    assert spool.get('P1') == portrait('P1', name='李四')
+    assert spool.get('P2') is None
+
+
+def test_identical_payloads_are_stored_once(clock, make_spool):
+    spool = make_spool()
+    payload = {'patientId': None, 'name': '同一份画像'}
+    assert spool.put('P1', payload) == spool.put('P2', dict(reversed(list(payload.items()))))
+
+    assert count(spool, 'payloads') == 1
+    assert count(spool, 'entries') == 2
+
+
+def test_expired_entries_are_hidden_and_evicted(clock, make_spool):
+    spool = make_spool(max_age_hours=1)
+    spool.put('P1', portrait('P1'))
+    clock.advance(1800)
+    spool.put('P2', portrait('P2'))
+    clock.advance(1801)
+
+    assert spool.get('P1') is None
+    assert spool.patient_ids() == ['P2']
+    assert spool.evict() == 1
+    assert count(spool, 'payloads') == 1
+
+
+def test_size_limit_evicts_oldest_payloads_first(clock, make_spool):
+    spool = make_spool()
+    for index in range(4):
+        spool.put(f'P{index}', portrait(f'P{index}', size=2000 + index))
+        clock.advance(1)
+    # 重新拉取的 P0 变成最新
+    spool.put('P0', portrait('P0', size=2000))
+    sizes = dict(spool._connection().execute('SELECT hash, size FROM payloads').fetchall())
+    spool.max_bytes = sum(sizes.values()) - 1
+
+    assert spool.evict() == 1
+    assert spool.get('P1') is None
+    assert [spool.get(f'P{index}') is not None for index in (0, 2, 3)] == [True, True, True]
+    assert spool.patient_ids() == ['P2', 'P3', 'P0']
@@ -0,0 +1,109 @@
+"""超大画像流式解码：转存临时文件后按需读取就诊记录，映射结果与整体解码一致"""
+
+import gc
+import os
+
+import msgspec
+import pytest
+
+from config.settings import Config
+from etl.core.encounter_delta import encounter_fingerprints
+from etl.core.etl_patient import build_patient_sections, iter_patient_sections
+from etl.utils.stream_decode import EncounterStream, PayloadBuffer, is_streamed, payload_bytes
+
+PATIENT = {
+    'patientId': 'P1',
+    'name': '张三',
+    'allergies': [{'allergen': '青霉素', 'reaction': '皮疹'}],
+    'encounters': [
+        {
+            'encounterId': f'E{index % 3}',
+            'encounterType': '1',
+            'visitStartTime': '2024-03-01 08:00:00',
+            'hospitalId': 'H1',
+            'hospitalName': '第一医院',
+            'weight': 62.5,
+            'diagnoses': [{'diagnosisNo': f'I{index}', 'diagnosisName': f'诊断{index}'}],
+        }
+        for index in range(7)
+    ] + [{'encounterType': '1'}],
+}
+
+BODY = msgspec.json.encode({'code': 0, 'msg': 'ok', 'data': PATIENT})
+
+
+@pytest.fixture(autouse=True)
+def stream_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(Config, 'STREAM_DECODE_DIR', str(tmp_path))
+    return tmp_path
+
+
+def decode(threshold, chunk=97):
+    buffer = PayloadBuffer(threshold=threshold)
+    for start in range(0, len(BODY), chunk):
+        buffer.write(BODY[start:start + chunk])
+    return buffer.finish()
+
+
+def test_small_payload_is_decoded_in_memory(stream_dir):
+    result = decode(threshold=len(BODY))
+    assert result == msgspec.json.decode(BODY)
+    assert not is_streamed(result['data'])
+    assert os.listdir(stream_dir) == []
+
+
+def test_large_payload_streams_encounters(stream_dir):
+    result = decode(threshold=100)
+    data = result['data']
+    assert (result['code'], result['msg']) == (0, 'ok')
+    assert is_streamed(data)
+    assert {key: value for key, value in data.items() if key != 'encounters'} == \
+        {key: value for key, value in PATIENT.items() if key != 'encounters'}
+
+    encounters = data['encounters']
+    assert list(encounters) == PATIENT['encounters']
+    # 可以重复迭代
+    assert list(encounters) == PATIENT['encounters']
+    assert len(encounters) == 8
+    assert encounters.encounter_counts == {'E0': 3, 'E1': 2, 'E2': 2}
+    assert payload_bytes(data) == len(BODY)
+
+    view = encounters.only(['E1'])
+    assert len(view) == 2
+    assert [encounter['encounterId'] for encounter in view] == ['E1', 'E1']
+
+
+def test_temporary_file_is_removed_with_the_stream(stream_dir):
+    result = decode(threshold=100)
+    assert len(os.listdir(stream_dir)) == 1
+    del result
+    gc.collect()
+    assert os.listdir(stream_dir) == []
+
+
+def test_discarded_buffer_removes_its_file(stream_dir):
+    buffer = PayloadBuffer(threshold=10)
+    buffer.write(BODY[:50])
+    assert buffer.spilled
+    buffer.discard()
+    assert os.listdir(stream_dir) == []
+
+
+def test_streamed_fingerprints_match_the_list():
+    streamed = decode(threshold=100)['data']
+    assert encounter_fingerprints(streamed['encounters']) == encounter_fingerprints(PATIENT['encounters'])
+
+
+def test_streamed_sections_match_the_list(monkeypatch):
+    monkeypatch.setattr(Config, 'STREAM_FLUSH_ROWS', 4)
+    streamed = decode(threshold=100)['data']
+    assert isinstance(streamed['encounters'], EncounterStream)
+
+    def rows(sections_list):
+        # seq 只用于块内还原诊断与检查发现的先后，每块重新编号
+        return {name: [{k: v for k, v in row.items() if k != 'seq'} for sections in sections_list
+                       for row in sections[name]] for name in sections_list[0]}
+
+    chunks = list(iter_patient_sections('P1', streamed))
+    assert len(chunks) > 1
+    assert rows(chunks) == rows([build_patient_sections('P1', PATIENT)])